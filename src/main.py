@@ -4,44 +4,78 @@ Transmits over TCP socket connections
 """
 
 import logging
+import signal
 import time
 from modules.system_controller.system_controller import SystemController
 from modules.arming_button.button import ArmingButton
+from modules.arming_button.button_service import ButtonService
 from modules.device_state import DeviceState
+from modules.hal.registry import GPIO_BACKENDS, create_backend
+from modules.log_service import LogService
+from modules.system_config import load_config
 
 if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.DEBUG, handlers=[logging.StreamHandler()]  # output to console
-    )
+    config = load_config()
+    # Started before any worker process, which all log through its queue
+    log_service = LogService(config["logging"])
+    log_service.start()
     logging.info("Main starting")
 
-    arming_btn = ArmingButton()  # Default: DISARMED, red
-
     # Starts main controller for all subsystems (IMU, Camera)
-    controller = SystemController()
-    
-     # Initialize the controller but don't start IMU and Camera until the button is pressed
-    arming_btn.wait_for_press_2() # Wait for button press before starting sensors
-            
-    # Once the button is pressed, update the state and start subsystems
-    controller.start()  # Start camera and IMU workers
+    controller = SystemController(config=config)
+
+    gpio = create_backend(GPIO_BACKENDS, controller.config["hal"]["gpio"], clock=controller.clock)
+    arming_btn = ArmingButton(gpio=gpio, clock=controller.clock)  # Default: DISARMED, red
+    # Each press arms or disarms the device, the LED follows every state change
+    button_service = ButtonService(
+        arming_btn, controller.state_machine, debounce=controller.config["button"]["debounce"], clock=controller.clock
+    )
+
+    # Push edited config.yaml stream profiles to the running workers on SIGHUP
+    signal.signal(signal.SIGHUP, lambda signum, frame: controller.reload_config())
+
+    # IMU and camera workers only run while the device is armed
+    state_changes = controller.subscribe()
+    button_service.start()
+    # The base station can also arm and disarm, and adjust the running cameras
+    if controller.config["control"]["enabled"]:
+        controller.start_control_server()
+    controller.clock.unregister()  # The loop below waits for state changes, not on the clock
+
+    METRICS_LOG_INTERVAL = 10  # Seconds between logging subsystem metrics
+    WORKER_CHECK_INTERVAL = 5  # Longest wait for a state change before checking the workers are alive
+    last_metrics_log = time.monotonic()
+    running = False
 
     try:
-        while controller.is_running():
-            # Read current IMU data
-            # imu_reading = controller.get_imu_reading()
-            # controller.imu_data.print()
-
-            # Poll IMU to check if it reports stationary state
-            if arming_btn.state != DeviceState.STATIONARY and controller.imu_data.is_stationary():
-                # Set colour to blue when IMU is stationary, trigger mapping
-                arming_btn.update_state(DeviceState.STATIONARY)
-                logging.info("Device is stationary")
-            time.sleep(1)
+        while True:
+            # Sleeps until the button, the base station or the IMU process changes the device state
+            state = state_changes.wait(timeout=WORKER_CHECK_INTERVAL)
+            if state is not None:
+                logging.info(f"Device is {state.name} ({1e3 * state_changes.latency():.1f} ms after the transition)")
+
+            armed = controller.device_state != DeviceState.DISARMED
+            if armed and not running:
+                controller.start()  # Start camera and IMU workers
+                running = True
+            elif not armed and running:
+                controller.stop()
+                running = False
+                logging.info("Workers stopped, press the button to re-arm")
+            elif running and not controller.is_running():
+                logging.error("All subsystem workers exited")
+                break
+
+            if running and time.monotonic() - last_metrics_log >= METRICS_LOG_INTERVAL:
+                logging.info(f"Metrics: {controller.get_metrics()}")
+                last_metrics_log = time.monotonic()
 
     except KeyboardInterrupt:
         logging.info("Process interrupted by user")
     finally:
         logging.debug("Stopping all subsystem workers")
+        button_service.stop()
+        controller.stop_control_server()
         controller.stop()
         logging.debug("All processes stopped")
+        log_service.stop()
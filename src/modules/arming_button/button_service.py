@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from modules.clock import REAL_CLOCK
+from modules.device_state import DeviceState
+
+
+class ButtonService:
+    """
+    Event-driven arming button and status LED
+    A GPIO edge callback wakes the button thread, which debounces the level and toggles the device
+    state machine between DISARMED and ARMED on each press. The transition is the arm/disarm event,
+    every StateSubscription sees it. The LED thread follows the state machine's notifications, so it
+    shows motion states reported by the IMU process as well. Both threads sleep while nothing
+    happens
+    """
+
+    LED_WAIT_TIMEOUT = 1.0  # Seconds the LED thread sleeps before rechecking the stop event
+
+    def __init__(self, button, state_machine, debounce=0.02, clock=REAL_CLOCK):
+        """
+        button: ArmingButton owning the button and LED pins
+        state_machine: DeviceStateMachine presses are sent to and the LED follows
+        debounce: seconds the button level must be stable before a press or release counts
+        clock: Clock the debounce is timed with
+        """
+        self.button = button
+        self.gpio = button.gpio
+        self.state_machine = state_machine
+        self.debounce = debounce
+        self.clock = clock
+        self.edge_event = threading.Event()  # Set by the GPIO edge callback
+        self.stop_event = threading.Event()
+        self.presses = 0  # Debounced presses so far
+        self.threads = []
+        self.__logger = logging.getLogger(__name__)
+
+    def start(self):
+        """
+        Registers the edge callback and starts the button and LED threads
+        """
+        self.stop_event.clear()
+        self.gpio.remove_event_detect(self.button.button_pin)  # Remove any existing detection
+        # Debounced here rather than with bouncetime, which drops the edge of a release that follows
+        # a press too quickly and leaves the level out of date
+        self.gpio.add_event_detect(self.button.button_pin, self.gpio.BOTH, callback=self.__on_edge)
+
+        subscription = self.state_machine.subscribe()
+        self.threads = [
+            threading.Thread(target=self.clock.participant(self.__run_button), name="Arming-Button", daemon=True),
+            threading.Thread(target=self.__run_led, args=(subscription,), name="Status-LED", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        self.__logger.info("Waiting for arming button press...")
+
+    def stop(self):
+        self.stop_event.set()
+        self.edge_event.set()  # Wakes the button thread
+        self.gpio.remove_event_detect(self.button.button_pin)
+        for thread in self.threads:
+            thread.join(timeout=2 * self.LED_WAIT_TIMEOUT)
+        self.threads = []
+
+    def __on_edge(self, channel):
+        """
+        Runs in the GPIO library's callback thread, only wakes the button thread
+        """
+        self.edge_event.set()
+
+    def __is_pressed(self):
+        return self.gpio.input(self.button.button_pin) == self.gpio.LOW  # Pulled up, pressed is LOW
+
+    def __run_button(self):
+        pressed = self.__is_pressed()
+        while not self.stop_event.is_set():
+            self.clock.wait(self.edge_event)
+            # Wait for the line to stay quiet for the debounce time, then read the settled level
+            while not self.stop_event.is_set():
+                self.edge_event.clear()
+                if not self.clock.wait(self.edge_event, self.debounce):
+                    break
+            if self.stop_event.is_set():
+                break
+
+            was_pressed, pressed = pressed, self.__is_pressed()
+            if pressed and not was_pressed:
+                self.presses += 1
+                self.__on_press()
+
+    def __on_press(self):
+        """
+        Arms a disarmed device and disarms it in any other state
+        """
+        if self.state_machine.state == DeviceState.DISARMED:
+            new_state = DeviceState.ARMED
+        else:
+            new_state = DeviceState.DISARMED
+        self.__logger.info(f"Button press received, system {new_state.name}")
+        self.state_machine.transition(new_state, source="arming button")
+
+    def __run_led(self, subscription):
+        self.button.update_state(self.state_machine.state)
+        while not self.stop_event.is_set():
+            state = subscription.wait(timeout=self.LED_WAIT_TIMEOUT)
+            if state is not None:
+                self.button.update_state(state)
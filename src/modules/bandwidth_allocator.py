@@ -0,0 +1,238 @@
+import logging
+import multiprocessing as mp
+import time
+
+# Per-stream fields in the shared array, each stream uses NUM_FIELDS consecutive doubles
+PRIORITY = 0  # Higher priority streams are allocated bandwidth first
+WEIGHT = 1  # Share of the remaining budget between streams of the same priority
+RATE = 2  # Allocated rate (bytes/s)
+TOKENS = 3  # Token bucket level (bytes), sending is allowed while >= 0
+LAST_REFILL = 4  # time.monotonic() of the last refill
+LAST_SIZE = 5  # Size of the last sent message, used to estimate the demand of throttled streams
+WINDOW_REQUESTED = 6  # Bytes sent or denied since the last rebalance
+WINDOW_SENT = 7  # Bytes sent since the last rebalance
+DEMAND = 8  # Smoothed requested rate (bytes/s)
+USAGE = 9  # Smoothed sent rate (bytes/s)
+TOTAL_SENT = 10  # Bytes sent since start
+THROTTLED = 11  # Number of sends denied since start
+ACTIVE = 12  # 1 if the stream slot is in use
+NUM_FIELDS = 13
+
+# Global fields stored after the stream fields
+LAST_REBALANCE = 0
+NUM_GLOBAL_FIELDS = 1
+
+
+class BandwidthAllocator:
+    """
+    System-wide token bucket in shared memory that splits the total uplink budget between streams
+    Streams are allocated by descending priority, and by weight within a priority, with each stream
+    capped at its measured demand so unused bandwidth flows to the others (weighted max-min
+    fairness)
+    Workers call is_throttled() before capturing/sending and consume() after sending
+    """
+
+    SMOOTHING = 0.5  # EWMA factor for demand and usage rates
+    MIN_RATE = 1000.0  # Bytes/s every active stream keeps so it can report demand
+    DEMAND_HEADROOM = 1.25  # Streams are capped at this multiple of their demand so they can grow
+
+    def __init__(self, total_rate, max_streams, burst_seconds=1.0, rebalance_interval=1.0, clock=time.monotonic):
+        """
+        total_rate: total uplink budget in bytes/s
+        max_streams: number of stream slots in shared memory
+        burst_seconds: bucket capacity as a multiple of the allocated rate
+        rebalance_interval: seconds between reallocating the budget from the measured demand
+        clock: returns the current time in seconds, shared by every process using the allocator
+        """
+        self.total_rate = total_rate
+        self.max_streams = max_streams
+        self.burst_seconds = burst_seconds
+        self.rebalance_interval = rebalance_interval
+        self.clock = clock
+        self.shared_array = mp.Array("d", max_streams * NUM_FIELDS + NUM_GLOBAL_FIELDS)
+        self.names = []  # Stream names by slot index, only known in the process that added them
+        self.__logger = logging.getLogger(__name__)
+
+    def __field(self, index, field):
+        return index * NUM_FIELDS + field
+
+    def add_stream(self, name, priority=0, weight=1.0):
+        """
+        Registers a stream (or updates its priority and weight) and returns its slot index
+        Must be called before the worker using the slot is started
+        """
+        if name in self.names:
+            index = self.names.index(name)
+        elif len(self.names) < self.max_streams:
+            index = len(self.names)
+            self.names.append(name)
+        else:
+            raise ValueError(f"No free bandwidth slot for stream {name}")
+
+        now = self.clock()
+        with self.shared_array.get_lock():
+            base = index * NUM_FIELDS
+            self.shared_array[base:base + NUM_FIELDS] = [0.0] * NUM_FIELDS
+            self.shared_array[base + PRIORITY] = priority
+            self.shared_array[base + WEIGHT] = weight
+            self.shared_array[base + LAST_REFILL] = now
+            self.shared_array[base + DEMAND] = float("inf")  # Unknown until measured
+            self.shared_array[base + ACTIVE] = 1.0
+            self.__rebalance_locked(now)
+
+        self.__logger.info(f"Bandwidth stream {name} (slot {index}): priority {priority}, weight {weight}")
+        return index
+
+    def __refill_locked(self, index, now):
+        """
+        Adds the tokens earned since the last refill, capped at the bucket capacity
+        """
+        rate = self.shared_array[self.__field(index, RATE)]
+        elapsed = now - self.shared_array[self.__field(index, LAST_REFILL)]
+        capacity = rate * self.burst_seconds
+        tokens = self.shared_array[self.__field(index, TOKENS)] + rate * elapsed
+        self.shared_array[self.__field(index, TOKENS)] = min(tokens, capacity)
+        self.shared_array[self.__field(index, LAST_REFILL)] = now
+
+    def is_throttled(self, index):
+        """
+        Returns True if the stream has used up its allocation and should skip or shrink its next
+        send
+        A stream may send while its bucket is not negative, so a large frame can overdraw the bucket
+        and is paid back before the next one
+        """
+        now = self.clock()
+        with self.shared_array.get_lock():
+            self.__maybe_rebalance_locked(now)
+            self.__refill_locked(index, now)
+
+            if self.shared_array[self.__field(index, TOKENS)] >= 0:
+                return False
+
+            # Count the skipped send as demand so the stream gets more bandwidth if it is available
+            self.shared_array[self.__field(index, WINDOW_REQUESTED)] += self.shared_array[
+                self.__field(index, LAST_SIZE)
+            ]
+            self.shared_array[self.__field(index, THROTTLED)] += 1
+            return True
+
+    def consume(self, index, num_bytes):
+        """
+        Records num_bytes sent by the stream
+        """
+        now = self.clock()
+        with self.shared_array.get_lock():
+            self.__refill_locked(index, now)
+            self.shared_array[self.__field(index, TOKENS)] -= num_bytes
+            self.shared_array[self.__field(index, LAST_SIZE)] = num_bytes
+            self.shared_array[self.__field(index, WINDOW_REQUESTED)] += num_bytes
+            self.shared_array[self.__field(index, WINDOW_SENT)] += num_bytes
+            self.shared_array[self.__field(index, TOTAL_SENT)] += num_bytes
+
+    def __maybe_rebalance_locked(self, now):
+        last = self.shared_array[self.max_streams * NUM_FIELDS + LAST_REBALANCE]
+        if now - last >= self.rebalance_interval:
+            self.__rebalance_locked(now)
+
+    def __rebalance_locked(self, now):
+        """
+        Updates the demand and usage estimates and reallocates the total budget
+        """
+        elapsed = now - self.shared_array[self.max_streams * NUM_FIELDS + LAST_REBALANCE]
+        self.shared_array[self.max_streams * NUM_FIELDS + LAST_REBALANCE] = now
+
+        streams = []
+        for index in range(self.max_streams):
+            if not self.shared_array[self.__field(index, ACTIVE)]:
+                continue
+
+            if 0 < elapsed < 60:
+                requested = self.shared_array[self.__field(index, WINDOW_REQUESTED)] / elapsed
+                sent = self.shared_array[self.__field(index, WINDOW_SENT)] / elapsed
+                demand = self.shared_array[self.__field(index, DEMAND)]
+                if demand == float("inf"):
+                    demand = requested
+                self.shared_array[self.__field(index, DEMAND)] = (
+                    self.SMOOTHING * requested + (1 - self.SMOOTHING) * demand
+                )
+                self.shared_array[self.__field(index, USAGE)] = (
+                    self.SMOOTHING * sent + (1 - self.SMOOTHING) * self.shared_array[self.__field(index, USAGE)]
+                )
+            self.shared_array[self.__field(index, WINDOW_REQUESTED)] = 0
+            self.shared_array[self.__field(index, WINDOW_SENT)] = 0
+
+            streams.append((
+                index,
+                self.shared_array[self.__field(index, PRIORITY)],
+                self.shared_array[self.__field(index, WEIGHT)],
+                self.shared_array[self.__field(index, DEMAND)] * self.DEMAND_HEADROOM,
+            ))
+
+        for index, rate in allocate(self.total_rate, streams, self.MIN_RATE).items():
+            self.__refill_locked(index, now)
+            self.shared_array[self.__field(index, RATE)] = rate
+
+    def get_metrics(self):
+        """
+        Returns {stream name: allocation and usage} for the streams registered in this process
+        """
+        metrics = {}
+        with self.shared_array.get_lock():
+            for index, name in enumerate(self.names):
+                demand = self.shared_array[self.__field(index, DEMAND)]
+                metrics[name] = {
+                    "priority": int(self.shared_array[self.__field(index, PRIORITY)]),
+                    "weight": self.shared_array[self.__field(index, WEIGHT)],
+                    "allocated_bytes_per_sec": self.shared_array[self.__field(index, RATE)],
+                    "used_bytes_per_sec": self.shared_array[self.__field(index, USAGE)],
+                    "demand_bytes_per_sec": None if demand == float("inf") else demand,
+                    "total_bytes_sent": int(self.shared_array[self.__field(index, TOTAL_SENT)]),
+                    "throttled_count": int(self.shared_array[self.__field(index, THROTTLED)]),
+                }
+        return metrics
+
+
+def allocate(total_rate, streams, min_rate=0.0):
+    """
+    Splits total_rate between streams given as (index, priority, weight, demand) tuples
+    Higher priorities are served first. Within a priority, the budget is split by weight and streams
+    that need less than their share are capped at their demand, with the rest going to the others
+    Returns {index: allocated rate}
+    """
+    # Weights that are not positive count as the default weight, in the shares and in their sums
+    streams = [(index, priority, weight if weight > 0 else 1.0, demand) for index, priority, weight, demand in streams]
+    rates = {index: min_rate for index, _, _, _ in streams}
+    remaining = max(total_rate - min_rate * len(streams), 0.0)
+
+    for priority in sorted({priority for _, priority, _, _ in streams}, reverse=True):
+        unsatisfied = [
+            (index, weight, max(demand - min_rate, 0.0))
+            for index, stream_priority, weight, demand in streams
+            if stream_priority == priority
+        ]
+
+        while unsatisfied and remaining > 0:
+            total_weight = sum(weight for _, weight, _ in unsatisfied)
+            shares = {index: remaining * weight / total_weight for index, weight, _ in unsatisfied}
+            satisfied = [(index, need) for index, _, need in unsatisfied if need <= shares[index]]
+
+            if not satisfied:
+                # Everyone wants more than their share, split what is left by weight
+                for index, share in shares.items():
+                    rates[index] += share
+                remaining = 0.0
+                break
+
+            for index, need in satisfied:
+                rates[index] += need
+                remaining -= need
+            satisfied_indices = {index for index, _ in satisfied}
+            unsatisfied = [stream for stream in unsatisfied if stream[0] not in satisfied_indices]
+
+    # Leftover budget goes to everyone by weight so streams can grow past their last demand
+    if remaining > 0 and streams:
+        total_weight = sum(weight for _, _, weight, _ in streams)
+        for index, _, weight, _ in streams:
+            rates[index] += remaining * weight / total_weight
+
+    return rates
@@ -1,25 +1,58 @@
-import time
 import logging
 
 import subprocess
 import re
 
 import multiprocessing as mp
+import threading
+import time
+from multiprocessing.connection import Connection
 
 from collections import deque
-from dataclasses import dataclass
-
-from .camera_worker import CameraWorker
+from dataclasses import asdict, dataclass
+
+from ..clock import REAL_CLOCK
+from .camera_worker import (
+    CONTROL_PAUSE, CONTROL_RESUME, CONTROL_SET_PROFILE, CONTROL_SNAPSHOT, CameraWorker, SnapshotRequest
+)
+from .stream_profile import NO_LIMIT, StreamProfile, resolve_camera_profiles, resolve_state_profiles
+from ..system_config import load_config
+from ..process_stats import read_process_placement, read_process_usage
+from ..scheduling import scheduled
+from ..shutdown import graceful, stop_processes
+
+# Capture modes, see camera.capture_mode in config.yaml
+PROCESS_PER_CAMERA = "process"
+THREAD_PER_CAMERA = "thread"
+
+# Stream profile fields the base station may override at runtime (see set_stream_params)
+REMOTE_PROFILE_FIELDS = ("fps", "width", "height", "quality", "frame_size_budget", "max_gyro_rate")
+
+# Type and inclusive range of the profile and snapshot fields the base station may set. Values are
+# checked before they reach a worker, which would otherwise fail on them again after every restart
+REMOTE_FIELD_LIMITS = {
+    "fps": (float, 0.1, 240.0),
+    "width": (int, 16, 8192),
+    "height": (int, 16, 8192),
+    "quality": (int, 0, 100),
+    "frame_size_budget": (int, 1024, 64 << 20),
+    "max_gyro_rate": (float, 0.0, 100.0),  # rads/s
+    "count": (int, 1, 100),  # Snapshot frames
+}
+
+
+def check_remote_field(name, value):
+    """
+    Returns value converted to the type of the field, raises ValueError if it has the wrong type or
+    is out of range
+    """
+    kind, low, high = REMOTE_FIELD_LIMITS[name]
+    if isinstance(value, bool) or not isinstance(value, (int, float) if kind is float else int):
+        raise ValueError(f"{name} must be {'a number' if kind is float else 'an integer'}, got {value!r}")
+    if not low <= value <= high:  # Also false for NaN
+        raise ValueError(f"{name} must be between {low} and {high}, got {value}")
+    return kind(value)
 
-# TODO: Move constants to .yaml file
-NUM_CAMERAS = 4  # Num cameras connected to RPI
-BASE_PORT = 5000  # Base port for the TCP socket transmissions
-SERVER_HOST = "192.168.194.241"
-# Mihir: "192.168.194.44" # "192.168.68.172"# Florence "192.168.194.189"# "192.168.194.44" # "192.168.194.77" # "192.168.2.208"  #  "192.168.194.189"  #"192.168.194.44" #   # Update value with base station IP address
-# CAMERA_FPS = 90.0  # FPS for streaming
-CAMERA_FPS = 2.0
-# SERVER_HOST = "127.0.0.1" # pi
-LOG_LEVEL = logging.DEBUG
 
 @dataclass
 class CameraWorkerInfo:
@@ -29,6 +62,36 @@ class CameraWorkerInfo:
     process: mp.Process
     device_id: int
     port: int
+    usb_port: str
+    profile: StreamProfile
+    control_conn: Connection  # Sending end of the worker control pipe
+    bandwidth_stream: int = None  # Slot index in the BandwidthAllocator
+
+
+def run_camera_threads(camera_workers, stop_event, clock=REAL_CLOCK, restart_interval=1.0):
+    """
+    Capture process target for thread mode: runs every CameraWorker as a thread in this process
+    cv2 releases the GIL while reading and encoding, so the cameras still run in parallel
+    A camera thread that exits before the stop event is set (e.g. its camera failed or the
+    connection was lost) is started again within restart_interval seconds, as monitor_workers does
+    for processes
+    """
+    logger = logging.getLogger(__name__)
+    threads = {}
+
+    def start(worker):
+        threads[worker.id] = threading.Thread(target=clock.participant(worker.run_camera), name=f"Worker-{worker.id}")
+        threads[worker.id].start()
+
+    for worker in camera_workers:
+        start(worker)
+    while not clock.wait(stop_event, restart_interval):
+        for worker in camera_workers:
+            if not threads[worker.id].is_alive() and not stop_event.is_set():
+                logger.warning(f"Camera thread Worker-{worker.id} exited. Restarting...")
+                start(worker)
+    for thread in threads.values():
+        thread.join()
 
 
 class CameraDeviceManager:
@@ -37,9 +100,14 @@ class CameraDeviceManager:
     Controls and manages multiple Camera_Worker processes for each USB camera connected
     """
 
-    def __init__(self, stop_event):
+    def __init__(self, stop_event, config=None, bandwidth=None, imu_pose=None, clock=REAL_CLOCK, scheduling=None):
         """
         Initializes Camera Device Controller which manages and handles all of the worker processes
+        config: system config dict (see system_config.load_config), loaded from file if not given
+        bandwidth: shared BandwidthAllocator the workers consult before sending, None to disable
+        imu_pose: IMUPoseSampler the workers tag frames with, None to send frames without a pose
+        clock: Clock the workers pace frames and retry connections with
+        scheduling: SchedulingPolicy applied by every capture process, None to leave them unchanged
         """
         self.worker_queue = deque()  # Store active workers in queue for cleanup process
         self.stop_event = (
@@ -50,6 +118,24 @@ class CameraDeviceManager:
         self.__logger = logging.getLogger(__name__)
         self.camera_map = {}  # List of usb camera devices connected
 
+        self.config = config if config is not None else load_config()
+        self.default_profile, self.device_profiles = resolve_camera_profiles(self.config["camera"])
+        self.state_profiles = resolve_state_profiles(self.config["camera"])
+        self.device_state = None  # Last DeviceState passed to set_device_state
+        self.overrides = {}  # {usb port: profile fields} set by the base station, kept across restarts
+        self.limit = NO_LIMIT  # StreamLimit applied to every camera last, see set_limit
+        # Profiles are pushed from the state, control and governor threads, one at a time
+        self.control_lock = threading.RLock()
+        # USB ports of the paused cameras, every camera starts paused with camera.start_paused
+        self.paused = set()
+        self.bandwidth = bandwidth
+        self.clock = clock
+        self.scheduling = scheduling
+        self.imu_pose = imu_pose
+        self.capture_mode = self.config["camera"]["capture_mode"]
+        if self.capture_mode not in (PROCESS_PER_CAMERA, THREAD_PER_CAMERA):
+            raise ValueError(f"Unknown camera capture mode '{self.capture_mode}'")
+
     def __get_usb_ports(self):
         """
         Uses `v4l2-ctl --list-devices` to find USB cameras
@@ -112,24 +198,46 @@ class CameraDeviceManager:
 
         return camera_map
 
+    def __list_cameras(self):
+        """
+        Returns {port name: device id} for the cameras of the configured backend
+        V4L2 cameras are found by USB port. Other backends simulate hal.camera.count cameras, named
+        <backend>-<index> in place of the USB port
+        """
+        camera_config = self.config["hal"]["camera"]
+        backend = camera_config["backend"]
+        if backend == "v4l2":
+            cam_map = self.__get_usb_ports() or {}
+            # Extract device id from /dev/video<id>
+            return {usb_port: int(device_path.replace("/dev/video", "")) for usb_port, device_path in cam_map.items()}
+
+        return {f"{backend}-{i}": i for i in range(camera_config["count"])}
+
     def start_camera_workers(self):
         """
         Start individual processes for each camera device and socket with unique port
+        In thread mode, all cameras run as threads of a single capture process instead
         """
-        self.__logger.info("Starting camera workers")
+        self.__logger.info(f"Starting camera workers ({self.capture_mode} mode)")
+        self.stop_event.clear()  # Set by the last stop_workers
+        camera_workers = []
 
-        cam_map = self.__get_usb_ports()
+        cam_map = self.__list_cameras()
         # for port, dev in cam_map.items():
         #     self.__logger.info(f"USB port {port} -> {dev}")
 
+        network = self.config["network"]
+        max_cameras = self.config["camera"]["max_cameras"]
+
         # Manually get USB device port numbers, only starting cameras actually connected
-        for i, port in enumerate(cam_map.items()):
+        for i, port in enumerate(list(cam_map.items())[:max_cameras]):
             # device_idx = int(port[0])
-            device_path = port[1]
-            device_id = int(device_path.replace("/dev/video", ""))  # Extract device id
+            usb_port, device_id = port
             # self.__logger.info(f"device_id: {device_id}, {i},{len(cam_map)}")
 
-            device_port = BASE_PORT + i
+            device_port = network["camera_base_port"] + i
+            profile = self.__profile_for(usb_port)
+            bandwidth_stream = self.__add_bandwidth_stream(usb_port, device_id)
             # self.__logger.info(f"USB port {port} -> {device_path}")
 
             # Create worker instance (opens camera and creates individual socket)
@@ -139,51 +247,247 @@ class CameraDeviceManager:
 
             # Initialize devices for all USB cameras to fetch video/ image data from
             # Each CameraWorker process controls its own socket and camera device
+            # Profile updates are pushed to the worker through a one-way control pipe
+            worker_conn, control_conn = mp.Pipe(duplex=False)
+            if self.config["camera"]["start_paused"]:
+                self.paused.add(usb_port)
+            if usb_port in self.paused:
+                control_conn.send((CONTROL_PAUSE, None))  # Read before the first frame
             camera_worker = CameraWorker(
-                host=SERVER_HOST,
+                host=network["server_host"],
                 port=device_port,
                 device_id=device_id,
-                fps=CAMERA_FPS,
+                profile=profile,
                 stop_event=self.stop_event,
+                control_conn=worker_conn,
+                bandwidth=self.bandwidth,
+                bandwidth_stream=bandwidth_stream,
+                imu_pose=self.imu_pose,
+                camera_config=self.config["hal"]["camera"],
+                clock=self.clock,
+                crc=network["crc"],
             )
 
             # Start new process and add to queue
-            process = mp.Process(target=camera_worker.run_camera, name=f"Worker-{device_id}")
-            process.start()
+            process = None
+            if self.capture_mode == PROCESS_PER_CAMERA:
+                target = self.clock.participant(scheduled(self.scheduling, graceful(camera_worker.run_camera)))
+                process = mp.Process(target=target, name=f"Worker-{device_id}")
+                process.start()
+            camera_workers.append(camera_worker)
 
             self.worker_queue.append(CameraWorkerInfo(
                     process=process,
                     device_id=device_id,
                     port=device_port,
+                    usb_port=usb_port,
+                    profile=profile,
+                    control_conn=control_conn,
+                    bandwidth_stream=bandwidth_stream,
                 )
             )
 
+        # Single capture process shared by all camera threads
+        if self.capture_mode == THREAD_PER_CAMERA and camera_workers:
+            process = mp.Process(
+                target=self.clock.participant(scheduled(self.scheduling, run_camera_threads)),
+                args=(camera_workers, self.stop_event, self.clock),
+                name="Camera-Capture",
+            )
+            process.start()
+            for worker in self.worker_queue:
+                worker.process = process
+
         self.__logger.info(f"All camera workers running {[w.process.name for w in self.worker_queue]}\n")
 
-    def stop_workers(self):
+    def __add_bandwidth_stream(self, usb_port, device_id):
         """
-        Stops all activate camera processes and terminates gracefully
+        Registers the camera with the bandwidth allocator using its per-port priority and weight
+        Returns the stream slot index, or None if bandwidth allocation is disabled
+        """
+        if self.bandwidth is None:
+            return None
+
+        bandwidth_config = self.config["bandwidth"]
+        settings = dict(bandwidth_config["camera"])
+        settings.update((bandwidth_config.get("devices") or {}).get(usb_port, {}))
+        return self.bandwidth.add_stream(f"camera-{device_id}", **settings)
+
+    def signal_stop(self):
+        """
+        Tells every worker to finish its current frame and exit, without waiting
+        Returns the capture processes to wait for
         """
-        self.__logger.info(f"Stopping all Camera_Worker processes {self.worker_queue}")
-        # Tells each worker to exit the stream_data loop
         self.stop_event.set()
+        return [worker.process for worker in self.worker_queue]
 
-         # Try to join all processes
-        for worker in self.worker_queue:
-            if worker.process.is_alive():
-                worker.process.join() # TODO: See if need timeout=5.0
+    def stop_workers(self, deadline=None):
+        """
+        Stops all active camera processes, terminating and then killing any still running at the
+        deadline (time.monotonic() time, shutdown.timeout from now if not given)
+        """
+        shutdown = self.config["shutdown"]
+        if deadline is None:
+            deadline = time.monotonic() + shutdown["timeout"]
 
-        self.__logger.info("All workers joined")
+        self.__logger.info(f"Stopping all Camera_Worker processes {[w.process.name for w in self.worker_queue]}")
+        escalated = stop_processes(self.signal_stop(), deadline, shutdown["kill_timeout"])
+        if escalated:
+            self.__logger.warning(f"Terminated Camera_Worker processes {escalated}")
 
-        # Force terminate and cleanup any remaining alive workers
         for worker in self.worker_queue:
-            if worker.process.is_alive():
-                self.__logger.warning(f"Terminating Camera_Worker {worker['device_id']}")
-                worker.process.terminate()
-                # worker.process.join(timeout=1.0)
+            worker.control_conn.close()
 
         self.worker_queue.clear()
-        self.__logger.info("All Camera_Worker processes terminated")
+        self.__logger.info("All Camera_Worker processes stopped")
+
+    def update_profile(self, device_id, profile: StreamProfile):
+        """
+        Pushes a new stream profile to a running camera worker
+        The worker applies it between frames, without restarting the process
+        """
+        for worker in self.worker_queue:
+            if worker.device_id != device_id:
+                continue
+
+            with self.control_lock:
+                if profile == worker.profile:
+                    return
+
+                try:
+                    worker.control_conn.send((CONTROL_SET_PROFILE, profile))
+                    worker.profile = profile
+                    self.__logger.info(f"Pushed stream profile to Camera_Worker {device_id}: {profile}")
+                except (BrokenPipeError, OSError) as e:
+                    self.__logger.warning(f"Unable to update Camera_Worker {device_id}: {e}")
+            return
+
+        self.__logger.warning(f"No running Camera_Worker for device {device_id}")
+
+    def apply_config(self, config):
+        """
+        Re-resolves the camera profiles from a reloaded config and pushes changes to the workers
+        Network and camera count changes only take effect on the next start
+        """
+        default_profile, device_profiles = resolve_camera_profiles(config["camera"])
+        state_profiles = resolve_state_profiles(config["camera"])
+        with self.control_lock:
+            self.config = config
+            self.default_profile, self.device_profiles = default_profile, device_profiles
+            self.state_profiles = state_profiles
+            self.__push_profiles()
+
+    def set_device_state(self, state):
+        """
+        Switches the workers to the stream profile configured for the device state in
+        camera.state_profiles, or back to their own profile if the state has none
+        """
+        with self.control_lock:
+            self.device_state = state
+            self.__push_profiles()
+
+    def __profile_for(self, usb_port):
+        if self.device_state in self.state_profiles:
+            profile = self.state_profiles[self.device_state]
+        else:
+            profile = self.device_profiles.get(usb_port, self.default_profile)
+        return self.limit.apply(profile.with_changes(**self.overrides.get(usb_port, {})))
+
+    def set_limit(self, limit):
+        """
+        Applies a StreamLimit on top of every camera's profile, including base station overrides,
+        and pushes the resulting profiles to the workers. NO_LIMIT restores them
+        """
+        with self.control_lock:
+            self.limit = limit
+            self.__push_profiles()
+
+    def __push_profiles(self):
+        for worker in self.worker_queue:
+            self.update_profile(worker.device_id, self.__profile_for(worker.usb_port))
+
+    def __workers_for(self, device_id):
+        """
+        Running workers of a device id, or every worker for None
+        Raises ValueError if no camera has the device id
+        """
+        workers = [worker for worker in self.worker_queue if device_id is None or worker.device_id == device_id]
+        if device_id is not None and not workers:
+            raise ValueError(f"No running camera with device id {device_id}")
+        return workers
+
+    def __send_control(self, worker, command, argument=None):
+        try:
+            with self.control_lock:
+                worker.control_conn.send((command, argument))
+        except (BrokenPipeError, OSError) as e:
+            raise ValueError(f"Unable to reach Camera_Worker {worker.device_id}: {e}")
+
+    def set_stream_params(self, device_id, **changes):
+        """
+        Overrides profile fields (REMOTE_PROFILE_FIELDS) of one camera, or every camera for None, on
+        top of the configured and device state profiles. No changes clears the overrides
+        Returns {device id: resulting profile fields}
+        """
+        unknown = set(changes) - set(REMOTE_PROFILE_FIELDS)
+        if unknown:
+            raise ValueError(f"Stream fields {sorted(unknown)} can not be changed, expected {REMOTE_PROFILE_FIELDS}")
+        changes = {name: check_remote_field(name, value) for name, value in changes.items()}
+
+        result = {}
+        with self.control_lock:
+            for worker in self.__workers_for(device_id):
+                if changes:
+                    self.overrides.setdefault(worker.usb_port, {}).update(changes)
+                else:
+                    self.overrides.pop(worker.usb_port, None)
+                self.update_profile(worker.device_id, self.__profile_for(worker.usb_port))
+                result[worker.device_id] = {name: getattr(worker.profile, name) for name in REMOTE_PROFILE_FIELDS}
+        return result
+
+    def pause(self, device_id=None):
+        """
+        Stops one camera, or every camera for None, from capturing until resume()
+        """
+        workers = self.__workers_for(device_id)
+        for worker in workers:
+            self.__send_control(worker, CONTROL_PAUSE)
+            self.paused.add(worker.usb_port)
+        return [worker.device_id for worker in workers]
+
+    def resume(self, device_id=None):
+        workers = self.__workers_for(device_id)
+        for worker in workers:
+            self.__send_control(worker, CONTROL_RESUME)
+            self.paused.discard(worker.usb_port)
+        return [worker.device_id for worker in workers]
+
+    def snapshot(self, device_id=None, **request):
+        """
+        Asks one camera, or every camera for None, for a burst of frames (see SnapshotRequest
+        fields)
+        The frames are sent on the camera streams with frame type FRAME_SNAPSHOT
+        """
+        request = SnapshotRequest(**request)
+        request = SnapshotRequest(**{name: check_remote_field(name, value) for name, value in asdict(request).items()})
+        workers = self.__workers_for(device_id)
+        for worker in workers:
+            self.__send_control(worker, CONTROL_SNAPSHOT, request)
+        return [worker.device_id for worker in workers]
+
+    def get_cameras(self):
+        """
+        Returns a list of {device_id, usb_port, port, paused} for the running cameras
+        """
+        return [
+            {
+                "device_id": worker.device_id,
+                "usb_port": worker.usb_port,
+                "port": worker.port,
+                "paused": worker.usb_port in self.paused,
+            }
+            for worker in self.worker_queue
+        ]
 
     def is_running(self):
         """
@@ -192,13 +496,45 @@ class CameraDeviceManager:
         """
         return any(worker.process.is_alive() for worker in self.worker_queue)
 
+    def get_metrics(self):
+        """
+        Returns the capture mode and the memory and CPU time of each capture process
+        In thread mode all cameras share one process
+        """
+        processes = {}
+        for worker in self.worker_queue:
+            if worker.process.pid in processes:
+                continue
+            usage = read_process_usage(worker.process.pid)
+            if usage is not None:
+                rss_bytes, cpu_seconds = usage
+                processes[worker.process.pid] = {
+                    "name": worker.process.name,
+                    "rss_mb": rss_bytes / 2**20,
+                    "cpu_seconds": cpu_seconds,
+                    "placement": read_process_placement(worker.process.pid),
+                }
+
+        return {
+            "capture_mode": self.capture_mode,
+            "cameras": len(self.worker_queue),
+            "processes": processes,
+            "total_rss_mb": sum(process["rss_mb"] for process in processes.values()),
+        }
+
 
     # TODO: function to check/poll if any worker process throws error
     # Maybe auto-restart failed workers X num of times
     def monitor_workers(self):
         """
         Monitors and auto-restarts worker mapping to device id if they crash
+        Only needed in process mode, in thread mode the capture process restarts its own camera
+        threads
+        (see run_camera_threads)
         """
+        if self.capture_mode != PROCESS_PER_CAMERA:
+            return
+
         while not self.stop_event.is_set():
             for i, worker_info in enumerate(self.worker_queue):
                 process = worker_info.process
@@ -209,20 +545,33 @@ class CameraDeviceManager:
                     worker_info = self.worker_queue[i]
                     self.__logger.warning(f"Worker {process.name} crashed. Restarting...")
 
+                    worker_conn, control_conn = mp.Pipe(duplex=False)
+                    if worker_info.usb_port in self.paused:
+                        control_conn.send((CONTROL_PAUSE, None))
                     new_worker = CameraWorker(
-                        host=self.SERVER_HOST,
+                        host=self.config["network"]["server_host"],
                         port=worker_info.port,
                         device_id=device_id,
-                        fps=self.CAMERA_FPS,
+                        profile=worker_info.profile,
                         stop_event=self.stop_event,
+                        control_conn=worker_conn,
+                        bandwidth=self.bandwidth,
+                        bandwidth_stream=worker_info.bandwidth_stream,
+                        imu_pose=self.imu_pose,
+                        camera_config=self.config["hal"]["camera"],
+                        clock=self.clock,
+                        crc=self.config["network"]["crc"],
                     )
 
                     # Start the new process
                     new_process = mp.Process(
-                        target=new_worker.run_camera, name=f"Worker-{device_id}"
+                        target=self.clock.participant(scheduled(self.scheduling, graceful(new_worker.run_camera))),
+                        name=f"Worker-{device_id}",
                     )
                     new_process.start()
 
                     # Update the worker information to include new process
                     worker_info.process=new_process
-            time.sleep(1)
+                    worker_info.control_conn.close()
+                    worker_info.control_conn = control_conn
+            self.clock.wait(self.stop_event, 1)
@@ -1,18 +1,74 @@
 import cv2
 import socket
 import struct
-import time
 import logging
+import threading
+from dataclasses import dataclass
+
+from ..clock import REAL_CLOCK
+from ..hal.registry import CAMERA_BACKENDS, create_backend
+from ..imu.imu_pose import angular_speed
+from ..shutdown import connect_until_stopped
+from ..wire_protocol import STREAM_CAMERA, FrameWriter, sendmsg_all
+from .frame_encoder import create_encoder, select_encoder
+from .stream_profile import StreamProfile
+from .tile_delta import FRAME_FULL, FRAME_SNAPSHOT, TileDeltaEncoder
+
+# Control channel commands sent by CameraDeviceManager as (command, argument) tuples
+CONTROL_SET_PROFILE = "set_profile"  # StreamProfile
+CONTROL_PAUSE = "pause"  # None, stop capturing until resumed
+CONTROL_RESUME = "resume"  # None
+CONTROL_SNAPSHOT = "snapshot"  # SnapshotRequest
+
+# Frames are sent as STREAM_CAMERA frames of the wire protocol, which carry the capture timestamp.
+# Their payload starts with this header, big endian (network endianess): uint32 device id, uint8
+# encoder id, uint8 frame type (see tile_delta.py), uint8 DeviceState value, float32 IMU orientation
+# quaternion w, x, y, z and float32 angular rate x, y, z (rads/s) at the capture time
+CAMERA_HEADER = struct.Struct(">IBBB4f3f")
+NO_POSE = 0xFF  # State value sent when there is no IMU pose, the quaternion and rate are zero
+NO_QUATERNION = (0.0,) * 4
+NO_GYRO = (0.0,) * 3
+
+
+@dataclass(frozen=True)
+class SnapshotRequest:
+    """
+    Burst of frames captured outside the stream profile, e.g. at full resolution
+    """
+
+    count: int = 1
+    width: int = 1920
+    height: int = 1080
+    quality: int = 95
 
 
 class CameraWorker:
+    THROTTLE_QUALITY_STEP = 10  # Quality drop per throttled frame
+    MIN_THROTTLE_QUALITY = 30  # Throttling never lowers the quality below this
+    PAUSED_WAIT = 1.0  # Seconds a paused worker sleeps before rechecking the stop event
+    SOCKET_TIMEOUT = 60.0  # Seconds a connect or send may block
+    RETRY_WINDOW = 10  # Seconds between connection attempts
+    MAX_BUFFER_AGE = 2.0  # Oldest plausible camera buffer timestamp in seconds, see __capture_time
+
+    # Encoder benchmark results shared by workers running as threads of the same process, so
+    # cameras with the same profile only benchmark once. Maps encoder settings to the chosen preset
+    selected_presets = {}
+    selection_lock = threading.Lock()
+
     def __init__(
         self,
         device_id: int,
         port: int,
         host: int,
-        fps: float,
+        profile: StreamProfile,
         stop_event,  # multiprocessing event for when workers should stop streaming data
+        control_conn=None,  # receiving end of the multiprocessing pipe from CameraDeviceManager
+        bandwidth=None,  # shared BandwidthAllocator consulted before each frame
+        bandwidth_stream=None,  # slot index of this camera in the BandwidthAllocator
+        imu_pose=None,  # IMUPoseSampler frames are tagged with, None to send frames without a pose
+        camera_config=None,  # hal.camera config selecting the camera backend, None for V4L2 devices
+        clock=REAL_CLOCK,  # Clock for frame pacing, retries and capture timestamps
+        crc=False,  # Send a CRC of every frame
     ):
         """
         Initialize camera worker for current camera device Id and TCP port
@@ -20,14 +76,26 @@ class CameraWorker:
         self.id = device_id
         self.port = port
         self.host = host
-        self.fps = fps
+        self.profile = profile
         self.camera = None  # OpenCV camera object
         self.socket = None  # TCP server socket
         self.stop_event = stop_event
-        self.height = 320
-        self.width = 240
+        self.control_conn = control_conn
+        self.encoder = None  # FrameEncoder picked by benchmarking the profile's presets
+        self.delta_encoder = None  # TileDeltaEncoder wrapping self.encoder when delta mode is on
+        self.bandwidth = bandwidth
+        self.bandwidth_stream = bandwidth_stream
+        self.imu_pose = imu_pose
+        self.camera_config = camera_config or {"backend": "v4l2"}
+        self.clock = clock
+        self.blurred_frames = 0  # Frames dropped for exceeding profile.max_gyro_rate
+        self.paused = False  # Set by CONTROL_PAUSE, the camera is left idle until CONTROL_RESUME
+        self.snapshots = []  # SnapshotRequests waiting to be captured
+        # Reused every frame: the capture buffer (replaced if the resolution changes) and the
+        # writer's headers
+        self.frame = None
+        self.writer = FrameWriter(STREAM_CAMERA, CAMERA_HEADER, crc=crc)
 
-        logging.basicConfig(level=logging.DEBUG)
         self.__logger = logging.getLogger(__name__)
 
     def run_camera(self):
@@ -35,6 +103,10 @@ class CameraWorker:
         Starts the camera and setups the TCP socket. Then attempts to transmit frames over socket
         Once finished or error encountered, cleans up by releaseing resources
         """
+        # A worker run again after it exited (thread mode restarts) benchmarks its encoders again
+        # and starts the new connection from a keyframe
+        self.encoder = None
+        self.delta_encoder = None
         try:
             self.__setup_camera()
             self.__logger.info(f"Finished camera setup, setting up sockets\n")
@@ -47,121 +119,329 @@ class CameraWorker:
 
     def __setup_camera(self):
         """
-        Initializes USB camera by opening the device
-        TODO: Potentially add setting camera resolution
+        Initializes USB camera by opening the device and applying the profile capture mode
         """
 
-        self.camera = cv2.VideoCapture(self.id)
+        self.camera = create_backend(CAMERA_BACKENDS, self.camera_config, self.id, clock=self.clock)
 
         if not self.camera.isOpened():
             raise RuntimeError("Failed to open camera")
 
-        # resolution
-        self.camera.set(self.height, self.width)
+        self.__set_capture_mode()
 
         self.__logger.info(f"[Camera-{self.id}] Camera successfully initialized")
 
-    def __setup_socket(self):
+    def __set_capture_mode(self):
         """
-        Initializes the TCP socket per camera for transmitting data to base terminal
+        Sets the resolution and fps of the opened camera from the current profile
+        Returns True if the device reports the requested resolution
+        """
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.profile.width)
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.profile.height)
+        self.camera.set(cv2.CAP_PROP_FPS, self.profile.fps)
+
+        actual_width = int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH))
+        actual_height = int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return (actual_width, actual_height) == (self.profile.width, self.profile.height)
+
+    def __apply_control_messages(self):
+        """
+        Applies any commands pushed by the manager since the last frame without blocking
+        Returns True if the stream profile changed
+        """
+        if self.control_conn is None:
+            return False
+
+        profile_changed = False
+        while self.control_conn.poll():
+            command, argument = self.control_conn.recv()
+            if command == CONTROL_SET_PROFILE:
+                self.__apply_profile(argument)
+                profile_changed = True
+            elif command in (CONTROL_PAUSE, CONTROL_RESUME):
+                self.paused = command == CONTROL_PAUSE
+                self.__logger.info(f"[Camera-{self.id}] {'Paused' if self.paused else 'Resumed'}")
+            elif command == CONTROL_SNAPSHOT:
+                self.snapshots.append(argument)
+            else:
+                self.__logger.warning(f"[Camera-{self.id}] Unknown control command {command}")
+        return profile_changed
+
+    def __apply_profile(self, profile: StreamProfile):
+        """
+        Switches to the new profile between frames
+        The device is only reconfigured if the capture mode changed, and only re-opened if the
+        running device does not accept the new mode
+        """
+        mode_changed = profile.capture_mode() != self.profile.capture_mode()
+        if (
+            profile.encoder_settings() != self.profile.encoder_settings()
+            or profile.delta_settings() != self.profile.delta_settings()
+        ):
+            self.encoder = None  # Re-run the encoder benchmark and restart from a keyframe
+        self.profile = profile
+        self.__logger.info(f"[Camera-{self.id}] Applying stream profile {profile}")
+
+        if not mode_changed:
+            return
+
+        if not self.__set_capture_mode():
+            self.__logger.warning(f"[Camera-{self.id}] Capture mode not accepted, re-opening device")
+            self.camera.release()
+            self.__setup_camera()
+
+    def __select_encoder(self, frame):
         """
+        Benchmarks the profile's encoder presets on a captured frame and keeps the fastest one
+        that fits in the frame size budget
+        """
+        settings = self.profile.encoder_settings()
+        with self.selection_lock:
+            preset = self.selected_presets.get(settings)
+            if preset is None:
+                candidates = [create_encoder(preset, self.profile.quality) for preset in self.profile.encoders]
+                encoder, _ = select_encoder(candidates, frame, self.profile.frame_size_budget)
+                preset = self.selected_presets[settings] = encoder.preset
+
+        # Each worker has its own encoder instance since throttling changes its quality
+        self.encoder = create_encoder(preset, self.profile.quality)
+        self.__logger.info(
+            f"[Camera-{self.id}] Selected encoder {self.encoder} (id {self.encoder.ENCODER_ID})"
+        )
+
+        self.delta_encoder = None
+        if self.profile.delta_tile_size:
+            self.delta_encoder = TileDeltaEncoder(
+                self.encoder,
+                tile_size=self.profile.delta_tile_size,
+                keyframe_interval=self.profile.keyframe_interval,
+            )
 
-        # Initialize network connection
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.settimeout(60.0)
-        RETRY_WINDOW = 10
+    def __encode_frame(self, frame):
+        """
+        Encodes the whole frame, or only its changed tiles in delta mode
+        Returns (frame type, payload buffer), payload is None if encoding failed
+        """
+        if self.delta_encoder is not None:
+            return self.delta_encoder.encode(frame)
 
+        # Sent straight from the encoder's output array
+        result, encoded_frame = self.encoder.encode(frame)
+        return FRAME_FULL, encoded_frame if result else None
+
+    def __is_throttled(self):
+        """
+        Checks the shared bandwidth allocation before capturing a frame
+        While throttled, frames are skipped and the encoder quality steps down. It recovers slowly
+        towards the profile quality once frames are allowed again
+        """
+        if self.bandwidth is None:
+            return False
+
+        throttled = self.bandwidth.is_throttled(self.bandwidth_stream)
+        if self.encoder is not None:
+            if throttled:
+                quality = max(self.encoder.quality - self.THROTTLE_QUALITY_STEP, self.MIN_THROTTLE_QUALITY)
+            else:
+                quality = min(self.encoder.quality + 1, self.profile.quality)
+
+            if quality != self.encoder.quality:
+                self.__logger.debug(f"[Camera-{self.id}] Bandwidth quality {quality}")
+                self.encoder.quality = quality
+        return throttled
+
+    def __wait_for_next_frame(self, delay_seconds):
+        """
+        Waits for the frame interval, returning early if a control message arrives
+        """
+        if self.control_conn is not None:
+            self.clock.poll(self.control_conn, delay_seconds)
+        else:
+            self.clock.sleep(delay_seconds)
+
+    def __setup_socket(self):
+        """
+        Initializes the TCP socket per camera for transmitting data to base terminal
+        Retries until connected, gives up as soon as the stop event is set
+        """
         while not self.stop_event.is_set():
+            # Initialize network connection, a failed connect leaves the socket unusable
+            if self.socket is not None:
+                self.socket.close()
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.settimeout(self.SOCKET_TIMEOUT)
+
             try:
                 self.__logger.info(f"Connecting to {self.host}:{self.port}")
-                self.socket.connect((self.host, self.port))
-                logging.info(f"Camera {self.id} socket initialized\n")
+                if connect_until_stopped(self.socket, (self.host, self.port), self.stop_event, self.SOCKET_TIMEOUT):
+                    logging.info(f"Camera {self.id} socket initialized\n")
                 return
             except ConnectionRefusedError:
-                 self.__logger.warning(f"[Camera-{self.id}] Connection refused, retrying in {RETRY_WINDOW}s...\n")
+                self.__logger.warning(f"[Camera-{self.id}] Connection refused, retrying in {self.RETRY_WINDOW}s...\n")
             except socket.timeout:
-                self.__logger.warning(f"[Camera-{self.id}] Connection timed out, retrying in {RETRY_WINDOW}s...\n")
+                self.__logger.warning(f"[Camera-{self.id}] Connection timed out, retrying in {self.RETRY_WINDOW}s...\n")
             except Exception as e:
-                self.__logger.error(f"[Camera-{self.id}] Unexpected error: {e}, retrying in {RETRY_WINDOW}s...\n")
-
-            time.sleep(RETRY_WINDOW)
-
-        # raise RuntimeError(f"[Camera-{self.id}] Stopped before socket could connect")
-                
-                
-        #         # self.socket.connect((self.host, self.port))
-        #         for attempt in range(5):
-        #             try:
-        #                 self.socket.connect((self.host, self.port))
-        #                 logging.info(f"Camera {self.id} socket initialized!")
-        #                 return
-        #             except ConnectionRefusedError:
-        #                 logging.warning(f"[Camera-{self.id}] Connection refused, retrying in 2s...")
-        #                 time.sleep(2)
-        #         raise RuntimeError("Failed to connect after multiple attempts")
-
-        # except socket.timeout:
-        #     self.__logger.error("Connection timed out")
-        #     raise RuntimeError("Connection timed out")
-
-        # except Exception as e:
-        #     self.__logger.error(f"Connection error: {e}")
-        #     raise RuntimeError(f"Connection failed: {e}")
-
-        # self.__logger.info(f"Camera {self.id} socket initialized!")
+                self.__logger.error(f"[Camera-{self.id}] Unexpected error: {e}, retrying in {self.RETRY_WINDOW}s...\n")
+
+            self.clock.wait(self.stop_event, self.RETRY_WINDOW)
 
     def __stream_frames(self):
         """
         Continuously capture and transmit frames over TCP
 
-        Payload format:
-        - 8 bytes: timestamp (float)
-        - 4 bytes: image length (int)
-        - N bytes: encoded image frame
+        Frame format (see wire_protocol.py):
+        - 25 bytes: frame header with the stream sequence number, capture timestamp, length and CRC
+        - 4 bytes: device id (int)
+        - 1 byte: encoder id (FrameEncoder.ENCODER_ID)
+        - 1 byte: frame type (full, keyframe, delta or snapshot, see tile_delta.py)
+        - 1 byte: DeviceState value at capture, NO_POSE without IMU data
+        - 16 bytes: IMU orientation quaternion w, x, y, z at capture (float32)
+        - 12 bytes: IMU angular rate x, y, z at capture (float32 rads/s)
+        - N bytes: encoded image frame, or keyframe/delta payload
         """
-        # delay_seconds = float(1.0 / self.fps)
-        delay_seconds = float(5)
+        next_frame_time = self.clock.monotonic()
 
         while not self.stop_event.is_set():
-            # Capture frame
-            result, frame = self.camera.read()
-            self.__logger.debug(f"Sending data {result}")
+            # Apply profile updates between frames, a faster fps takes effect from the next frame
+            if self.__apply_control_messages():
+                next_frame_time = min(next_frame_time, self.clock.monotonic() + 1.0 / self.profile.fps)
+
+            # Snapshots are taken even while paused or throttled, they were asked for explicitly
+            if self.snapshots and not self.__capture_snapshots():
+                break
+
+            if self.paused:
+                self.__wait_for_next_frame(self.PAUSED_WAIT)
+                next_frame_time = self.clock.monotonic()  # First frame straight after resuming
+                continue
+
+            # Wait until the next frame is due (a control message cuts the wait short)
+            remaining = next_frame_time - self.clock.monotonic()
+            if remaining > 0:
+                self.__wait_for_next_frame(remaining)
+                continue
+            next_frame_time = self.clock.monotonic() + 1.0 / self.profile.fps
+
+            # Skip this frame if the camera is over its share of the uplink. It is still taken from
+            # the driver queue, or the first frame read after throttling would be an old one
+            if self.__is_throttled():
+                self.camera.grab()
+                continue
+
+            # Capture frame into the last frame's buffer
+            result, frame = self.camera.read(self.frame)
+            capture_time = self.__capture_time()
 
             if not result:
                 self.__logger.warn(f"[Camera-{self.id}] Failed to capture frame {result}")
                 continue
+            self.frame = frame
+
+            # IMU pose at the capture time, frames taken while turning fast are dropped before
+            # encoding
+            pose = self.imu_pose.pose_at(capture_time) if self.imu_pose is not None else None
+            if pose is not None and self.profile.max_gyro_rate and angular_speed(pose) > self.profile.max_gyro_rate:
+                self.blurred_frames += 1
+                self.__logger.debug(f"[Camera-{self.id}] Dropped blurred frame at {angular_speed(pose):.2f} rads/s")
+                continue
+
+            if self.encoder is None:
+                self.__select_encoder(frame)
 
             # Encode frame
-            result, encoded_frame = cv2.imencode(".jpg", frame)
+            frame_type, data_to_send = self.__encode_frame(frame)
 
-            if not result:
+            if data_to_send is None:
                 self.__logger.warn(f"[Camera-{self.id}] Failed to encode frame")
                 continue
 
-            data_to_send = encoded_frame.tobytes()
-
-            # Transmit image
-            timestamp = time.time()
-            length = len(data_to_send)
+            if not self.__send_frame(capture_time, self.encoder.ENCODER_ID, frame_type, pose, data_to_send):
+                break
 
-            # Pack header (timestamp + length)
-            header = struct.pack(
-                ">dII",  # Big endian (network endianess), float64, uint32, uint32
-                timestamp,
-                self.id,
-                length,
-            )
+    def __capture_time(self):
+        """
+        Wall clock time the frame just read was captured
+        V4L2 stamps each buffer with the monotonic clock when the camera fills it, so a frame that
+        waited in the driver queue keeps its own time. Without a plausible buffer timestamp (a
+        backend that reports none, or a camera clock other than ours) the time read() returned is
+        used, which is late by the time the frame was queued: up to the queue length (4 buffers by
+        default) times the frame period
+        """
+        now = self.clock.time()
+        buffer_ms = self.camera.get(cv2.CAP_PROP_POS_MSEC)
+        age = self.clock.monotonic() - buffer_ms / 1000.0
+        if buffer_ms > 0 and 0.0 <= age < self.MAX_BUFFER_AGE:
+            return now - age
+        return now
+
+    def __send_frame(self, capture_time, encoder_id, frame_type, pose, data_to_send):
+        """
+        Sends the header and encoded frame, returns False if the connection is lost
+        """
+        if pose is not None:
+            state = pose.state.value if pose.state is not None else NO_POSE
+            quaternion, gyro = pose.quaternion, pose.gyro
+        else:
+            state, quaternion, gyro = NO_POSE, NO_QUATERNION, NO_GYRO
+
+        # Pack headers (frame header + device id + encoder id + frame type + pose) into the writer's
+        # buffer
+        header = self.writer.pack(
+            capture_time,
+            data_to_send,
+            self.id,
+            encoder_id,
+            frame_type,
+            state,
+            *quaternion,
+            *gyro,
+        )
 
-            try:
-                # Send header + image to server
-                payload = header + data_to_send
-                self.socket.sendall(payload)
-                self.__logger.info(f"[Camera-{self.id}] payload sent")
-            except (BrokenPipeError, ConnectionResetError):
-                self.__logger.error(f"[Camera-{self.id}] Unable to connect to server")
+        try:
+            # Send header + image to server, gathered by the kernel instead of concatenated
+            sent = sendmsg_all(self.socket, (header, data_to_send))
+            if self.bandwidth is not None:
+                self.bandwidth.consume(self.bandwidth_stream, sent)
+            self.__logger.debug("[Camera-%s] payload sent", self.id)
+        except (BrokenPipeError, ConnectionResetError):
+            self.__logger.error(f"[Camera-{self.id}] Unable to connect to server")
+            return False
+        return True
+
+    def __capture_snapshots(self):
+        """
+        Captures and sends the requested snapshot bursts as FRAME_SNAPSHOT frames, switching the
+        camera to the snapshot resolution and back. Returns False if the connection is lost
+        """
+        requests, self.snapshots = self.snapshots, []
+        preset = self.encoder.preset if self.encoder is not None else self.profile.encoders[0]
+        connected = True
+        for request in requests:
+            self.__logger.info(f"[Camera-{self.id}] Taking snapshot {request}")
+            encoder = create_encoder(preset, request.quality)
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, request.width)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, request.height)
+
+            for _ in range(request.count):
+                result, frame = self.camera.read()
+                capture_time = self.clock.time()
+                if not result:
+                    self.__logger.warning(f"[Camera-{self.id}] Failed to capture snapshot frame")
+                    continue
+                result, encoded_frame = encoder.encode(frame)
+                if not result:
+                    self.__logger.warning(f"[Camera-{self.id}] Failed to encode snapshot frame")
+                    continue
+                pose = self.imu_pose.pose_at(capture_time) if self.imu_pose is not None else None
+                connected = self.__send_frame(capture_time, encoder.ENCODER_ID, FRAME_SNAPSHOT, pose, encoded_frame)
+                if not connected:
+                    break
+            if not connected:
                 break
 
-            time.sleep(delay_seconds)
+        if not self.__set_capture_mode():
+            self.__logger.warning(f"[Camera-{self.id}] Stream capture mode not accepted after snapshot")
+        return connected
 
     def __del__(self):
         """
@@ -0,0 +1,199 @@
+import logging
+import time
+from dataclasses import dataclass
+
+import cv2
+
+
+@dataclass(frozen=True)
+class EncoderPreset:
+    """
+    Named encoder configuration from the config file
+    Quality is not part of the preset, it comes from the stream profile so it can be tuned at
+    runtime
+    """
+
+    name: str
+    backend: str  # Key in ENCODER_BACKENDS
+    chroma_subsampling: str = "420"  # JPEG only: 411, 420, 422, 440 or 444
+    optimize: bool = False  # JPEG only: optimized Huffman tables, smaller but slower
+    compression: int = 1  # PNG only: zlib level 0-9
+
+    def __post_init__(self):
+        # YAML reads an unquoted 420 as an int, checked here so a bad value fails when the config
+        # loads rather than at the first encode in the worker
+        chroma_subsampling = str(self.chroma_subsampling)
+        if chroma_subsampling not in JpegEncoder.SAMPLING_FACTORS:
+            raise ValueError(
+                f"Encoder preset '{self.name}' has chroma_subsampling {self.chroma_subsampling!r}, "
+                f"expected one of {', '.join(JpegEncoder.SAMPLING_FACTORS)}"
+            )
+        object.__setattr__(self, "chroma_subsampling", chroma_subsampling)  # Frozen dataclass
+
+
+@dataclass(frozen=True)
+class EncoderBenchmark:
+    """
+    Result of encoding the sample frame with one encoder
+    """
+
+    preset: str
+    encoder_id: int
+    encode_seconds: float  # Mean time to encode the sample frame
+    size: int  # Encoded size of the sample frame in bytes
+
+
+class FrameEncoder:
+    """
+    Base class for frame encoder backends
+    ENCODER_ID is sent in the frame header so the base station knows how to decode the payload
+    """
+
+    ENCODER_ID = 0
+    EXTENSION = ""
+
+    def __init__(self, preset: EncoderPreset, quality: int):
+        self.preset = preset
+        self.quality = quality
+
+    def params(self):
+        """
+        cv2.imwrite flags passed to cv2.imencode
+        """
+        return []
+
+    def prepare(self, frame):
+        """
+        Converts the captured BGR frame before encoding
+        """
+        return frame
+
+    def encode(self, frame):
+        """
+        Encodes the frame, returns (success, encoded numpy buffer) like cv2.imencode
+        """
+        return cv2.imencode(self.EXTENSION, self.prepare(frame), self.params())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.preset.name}, quality={self.quality})"
+
+
+class JpegEncoder(FrameEncoder):
+    ENCODER_ID = 1
+    EXTENSION = ".jpg"
+
+    SAMPLING_FACTORS = {
+        "411": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_411,
+        "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+        "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+        "440": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_440,
+        "444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    }
+
+    def params(self):
+        return [
+            cv2.IMWRITE_JPEG_QUALITY, self.quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, int(self.preset.optimize),
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, self.SAMPLING_FACTORS[self.preset.chroma_subsampling],
+        ]
+
+
+class GrayJpegEncoder(JpegEncoder):
+    ENCODER_ID = 2
+
+    def params(self):
+        # Chroma subsampling does not apply to single channel images
+        return [
+            cv2.IMWRITE_JPEG_QUALITY, self.quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, int(self.preset.optimize),
+        ]
+
+    def prepare(self, frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+class PngEncoder(FrameEncoder):
+    """
+    Lossless, intended for debug captures. Ignores the stream quality
+    """
+
+    ENCODER_ID = 3
+    EXTENSION = ".png"
+
+    def params(self):
+        return [cv2.IMWRITE_PNG_COMPRESSION, self.preset.compression]
+
+
+class WebpEncoder(FrameEncoder):
+    ENCODER_ID = 4
+    EXTENSION = ".webp"
+
+    def params(self):
+        return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+
+
+ENCODER_BACKENDS = {
+    "jpeg": JpegEncoder,
+    "gray_jpeg": GrayJpegEncoder,
+    "png": PngEncoder,
+    "webp": WebpEncoder,
+}
+
+
+def create_encoder(preset: EncoderPreset, quality: int):
+    """
+    Instantiates the backend named by the preset
+    """
+    if preset.backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{preset.backend}' in preset '{preset.name}'")
+    return ENCODER_BACKENDS[preset.backend](preset, quality)
+
+
+def benchmark_encoders(encoders, frame, repeats=5):
+    """
+    Encodes the sample frame `repeats` times with each encoder
+    Returns a list of EncoderBenchmark in the same order as encoders
+    """
+    results = []
+    for encoder in encoders:
+        encoder.encode(frame)  # Warm up, first call includes codec initialization
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            success, encoded = encoder.encode(frame)
+        elapsed = (time.perf_counter() - start) / repeats
+
+        size = len(encoded) if success else 0
+        results.append(EncoderBenchmark(encoder.preset.name, encoder.ENCODER_ID, elapsed, size))
+
+    return results
+
+
+def select_encoder(encoders, frame, size_budget, repeats=5):
+    """
+    Benchmarks the candidate encoders on a sample frame and picks the fastest one whose output fits
+    within size_budget bytes. If none fit, picks the one with the smallest output
+    Returns (encoder, list of EncoderBenchmark)
+    """
+    if not encoders:
+        raise ValueError("No candidate encoders to select from")
+
+    logger = logging.getLogger(__name__)
+    results = benchmark_encoders(encoders, frame, repeats)
+
+    for result in results:
+        logger.info(
+            f"Encoder {result.preset}: {result.encode_seconds * 1000:.2f} ms, {result.size} bytes"
+        )
+
+    candidates = [
+        (result.encode_seconds, i) for i, result in enumerate(results)
+        if 0 < result.size <= size_budget
+    ]
+    if candidates:
+        _, best = min(candidates)
+    else:
+        logger.warning(f"No encoder fits the {size_budget} byte budget, using the smallest output")
+        _, best = min((result.size or float("inf"), i) for i, result in enumerate(results))
+
+    return encoders[best], results
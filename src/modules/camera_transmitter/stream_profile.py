@@ -0,0 +1,158 @@
+import logging
+from dataclasses import dataclass, fields, replace
+
+from .frame_encoder import EncoderPreset
+from ..device_state import DeviceState
+
+DEFAULT_ENCODER_PRESET = "jpeg"  # Always defined, see system_config.DEFAULT_CONFIG
+
+
+@dataclass(frozen=True)
+class StreamProfile:
+    """
+    Per-camera stream settings that can be pushed to a running CameraWorker
+    """
+
+    fps: float = 2.0
+    width: int = 320
+    height: int = 240
+    quality: int = 90  # JPEG/WebP quality 0-100, higher is better quality and larger frames
+    encoders: tuple = ()  # Candidate EncoderPresets, the fastest within the size budget is used
+    frame_size_budget: int = 100000  # Max encoded frame size in bytes
+    delta_tile_size: int = 0  # Tile size for delta encoding (see tile_delta.py), 0 sends whole frames
+    keyframe_interval: int = 30  # Delta mode only: max frames between full keyframes
+    max_gyro_rate: float = 0.0  # rads/s, frames captured while rotating faster are dropped as blurred, 0 keeps all
+
+    @classmethod
+    def from_dict(cls, values, encoder_presets):
+        """
+        Builds a profile from a config dict, ignoring unknown keys
+        encoder_presets: {preset name: EncoderPreset} used to resolve the `encoders` list
+        """
+        known = {f.name for f in fields(cls)}
+        unknown = set(values) - known
+        if unknown:
+            logging.getLogger(__name__).warning(f"Ignoring unknown stream profile keys {unknown}")
+
+        values = {key: value for key, value in values.items() if key in known}
+
+        preset_names = values.get("encoders") or [DEFAULT_ENCODER_PRESET]
+        for name in preset_names:
+            if name not in encoder_presets:
+                raise ValueError(f"Stream profile uses undefined encoder preset '{name}'")
+        values["encoders"] = tuple(encoder_presets[name] for name in preset_names)
+
+        return cls(**values)
+
+    def capture_mode(self):
+        """
+        Settings that have to be configured on the camera device itself
+        Changing anything else only affects encoding and transmission
+        """
+        return (self.width, self.height, self.fps)
+
+    def encoder_settings(self):
+        """
+        Settings that require re-running the encoder selection benchmark when changed
+        """
+        return (self.width, self.height, self.quality, self.encoders, self.frame_size_budget)
+
+    def delta_settings(self):
+        """
+        Settings that require restarting delta encoding from a new keyframe when changed
+        """
+        return (self.delta_tile_size, self.keyframe_interval)
+
+    def with_changes(self, **changes):
+        """
+        Returns a copy of the profile with the given fields replaced
+        """
+        return replace(self, **changes)
+
+
+@dataclass(frozen=True)
+class StreamLimit:
+    """
+    Reduction applied on top of every camera's profile, e.g. by the performance governor
+    """
+
+    fps_scale: float = 1.0
+    resolution_scale: float = 1.0  # Width and height are scaled, keeping the aspect ratio
+    max_quality: int = 100
+
+    def combine(self, other):
+        """
+        Returns a limit at least as strict as both limits
+        """
+        return StreamLimit(
+            fps_scale=self.fps_scale * other.fps_scale,
+            resolution_scale=self.resolution_scale * other.resolution_scale,
+            max_quality=min(self.max_quality, other.max_quality),
+        )
+
+    def apply(self, profile):
+        """
+        Returns the profile with the limit applied
+        """
+        if self == NO_LIMIT:
+            return profile
+        return profile.with_changes(
+            fps=profile.fps * self.fps_scale,
+            width=max(2, round(profile.width * self.resolution_scale / 2) * 2),  # Kept even for the encoders
+            height=max(2, round(profile.height * self.resolution_scale / 2) * 2),
+            quality=min(profile.quality, self.max_quality),
+        )
+
+
+NO_LIMIT = StreamLimit()
+
+
+def _build_profiles(camera_config):
+    """
+    Returns {profile name: StreamProfile} for the profiles defined in the camera config
+    """
+    encoder_presets = {
+        name: EncoderPreset(name=name, **values)
+        for name, values in (camera_config.get("encoders") or {}).items()
+    }
+    return {
+        name: StreamProfile.from_dict(values, encoder_presets)
+        for name, values in camera_config["profiles"].items()
+    }
+
+
+def resolve_camera_profiles(camera_config):
+    """
+    Maps each configured USB port to its StreamProfile
+    Returns (default profile, {usb port: profile})
+    """
+    profiles = _build_profiles(camera_config)
+
+    default_name = camera_config["default_profile"]
+    if default_name not in profiles:
+        raise ValueError(f"Default stream profile '{default_name}' is not defined")
+
+    device_profiles = {}
+    for usb_port, profile_name in (camera_config.get("devices") or {}).items():
+        if profile_name not in profiles:
+            raise ValueError(f"Camera {usb_port} uses undefined stream profile '{profile_name}'")
+        device_profiles[usb_port] = profiles[profile_name]
+
+    return profiles[default_name], device_profiles
+
+
+def resolve_state_profiles(camera_config):
+    """
+    Returns {DeviceState: StreamProfile} for the device states that override every camera's profile
+    """
+    profiles = _build_profiles(camera_config)
+
+    state_profiles = {}
+    for state_name, profile_name in (camera_config.get("state_profiles") or {}).items():
+        if state_name not in DeviceState.__members__:
+            raise ValueError(f"Unknown device state '{state_name}' in camera state profiles")
+        if profile_name not in profiles:
+            raise ValueError(f"Device state {state_name} uses undefined stream profile '{profile_name}'")
+        state_profiles[DeviceState[state_name]] = profiles[profile_name]
+
+    return state_profiles
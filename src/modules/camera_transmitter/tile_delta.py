@@ -0,0 +1,213 @@
+import struct
+
+import cv2
+import numpy as np
+
+# Frame types sent in the frame header
+FRAME_FULL = 0  # Whole frame encoded on its own (delta mode off)
+FRAME_KEY = 1  # Whole frame, becomes the reference for the following delta frames
+FRAME_DELTA = 2  # Only the tiles that changed since the last keyframe
+FRAME_SNAPSHOT = 3  # Whole frame captured on request outside the stream profile (see CameraWorker)
+
+# Keyframe payload: uint32 keyframe id, uint16 frame width, uint16 frame height, encoded frame
+KEY_HEADER = struct.Struct(">IHH")
+# Delta payload: uint32 keyframe id, uint16 tile size, uint16 tile count, uint16 tile
+# indices[count], encoded mosaic of the changed tiles
+DELTA_HEADER = struct.Struct(">IHH")
+
+
+def _tile_view(image, tile_size):
+    """
+    Returns a (tiles_y, tiles_x, tile_size, tile_size, channels) view of an image whose sides are
+    multiples of tile_size, without copying
+    """
+    height, width = image.shape[:2]
+    channels = image.shape[2] if image.ndim == 3 else 1
+    tiles = image.reshape(height // tile_size, tile_size, width // tile_size, tile_size, channels)
+    return tiles.swapaxes(1, 2)
+
+
+class TileDeltaEncoder:
+    """
+    Splits frames into tiles and only encodes the tiles that changed since the last keyframe
+    Changed tiles are packed into a single mosaic image so they share one encoder call and header
+    The first frame is always a keyframe. A receiver that reconnects starts from a new encoder: a
+    lost connection ends the CameraWorker run, and the restarted run creates its encoders again
+    """
+
+    def __init__(
+        self,
+        encoder,
+        tile_size=32,
+        threshold=6.0,
+        keyframe_interval=30,
+        max_changed_fraction=0.5,
+    ):
+        """
+        encoder: FrameEncoder used for keyframes and tile mosaics
+        tile_size: tile side in pixels, a multiple of 16 keeps tiles aligned to JPEG blocks
+        threshold: mean absolute pixel difference above which a tile counts as changed
+        keyframe_interval: send a keyframe at least every N frames for recovery
+        max_changed_fraction: send a keyframe instead if more than this fraction of tiles changed
+        """
+        self.encoder = encoder
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.max_changed_fraction = max_changed_fraction
+
+        self.keyframe_id = 0
+        self.frames_since_keyframe = 0
+        self.keyframe = None  # Padded copy of the last keyframe
+        self.padded = None  # Reused buffer for padding frames to whole tiles
+        self.diff = None  # Reused buffer for the difference from the keyframe
+
+    def __pad(self, frame):
+        """
+        Copies the frame into a buffer whose sides are rounded up to whole tiles
+        Edge tiles are padded with zeros, which the decoder crops off again
+        """
+        height, width = frame.shape[:2]
+        padded_height = -(-height // self.tile_size) * self.tile_size
+        padded_width = -(-width // self.tile_size) * self.tile_size
+        padded_shape = (padded_height, padded_width) + frame.shape[2:]
+
+        if self.padded is None or self.padded.shape != padded_shape or self.padded.dtype != frame.dtype:
+            self.padded = np.zeros(padded_shape, dtype=frame.dtype)
+            self.diff = np.empty_like(self.padded)
+            self.keyframe = None
+        self.padded[:height, :width] = frame
+        return self.padded
+
+    def changed_tiles(self, padded):
+        """
+        Returns the flat indices of tiles whose mean absolute difference from the keyframe exceeds
+        the threshold
+        """
+        diff = cv2.absdiff(padded, self.keyframe, dst=self.diff)
+        tile_diff = _tile_view(diff, self.tile_size).mean(axis=(2, 3, 4))
+        return np.flatnonzero(tile_diff > self.threshold)
+
+    def encode(self, frame):
+        """
+        Encodes the frame as a keyframe or delta frame
+        Returns (frame type, payload bytes), or (frame type, None) if encoding failed
+        """
+        height, width = frame.shape[:2]
+        padded = self.__pad(frame)
+
+        if self.keyframe is not None and self.frames_since_keyframe < self.keyframe_interval:
+            changed = self.changed_tiles(padded)
+            tiles_y, tiles_x = padded.shape[0] // self.tile_size, padded.shape[1] // self.tile_size
+            if len(changed) <= self.max_changed_fraction * tiles_y * tiles_x:
+                self.frames_since_keyframe += 1
+                return FRAME_DELTA, self.__encode_delta(padded, changed, tiles_x)
+
+        return FRAME_KEY, self.__encode_keyframe(frame, padded, width, height)
+
+    def __encode_keyframe(self, frame, padded, width, height):
+        success, encoded = self.encoder.encode(frame)
+        if not success:
+            return None
+
+        if self.keyframe is None:
+            self.keyframe = padded.copy()
+        else:
+            np.copyto(self.keyframe, padded)
+
+        self.keyframe_id = (self.keyframe_id + 1) & 0xFFFFFFFF
+        self.frames_since_keyframe = 0
+        return KEY_HEADER.pack(self.keyframe_id, width, height) + encoded.tobytes()
+
+    def __encode_delta(self, padded, changed, tiles_x):
+        header = DELTA_HEADER.pack(self.keyframe_id, self.tile_size, len(changed))
+        indices = changed.astype(">u2").tobytes()
+        if len(changed) == 0:
+            return header + indices
+
+        # Gather the changed tiles and lay them out row by row, tiles_x tiles per mosaic row
+        rows, cols = np.divmod(changed, tiles_x)
+        selected = _tile_view(padded, self.tile_size)[rows, cols]
+        mosaic_rows = -(-len(changed) // tiles_x)
+        grid = np.zeros((mosaic_rows * tiles_x,) + selected.shape[1:], dtype=padded.dtype)
+        grid[: len(changed)] = selected
+        mosaic = grid.reshape(mosaic_rows, tiles_x, self.tile_size, self.tile_size, -1).swapaxes(1, 2)
+        mosaic = mosaic.reshape((mosaic_rows * self.tile_size, tiles_x * self.tile_size) + padded.shape[2:])
+
+        success, encoded = self.encoder.encode(mosaic)
+        if not success:
+            return None
+        return header + indices + encoded.tobytes()
+
+
+class TileDeltaDecoder:
+    """
+    Reference decoder that rebuilds full frames from keyframe and delta payloads
+    Used on the base station side and to verify TileDeltaEncoder
+    """
+
+    def __init__(self):
+        self.keyframe_id = None
+        self.keyframe = None  # Decoded keyframe padded to whole tiles
+        self.width = 0
+        self.height = 0
+
+    def decode(self, frame_type, payload):
+        """
+        Returns the reconstructed frame as a numpy array
+        Raises ValueError for delta frames whose keyframe has not been received
+        """
+        if frame_type in (FRAME_FULL, FRAME_SNAPSHOT):
+            return self.__imdecode(payload)
+        if frame_type == FRAME_KEY:
+            return self.__decode_keyframe(payload)
+        if frame_type == FRAME_DELTA:
+            return self.__decode_delta(payload)
+        raise ValueError(f"Unknown frame type {frame_type}")
+
+    @staticmethod
+    def __imdecode(data):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError("Unable to decode image payload")
+        return image
+
+    def __decode_keyframe(self, payload):
+        keyframe_id, width, height = KEY_HEADER.unpack_from(payload)
+        image = self.__imdecode(memoryview(payload)[KEY_HEADER.size:])
+
+        self.keyframe_id = keyframe_id
+        self.width, self.height = width, height
+        self.keyframe = image
+        return image[:height, :width].copy()
+
+    def __decode_delta(self, payload):
+        keyframe_id, tile_size, count = DELTA_HEADER.unpack_from(payload)
+        if self.keyframe is None or keyframe_id != self.keyframe_id:
+            raise ValueError(f"Delta frame references missing keyframe {keyframe_id}")
+
+        # Pad the stored keyframe to whole tiles the first time a delta refers to it
+        padded_height = -(-self.height // tile_size) * tile_size
+        padded_width = -(-self.width // tile_size) * tile_size
+        if self.keyframe.shape[:2] != (padded_height, padded_width):
+            padded = np.zeros((padded_height, padded_width) + self.keyframe.shape[2:], self.keyframe.dtype)
+            padded[: self.height, : self.width] = self.keyframe
+            self.keyframe = padded
+
+        frame = self.keyframe.copy()
+        offset = DELTA_HEADER.size
+        indices = np.frombuffer(payload, dtype=">u2", count=count, offset=offset).astype(np.intp)
+        offset += 2 * count
+
+        if count:
+            mosaic = self.__imdecode(memoryview(payload)[offset:])
+            if mosaic.ndim != frame.ndim:
+                raise ValueError("Tile mosaic does not match the keyframe channels")
+
+            # Scatter the mosaic tiles back to their positions through a tile view of the frame
+            tiles = _tile_view(mosaic, tile_size)
+            tiles = tiles.reshape((-1,) + tiles.shape[2:])[:count]
+            rows, cols = np.divmod(indices, padded_width // tile_size)
+            _tile_view(frame, tile_size)[rows, cols] = tiles
+
+        return frame[: self.height, : self.width]
@@ -0,0 +1,247 @@
+import functools
+import math
+import multiprocessing as mp
+import os
+import threading
+import time
+
+# Participant slot states in VirtualClock
+FREE = 0
+RUNNING = 1
+SLEEPING = 2
+
+VIRTUAL_EPOCH = 1.7e9  # time() of virtual time 0, so timestamps look like wall clock times
+
+
+class Clock:
+    """
+    Wall and monotonic time and sleeping, injected into every loop that waits so a simulation can
+    swap in a VirtualClock
+    time() is the wall clock used for sample and frame timestamps, monotonic() is for intervals
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0.0))
+
+    def wait(self, event, timeout=None):
+        """
+        Blocks until event is set or timeout seconds pass, returns True if the event is set
+        """
+        return event.wait(timeout)
+
+    def poll(self, conn, timeout):
+        """
+        Blocks until conn (a multiprocessing Connection) has data or timeout seconds pass, returns
+        True if it has data
+        """
+        return conn.poll(timeout)
+
+    def participant(self, target):
+        """
+        Wraps the target of a new thread or process that sleeps on this clock, see VirtualClock
+        """
+        return target
+
+    def unregister(self):
+        """
+        Called by a thread that will not sleep on this clock again, see VirtualClock
+        """
+
+
+class VirtualClock(Clock):
+    """
+    Simulated time shared by every process and thread forked after it is created
+    Threads that sleep or wait on the clock take part in the simulation, as does the thread that
+    creates it. Time stands still while any of them is running and jumps straight to the earliest
+    wake-up once all of them are asleep, so an hour of sleeps, polls and retries runs as fast as the
+    work between them. Work outside the clock (encoding, socket I/O) takes no simulated time
+    Threads and processes are started with participant(target), so time also waits for them between
+    being started and their first sleep. A participant that goes on to block outside the clock must
+    unregister() first, or time stops. Participants that exit without unregistering are freed by the
+    next sleeper that notices (Linux only for threads of a process that is still running)
+    """
+
+    POLL_INTERVAL = 0.005  # Real seconds between checks of events and exited participants while asleep
+
+    def __init__(self, start=0.0, max_participants=64):
+        """
+        start: initial monotonic() time, time() is VIRTUAL_EPOCH later
+        max_participants: number of threads that may use the clock, across all processes
+        """
+        self.condition = mp.Condition()
+        # Guarded by the condition
+        self.now = mp.RawValue("d", start)
+        self.states = mp.RawArray("B", max_participants)
+        self.wake_times = mp.RawArray("d", max_participants)
+        self.pids = mp.RawArray("i", max_participants)
+        self.tids = mp.RawArray("i", max_participants)  # Native thread id, 0 until the participant runs
+        # Sleepers that also wait for an event or pipe data may only be overtaken by time once they
+        # saw what the last participant to stop running did: sleeps counts the participants that
+        # stopped, checked the count each waiting sleeper last looked at
+        self.sleeps = mp.RawValue("Q", 0)
+        self.checked = mp.RawArray("Q", max_participants)
+        self.waiting = mp.RawArray("B", max_participants)
+        self.slots = {}  # (pid, thread id): slot, only the entries of this process are used
+
+        # Time waits for the creating thread to finish setting up the simulation
+        with self.condition:
+            self.__slot()
+
+    def time(self):
+        return VIRTUAL_EPOCH + self.now.value
+
+    def monotonic(self):
+        return self.now.value
+
+    def sleep(self, seconds):
+        self.__sleep_until(self.now.value + max(seconds, 0.0))
+
+    def wait(self, event, timeout=None):
+        if event.is_set():
+            return True
+        wake_time = math.inf if timeout is None else self.now.value + max(timeout, 0.0)
+        return self.__sleep_until(wake_time, event.is_set)
+
+    def poll(self, conn, timeout):
+        if conn.poll():
+            return True
+        # Data sent by a participant arrives while time stands still for it, so the sleep ends at
+        # the simulated time it was sent
+        return self.__sleep_until(self.now.value + max(timeout, 0.0), conn.poll)
+
+    def participant(self, target):
+        """
+        Reserves a slot now, in the starting thread, for the thread or process that will run target
+        """
+        with self.condition:
+            slot = self.__claim_slot()
+        return functools.partial(self.__run_participant, slot, target)
+
+    def __run_participant(self, slot, target, *args, **kwargs):
+        self.slots[(os.getpid(), threading.get_ident())] = slot
+        self.pids[slot] = os.getpid()
+        self.tids[slot] = threading.get_native_id()
+        try:
+            return target(*args, **kwargs)
+        finally:
+            self.unregister()
+
+    def unregister(self):
+        """
+        Frees the calling thread's slot, so time no longer waits for it
+        Threads that exit without calling this are noticed by the next sleep that times out waiting
+        for them
+        """
+        slot = self.slots.pop((os.getpid(), threading.get_ident()), None)
+        if slot is None:
+            return
+        with self.condition:
+            self.states[slot] = FREE
+            self.sleeps.value += 1
+            self.__advance()
+
+    def __slot(self):
+        """
+        Slot of the calling thread, claimed on its first sleep
+        Must be called with the condition held
+        """
+        key = (os.getpid(), threading.get_ident())
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.__claim_slot()
+            self.slots[key] = slot
+            self.tids[slot] = threading.get_native_id()
+        return slot
+
+    def __claim_slot(self):
+        """
+        Marks a free slot as running in this process, must be called with the condition held
+        """
+        free = [i for i, state in enumerate(self.states) if state == FREE]
+        if not free:
+            raise RuntimeError(f"VirtualClock has no free slots for another thread ({len(self.states)} in use)")
+        slot = free[0]
+        self.states[slot] = RUNNING
+        self.pids[slot] = os.getpid()
+        self.tids[slot] = 0
+        return slot
+
+    def __advance(self):
+        """
+        Moves time to the earliest wake-up if every participant is asleep and wakes the sleepers
+        Must be called with the condition held
+        """
+        if any(state == RUNNING for state in self.states):
+            return
+        if any(
+            state == SLEEPING and self.waiting[i] and self.checked[i] != self.sleeps.value
+            for i, state in enumerate(self.states)
+        ):
+            self.condition.notify_all()  # Let them look first
+            return
+        wake_times = [self.wake_times[i] for i, state in enumerate(self.states) if state == SLEEPING]
+        if wake_times and math.isfinite(min(wake_times)) and min(wake_times) > self.now.value:
+            self.now.value = min(wake_times)
+        self.condition.notify_all()
+
+    def __reap(self):
+        """
+        Frees the slots of exited processes and threads, which would otherwise hold time still
+        forever
+        Must be called with the condition held
+        """
+        for slot, state in enumerate(self.states):
+            if state == FREE:
+                continue
+            pid, tid = self.pids[slot], self.tids[slot]
+            if pid != os.getpid():
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    self.states[slot] = FREE
+                    continue
+            # A thread that has not started yet has no id. Without /proc exited threads of running
+            # processes are not detected
+            if tid and os.path.isdir(f"/proc/{pid}/task") and not os.path.exists(f"/proc/{pid}/task/{tid}"):
+                self.states[slot] = FREE
+
+    def __sleep_until(self, wake_time, ready=None):
+        """
+        Sleeps until wake_time or until ready() returns True, returns ready() (True without it)
+        """
+        with self.condition:
+            slot = self.__slot()
+            self.wake_times[slot] = wake_time
+            self.states[slot] = SLEEPING
+            self.waiting[slot] = ready is not None
+            self.sleeps.value += 1
+            self.__advance()
+            while self.now.value < wake_time and not (ready is not None and ready()):
+                if ready is not None and self.checked[slot] != self.sleeps.value:
+                    self.checked[slot] = self.sleeps.value
+                    self.__advance()
+                elif not self.condition.wait(self.POLL_INTERVAL):
+                    self.__reap()
+                    self.__advance()
+            self.states[slot] = RUNNING
+        return ready() if ready is not None else True
+
+
+def create_clock(name):
+    """
+    Clock for the hal.clock config value: real or virtual
+    """
+    if name == "real":
+        return Clock()
+    if name == "virtual":
+        return VirtualClock()
+    raise ValueError(f"Unknown clock '{name}', expected real or virtual")
+
+
+REAL_CLOCK = Clock()
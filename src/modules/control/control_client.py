@@ -0,0 +1,56 @@
+import logging
+import socket
+
+from .control_protocol import ControlError, MessageReader, encode_message
+
+
+class ControlClient:
+    """
+    Base station side of the control channel, also the stand-in base station for tests
+    """
+
+    def __init__(self, host, port, timeout=5.0):
+        """
+        timeout: seconds to wait for the connection and for each response
+        """
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.reader = MessageReader()
+        self.next_id = 1
+        self.__logger = logging.getLogger(__name__)
+
+    def request(self, request_type, camera=None, **params):
+        """
+        Sends a request and returns the result of its response
+        Raises ControlError if the device answers with an error, socket.timeout if it does not
+        answer
+        """
+        request_id = self.next_id
+        self.next_id += 1
+        message = {"id": request_id, "type": request_type, "params": params}
+        if camera is not None:
+            message["camera"] = camera
+        self.socket.sendall(encode_message(message))
+
+        while True:
+            for response in self.__receive():
+                if response.get("id") != request_id:
+                    self.__logger.warning(f"Ignoring control response to request {response.get('id')}")
+                    continue
+                if not response.get("ok"):
+                    raise ControlError(response.get("error", "Unknown error"))
+                return response.get("result")
+
+    def __receive(self):
+        data = self.socket.recv(1 << 16)
+        if not data:
+            raise ConnectionError("Control connection closed by the device")
+        return self.reader.feed(data)
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,78 @@
+import json
+import struct
+
+# Base station control channel: the base station connects to network.control_port on the device and
+# sends requests, the device answers each with one response. Both are UTF-8 JSON objects, each
+# prefixed by its uint32 big endian length
+#   request:  {"id": 7, "type": "set_stream", "camera": 0, "params": {"fps": 5}}
+#   response: {"id": 7, "ok": true, "result": {...}} or {"id": 7, "ok": false, "error": "..."}
+# "camera" is a device id, or missing for every camera
+PROTOCOL_VERSION = 1
+MESSAGE_LENGTH = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 1 << 20
+
+# Request types
+STATUS = "status"  # Protocol version, device state and cameras
+METRICS = "metrics"  # SystemController.get_metrics()
+ARM = "arm"
+DISARM = "disarm"
+SET_STREAM = "set_stream"  # params: stream profile fields to override, {} to go back to the configured profile
+SNAPSHOT = "snapshot"  # params: count, width, height, quality. Frames arrive on the camera stream as FRAME_SNAPSHOT
+PAUSE = "pause"  # Camera stops capturing until resumed
+RESUME = "resume"
+REQUEST_TYPES = (STATUS, METRICS, ARM, DISARM, SET_STREAM, SNAPSHOT, PAUSE, RESUME)
+
+
+class ControlError(Exception):
+    """
+    Error response from the device, or a malformed message
+    """
+
+
+def encode_message(message):
+    """
+    Length prefixed JSON for a request or response dict
+    Values JSON has no type for (e.g. enums) are sent as strings
+    """
+    body = json.dumps(message, default=str).encode("utf-8")
+    if len(body) > MAX_MESSAGE_SIZE:
+        raise ControlError(f"Control message of {len(body)} bytes is over the {MAX_MESSAGE_SIZE} byte limit")
+    return MESSAGE_LENGTH.pack(len(body)) + body
+
+
+class MessageReader:
+    """
+    Splits a TCP byte stream into control messages
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Adds received bytes and returns the list of messages (dicts) completed by them
+        Raises ControlError for oversized or malformed messages, the connection should then be
+        closed
+        """
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= MESSAGE_LENGTH.size:
+            (length,) = MESSAGE_LENGTH.unpack_from(self.buffer, offset)
+            if length > MAX_MESSAGE_SIZE:
+                raise ControlError(f"Control message of {length} bytes is over the {MAX_MESSAGE_SIZE} byte limit")
+            end = offset + MESSAGE_LENGTH.size + length
+            if end > len(self.buffer):
+                break
+
+            try:
+                message = json.loads(self.buffer[offset + MESSAGE_LENGTH.size:end])
+            except ValueError as e:
+                raise ControlError(f"Malformed control message: {e}")
+            if not isinstance(message, dict):
+                raise ControlError("Control message is not a JSON object")
+            messages.append(message)
+            offset = end
+
+        del self.buffer[:offset]
+        return messages
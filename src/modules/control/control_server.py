@@ -0,0 +1,108 @@
+import logging
+import socket
+import threading
+
+from .control_protocol import ControlError, MessageReader, encode_message
+
+
+class ControlServer:
+    """
+    Serves the base station control channel (see control_protocol.py)
+    Each connection is handled by its own thread, requests on it are answered in order. Requests
+    are passed to the handler registered for their type, whose return value is the result
+    """
+
+    def __init__(self, handlers, host="127.0.0.1", port=7000, max_clients=4):
+        """
+        handlers: {request type: function(camera, params) returning a JSON serializable result}. A
+        ValueError, KeyError, TypeError, ControlError or OSError (e.g. the worker's pipe was closed)
+        raised by the handler is sent back as the error
+        port: 0 for any free port, see self.port
+        """
+        self.handlers = handlers
+        self.max_clients = max_clients
+        self.server = socket.create_server((host, port))
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        self.lock = threading.Lock()  # Guards connections
+        self.thread = None
+        self.__logger = logging.getLogger(__name__)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__serve, name="Control-Server", daemon=True)
+        self.thread.start()
+        self.__logger.info(f"Control server listening on port {self.port}")
+
+    def stop(self):
+        """
+        Closes the listening socket and every connection
+        """
+        self.server.close()
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+
+    def __serve(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                return  # Closed by stop()
+
+            with self.lock:
+                if len(self.connections) >= self.max_clients:
+                    self.__logger.warning(
+                        f"Refusing control connection from {address}, {self.max_clients} already open"
+                    )
+                    connection.close()
+                    continue
+                self.connections.append(connection)
+
+            self.__logger.info(f"Control connection from {address}")
+            threading.Thread(
+                target=self.__handle_connection, args=(connection, address), name="Control-Client", daemon=True
+            ).start()
+
+    def __handle_connection(self, connection, address):
+        reader = MessageReader()
+        try:
+            with connection:
+                while True:
+                    data = connection.recv(1 << 16)
+                    if not data:
+                        break
+                    for request in reader.feed(data):
+                        connection.sendall(encode_message(self.handle(request)))
+        except (ControlError, OSError) as e:
+            self.__logger.warning(f"Closing control connection from {address}: {e}")
+        finally:
+            with self.lock:
+                if connection in self.connections:
+                    self.connections.remove(connection)
+        self.__logger.info(f"Control connection from {address} closed")
+
+    def handle(self, request):
+        """
+        Returns the response to one request
+        """
+        request_id = request.get("id")
+        request_type = request.get("type")
+        handler = self.handlers.get(request_type)
+        if handler is None:
+            return {"id": request_id, "ok": False, "error": f"Unknown request type {request_type}"}
+
+        params = request.get("params") or {}
+        try:
+            result = handler(request.get("camera"), params)
+        except (ValueError, KeyError, TypeError, ControlError, OSError) as e:
+            self.__logger.warning(f"Control request {request_type} {params} failed: {e}")
+            return {"id": request_id, "ok": False, "error": str(e)}
+
+        self.__logger.debug(f"Control request {request_type} {params} done")
+        return {"id": request_id, "ok": True, "result": result}
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+
+class FakeSysfs:
+    """
+    Directory tree with the /sys and /proc files SystemSensors reads, so the governor can be driven
+    off-device. Pass fake.root as the sensors root (governor.sysfs_root) and set the values to
+    simulate
+    """
+
+    TICKS_PER_UPDATE = 1000  # Jiffies added to /proc/stat by each set_cpu_usage
+
+    def __init__(self, root=None, cpus=4, zones=1, max_freq=1800.0):
+        """
+        root: directory to create the tree in, a new temporary directory if not given
+        max_freq: maximum CPU frequency in MHz, the CPUs start at it
+        """
+        self.root = root if root is not None else tempfile.mkdtemp(prefix="fake-sysfs-")
+        self.cpus = cpus
+        self.zones = zones
+        self.cpu_times = [0] * 8  # user nice system idle iowait irq softirq steal
+
+        for zone in range(zones):
+            self.__write(f"sys/class/thermal/thermal_zone{zone}/type", "cpu-thermal")
+        for cpu in range(cpus):
+            self.__write(f"sys/devices/system/cpu/cpu{cpu}/cpufreq/cpuinfo_max_freq", int(max_freq * 1000))
+        self.set_temperature(45.0)
+        self.set_cpu_freq(max_freq)
+        self.set_cpu_usage(0.0)
+        self.set_load_average(0.0)
+
+    def __write(self, path, value):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Replaced in one step so a concurrent reader never sees an empty file
+        with open(f"{path}.tmp", "w") as file:
+            file.write(f"{value}\n")
+        os.replace(f"{path}.tmp", path)
+
+    def set_temperature(self, celsius, zone=None):
+        """
+        Sets one thermal zone, or all of them for None
+        """
+        for index in range(self.zones) if zone is None else [zone]:
+            self.__write(f"sys/class/thermal/thermal_zone{index}/temp", int(celsius * 1000))
+
+    def set_cpu_freq(self, mhz):
+        for cpu in range(self.cpus):
+            self.__write(f"sys/devices/system/cpu/cpu{cpu}/cpufreq/scaling_cur_freq", int(mhz * 1000))
+
+    def set_cpu_usage(self, fraction):
+        """
+        Advances /proc/stat so the CPUs were busy for fraction of the time since the last update
+        """
+        busy = round(self.TICKS_PER_UPDATE * fraction)
+        self.cpu_times[0] += busy
+        self.cpu_times[3] += self.TICKS_PER_UPDATE - busy
+        line = " ".join(str(value) for value in self.cpu_times)
+        self.__write("proc/stat", f"cpu  {line} 0 0")
+
+    def set_load_average(self, load):
+        """
+        load: 1 minute load average over all CPUs, not per CPU
+        """
+        self.__write("proc/loadavg", f"{load:.2f} {load:.2f} {load:.2f} 1/100 1000")
+
+    def set_throttled(self, flags):
+        """
+        Writes the Raspberry Pi firmware throttle flags, see system_sensors.THROTTLED etc.
+        """
+        self.__write("sys/devices/platform/soc/soc:firmware/get_throttled", f"{flags:x}")
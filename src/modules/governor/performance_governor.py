@@ -0,0 +1,170 @@
+import logging
+from collections import deque
+from dataclasses import asdict
+
+from ..camera_transmitter.stream_profile import NO_LIMIT, StreamLimit
+from ..clock import REAL_CLOCK
+
+
+class PerformanceGovernor:
+    """
+    Lowers the camera streams step by step before the SoC reaches its thermal throttle point, and
+    restores them once there is headroom again
+    Each update reads the sensors and moves at most one level: up while the temperature, CPU usage
+    or firmware throttle flags show pressure, down while all of them are well below the limits.
+    Level n applies the first n steps on top of every camera's profile, so the steps are given in
+    the order they should be applied. Reaching hard_temp jumps straight to the last level
+    """
+
+    def __init__(
+        self,
+        sensors,
+        apply_limit,
+        steps,
+        soft_temp=70.0,
+        hard_temp=80.0,
+        restore_margin=5.0,
+        max_cpu_usage=0.9,
+        restore_cpu_usage=0.7,
+        hold=10.0,
+        clock=REAL_CLOCK,
+        history=20,
+    ):
+        """
+        sensors: SystemSensors to read
+        apply_limit: function(StreamLimit) applying a limit to every camera
+        steps: list of StreamLimit, applied cumulatively in order
+        soft_temp: degrees C at which the streams start being lowered
+        hard_temp: degrees C at which every step is applied at once
+        restore_margin: degrees below soft_temp the temperature must be for a step to be removed
+        max_cpu_usage, restore_cpu_usage: CPU busy fractions to lower at and restore below
+        hold: seconds between level changes, for the temperature to respond to the last one
+        history: number of level changes kept for metrics
+        """
+        self.sensors = sensors
+        self.apply_limit = apply_limit
+        self.steps = list(steps)
+        self.soft_temp = soft_temp
+        self.hard_temp = hard_temp
+        self.restore_margin = restore_margin
+        self.max_cpu_usage = max_cpu_usage
+        self.restore_cpu_usage = restore_cpu_usage
+        self.hold = hold
+        self.clock = clock
+
+        self.level = 0
+        self.limit = NO_LIMIT
+        self.reading = None  # Last SensorReading
+        self.pressure = []  # Reasons the last reading was over a limit
+        self.last_change = None  # clock.monotonic() of the last level change
+        self.decisions = deque(maxlen=history)
+        self.changes = 0
+        self.__logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_config(cls, sensors, apply_limit, governor_config, clock=REAL_CLOCK):
+        """
+        Builds a governor from the governor config section
+        """
+        settings = {
+            key: value for key, value in governor_config.items() if key not in ("enabled", "interval", "sysfs_root")
+        }
+        settings["steps"] = [StreamLimit(**step) for step in settings["steps"]]
+        return cls(sensors, apply_limit, clock=clock, **settings)
+
+    @property
+    def max_level(self):
+        return len(self.steps)
+
+    def limit_for(self, level):
+        limit = NO_LIMIT
+        for step in self.steps[:level]:
+            limit = limit.combine(step)
+        return limit
+
+    def __pressure(self, reading):
+        reasons = []
+        if reading.temperature is not None and reading.temperature >= self.soft_temp:
+            reasons.append("temperature")
+        if reading.cpu_usage is not None and reading.cpu_usage >= self.max_cpu_usage:
+            reasons.append("cpu usage")
+        if reading.firmware_throttled():
+            reasons.append("firmware throttle")
+        return reasons
+
+    def __has_headroom(self, reading):
+        if reading.temperature is not None and reading.temperature > self.soft_temp - self.restore_margin:
+            return False
+        if reading.cpu_usage is not None and reading.cpu_usage > self.restore_cpu_usage:
+            return False
+        return not reading.firmware_throttled()
+
+    def update(self):
+        """
+        Reads the sensors and changes the level by at most one step, or to the last step above
+        hard_temp
+        Returns the level
+        """
+        reading = self.sensors.read()
+        now = self.clock.monotonic()
+        self.reading = reading
+        self.pressure = self.__pressure(reading)
+        held = self.last_change is None or now - self.last_change >= self.hold
+
+        level = self.level
+        if reading.temperature is not None and reading.temperature >= self.hard_temp:
+            level, reason = self.max_level, "hard temperature limit"
+        elif self.pressure and held:
+            level, reason = min(self.level + 1, self.max_level), ", ".join(self.pressure)
+        elif self.level > 0 and held and self.__has_headroom(reading):
+            level, reason = self.level - 1, "headroom"
+
+        if level != self.level:
+            self.__set_level(level, reason, now)
+        return self.level
+
+    def __set_level(self, level, reason, now):
+        previous, self.level = self.level, level
+        self.limit = self.limit_for(level)
+        self.last_change = now
+        self.changes += 1
+        self.decisions.append({
+            "time": now,
+            "from": previous,
+            "to": level,
+            "reason": reason,
+            "temperature": self.reading.temperature,
+            "cpu_usage": self.reading.cpu_usage,
+        })
+
+        message = (
+            f"Performance level {previous} -> {level}/{self.max_level} ({reason}, "
+            f"{self.reading.temperature} C, CPU usage {self.reading.cpu_usage}), limit {self.limit}"
+        )
+        if level > previous:
+            self.__logger.warning(message)
+        else:
+            self.__logger.info(message)
+        self.apply_limit(self.limit)
+
+    def run(self, stop_event, interval):
+        """
+        Updates every interval seconds until stop_event is set
+        """
+        while not stop_event.is_set():
+            try:
+                self.update()
+            except Exception as e:  # Keep governing, a bad reading must not stop the thread
+                self.__logger.error(f"Performance governor update failed: {e}")
+            self.clock.wait(stop_event, interval)
+
+    def get_metrics(self):
+        return {
+            "level": self.level,
+            "max_level": self.max_level,
+            "limit": asdict(self.limit),
+            "reading": asdict(self.reading) if self.reading is not None else None,
+            "pressure": self.pressure,
+            "changes": self.changes,
+            "decisions": list(self.decisions),
+        }
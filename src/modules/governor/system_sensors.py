@@ -0,0 +1,133 @@
+import glob
+import os
+from dataclasses import dataclass
+
+# Raspberry Pi firmware throttle flags (get_throttled), only the ones that apply right now
+UNDER_VOLTAGE = 0x1
+FREQUENCY_CAPPED = 0x2
+THROTTLED = 0x4
+SOFT_TEMP_LIMIT = 0x8
+
+
+@dataclass(frozen=True)
+class SensorReading:
+    """
+    One reading of the SoC temperature, CPU frequency and load
+    Values the system does not expose are None
+    """
+
+    temperature: float = None  # Hottest thermal zone, degrees C
+    cpu_freq: float = None  # Mean current CPU frequency, MHz
+    max_cpu_freq: float = None  # Mean maximum CPU frequency, MHz
+    cpu_usage: float = None  # Busy fraction of all CPUs since the previous reading, 0-1
+    load_average: float = None  # 1 minute load average per CPU
+    throttled: int = None  # Firmware throttle flags, see UNDER_VOLTAGE etc.
+
+    def firmware_throttled(self):
+        """
+        True if the firmware is currently capping or throttling the CPU
+        """
+        return bool(self.throttled and self.throttled & (FREQUENCY_CAPPED | THROTTLED | SOFT_TEMP_LIMIT))
+
+
+class SystemSensors:
+    """
+    Reads temperature, CPU frequency and load from sysfs and procfs
+    root: directory the /sys and /proc paths are relative to, a FakeSysfs directory in tests
+    """
+
+    THROTTLED_PATH = "sys/devices/platform/soc/soc:firmware/get_throttled"
+
+    def __init__(self, root="/"):
+        self.root = root
+        self.last_cpu_times = None  # (busy, total) jiffies of the previous reading
+
+    def __path(self, path):
+        return os.path.join(self.root, path)
+
+    def read(self):
+        return SensorReading(
+            temperature=self.read_temperature(),
+            cpu_freq=self.__read_frequencies("scaling_cur_freq"),
+            max_cpu_freq=self.__read_frequencies("cpuinfo_max_freq"),
+            cpu_usage=self.read_cpu_usage(),
+            load_average=self.read_load_average(),
+            throttled=self.read_throttled(),
+        )
+
+    def read_temperature(self):
+        """
+        Returns the temperature of the hottest thermal zone in degrees C
+        """
+        temperatures = []
+        for path in glob.glob(self.__path("sys/class/thermal/thermal_zone*/temp")):
+            value = _read_number(path)
+            if value is not None:
+                temperatures.append(value / 1000.0)  # Millidegrees
+        return max(temperatures, default=None)
+
+    def __read_frequencies(self, name):
+        """
+        Returns the mean of a cpufreq value (kHz) over all CPUs, in MHz
+        """
+        values = [
+            _read_number(path) for path in glob.glob(self.__path(f"sys/devices/system/cpu/cpu[0-9]*/cpufreq/{name}"))
+        ]
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+        return sum(values) / len(values) / 1000.0
+
+    def read_cpu_usage(self):
+        """
+        Returns the busy fraction of all CPUs since the previous call, or since boot for the first
+        call
+        """
+        try:
+            with open(self.__path("proc/stat"), "r") as file:
+                fields = file.readline().split()
+        except OSError:
+            return None
+        if not fields or fields[0] != "cpu":
+            return None
+
+        times = [int(value) for value in fields[1:]]
+        idle = times[3] + (times[4] if len(times) > 4 else 0)  # idle + iowait
+        total = sum(times[:8])  # guest time is already counted in user time
+        busy = total - idle
+
+        last_busy, last_total = self.last_cpu_times or (0, 0)
+        self.last_cpu_times = (busy, total)
+        if total <= last_total:
+            return None
+        return (busy - last_busy) / (total - last_total)
+
+    def read_load_average(self):
+        """
+        Returns the 1 minute load average divided by the number of CPUs
+        """
+        try:
+            with open(self.__path("proc/loadavg"), "r") as file:
+                load = float(file.read().split()[0])
+        except (OSError, IndexError, ValueError):
+            return None
+        cpus = len(glob.glob(self.__path("sys/devices/system/cpu/cpu[0-9]*"))) or os.cpu_count() or 1
+        return load / cpus
+
+    def read_throttled(self):
+        """
+        Returns the Raspberry Pi firmware throttle flags, None on other systems
+        """
+        try:
+            with open(self.__path(self.THROTTLED_PATH), "r") as file:
+                return int(file.read().strip(), 16)
+        except (OSError, ValueError):
+            return None
+
+
+def _read_number(path):
+    try:
+        with open(path, "r") as file:
+            return float(file.read().strip())
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,194 @@
+import abc
+import logging
+
+import cv2
+import numpy as np
+
+from ..clock import REAL_CLOCK
+
+
+def open_v4l2_camera(device_id, clock=None):
+    """
+    USB camera /dev/video<device_id>, the camera runs in real time whatever the clock
+    """
+    return cv2.VideoCapture(device_id)
+
+
+class PacedCapture(abc.ABC):
+    """
+    Base for the cv2.VideoCapture stand-ins: keeps the width, height and fps set by the worker and
+    blocks in grab() and read() until the next frame is due, like a camera running at that fps.
+    CAP_PROP_POS_MSEC is the clock's monotonic() time the last frame was due, like the buffer
+    timestamp of a V4L2 camera
+    """
+
+    def __init__(self, device_id, clock=REAL_CLOCK):
+        self.device_id = device_id
+        self.clock = clock
+        self.properties = {
+            cv2.CAP_PROP_FRAME_WIDTH: 640,
+            cv2.CAP_PROP_FRAME_HEIGHT: 480,
+            cv2.CAP_PROP_FPS: 30.0,
+        }
+        self.opened = True
+        self.next_frame_time = None
+        self.frame_time = None  # monotonic() time the last grabbed frame was due
+        self.frames = 0
+
+    @property
+    def size(self):
+        return int(self.properties[cv2.CAP_PROP_FRAME_WIDTH]), int(self.properties[cv2.CAP_PROP_FRAME_HEIGHT])
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop, value):
+        if prop not in self.properties:
+            return False
+        self.properties[prop] = value
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return 1000.0 * self.frame_time if self.frame_time is not None else 0.0
+        return self.properties.get(prop, 0.0)
+
+    def grab(self):
+        """
+        Waits for the next frame and discards it, like cv2.VideoCapture.grab. Returns False if
+        closed
+        """
+        if not self.opened:
+            return False
+
+        # A camera delivers frames at its own rate, so reading faster than the fps blocks
+        period = 1.0 / max(self.properties[cv2.CAP_PROP_FPS], 1e-3)
+        now = self.clock.monotonic()
+        if self.next_frame_time is not None and now < self.next_frame_time:
+            self.clock.sleep(self.next_frame_time - now)
+            now = self.next_frame_time
+        self.next_frame_time = now + period
+        self.frame_time = now
+        return True
+
+    def read(self, image=None):
+        """
+        Returns (success, frame) like cv2.VideoCapture.read, writing the frame into image if it has
+        the frame's shape so a caller passing back the last frame reuses its buffer
+        """
+        if not self.grab():
+            return False, None
+
+        if image is not None and image.shape[:2] != (self.size[1], self.size[0]):
+            image = None  # Resolution changed, a new buffer is needed
+        frame = self.next_frame(image)
+        if frame is None:
+            return False, None
+        self.frames += 1
+        return True, frame
+
+    @abc.abstractmethod
+    def next_frame(self, out=None):
+        """
+        Returns the next frame, written into out if the backend can (out has the current frame size)
+        """
+
+    def release(self):
+        self.opened = False
+
+
+class SyntheticCamera(PacedCapture):
+    """
+    Generates test frames: colour bars scrolling sideways (bars), a fixed image that only changes
+    in one tile (static, the best case for delta encoding) or random noise (noise, the worst case
+    for every encoder)
+    """
+
+    PATTERNS = ("bars", "static", "noise")
+
+    def __init__(self, device_id, pattern="bars", speed=120.0, seed=None, clock=REAL_CLOCK):
+        """
+        speed: bars pattern scroll speed in pixels per second
+        """
+        super().__init__(device_id, clock)
+        if pattern not in self.PATTERNS:
+            raise ValueError(f"Unknown synthetic camera pattern '{pattern}', expected one of {self.PATTERNS}")
+        self.pattern = pattern
+        self.speed = speed
+        self.rng = np.random.default_rng(device_id if seed is None else seed)
+        self.start_time = clock.monotonic()
+        self.base = None  # Pattern rendered once per size, frames are views or copies of it
+
+    def __render_base(self, width, height):
+        if self.pattern == "bars":
+            # Twice as wide as the frame, so every scroll offset is a slice of it
+            x = np.arange(2 * width)
+            colours = np.array(
+                [
+                    [255, 255, 255], [0, 255, 255], [255, 255, 0], [0, 255, 0],
+                    [255, 0, 255], [0, 0, 255], [255, 0, 0], [0, 0, 0],
+                ],
+                dtype=np.uint8,
+            )
+            row = colours[(x * len(colours) // width) % len(colours)]
+            gradient = np.linspace(0.5, 1.0, height)[:, None, None]
+            return (row[None, :, :] * gradient).astype(np.uint8)
+        if self.pattern == "static":
+            return self.rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        return None
+
+    def next_frame(self, out=None):
+        width, height = self.size
+        if self.base is None or self.base.shape[0] != height or self.base.shape[1] < width:
+            self.base = self.__render_base(width, height)
+        if self.pattern == "noise":
+            return self.rng.integers(0, 256, (height, width, 3), dtype=np.uint8)  # New array every frame
+
+        frame = out if out is not None else np.empty((height, width, 3), dtype=np.uint8)
+        if self.pattern == "bars":
+            offset = int(self.speed * (self.clock.monotonic() - self.start_time)) % width
+            np.copyto(frame, self.base[:, offset:offset + width])
+            return frame
+
+        np.copyto(frame, self.base)
+        tile = 32
+        y, x = (self.frames * tile) % max(height - tile, 1), (self.frames * tile) % max(width - tile, 1)
+        frame[y:y + tile, x:x + tile] = self.frames % 256
+        return frame
+
+
+class FileReplayCamera(PacedCapture):
+    """
+    Replays a recorded video (or image sequence such as frames/%04d.png) at the configured fps,
+    resized to the configured resolution and looping at the end
+    """
+
+    def __init__(self, device_id, path, loop=True, clock=REAL_CLOCK):
+        """
+        path: file to replay, may contain {device_id} so each camera replays its own recording
+        """
+        super().__init__(device_id, clock)
+        self.path = path.format(device_id=device_id)
+        self.loop = loop
+        self.capture = cv2.VideoCapture(self.path)
+        self.decoded = None  # Buffer the recording is decoded into, reused while its size is unchanged
+        self.opened = self.capture.isOpened()
+        if not self.opened:
+            logging.getLogger(__name__).error(f"Unable to open recording {self.path}")
+
+    def next_frame(self, out=None):
+        result, frame = self.capture.read(self.decoded)
+        if not result and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            result, frame = self.capture.read(self.decoded)
+        if not result:
+            return None
+        self.decoded = frame
+
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, dst=out, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def release(self):
+        super().release()
+        self.capture.release()
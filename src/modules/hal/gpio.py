@@ -0,0 +1,129 @@
+import logging
+import threading
+
+from ..clock import REAL_CLOCK
+
+
+def open_rpi_gpio(clock=None):
+    """
+    The RPi.GPIO module itself, pins change in real time whatever the clock
+    """
+    import RPi.GPIO as GPIO
+
+    return GPIO
+
+
+class InMemoryGPIO:
+    """
+    Stand-in for the RPi.GPIO module keeping pin levels in memory
+    Inputs are driven with set_input(), or press() and release() for buttons wired to ground, which
+    fire the edge callbacks registered with add_event_detect()
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, auto_press=None, hold=0.2, clock=REAL_CLOCK):
+        """
+        auto_press: {pin: seconds} presses each pin once that long after startup, so a simulated run
+        can arm itself
+        hold: seconds an automatic press is held before release
+        clock: Clock the automatic presses and releases are timed with
+        """
+        self.clock = clock
+        self.mode = None
+        self.directions = {}  # pin: IN or OUT
+        self.levels = {}  # pin: LOW or HIGH
+        self.callbacks = {}  # pin: (edge, callback)
+        self.lock = threading.Lock()
+        self.__logger = logging.getLogger(__name__)
+
+        for pin, delay in (auto_press or {}).items():
+            self.__after(delay, self.press, int(pin), hold)
+
+    def __after(self, delay, function, *args):
+        """
+        Calls function(*args) from a background thread delay seconds from now
+        """
+        def run():
+            self.clock.sleep(delay)
+            function(*args)
+
+        threading.Thread(target=self.clock.participant(run), name="GPIO-Timer", daemon=True).start()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+        with self.lock:
+            self.directions[pin] = direction
+            if direction == self.IN:
+                self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+            else:
+                self.levels[pin] = initial
+
+    def input(self, pin):
+        return self.levels[pin]
+
+    def output(self, pin, value):
+        if self.directions.get(pin) != self.OUT:
+            raise RuntimeError(f"GPIO {pin} is not set up as an output")
+        self.levels[pin] = self.HIGH if value else self.LOW
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            self.callbacks[pin] = (edge, callback)
+
+    def add_event_callback(self, pin, callback):
+        with self.lock:
+            edge, _ = self.callbacks.get(pin, (self.BOTH, None))
+            self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.callbacks.pop(pin, None)
+
+    def set_input(self, pin, level):
+        """
+        Drives an input pin, calling its edge callback if the level changed
+        """
+        with self.lock:
+            previous = self.levels.get(pin)
+            self.levels[pin] = level
+            edge, callback = self.callbacks.get(pin, (None, None))
+
+        if callback is None or previous == level:
+            return
+        rising = level == self.HIGH
+        if edge == self.BOTH or edge == (self.RISING if rising else self.FALLING):
+            callback(pin)
+
+    def press(self, pin, hold=None):
+        """
+        Pulls a pulled-up button input low, and releases it after hold seconds if given
+        """
+        self.__logger.info(f"Simulated press of GPIO {pin}")
+        self.set_input(pin, self.LOW)
+        if hold is not None:
+            self.__after(hold, self.release, pin)
+
+    def release(self, pin):
+        self.set_input(pin, self.HIGH)
+
+    def cleanup(self):
+        with self.lock:
+            self.directions.clear()
+            self.callbacks.clear()
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+from ..clock import REAL_CLOCK
+from ..imu.fake_i2c import STANDARD_GRAVITY, FakeICM20948Bus
+
+
+def open_smbus_i2c(i2c_bus=1, clock=None):
+    """
+    I2C bus of the Pi the ICM20948 is wired to, the sensor samples in real time whatever the clock
+    """
+    from ..imu.icm20948 import SMBusI2C
+
+    return SMBusI2C(i2c_bus)
+
+
+class SyntheticIMUBus(FakeICM20948Bus):
+    """
+    Fake ICM20948 I2C bus following a motion profile: the device lies still for still_seconds, then
+    is carried around for moving_seconds, repeating, so the motion detector and adaptive rate go
+    through their STATIONARY and MOVING transitions
+    """
+
+    def __init__(
+        self, i2c_bus=1, address=0x69, still_seconds=5.0, moving_seconds=3.0, bus_hz=None, clock=REAL_CLOCK
+    ):
+        """
+        i2c_bus: ignored, the bus number of the real backend
+        bus_hz: simulated I2C clock (e.g. 400000) to delay transfers like a real bus, None for no
+        delay.
+        The delay busy-waits, so it also shows up as CPU time
+        """
+        super().__init__(address=address, clock=clock.time, bus_hz=bus_hz)
+        self.still_seconds = still_seconds
+        self.period = still_seconds + moving_seconds
+        self.start = clock.time()  # The profile starts still when the bus is created
+
+    def signal(self, times):
+        times = np.asarray(times, dtype=np.float64)
+        moving = ((times - self.start) % self.period) >= self.still_seconds
+
+        values = np.zeros((len(times), 9))
+        values[:, 2] = STANDARD_GRAVITY
+        # Swinging motion while carried: acceleration and rotation at a few Hz
+        swing = np.sin(2 * math.pi * 2.0 * times)
+        values[:, 0] = np.where(moving, 2.0 * swing, 0.0)
+        values[:, 1] = np.where(moving, 1.0 * np.cos(2 * math.pi * 3.0 * times), 0.0)
+        values[:, 3] = np.where(moving, 1.5 * swing, 0.0)
+        values[:, 5] = np.where(moving, 0.8 * np.cos(2 * math.pi * 1.0 * times), 0.0)
+        values[:, 6:9] = (20.0, -5.0, 40.0)
+        return values
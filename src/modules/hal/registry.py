@@ -0,0 +1,62 @@
+import importlib
+
+
+class BackendRegistry:
+    """
+    Named implementations of one kind of hardware
+    Backends are registered as "module:attribute" paths and only imported when one is created, so
+    hardware libraries (RPi.GPIO, smbus2) are only needed where those backends are used
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.backends = {}
+
+    def register(self, name, target):
+        """
+        target: factory callable, or "module:attribute" path to one (relative to this package)
+        """
+        self.backends[name] = target
+
+    def load(self, name):
+        """
+        Returns the factory of a backend, raises ValueError for unknown names
+        """
+        if name not in self.backends:
+            raise ValueError(f"Unknown {self.kind} backend '{name}', expected one of {sorted(self.backends)}")
+
+        target = self.backends[name]
+        if isinstance(target, str):
+            module, _, attribute = target.partition(":")
+            target = getattr(importlib.import_module(module, package=__package__), attribute)
+        return target
+
+    def create(self, name, *args, **kwargs):
+        return self.load(name)(*args, **kwargs)
+
+
+# Each factory returns an object with the interface the consumer already used with the hardware:
+# cv2.VideoCapture for cameras, SMBusI2C for the IMU bus and the RPi.GPIO module for GPIO
+CAMERA_BACKENDS = BackendRegistry("camera")
+CAMERA_BACKENDS.register("v4l2", ".camera:open_v4l2_camera")
+CAMERA_BACKENDS.register("synthetic", ".camera:SyntheticCamera")
+CAMERA_BACKENDS.register("file", ".camera:FileReplayCamera")
+
+IMU_BACKENDS = BackendRegistry("IMU")
+IMU_BACKENDS.register("icm20948", ".imu:open_smbus_i2c")
+IMU_BACKENDS.register("synthetic", ".imu:SyntheticIMUBus")
+
+GPIO_BACKENDS = BackendRegistry("GPIO")
+GPIO_BACKENDS.register("rpi", ".gpio:open_rpi_gpio")
+GPIO_BACKENDS.register("memory", ".gpio:InMemoryGPIO")
+
+
+def create_backend(registry, config, *args, **kwargs):
+    """
+    Creates the backend named by config["backend"] with the options in config[<backend name>]
+    e.g. {"backend": "synthetic", "synthetic": {"pattern": "bars"}}
+    kwargs are passed to every backend, e.g. the clock simulated backends follow
+    """
+    name = config["backend"]
+    options = config.get(name) or {}
+    return registry.create(name, *args, **options, **kwargs)
@@ -0,0 +1,200 @@
+import logging
+import math
+
+import numpy as np
+
+from .icm20948 import STANDARD_GRAVITY
+from .imu_ring_buffer import ACCEL, GYRO, LINEAR_ACCEL, MAG, QUAT, TIME
+
+
+class MadgwickAHRS:
+    """
+    Madgwick orientation filter fusing accel, gyro and mag into a quaternion (w, x, y, z) that
+    rotates sensor frame vectors into an earth frame with z up and x towards magnetic north
+    Blocks of samples are processed at once: normalisation and the gravity removal are vectorized,
+    and only the filter recursion runs per sample, on plain floats
+    """
+
+    def __init__(self, sample_rate, beta=0.1, use_mag=True):
+        """
+        sample_rate: nominal IMU rate (Hz), used for the first sample's time step
+        beta: gradient descent gain, higher converges faster but follows accel noise more
+        use_mag: fuse the magnetometer for heading, otherwise heading drifts with gyro bias
+        """
+        self.sample_period = 1 / sample_rate
+        self.beta = beta
+        self.use_mag = use_mag
+        self.q = None  # Current orientation, set from the first sample
+        self.last_time = None
+        self.__logger = logging.getLogger(__name__)
+
+    def set_sample_rate(self, sample_rate):
+        """
+        Nominal rate changed, time steps are still taken from the sample timestamps
+        """
+        self.sample_period = 1 / sample_rate
+
+    def update(self, block):
+        """
+        Runs the filter over a (n, NUM_COLUMNS) block and fills in its QUAT and LINEAR_ACCEL columns
+        """
+        if len(block) == 0:
+            return block
+
+        accel = block[:, ACCEL]
+        if self.q is None:
+            self.q = initial_quaternion(accel[0], block[0, MAG] if self.use_mag else None)
+            self.__logger.info(f"AHRS initialized at {self.q}")
+
+        times = block[:, TIME]
+        previous = self.last_time if self.last_time is not None else times[0] - self.sample_period
+        steps = np.diff(times, prepend=previous)
+        steps[(steps <= 0) | (steps > 10 * self.sample_period)] = self.sample_period
+        self.last_time = times[-1]
+
+        accel_unit = _normalize(accel)
+        mag_unit = _normalize(block[:, MAG]) if self.use_mag else np.zeros((len(block), 3))
+
+        block[:, QUAT] = self.__filter(steps, block[:, GYRO], accel_unit, mag_unit)
+        block[:, LINEAR_ACCEL] = linear_acceleration(block[:, QUAT], accel)
+        return block
+
+    def __filter(self, steps, gyro, accel, mag):
+        """
+        Sequential part of the filter, returns the (n, 4) quaternion after each sample
+        """
+        out = np.empty((len(steps), 4))
+        beta = self.beta
+        q0, q1, q2, q3 = self.q
+        rows = zip(steps.tolist(), gyro.tolist(), accel.tolist(), mag.tolist())
+        for i, (dt, (gx, gy, gz), (ax, ay, az), (mx, my, mz)) in enumerate(rows):
+            # Rate of change of quaternion from the gyro
+            qdot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+            qdot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+            qdot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+            qdot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+            if ax or ay or az:
+                # Gradient of the error between measured and predicted gravity (and magnetic field)
+                q1q3 = q1 * q3
+                q0q2 = q0 * q2
+                q0q1 = q0 * q1
+                q2q3 = q2 * q3
+                q1q1 = q1 * q1
+                q2q2 = q2 * q2
+                f0 = 2 * (q1q3 - q0q2) - ax
+                f1 = 2 * (q0q1 + q2q3) - ay
+                f2 = 1 - 2 * (q1q1 + q2q2) - az
+                s0 = -2 * q2 * f0 + 2 * q1 * f1
+                s1 = 2 * q3 * f0 + 2 * q0 * f1 - 4 * q1 * f2
+                s2 = -2 * q0 * f0 + 2 * q3 * f1 - 4 * q2 * f2
+                s3 = 2 * q1 * f0 + 2 * q2 * f1
+
+                if mx or my or mz:
+                    q0q0 = q0 * q0
+                    q3q3 = q3 * q3
+                    q0q3 = q0 * q3
+                    q1q2 = q1 * q2
+                    # Earth field direction in the earth frame, with its east component removed
+                    hx = (mx * (q0q0 + q1q1 - q2q2 - q3q3) + 2 * my * (q1q2 - q0q3) + 2 * mz * (q1q3 + q0q2))
+                    hy = (2 * mx * (q1q2 + q0q3) + my * (q0q0 - q1q1 + q2q2 - q3q3) + 2 * mz * (q2q3 - q0q1))
+                    bx = math.sqrt(hx * hx + hy * hy)
+                    bz = 2 * mx * (q1q3 - q0q2) + 2 * my * (q2q3 + q0q1) + mz * (q0q0 - q1q1 - q2q2 + q3q3)
+                    f3 = 2 * bx * (0.5 - q2q2 - q3q3) + 2 * bz * (q1q3 - q0q2) - mx
+                    f4 = 2 * bx * (q1q2 - q0q3) + 2 * bz * (q0q1 + q2q3) - my
+                    f5 = 2 * bx * (q0q2 + q1q3) + 2 * bz * (0.5 - q1q1 - q2q2) - mz
+                    s0 += -2 * bz * q2 * f3 + (-2 * bx * q3 + 2 * bz * q1) * f4 + 2 * bx * q2 * f5
+                    s1 += 2 * bz * q3 * f3 + (2 * bx * q2 + 2 * bz * q0) * f4 + (2 * bx * q3 - 4 * bz * q1) * f5
+                    s2 += ((-4 * bx * q2 - 2 * bz * q0) * f3 + (2 * bx * q1 + 2 * bz * q3) * f4
+                           + (2 * bx * q0 - 4 * bz * q2) * f5)
+                    s3 += (-4 * bx * q3 + 2 * bz * q1) * f3 + (-2 * bx * q0 + 2 * bz * q2) * f4 + 2 * bx * q1 * f5
+
+                norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+                if norm > 0:
+                    qdot0 -= beta * s0 / norm
+                    qdot1 -= beta * s1 / norm
+                    qdot2 -= beta * s2 / norm
+                    qdot3 -= beta * s3 / norm
+
+            q0 += qdot0 * dt
+            q1 += qdot1 * dt
+            q2 += qdot2 * dt
+            q3 += qdot3 * dt
+            norm = 1 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+            q0 *= norm
+            q1 *= norm
+            q2 *= norm
+            q3 *= norm
+            out[i] = (q0, q1, q2, q3)
+
+        self.q = (q0, q1, q2, q3)
+        return out
+
+
+def _normalize(vectors):
+    """
+    Unit vectors of the rows, rows of zeros stay zero
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def rotation_matrices(quaternions):
+    """
+    (n, 3, 3) matrices rotating sensor frame vectors into the earth frame
+    """
+    w, x, y, z = quaternions.T
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), axis=-1),
+        np.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), axis=-1),
+        np.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), axis=-1),
+    ), axis=1)
+
+
+def linear_acceleration(quaternions, accel):
+    """
+    Gravity-free acceleration (m/s^2) in the earth frame for each sample
+    """
+    earth = np.einsum("nij,nj->ni", rotation_matrices(quaternions), accel)
+    earth[:, 2] -= STANDARD_GRAVITY
+    return earth
+
+
+def initial_quaternion(accel, mag=None):
+    """
+    Orientation from a single accel (and mag) reading, so the filter does not start far from the
+    truth
+    """
+    up = accel / (np.linalg.norm(accel) or 1.0)
+    north = np.array([1.0, 0.0, 0.0]) if mag is None or not np.any(mag) else np.asarray(mag, dtype=float)
+    north = north - np.dot(north, up) * up
+    if np.linalg.norm(north) < 1e-6:
+        # Field parallel to gravity, pick any horizontal direction
+        north = np.cross(up, [0.0, 1.0, 0.0] if abs(up[1]) < 0.9 else [1.0, 0.0, 0.0])
+    north /= np.linalg.norm(north)
+    west = np.cross(up, north)
+
+    # Rows are the earth axes expressed in the sensor frame
+    matrix = np.stack((north, west, up))
+    return _quaternion_from_matrix(matrix)
+
+
+def _quaternion_from_matrix(m):
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    if trace > 0:
+        s = 2 * math.sqrt(1 + trace)
+        q = (0.25 * s, (m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s)
+    elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[0, 0] - m[1, 1] - m[2, 2])
+        q = ((m[2, 1] - m[1, 2]) / s, 0.25 * s, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s)
+    elif m[1, 1] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[1, 1] - m[0, 0] - m[2, 2])
+        q = ((m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, 0.25 * s, (m[1, 2] + m[2, 1]) / s)
+    else:
+        s = 2 * math.sqrt(1 + m[2, 2] - m[0, 0] - m[1, 1])
+        q = ((m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, 0.25 * s)
+
+    q = np.array(q)
+    if q[0] < 0:
+        q = -q
+    return tuple(float(v) for v in q / np.linalg.norm(q))
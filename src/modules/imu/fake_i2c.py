@@ -0,0 +1,208 @@
+import math
+import time
+
+import numpy as np
+
+from . import icm20948 as icm
+
+FIFO_SIZE = 512  # Bytes kept before the fake FIFO reports an overflow
+STANDARD_GRAVITY = icm.STANDARD_GRAVITY
+
+
+class FakeICM20948Bus:
+    """
+    In-memory register map of an ICM20948 with its AK09916 magnetometer, with the same interface as
+    SMBusI2C so the driver and its throughput can be tested off-device
+    Samples are generated at the configured rate from the clock, and bus_hz optionally delays each
+    transaction by the time it would take on a real bus
+    """
+
+    def __init__(self, address=0x69, clock=time.monotonic, bus_hz=None):
+        """
+        clock: returns the current time in seconds, the sample generator follows it
+        bus_hz: I2C clock to simulate (e.g. 400000), or None for no transfer delay
+        """
+        self.address = address
+        self.clock = clock
+        self.bus_hz = bus_hz
+        self.__reset()
+
+        # Bus usage counters for throughput reports
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.busy_seconds = 0.0
+
+    def __reset(self):
+        """
+        Puts the registers in their power-on state
+        """
+        self.banks = [bytearray(128) for _ in range(4)]
+        self.banks[0][icm.WHO_AM_I] = icm.ICM20948_ID
+        self.bank = 0
+        self.mag_registers = bytearray(0x40)
+        self.mag_registers[icm.AK09916_WIA2] = icm.AK09916_ID
+
+        self.fifo = bytearray()
+        self.overflowed = False
+        self.samples_generated = 0  # Samples since the FIFO was started
+        self.fifo_start = None
+        self.last_mag_sample = 0.0
+
+    @staticmethod
+    def signal(times):
+        """
+        Returns the (n, 9) accel (m/s^2), gyro (rad/s), mag (uT) the fake sensor measures at times
+        """
+        times = np.asarray(times, dtype=np.float64)
+        values = np.zeros((len(times), 9))
+        values[:, 0] = 0.5 * np.sin(2 * math.pi * times)
+        values[:, 2] = STANDARD_GRAVITY
+        values[:, 3] = 0.2 * np.cos(2 * math.pi * times)
+        values[:, 6:9] = (20.0, -5.0, 40.0)
+        return values
+
+    def __transfer(self, num_bytes):
+        """
+        Counts a transaction of num_bytes data bytes, waiting as long as a real bus would
+        """
+        self.transactions += 1
+        self.bytes_transferred += num_bytes
+        if self.bus_hz:
+            # Start, address, register, repeated start and address bytes plus 9 clocks per data byte
+            seconds = (4 + num_bytes) * 9 / self.bus_hz
+            self.busy_seconds += seconds
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                pass
+
+    def __fifo_enabled(self):
+        bank0 = self.banks[0]
+        return bank0[icm.USER_CTRL] & icm.FIFO_ENABLE and bank0[icm.FIFO_EN_2] & icm.ACCEL_GYRO_FIFO
+
+    def __scales(self):
+        bank2 = self.banks[2]
+        accel_g = 2 << ((bank2[icm.ACCEL_CONFIG] >> 1) & 0x3)
+        gyro_dps = 250 << ((bank2[icm.GYRO_CONFIG_1] >> 1) & 0x3)
+        scale = np.empty(6)
+        scale[0:3] = accel_g * STANDARD_GRAVITY / 32768
+        scale[3:6] = math.radians(gyro_dps) / 32768
+        return scale
+
+    def sample_rate(self):
+        return icm.BASE_SAMPLE_RATE / (1 + self.banks[2][icm.GYRO_SMPLRT_DIV])
+
+    def __raw_motion(self, times):
+        values = self.signal(times)[:, 0:6] / self.__scales()
+        return np.clip(np.rint(values), -32768, 32767).astype(">i2")
+
+    def __update_fifo(self):
+        """
+        Appends the packets sampled since the last update
+        """
+        if not self.__fifo_enabled():
+            self.fifo_start = None
+            return
+
+        now = self.clock()
+        if self.fifo_start is None:
+            self.fifo_start = now
+            self.samples_generated = 0
+
+        rate = self.sample_rate()
+        due = int((now - self.fifo_start) * rate)
+        count = due - self.samples_generated
+        if count <= 0:
+            return
+
+        times = self.fifo_start + np.arange(self.samples_generated + 1, due + 1) / rate
+        self.samples_generated = due
+        free = FIFO_SIZE - len(self.fifo)
+        packets = self.__raw_motion(times).tobytes()
+        if len(packets) > free:
+            # Stream mode keeps the newest data, the oldest bytes are overwritten
+            self.overflowed = True
+            self.fifo += packets
+            del self.fifo[: len(self.fifo) - FIFO_SIZE]
+        else:
+            self.fifo += packets
+
+    def __update_mag(self):
+        rates = {mode: rate for rate, mode in icm.MAG_MODES.items()}
+        rate = rates.get(self.mag_registers[icm.AK09916_CNTL2])
+        if rate is None:
+            return
+
+        now = self.clock()
+        if now - self.last_mag_sample >= 1 / rate:
+            self.last_mag_sample = now
+            raw = np.rint(self.signal([now])[0, 6:9] / icm.MAG_SCALE).astype("<i2")
+            self.mag_registers[icm.AK09916_ST1 + 1: icm.AK09916_ST1 + 7] = raw.tobytes()
+            self.mag_registers[icm.AK09916_ST1] |= 0x01
+
+    def __read_register(self, register):
+        bank = self.banks[self.bank]
+        if self.bank == 0:
+            if register == icm.INT_STATUS_2:
+                value = 0x0F if self.overflowed else 0
+                self.overflowed = False
+                return value
+            if register == icm.FIFO_COUNTH:
+                return (len(self.fifo) >> 8) & 0x1F
+            if register == icm.FIFO_COUNTH + 1:
+                return len(self.fifo) & 0xFF
+            if icm.ACCEL_XOUT_H <= register < icm.ACCEL_XOUT_H + 12:
+                raw = self.__raw_motion([self.clock()]).tobytes()
+                return raw[register - icm.ACCEL_XOUT_H]
+        return bank[register]
+
+    def read_byte(self, address, register):
+        return self.read_block(address, register, 1)[0]
+
+    def write_byte(self, address, register, value):
+        self.__transfer(1)
+        if address == icm.AK09916_ADDRESS:
+            if register == icm.AK09916_CNTL3 and value & icm.AK09916_RESET:
+                self.mag_registers[icm.AK09916_CNTL2] = 0
+            else:
+                self.mag_registers[register] = value
+            return
+        if address != self.address:
+            raise OSError(f"No I2C device at {address:#x}")
+
+        if register == icm.REG_BANK_SEL:
+            self.bank = (value >> 4) & 0x3
+            return
+
+        self.__update_fifo()
+        if self.bank == 2 and register == icm.GYRO_SMPLRT_DIV and value != self.banks[2][register]:
+            self.fifo_start = None  # Restart the sample generator at the new rate
+        if self.bank == 0 and register == icm.PWR_MGMT_1 and value & icm.DEVICE_RESET:
+            self.__reset()
+            return
+        if self.bank == 0 and register == icm.FIFO_RST and value:
+            self.fifo.clear()
+            self.overflowed = False
+        self.banks[self.bank][register] = value
+        self.__update_fifo()  # Starts or stops sampling if the FIFO was just enabled or disabled
+
+    def read_block(self, address, register, length):
+        self.__transfer(length)
+        if address == icm.AK09916_ADDRESS:
+            self.__update_mag()
+            data = bytes(self.mag_registers[register:register + length])
+            if register <= icm.AK09916_ST1 + 8 < register + length:
+                self.mag_registers[icm.AK09916_ST1] &= ~0x01  # Reading ST2 clears DRDY
+            return data
+        if address != self.address:
+            raise OSError(f"No I2C device at {address:#x}")
+
+        self.__update_fifo()
+        if self.bank == 0 and register == icm.FIFO_R_W:
+            # Burst reads of FIFO_R_W pop consecutive FIFO bytes, reading past the end returns 0xFF
+            data = bytes(self.fifo[:length]).ljust(length, b"\xff")
+            del self.fifo[:length]
+            return data
+        return bytes(self.__read_register(register + i) for i in range(length))
+
+    def close(self):
+        pass
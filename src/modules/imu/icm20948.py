@@ -0,0 +1,300 @@
+import logging
+import math
+import time
+
+import numpy as np
+
+from .imu_ring_buffer import ACCEL, GYRO, MAG, NUM_COLUMNS, QUAT, TIME
+
+# ICM20948 user bank 0 registers
+WHO_AM_I = 0x00
+ICM20948_ID = 0xEA
+USER_CTRL = 0x03
+FIFO_ENABLE = 0x40
+I2C_MST_EN = 0x20
+PWR_MGMT_1 = 0x06
+DEVICE_RESET = 0x80
+CLKSEL_AUTO = 0x01
+PWR_MGMT_2 = 0x07  # 0 enables all accel and gyro axes
+INT_PIN_CFG = 0x0F
+BYPASS_EN = 0x02  # Puts the magnetometer directly on the host I2C bus
+INT_STATUS_2 = 0x1B  # Non zero if the FIFO overflowed, cleared on read
+ACCEL_XOUT_H = 0x2D
+FIFO_EN_2 = 0x67
+ACCEL_GYRO_FIFO = 0x1E  # ACCEL_FIFO_EN and GYRO_{X,Y,Z}_FIFO_EN, no temperature
+FIFO_RST = 0x68
+FIFO_MODE = 0x69
+FIFO_COUNTH = 0x70  # 13-bit byte count, high byte first
+FIFO_R_W = 0x72
+REG_BANK_SEL = 0x7F
+
+# User bank 2 registers
+GYRO_SMPLRT_DIV = 0x00
+GYRO_CONFIG_1 = 0x01
+ACCEL_SMPLRT_DIV_1 = 0x10
+ACCEL_SMPLRT_DIV_2 = 0x11
+ACCEL_CONFIG = 0x14
+
+# AK09916 magnetometer, reached through the ICM20948 bypass mux
+AK09916_ADDRESS = 0x0C
+AK09916_WIA2 = 0x01
+AK09916_ID = 0x09
+AK09916_ST1 = 0x10  # ST1, HXL..HZH, TMPS, ST2. Reading through ST2 releases the next measurement
+AK09916_CNTL2 = 0x31
+AK09916_CNTL3 = 0x32
+AK09916_RESET = 0x01
+MAG_MODES = {10: 0x02, 20: 0x04, 50: 0x06, 100: 0x08}  # Continuous measurement rate (Hz): mode
+MAG_SCALE = 0.15  # uT per LSB
+
+BASE_SAMPLE_RATE = 1125.0  # Hz, divided by (1 + SMPLRT_DIV)
+PACKET_SIZE = 12  # FIFO packet: accel x, y, z then gyro x, y, z, big-endian int16
+MAX_BURST = 42 * PACKET_SIZE  # Bytes read from the FIFO per I2C transaction
+STANDARD_GRAVITY = 9.80665
+
+ACCEL_RANGES = {2: 0, 4: 1, 8: 2, 16: 3}  # Full scale (g): FS_SEL
+GYRO_RANGES = {250: 0, 500: 1, 1000: 2, 2000: 3}  # Full scale (dps): FS_SEL
+DLPF_CONFIG = 1  # Accel and gyro low pass filter setting, about 200 Hz bandwidth
+
+
+def sample_rate_divider(sample_rate):
+    """
+    SMPLRT_DIV register value for the supported rate closest to sample_rate (Hz)
+    """
+    return min(max(round(BASE_SAMPLE_RATE / sample_rate) - 1, 0), 255)
+
+
+class SMBusI2C:
+    """
+    Host I2C bus through smbus2, using combined write/read transactions so burst reads are not
+    limited to the 32 byte SMBus block size
+    """
+
+    def __init__(self, bus=1):
+        # Imported here so the driver and fake bus can be used on machines without smbus2
+        from smbus2 import SMBus, i2c_msg
+
+        self.__i2c_msg = i2c_msg
+        self.bus = SMBus(bus)
+
+        # Bus usage counters for utilization reports, busy_seconds is the time spent in transfers
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.busy_seconds = 0.0
+
+    def __count(self, num_bytes, start):
+        self.transactions += 1
+        self.bytes_transferred += num_bytes
+        self.busy_seconds += time.perf_counter() - start
+
+    def read_byte(self, address, register):
+        start = time.perf_counter()
+        value = self.bus.read_byte_data(address, register)
+        self.__count(1, start)
+        return value
+
+    def write_byte(self, address, register, value):
+        start = time.perf_counter()
+        self.bus.write_byte_data(address, register, value)
+        self.__count(1, start)
+
+    def read_block(self, address, register, length):
+        start = time.perf_counter()
+        write = self.__i2c_msg.write(address, [register])
+        read = self.__i2c_msg.read(address, length)
+        self.bus.i2c_rdwr(write, read)
+        self.__count(length, start)
+        return bytes(read)
+
+    def close(self):
+        self.bus.close()
+
+
+class ICM20948:
+    """
+    ICM20948 driver that samples accel and gyro into the on-chip FIFO at a fixed rate and drains it
+    with burst reads, so samples are evenly spaced no matter how often the host polls
+    The AK09916 magnetometer runs in continuous mode and is read on its own slower schedule
+    """
+
+    def __init__(
+        self,
+        bus,
+        address=0x69,
+        sample_rate=1125.0,
+        accel_range=4,
+        gyro_range=500,
+        mag_rate=100,
+    ):
+        """
+        bus: SMBusI2C, or a fake with the same read_byte, write_byte and read_block methods
+        sample_rate: requested accel and gyro rate (Hz), rounded to 1125 / (1 + divider)
+        accel_range: full scale in g (2, 4, 8 or 16)
+        gyro_range: full scale in degrees/s (250, 500, 1000 or 2000)
+        mag_rate: magnetometer rate in Hz (10, 20, 50 or 100)
+        """
+        if accel_range not in ACCEL_RANGES:
+            raise ValueError(f"Unsupported accel range {accel_range} g")
+        if gyro_range not in GYRO_RANGES:
+            raise ValueError(f"Unsupported gyro range {gyro_range} dps")
+        if mag_rate not in MAG_MODES:
+            raise ValueError(f"Unsupported magnetometer rate {mag_rate} Hz")
+
+        self.bus = bus
+        self.address = address
+        self.divider = sample_rate_divider(sample_rate)
+        self.sample_rate = BASE_SAMPLE_RATE / (1 + self.divider)
+        self.accel_range = accel_range
+        self.gyro_range = gyro_range
+        self.mag_rate = mag_rate
+        self.bank = None
+
+        # Raw int16 to m/s^2 and rad/s, applied to all samples of a burst at once
+        self.scale = np.empty(6)
+        self.scale[0:3] = accel_range * STANDARD_GRAVITY / 32768
+        self.scale[3:6] = math.radians(gyro_range) / 32768
+
+        self.mag = np.zeros(3)  # Latest magnetometer reading, repeated in samples until the next one
+        self.next_mag_read = 0
+        self.overflows = 0  # Times the FIFO filled up before it was drained
+        self.__logger = logging.getLogger(__name__)
+
+    def __select_bank(self, bank):
+        if bank != self.bank:
+            self.bus.write_byte(self.address, REG_BANK_SEL, bank << 4)
+            self.bank = bank
+
+    def __write(self, bank, register, value):
+        self.__select_bank(bank)
+        self.bus.write_byte(self.address, register, value)
+
+    def __read(self, bank, register):
+        self.__select_bank(bank)
+        return self.bus.read_byte(self.address, register)
+
+    def configure(self):
+        """
+        Resets the sensor and starts sampling accel and gyro into the FIFO and the magnetometer in
+        continuous mode. Raises RuntimeError if either chip does not answer with its id
+        """
+        self.bank = None
+        self.__write(0, PWR_MGMT_1, DEVICE_RESET)
+        time.sleep(0.1)
+        self.bank = None  # The reset also resets the bank select register
+
+        if self.__read(0, WHO_AM_I) != ICM20948_ID:
+            raise RuntimeError(f"No ICM20948 at I2C address {self.address:#x}")
+
+        self.__write(0, PWR_MGMT_1, CLKSEL_AUTO)
+        self.__write(0, PWR_MGMT_2, 0x00)
+        time.sleep(0.05)
+
+        # Same output data rate for accel and gyro so each FIFO packet holds one of each
+        self.__write(2, GYRO_SMPLRT_DIV, self.divider)
+        self.__write(2, GYRO_CONFIG_1, (DLPF_CONFIG << 3) | (GYRO_RANGES[self.gyro_range] << 1) | 1)
+        self.__write(2, ACCEL_SMPLRT_DIV_1, 0)
+        self.__write(2, ACCEL_SMPLRT_DIV_2, self.divider)
+        self.__write(2, ACCEL_CONFIG, (DLPF_CONFIG << 3) | (ACCEL_RANGES[self.accel_range] << 1) | 1)
+
+        # The magnetometer is read directly by the host instead of through the internal I2C master
+        self.__write(0, USER_CTRL, 0x00)
+        self.__write(0, INT_PIN_CFG, BYPASS_EN)
+        if self.bus.read_byte(AK09916_ADDRESS, AK09916_WIA2) != AK09916_ID:
+            raise RuntimeError("No AK09916 magnetometer behind the ICM20948")
+        self.bus.write_byte(AK09916_ADDRESS, AK09916_CNTL3, AK09916_RESET)
+        time.sleep(0.01)
+        self.bus.write_byte(AK09916_ADDRESS, AK09916_CNTL2, MAG_MODES[self.mag_rate])
+
+        # Stream mode FIFO with accel and gyro packets
+        self.__write(0, FIFO_EN_2, ACCEL_GYRO_FIFO)
+        self.__write(0, FIFO_MODE, 0x00)
+        self.reset_fifo()
+        self.__write(0, USER_CTRL, FIFO_ENABLE)
+
+        self.__logger.info(
+            f"ICM20948 sampling at {self.sample_rate:.1f} Hz (±{self.accel_range} g, ±{self.gyro_range} dps), "
+            f"magnetometer at {self.mag_rate} Hz"
+        )
+
+    def set_sample_rate(self, sample_rate, now=None):
+        """
+        Changes the accel and gyro rate while running
+        Returns the samples still in the FIFO at the old rate as a read_samples() block, since
+        their timestamps depend on the rate they were taken at
+        """
+        block = self.read_samples(now)
+        divider = sample_rate_divider(sample_rate)
+        if divider != self.divider:
+            self.divider = divider
+            self.sample_rate = BASE_SAMPLE_RATE / (1 + divider)
+            self.__write(2, GYRO_SMPLRT_DIV, divider)
+            self.__write(2, ACCEL_SMPLRT_DIV_2, divider)
+            self.reset_fifo()  # Drops any packet taken between the read and the change
+            self.__logger.info(f"ICM20948 sampling at {self.sample_rate:.2f} Hz")
+        return block
+
+    def reset_fifo(self):
+        """
+        Discards the FIFO contents
+        """
+        self.__write(0, FIFO_RST, 0x1F)
+        self.__write(0, FIFO_RST, 0x00)
+
+    def read_fifo(self):
+        """
+        Drains the FIFO and returns a (n, 6) array of accel (m/s^2) and gyro (rad/s) samples, oldest
+        first. If the FIFO overflowed, it is reset and the samples in it are lost
+        """
+        self.__select_bank(0)
+        if self.bus.read_byte(self.address, INT_STATUS_2):
+            # Packets may no longer start on a packet boundary
+            self.overflows += 1
+            self.__logger.warning("ICM20948 FIFO overflow, samples dropped")
+            self.reset_fifo()
+            return np.empty((0, 6))
+
+        count_bytes = self.bus.read_block(self.address, FIFO_COUNTH, 2)
+        count = ((count_bytes[0] & 0x1F) << 8 | count_bytes[1]) // PACKET_SIZE * PACKET_SIZE
+
+        chunks = []
+        while count > 0:
+            length = min(count, MAX_BURST)
+            chunks.append(self.bus.read_block(self.address, FIFO_R_W, length))
+            count -= length
+
+        raw = np.frombuffer(b"".join(chunks), dtype=">i2").reshape(-1, 6)
+        return raw * self.scale
+
+    def read_mag(self):
+        """
+        Returns the latest magnetometer reading (uT) as a numpy array, or None if there is no new
+        one
+        """
+        data = self.bus.read_block(AK09916_ADDRESS, AK09916_ST1, 9)
+        if not data[0] & 0x01:  # DRDY
+            return None
+        return np.frombuffer(data, dtype="<i2", count=3, offset=1) * MAG_SCALE
+
+    def read_samples(self, now=None):
+        """
+        Drains the FIFO and returns a (n, NUM_COLUMNS) block of samples for IMURingBuffer.extend
+        Timestamps are spaced by the sample period and end at the time of the read. Samples carry
+        the latest magnetometer reading, which is refreshed at most mag_rate times per second
+        """
+        if now is None:
+            now = time.time()
+
+        if now >= self.next_mag_read:
+            mag = self.read_mag()
+            if mag is not None:
+                self.mag = mag
+            self.next_mag_read = now + 1 / self.mag_rate
+
+        motion = self.read_fifo()
+        count = len(motion)
+        block = np.zeros((count, NUM_COLUMNS))
+        block[:, QUAT.start] = 1.0  # Identity orientation until an AHRS fills it in
+        block[:, TIME] = now - np.arange(count - 1, -1, -1) / self.sample_rate
+        block[:, ACCEL] = motion[:, 0:3]
+        block[:, GYRO] = motion[:, 3:6]
+        block[:, MAG] = self.mag
+        return block
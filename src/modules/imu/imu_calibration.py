@@ -0,0 +1,193 @@
+import datetime
+import logging
+import os
+
+import numpy as np
+import yaml
+
+from .icm20948 import STANDARD_GRAVITY
+from .imu_ring_buffer import ACCEL, MAG
+
+CALIBRATION_VERSION = 1
+
+# Accel, gyro and mag are adjacent sample columns, corrected together as one 9 value vector
+SENSOR_COLUMNS = slice(ACCEL.start, MAG.stop)
+
+# Calibration poses: the sensor axis pointing up, and the reading a perfect accelerometer gives in
+# it
+ACCEL_POSES = {
+    "Z+": (0.0, 0.0, 1.0),
+    "Z-": (0.0, 0.0, -1.0),
+    "X+": (1.0, 0.0, 0.0),
+    "X-": (-1.0, 0.0, 0.0),
+    "Y+": (0.0, 1.0, 0.0),
+    "Y-": (0.0, -1.0, 0.0),
+}
+
+
+class IMUCalibration:
+    """
+    Accel bias and scale/misalignment, gyro bias, and mag hard iron offset and soft iron matrix
+    Each sensor is corrected as matrix @ (raw - bias), and apply() does all three at once on a
+    block of samples as a single 9x9 affine transform
+    """
+
+    def __init__(
+        self,
+        accel_bias=(0.0, 0.0, 0.0),
+        accel_matrix=None,
+        gyro_bias=(0.0, 0.0, 0.0),
+        mag_bias=(0.0, 0.0, 0.0),
+        mag_matrix=None,
+        created=None,
+    ):
+        self.accel_bias = np.asarray(accel_bias, dtype=float)
+        self.accel_matrix = np.eye(3) if accel_matrix is None else np.asarray(accel_matrix, dtype=float)
+        self.gyro_bias = np.asarray(gyro_bias, dtype=float)
+        self.mag_bias = np.asarray(mag_bias, dtype=float)
+        self.mag_matrix = np.eye(3) if mag_matrix is None else np.asarray(mag_matrix, dtype=float)
+        self.created = created  # ISO timestamp of the calibration run, None for the identity
+
+        # Block diagonal transform applied to the accel, gyro and mag columns
+        self.offset = np.concatenate((self.accel_bias, self.gyro_bias, self.mag_bias))
+        matrix = np.zeros((9, 9))
+        matrix[0:3, 0:3] = self.accel_matrix
+        matrix[3:6, 3:6] = np.eye(3)
+        matrix[6:9, 6:9] = self.mag_matrix
+        self.matrix_t = matrix.T  # Rows are samples, so samples @ matrix.T
+
+    def apply(self, block):
+        """
+        Corrects the accel, gyro and mag columns of a (n, NUM_COLUMNS) block in place
+        """
+        block[:, SENSOR_COLUMNS] = (block[:, SENSOR_COLUMNS] - self.offset) @ self.matrix_t
+        return block
+
+    def to_dict(self):
+        return {
+            "version": CALIBRATION_VERSION,
+            "created": self.created,
+            "accel": {"bias": self.accel_bias.tolist(), "matrix": self.accel_matrix.tolist()},
+            "gyro": {"bias": self.gyro_bias.tolist()},
+            "mag": {"bias": self.mag_bias.tolist(), "matrix": self.mag_matrix.tolist()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Raises ValueError if the calibration was written by an unknown version of the tool
+        """
+        version = data.get("version")
+        if version != CALIBRATION_VERSION:
+            raise ValueError(f"Unsupported IMU calibration version {version}")
+        return cls(
+            accel_bias=data["accel"]["bias"],
+            accel_matrix=data["accel"]["matrix"],
+            gyro_bias=data["gyro"]["bias"],
+            mag_bias=data["mag"]["bias"],
+            mag_matrix=data["mag"]["matrix"],
+            created=data.get("created"),
+        )
+
+    def save(self, path):
+        with open(path, "w") as file:
+            yaml.safe_dump(self.to_dict(), file, sort_keys=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            return cls.from_dict(yaml.safe_load(file))
+
+
+def load_calibration(path):
+    """
+    Loads the calibration file, or returns the identity calibration if there is none or it is
+    invalid
+    """
+    logger = logging.getLogger(__name__)
+    if not path or not os.path.exists(path):
+        logger.warning(f"No IMU calibration at {path}, using raw readings (run test/calibrate_imu.py)")
+        return IMUCalibration()
+
+    try:
+        calibration = IMUCalibration.load(path)
+    except (OSError, ValueError, KeyError, TypeError, yaml.YAMLError) as e:
+        logger.error(f"Could not load IMU calibration {path}: {e}")
+        return IMUCalibration()
+
+    logger.info(f"Loaded IMU calibration from {path} (created {calibration.created})")
+    return calibration
+
+
+def fit_accel(pose_samples, gravity=STANDARD_GRAVITY):
+    """
+    Least squares fit of raw = A @ true + bias over the ACCEL_POSES, where true is gravity along the
+    up axis. pose_samples maps pose names to (n, 3) raw readings, at least 4 non-coplanar poses
+    Returns (bias, matrix) with matrix = inverse(A), so true = matrix @ (raw - bias)
+    """
+    means = np.array([np.mean(samples, axis=0) for samples in pose_samples.values()])
+    truth = gravity * np.array([ACCEL_POSES[pose] for pose in pose_samples])
+
+    # Solve [true, 1] @ [A.T; bias] = raw for all three axes at once
+    design = np.hstack((truth, np.ones((len(truth), 1))))
+    solution, _, rank, _ = np.linalg.lstsq(design, means, rcond=None)
+    if rank < 4:
+        raise ValueError("Accel poses do not span all three axes")
+
+    return solution[3], np.linalg.inv(solution[:3].T)
+
+
+def fit_gyro(samples):
+    """
+    Gyro bias from (n, 3) readings taken while the sensor is still
+    """
+    return np.mean(samples, axis=0)
+
+
+def fit_ellipsoid(samples):
+    """
+    Least squares fit of a general ellipsoid to (n, 3) mag readings taken while rotating the sensor
+    through as many orientations as possible
+    Returns (bias, matrix, field) such that |matrix @ (raw - bias)| = field, the mean field strength
+    (uT)
+    """
+    x, y, z = samples.T
+    # a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1
+    design = np.column_stack((x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z))
+    (a, b, c, d, e, f, g, h, i), _, rank, _ = np.linalg.lstsq(design, np.ones(len(samples)), rcond=None)
+    if rank < 9:
+        raise ValueError("Mag samples do not cover enough orientations for an ellipsoid fit")
+
+    quadric = np.array([[a, d, e], [d, b, f], [e, f, c]])
+    center = -np.linalg.solve(quadric, (g, h, i))
+    # (raw - center).T @ shape @ (raw - center) = 1
+    shape = quadric / (1 + center @ quadric @ center)
+    eigenvalues, eigenvectors = np.linalg.eigh(shape)
+    if np.any(eigenvalues <= 0):
+        raise ValueError("Mag samples do not fit an ellipsoid")
+
+    # Keep readings in uT by mapping onto a sphere with the geometric mean of the ellipsoid radii
+    field = np.prod(eigenvalues ** -0.5) ** (1 / 3)
+    matrix = field * eigenvectors @ np.diag(np.sqrt(eigenvalues)) @ eigenvectors.T
+    return center, matrix, field
+
+
+def fit_calibration(accel_poses, still_gyro, mag_samples=None, gravity=STANDARD_GRAVITY):
+    """
+    Fits an IMUCalibration from the samples collected by the calibration tool
+    accel_poses: pose name -> (n, 3) accel readings, still_gyro: (n, 3) gyro readings at rest,
+    mag_samples: (n, 3) mag readings while rotating, or None to leave the mag uncorrected
+    """
+    accel_bias, accel_matrix = fit_accel(accel_poses, gravity)
+    mag_bias, mag_matrix = (0.0, 0.0, 0.0), None
+    if mag_samples is not None:
+        mag_bias, mag_matrix, _ = fit_ellipsoid(mag_samples)
+
+    return IMUCalibration(
+        accel_bias=accel_bias,
+        accel_matrix=accel_matrix,
+        gyro_bias=fit_gyro(still_gyro),
+        mag_bias=mag_bias,
+        mag_matrix=mag_matrix,
+        created=datetime.datetime.now().isoformat(timespec="seconds"),
+    )
@@ -1,12 +1,39 @@
 import logging
 import multiprocessing as mp
+import time
+from ..clock import REAL_CLOCK
+from ..process_stats import read_process_placement
+from ..scheduling import scheduled
+from ..shutdown import graceful, stop_processes
 from .imu_worker import IMUWorker
 
 
 class IMUManager:
-    HOST="192.168.194.44"  # Base station IP
+    HOST="192.168.194.44"  # Default base station IP
     PORT=6000
-    def __init__(self, stop_event, imu_data):
+    def __init__(
+        self,
+        stop_event,
+        imu_data,
+        host=HOST,
+        port=PORT,
+        bandwidth=None,
+        bandwidth_stream=None,
+        sample_ring=None,
+        uplink_config=None,
+        crc=False,
+        sensor_config=None,
+        motion_config=None,
+        ahrs_config=None,
+        calibration_path=None,
+        state_rates=None,
+        usage_report_interval=60.0,
+        hal_config=None,
+        clock=REAL_CLOCK,
+        scheduling=None,
+        state_machine=None,
+        shutdown_config=None,
+    ):
         """
         Initializes IMU Manager which manages and handles the IMU worker process
         """
@@ -17,6 +44,24 @@ class IMUManager:
 
         self.stop_event = stop_event
         self.imu_data = imu_data
+        self.host = host
+        self.port = port
+        self.bandwidth = bandwidth  # Shared BandwidthAllocator, or None to send unthrottled
+        self.bandwidth_stream = bandwidth_stream  # Slot index of the IMU stream in the allocator
+        self.sample_ring = sample_ring  # IMURingBuffer of timestamped samples, or None
+        self.uplink_config = uplink_config or {}  # IMUWorker send_mode, batch_size, max_batch_age
+        self.crc = crc  # Send a CRC of every binary frame
+        self.sensor_config = sensor_config  # ICM20948 driver settings, or None for the defaults
+        self.motion_config = motion_config  # MotionDetector settings, or None for the defaults
+        self.ahrs_config = ahrs_config  # MadgwickAHRS settings, or None for the defaults
+        self.calibration_path = calibration_path  # IMUCalibration file, or None for raw readings
+        self.state_rates = state_rates  # Sensor rate per motion state, or None for a fixed rate
+        self.usage_report_interval = usage_report_interval  # Seconds between IMU utilization logs
+        self.hal_config = hal_config  # hal.imu backend config, or None for the ICM20948
+        self.clock = clock  # Clock the IMU processes poll and timestamp samples with
+        self.scheduling = scheduling or {}  # {role: SchedulingPolicy} for the IMU processes
+        self.state_machine = state_machine  # DeviceStateMachine that motion transitions are sent to
+        self.shutdown_config = shutdown_config or {"timeout": 2.0, "kill_timeout": 1.0}
         self.__logger = logging.getLogger(__name__)
         self.imu_process = None
         self.imu_worker = None
@@ -26,31 +71,73 @@ class IMUManager:
         Initializes IMU worker using shared memory
         """
         self.imu_worker = IMUWorker(
-            host=self.HOST,
-            port=self.PORT,         
+            host=self.host,
+            port=self.port,
             stop_event=self.stop_event, 
-            shared_data=imu_data)
-        self.imu_process = mp.Process(target=self.imu_worker.run, name="IMU-Worker")
+            shared_data=imu_data,
+            bandwidth=self.bandwidth,
+            bandwidth_stream=self.bandwidth_stream,
+            sample_ring=self.sample_ring,
+            crc=self.crc,
+            sensor_config=self.sensor_config,
+            motion_config=self.motion_config,
+            ahrs_config=self.ahrs_config,
+            calibration_path=self.calibration_path,
+            state_rates=self.state_rates,
+            usage_report_interval=self.usage_report_interval,
+            hal_config=self.hal_config,
+            clock=self.clock,
+            scheduling=self.scheduling,
+            state_machine=self.state_machine,
+            shutdown_config=self.shutdown_config,
+            **self.uplink_config)
+        self.imu_process = mp.Process(
+            target=self.clock.participant(scheduled(self.scheduling.get("imu_manager"), graceful(self.imu_worker.run))),
+            name="IMU-Worker",
+        )
         self.imu_process.start()
 
-    def stop_workers(self):
+    def signal_stop(self):
         """
-        Stops all activate camera processes and terminates gracefully
+        Tells the IMU processes to flush and exit, without waiting
+        Returns the processes to wait for
+        """
+        self.stop_event.set()
+        return [self.imu_process]
+
+    def stop_workers(self, deadline=None):
+        """
+        Stops the IMU worker process, which stops its sensor and socket processes first. Terminates
+        and then kills it if it is still running at the deadline (time.monotonic() time, shutdown
+        timeout from now if not given)
         """
         self.__logger.info(f"Stopping IMU process {self.imu_process}")
-                
-        if self.imu_process:
-            # Tells each worker to exit the stream_data loop
-            self.stop_event.set()
-            self.imu_worker.stop_imu()
+        if self.imu_process is None:
+            return
 
-            self.imu_process.join(timeout=1.0)
+        if deadline is None:
+            deadline = time.monotonic() + self.shutdown_config["timeout"]
+        escalated = stop_processes(self.signal_stop(), deadline, self.shutdown_config["kill_timeout"])
+        if escalated:
+            self.__logger.warning(f"Terminated IMU processes {escalated}")
 
-            if self.imu_process.is_alive():
-                self.__logger.warning("IMU process still alive. Terminating...")
-                self.imu_process.terminate()
+        self.imu_process = None
+        self.imu_worker = None
+        self.__logger.info("IMU worker process stopped")
+
+    def get_metrics(self):
+        """
+        Returns the placement of the IMU processes and the sensor wake-up lateness
+        """
+        if self.imu_worker is None:
+            return {}
 
-            self.__logger.info("IMU worker process stopped")
+        pids = {"imu_manager": self.imu_process.pid}
+        pids.update(zip(("imu_sensor", "imu_socket"), self.imu_worker.process_ids))
+        return {
+            "placement": {role: read_process_placement(pid) for role, pid in pids.items() if pid},
+            "jitter": self.imu_worker.jitter.summary(),
+        }
 
     def is_running(self):
         """
@@ -0,0 +1,73 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from .imu_ring_buffer import GYRO, QUAT, TIME
+
+# Orientation quaternion (w, x, y, z), angular rate (rads/s) and DeviceState at a given time
+IMUPose = namedtuple("IMUPose", ["quaternion", "gyro", "state"])
+
+
+class IMUPoseSampler:
+    """
+    Looks up the IMU pose at a timestamp from the recent samples in the IMURingBuffer, so camera
+    frames can carry the orientation and angular rate at their capture time
+    """
+
+    def __init__(self, ring, shared_data=None, sample_rate=1125.0, history=0.25, max_gap=0.05):
+        """
+        ring: IMURingBuffer written by the IMU process
+        shared_data: IMUSharedData the motion state is read from, None to leave the state out
+        history: seconds of samples searched, frames older than this get no pose
+        max_gap: seconds a timestamp may be outside the samples (e.g. newer than the last FIFO read)
+        and still use the nearest sample
+        """
+        self.ring = ring
+        self.shared_data = shared_data
+        self.count = max(int(history * sample_rate), 2)
+        self.max_gap = max_gap
+
+    def pose_at(self, timestamp):
+        """
+        Returns the IMUPose interpolated at a time.time() timestamp, or None if there are no samples
+        near it
+        """
+        samples = self.ring.recent(self.count)
+        if len(samples) == 0:
+            return None
+
+        times = samples[:, TIME]
+        if timestamp < times[0] - self.max_gap or timestamp > times[-1] + self.max_gap:
+            return None
+
+        index = int(np.searchsorted(times, timestamp))
+        if index == 0 or index == len(samples):
+            row = samples[min(index, len(samples) - 1)]
+            quaternion, gyro = row[QUAT], row[GYRO]
+        else:
+            before, after = samples[index - 1], samples[index]
+            span = after[TIME] - before[TIME]
+            fraction = (timestamp - before[TIME]) / span if span > 0 else 0.0
+            gyro = before[GYRO] + fraction * (after[GYRO] - before[GYRO])
+            quaternion = interpolate_quaternion(before[QUAT], after[QUAT], fraction)
+
+        state = self.shared_data.get_state() if self.shared_data is not None else None
+        return IMUPose(tuple(quaternion.tolist()), tuple(gyro.tolist()), state)
+
+
+def interpolate_quaternion(q0, q1, fraction):
+    """
+    Normalized linear interpolation, close to slerp for the small rotations between IMU samples
+    """
+    if np.dot(q0, q1) < 0:
+        q1 = -q1  # Same rotation, take the short way round
+    q = q0 + fraction * (q1 - q0)
+    return q / np.linalg.norm(q)
+
+
+def angular_speed(pose):
+    """
+    Magnitude of the pose angular rate (rads/s)
+    """
+    return math.sqrt(sum(rate * rate for rate in pose.gyro))
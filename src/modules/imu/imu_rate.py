@@ -0,0 +1,86 @@
+import logging
+import time
+from collections import namedtuple
+
+from ..device_state import DeviceState
+
+# Sensor accel and gyro rate (Hz) and seconds between FIFO reads
+RateMode = namedtuple("RateMode", ["sample_rate", "poll_interval"])
+# Totals for one rate mode: seconds spent in it, samples read, sensor process CPU seconds and I2C
+# busy seconds
+ModeUsage = namedtuple("ModeUsage", ["seconds", "samples", "cpu_seconds", "bus_seconds"])
+
+
+def resolve_state_rates(sensor_config, state_rates_config):
+    """
+    Returns the default RateMode from the sensor config and {DeviceState: RateMode} from
+    imu.state_rates
+    """
+    default = RateMode(sensor_config.get("sample_rate", 1125.0), sensor_config.get("poll_interval", 0.01))
+    state_rates = {}
+    for name, values in (state_rates_config or {}).items():
+        if name not in DeviceState.__members__:
+            raise ValueError(f"Unknown device state '{name}' in imu.state_rates")
+        state_rates[DeviceState[name]] = default._replace(**values)
+    return default, state_rates
+
+
+class IMUUsageMeter:
+    """
+    Splits the sensor process CPU time and I2C bus time between the rate modes it ran in, for
+    reports of what each mode costs. Lives in the sensor process
+    """
+
+    def __init__(self, bus, clock=time.monotonic, cpu_clock=time.process_time):
+        """
+        bus: SMBusI2C or FakeICM20948Bus, its busy_seconds counter is sampled
+        """
+        self.bus = bus
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.totals = {}  # Mode label: ModeUsage
+        self.mode = None
+        self.samples = 0
+        self.__mark = None
+        self.__logger = logging.getLogger(__name__)
+
+    def __readings(self):
+        return self.clock(), self.cpu_clock(), getattr(self.bus, "busy_seconds", 0.0)
+
+    def switch(self, mode):
+        """
+        Closes the current interval and starts counting towards mode (any hashable label)
+        """
+        readings = self.__readings()
+        if self.mode is not None:
+            seconds, cpu_seconds, bus_seconds = (now - then for now, then in zip(readings, self.__mark))
+            total = self.totals.get(self.mode, ModeUsage(0.0, 0, 0.0, 0.0))
+            self.totals[self.mode] = ModeUsage(
+                total.seconds + seconds,
+                total.samples + self.samples,
+                total.cpu_seconds + cpu_seconds,
+                total.bus_seconds + bus_seconds,
+            )
+        self.mode = mode
+        self.samples = 0
+        self.__mark = readings
+
+    def add_samples(self, count):
+        self.samples += count
+
+    def report(self):
+        """
+        Returns {mode: ModeUsage} including the interval in progress
+        """
+        self.switch(self.mode)
+        return dict(self.totals)
+
+    def log_report(self):
+        for mode, usage in self.report().items():
+            if usage.seconds <= 0:
+                continue
+            self.__logger.info(
+                f"[IMU] {mode}: {usage.seconds:.0f} s, {usage.samples / usage.seconds:.1f} samples/s, "
+                f"CPU {100 * usage.cpu_seconds / usage.seconds:.2f}%, "
+                f"I2C {100 * usage.bus_seconds / usage.seconds:.2f}%"
+            )
@@ -0,0 +1,167 @@
+import logging
+import multiprocessing as mp
+from collections import namedtuple
+
+import numpy as np
+
+# Columns of each sample row
+TIME = 0  # time.time() when the sample was read
+ACCEL = slice(1, 4)  # m/s^2
+GYRO = slice(4, 7)  # rads/s
+MAG = slice(7, 10)  # uT
+QUAT = slice(10, 14)  # AHRS orientation quaternion w, x, y, z (sensor to earth frame)
+LINEAR_ACCEL = slice(14, 17)  # Gravity-free acceleration in the earth frame, m/s^2
+NUM_COLUMNS = 17
+
+
+class IMURingBuffer:
+    """
+    Fixed size ring of timestamped IMU samples in shared memory
+    A single writer (the IMU sensor process) appends without locking. Each sample has a sequence
+    number (total samples written before it), and readers use it to detect samples that were
+    overwritten before they could read them
+    """
+
+    IMUBlock = namedtuple("IMUBlock", ["samples", "first_seq", "dropped"])
+
+    def __init__(self, capacity=4096):
+        """
+        capacity: number of samples kept, readers must read at least this often to not drop samples
+        """
+        self.capacity = capacity
+        self.shared_samples = mp.RawArray("d", capacity * NUM_COLUMNS)
+        # Number of samples written. Only updated after the sample rows, so readers never see a
+        # sequence number for a row that is still being written. 64-bit, a single store on 64-bit Pi
+        # OS
+        self.write_seq = mp.RawValue("Q", 0)
+        # End of the rows being written, set before they are written. Rows older than capacity
+        # before it may be overwritten while a reader copies them
+        self.reserved_seq = mp.RawValue("Q", 0)
+        self.__samples = None
+
+    def __getstate__(self):
+        # The numpy view is rebuilt in each process from the shared array
+        state = self.__dict__.copy()
+        state["_IMURingBuffer__samples"] = None
+        return state
+
+    @property
+    def samples(self):
+        """
+        (capacity, NUM_COLUMNS) numpy view of the shared memory
+        """
+        if self.__samples is None:
+            self.__samples = np.frombuffer(self.shared_samples, dtype=np.float64).reshape(
+                self.capacity, NUM_COLUMNS
+            )
+        return self.__samples
+
+    def append(self, timestamp, accel, gyro, mag, quaternion=(1.0, 0.0, 0.0, 0.0), linear_accel=(0.0, 0.0, 0.0)):
+        """
+        Writes one sample. Never blocks, old samples are overwritten when the ring is full
+        """
+        seq = self.write_seq.value
+        self.reserved_seq.value = seq + 1
+        row = self.samples[seq % self.capacity]
+        row[TIME] = timestamp
+        row[ACCEL] = accel
+        row[GYRO] = gyro
+        row[MAG] = mag
+        row[QUAT] = quaternion
+        row[LINEAR_ACCEL] = linear_accel
+        self.write_seq.value = seq + 1
+
+    def extend(self, block):
+        """
+        Writes a (n, NUM_COLUMNS) block of samples at once
+        """
+        count = len(block)
+        if count == 0:
+            return
+        if count > self.capacity:
+            block = block[-self.capacity:]
+
+        seq = self.write_seq.value
+        self.reserved_seq.value = seq + count
+        start = (seq + count - len(block)) % self.capacity
+        first = min(len(block), self.capacity - start)
+        self.samples[start:start + first] = block[:first]
+        self.samples[: len(block) - first] = block[first:]
+        self.write_seq.value = seq + count
+
+    def latest(self):
+        """
+        Returns a copy of the most recent sample row, or None if nothing was written yet
+        """
+        seq = self.write_seq.value
+        if seq == 0:
+            return None
+        return self.samples[(seq - 1) % self.capacity].copy()
+
+    def recent(self, count):
+        """
+        Returns a copy of the (up to) count most recent samples as a (n, NUM_COLUMNS) array, oldest
+        first
+        """
+        end = self.write_seq.value
+        start = max(end - min(count, self.capacity), 0)
+        samples = self.samples[np.arange(start, end) % self.capacity]
+
+        # Rows the writer overwrote while we copied are dropped, as in IMURingReader.read()
+        oldest_valid = self.reserved_seq.value - self.capacity
+        if start < oldest_valid:
+            samples = samples[oldest_valid - start:]
+        return samples
+
+    def reader(self, from_start=False):
+        """
+        Creates a reader that receives samples written after this call, or all samples still in the
+        ring if from_start is set
+        """
+        return IMURingReader(self, from_start)
+
+
+class IMURingReader:
+    """
+    Per-consumer cursor into an IMURingBuffer
+    """
+
+    def __init__(self, ring, from_start=False):
+        self.ring = ring
+        seq = ring.write_seq.value
+        self.cursor = max(seq - ring.capacity, 0) if from_start else seq
+        self.dropped = 0  # Total samples overwritten before this reader got to them
+        self.__logger = logging.getLogger(__name__)
+
+    def read(self):
+        """
+        Returns an IMUBlock with every sample written since the last read as one (n, NUM_COLUMNS)
+        array, the sequence number of its first row, and how many samples were lost to overflow
+        """
+        ring = self.ring
+        end = ring.write_seq.value
+        start = max(self.cursor, end - ring.capacity)
+
+        indices = np.arange(start, end) % ring.capacity
+        samples = ring.samples[indices]  # Fancy indexing copies the rows
+
+        # The writer may have wrapped around while we copied. Rows older than this were overwritten
+        # (or are being written), so they are dropped as overflow
+        oldest_valid = ring.reserved_seq.value - ring.capacity
+        if start < oldest_valid:
+            samples = samples[oldest_valid - start:]
+            start = min(oldest_valid, end)
+
+        dropped = start - self.cursor
+        if dropped:
+            self.dropped += dropped
+            self.__logger.warning(f"IMU ring overflow, {dropped} samples dropped")
+
+        self.cursor = end
+        return IMURingBuffer.IMUBlock(samples, start, dropped)
+
+    def pending(self):
+        """
+        Number of samples written since the last read
+        """
+        return self.ring.write_seq.value - self.cursor
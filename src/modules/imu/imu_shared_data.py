@@ -1,5 +1,7 @@
 import logging
 import math
+import multiprocessing as mp
+import time
 from collections import namedtuple
 from ..device_state import DeviceState as State
 
@@ -11,70 +13,109 @@ class IMUSharedData:
     """
 
     IMUReading = namedtuple("IMUReading", ["accel", "gyro", "mag"])
+    IMUOrientation = namedtuple("IMUOrientation", ["quaternion", "linear_accel"])
     # Set thresholds for stationary/ no motion detection
     ACCEL_THRESHOLD = 0.5  # Allowable noise for acceleration (m/s^2)
     GRAV_THRESHOLD = 1 # Higher threshold since stationary reading is usually around 8.5
     GYRO_THRESHOLD = 0.05  # Allowable noise for angular velocity (rads/s)
     TIME_WINDOW = 1  # Time interval to check for movement (sec)
-
-    # Calibration values (from running calibrate_imu.py)
-    # ACC_OFFSET_X, ACC_OFFSET_Y, ACC_OFFSET_Z = -0.005506663818359374, 5.941714202026368, -7.348451329467771
-    # ACC_OFFSET_X, ACC_OFFSET_Y, ACC_OFFSET_Z = 0.3363853332519531, 6.556521246337891, 0.280121594238282
-    # ACC_OFFSET_X, ACC_OFFSET_Y, ACC_OFFSET_Z = -0.04070142822265625, 4.015076184082031, -8.553285430908204
-    ACC_OFFSET_X, ACC_OFFSET_Y, ACC_OFFSET_Z = 0,0,0
-    GYRO_OFFSET_X, GYRO_OFFSET_Y, GYRO_OFFSET_Z = 0.004529862305343512, -0.010658499541984735, 0.013589586916030535
-    
-
-    def __init__(self, shared_array):
-        self.shared_array = shared_array
+    # Seconds the sequence number may stay odd before readers assume the writer died mid-update. An
+    # update takes microseconds, a writer terminated or killed between its two stores never finishes
+    STALE_WRITE_TIMEOUT = 0.1
+
+    def __init__(self):
+        # Latest accel, gyro, mag, AHRS quaternion and linear acceleration values. Written by a
+        # single writer (the IMU sensor process) and read by any process without locking, using a
+        # seqlock: the writer makes the sequence number odd while it updates the values, and readers
+        # retry if it was odd or changed while they copied, so the writer never blocks and readers
+        # never see a torn update
+        self.shared_array = mp.RawArray("d", 16)
+        self.shared_array[9] = 1.0  # Identity quaternion until the AHRS runs
+        self.seq = mp.RawValue("Q", 0)
+        # Debounced DeviceState from the MotionDetector in the IMU process, a single byte store
+        self.motion_state = mp.RawValue("B", State.MOVING.value)
+        # Current accel and gyro sample rate (Hz), 0 until the sensor is configured
+        self.sample_rate = mp.RawValue("d", 0.0)
         self.__logger = logging.getLogger(__name__)
 
+    def __snapshot(self):
+        """
+        Returns a consistent copy of the 16 values (accel, gyro, mag, quaternion, linear accel)
+        """
+        deadline = None
+        while True:
+            seq = self.seq.value
+            if seq & 1:
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.STALE_WRITE_TIMEOUT
+                elif now >= deadline:
+                    # The values are as the dead writer left them, possibly half updated
+                    self.__logger.warning("IMU writer stopped mid-update, reading the values as they are")
+                    return self.shared_array[:]
+                time.sleep(0)  # Writer is mid-update, yield and retry
+                continue
+
+            values = self.shared_array[:]
+            if self.seq.value == seq:
+                return values
+
     def get(self):
         """
         To safely access and read shared IMU data
         """
-        with self.shared_array.get_lock():
-            accel = tuple(self.shared_array[0:3])
-            gyro = tuple(self.shared_array[3:6])
-            mag = tuple(self.shared_array[6:9])
-        return self.IMUReading(accel, gyro, mag)
+        values = self.__snapshot()
+        return self.IMUReading(tuple(values[0:3]), tuple(values[3:6]), tuple(values[6:9]))
         
     def get_calibrated(self):
         """
-        Safely access and read calibrated shared IMU data values
+        Same as get(), the IMU process applies the calibration file before publishing readings
         """
-        with self.shared_array.get_lock():
-            raw_accel = self.shared_array[0:3]
-            raw_gyro = self.shared_array[3:6]
-            mag = self.shared_array[6:9]
+        return self.get()
 
-        # Apply calibration offsets to accel and gyro
-        calibrated_accel = (
-            raw_accel[0] - self.ACC_OFFSET_X,
-            raw_accel[1] - self.ACC_OFFSET_Y,
-            raw_accel[2] - self.ACC_OFFSET_Z,
-        )
-        calibrated_gyro = (
-            raw_gyro[0] - self.GYRO_OFFSET_X,
-            raw_gyro[1] - self.GYRO_OFFSET_Y,
-            raw_gyro[2] - self.GYRO_OFFSET_Z,
-        )
-        return self.IMUReading(calibrated_accel, calibrated_gyro, mag)
-    
     def get_state(self):
-        if self.is_stationary():
-            return State.STATIONARY
-        else:
-            return State.MOVING
+        """
+        Returns the motion state (DeviceState.MOVING or STATIONARY) set by the IMU process
+        """
+        return State(self.motion_state.value)
+
+    def set_state(self, state):
+        """
+        Publishes the motion state, called by the IMU process when the MotionDetector changes state
+        """
+        self.motion_state.value = state.value
+
+    def get_sample_rate(self):
+        """
+        Returns the sample rate (Hz) set by the IMU process, which changes with the motion state
+        """
+        return self.sample_rate.value
+
+    def set_sample_rate(self, sample_rate):
+        self.sample_rate.value = sample_rate
+
+    def get_orientation(self):
+        """
+        Returns the latest AHRS quaternion (w, x, y, z) and gravity-free earth frame acceleration
+        """
+        values = self.__snapshot()
+        return self.IMUOrientation(tuple(values[9:13]), tuple(values[13:16]))
 
-    def set(self, accel, gyro, mag):
+    def set(self, accel, gyro, mag, quaternion=(1.0, 0.0, 0.0, 0.0), linear_accel=(0.0, 0.0, 0.0)):
         """
-        Safely set the accel, gyro, and mag IMU data values
+        Safely set the accel, gyro, and mag IMU data values, and the AHRS output
+        Must only be called from one process (the IMU sensor process)
         """
-        with self.shared_array.get_lock():
-            self.shared_array[0:3] = accel
-            self.shared_array[3:6] = gyro
-            self.shared_array[6:9] = mag
+        # Rounded down to even in case a previous writer was stopped mid-update, so readers are not
+        # stuck and odd still means a write in progress after re-arming
+        seq = self.seq.value & ~1
+        self.seq.value = seq + 1  # Odd, readers wait and retry
+        self.shared_array[0:3] = accel
+        self.shared_array[3:6] = gyro
+        self.shared_array[6:9] = mag
+        self.shared_array[9:13] = quaternion
+        self.shared_array[13:16] = linear_accel
+        self.seq.value = seq + 2
 
     def print_raw(self):
         """
@@ -82,30 +123,16 @@ class IMUSharedData:
         """
         # Note: accel Z is gravity
         # Raw values
-        self.__logger.debug("Accel: X:{:.2f}, Y: {:.2f}, Z: {:.2f} m/s^2".format(*self.shared_array[0:3]))
-        self.__logger.debug("Gyro: X:{:.2f}, Y: {:.2f}, Z: {:.2f} rads/s".format(*self.shared_array[3:6]))
-        self.__logger.debug("Mag: X:{:.2f}, Y: {:.2f}, Z: {:.2f} uT\n".format(*self.shared_array[6:9]))
+        reading = self.get()
+        self.__logger.debug("Accel: X:{:.2f}, Y: {:.2f}, Z: {:.2f} m/s^2".format(*reading.accel))
+        self.__logger.debug("Gyro: X:{:.2f}, Y: {:.2f}, Z: {:.2f} rads/s".format(*reading.gyro))
+        self.__logger.debug("Mag: X:{:.2f}, Y: {:.2f}, Z: {:.2f} uT\n".format(*reading.mag))
 
     def print(self):
         """
         Print calibrated acceleration, gyro, and magnetometer values with offsets
         """
-        with self.shared_array.get_lock():
-            raw_accel = self.shared_array[0:3]
-            raw_gyro = self.shared_array[3:6]
-            mag = self.shared_array[6:9]
-
-        # Apply calibration offsets to accel and gyro
-        calibrated_accel = (
-            raw_accel[0] - self.ACC_OFFSET_X,
-            raw_accel[1] - self.ACC_OFFSET_Y,
-            raw_accel[2] - self.ACC_OFFSET_Z,
-        )
-        calibrated_gyro = (
-            raw_gyro[0] - self.GYRO_OFFSET_X,
-            raw_gyro[1] - self.GYRO_OFFSET_Y,
-            raw_gyro[2] - self.GYRO_OFFSET_Z,
-        )
+        calibrated_accel, calibrated_gyro, mag = self.get_calibrated()
 
         self.__logger.info(
             "Calibrated Accel: X:{:.2f}, Y: {:.2f}, Z: {:.2f} m/s^2".format(*calibrated_accel)
@@ -118,49 +145,25 @@ class IMUSharedData:
         )
 
     def is_stationary(self):
-        acc_x, acc_y, acc_z = self.shared_array[0:3]
-        gyro_x, gyro_y, gyro_z = self.shared_array[3:6]
-
-        # Check if accelerometer values is close to 0 (use calibrated, offset since there may be noise)
-        is_acc_zero = (
-            abs((acc_x - self.ACC_OFFSET_X)) <= self.ACCEL_THRESHOLD and
-            abs((acc_y - self.ACC_OFFSET_Y)) <= self.ACCEL_THRESHOLD and
-            abs((acc_z - self.ACC_OFFSET_Z)) <= self.ACCEL_THRESHOLD
-        )
-
-        # Check if gyrometer values is close to 0
-        is_gyro_zero = (
-            abs(gyro_x-self.GYRO_OFFSET_X) <= self.GYRO_THRESHOLD and 
-            abs(gyro_y - self.GYRO_OFFSET_Y) <= self.GYRO_THRESHOLD and 
-            abs(gyro_z - self.GYRO_OFFSET_Z) <= self.GYRO_THRESHOLD
-        )
-
-        return is_acc_zero and is_gyro_zero
-
-
+        """
+        True if the MotionDetector in the IMU process classified the recent samples as stationary
+        """
+        return self.get_state() == State.STATIONARY
 
     def is_stationary_mag(self):
         """
-        Check if stationary using the magnitude and so that gravity doesn't affect it
+        Check if stationary using the magnitude of the AHRS linear acceleration (gravity removed in
+        the earth frame, so orientation doesn't affect it) and of the gyro
         """
-        acc_x, acc_y, acc_z = self.shared_array[0:3]
-        gx, gy, gz = self.shared_array[3:6]
-
-        # Compute calibrated acceleration
-        acc_x -= self.ACC_OFFSET_X
-        acc_y -= self.ACC_OFFSET_Y
-        acc_z -= self.ACC_OFFSET_Z
-
-        # Compute calibrated gyroscope
-        gx -= self.GYRO_OFFSET_X
-        gy -= self.GYRO_OFFSET_Y
-        gz -= self.GYRO_OFFSET_Z
+        values = self.__snapshot()
+        gx, gy, gz = values[3:6]
+        lin_x, lin_y, lin_z = values[13:16]
 
         #  Calculate overall magnitude
-        acc_mag = math.sqrt(acc_x**2 + acc_y**2 + acc_z**2)
+        acc_mag = math.sqrt(lin_x**2 + lin_y**2 + lin_z**2)
         gyro_mag = math.sqrt(gx**2 + gy**2 + gz**2)
 
-        is_acc_zero = abs(acc_mag) < self.ACCEL_THRESHOLD
+        is_acc_zero = acc_mag < self.ACCEL_THRESHOLD
         is_gyro_zero = gyro_mag < self.GYRO_THRESHOLD
 
-        return is_acc_zero and is_gyro_zero
\ No newline at end of file
+        return is_acc_zero and is_gyro_zero
@@ -0,0 +1,231 @@
+import json
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from ..wire_protocol import PROTOCOL_VERSION, STREAM_IMU, FrameParser, encode_frame
+from .imu_ring_buffer import ACCEL, GYRO, LINEAR_ACCEL, MAG, NUM_COLUMNS, QUAT, TIME
+
+# Send modes
+BINARY = "binary"
+JSON = "json"  # One JSON line per batch, for debugging with netcat
+
+# Binary batches are sent as STREAM_IMU frames of the wire protocol, whose sequence number is the
+# batch sequence number and whose timestamp is the base timestamp of the batch. Their payload starts
+# with the batch header: uint8 device state, uint64 sequence number of the first sample (samples
+# read since boot), uint16 sample count
+BATCH_HEADER = struct.Struct(">BQH")
+# Sample records follow the header, the timestamp is stored as microseconds after the base timestamp
+SAMPLE_DTYPE = np.dtype([
+    ("offset_us", ">u4"),
+    ("accel", ">f4", (3,)),  # m/s^2
+    ("gyro", ">f4", (3,)),  # rads/s
+    ("mag", ">f4", (3,)),  # uT
+    ("quat", ">f4", (4,)),  # w, x, y, z, sensor to earth frame
+    ("linear_accel", ">f4", (3,)),  # m/s^2, earth frame without gravity
+])
+
+IMUBatch = namedtuple(
+    "IMUBatch",
+    [
+        "version",
+        "state",
+        "batch_seq",
+        "first_seq",
+        "timestamps",
+        "accel",
+        "gyro",
+        "mag",
+        "quat",
+        "linear_accel",
+    ],
+)
+
+
+class IMUUplink:
+    """
+    Batches the samples of an IMURingReader into frames for the base station
+    Each sample is sent once: poll() returns a frame for every batch_size samples, and sends the
+    remaining samples early once the oldest one has waited max_age seconds
+    """
+
+    def __init__(
+        self,
+        reader,
+        batch_size=25,
+        max_age=0.2,
+        send_mode=BINARY,
+        crc=False,
+    ):
+        """
+        reader: IMURingReader the samples are taken from
+        batch_size: samples per frame, at most 65535
+        max_age: seconds a sample may wait for its batch to fill
+        crc: send a CRC of every binary frame
+        """
+        if send_mode not in (BINARY, JSON):
+            raise ValueError(f"Unknown IMU send mode {send_mode}")
+
+        self.reader = reader
+        self.set_batch_size(batch_size)
+        self.max_age = max_age
+        self.send_mode = send_mode
+        self.crc = crc
+
+        self.batch_seq = 0
+        self.pending = np.empty((0, NUM_COLUMNS))
+        self.pending_seq = 0  # Sequence number of the first pending sample
+
+    def set_batch_size(self, batch_size):
+        """
+        Changes the samples per frame, e.g. to keep frames the same length in time when the IMU rate
+        changes
+        """
+        self.batch_size = min(max(int(batch_size), 1), 0xFFFF)
+
+    def poll(self, state=0, now=None):
+        """
+        Reads the new samples and returns the list of frames (bytes) that are ready to send
+        state: DeviceState value sent with the batches
+        """
+        if now is None:
+            now = time.time()
+
+        block = self.reader.read()
+        frames = []
+        if len(block.samples):
+            # Batches hold consecutive samples, so samples lost to overflow end the current batch
+            if len(self.pending) and block.first_seq != self.pending_seq + len(self.pending):
+                frames.append(self.__take(len(self.pending), state))
+            if len(self.pending):
+                self.pending = np.concatenate((self.pending, block.samples))
+            else:
+                self.pending = block.samples
+                self.pending_seq = block.first_seq
+
+        while len(self.pending) >= self.batch_size:
+            frames.append(self.__take(self.batch_size, state))
+
+        if len(self.pending) and now - self.pending[0, TIME] >= self.max_age:
+            frames.append(self.__take(len(self.pending), state))
+        return frames
+
+    def flush(self, state=0):
+        """
+        Returns the frames for all pending samples without waiting for them to fill a batch
+        """
+        return self.poll(state=state, now=float("inf"))  # Every pending sample is past its max age
+
+    def discard(self):
+        """
+        Drops the pending and unread samples, e.g. while the base station is not connected
+        Returns the number of samples dropped
+        """
+        dropped = len(self.pending) + len(self.reader.read().samples)
+        self.pending = self.pending[:0]
+        return dropped
+
+    def __take(self, count, state):
+        samples = self.pending[:count]
+        frame = self.__encode(samples, self.pending_seq, state)
+        self.pending = self.pending[count:]
+        self.pending_seq += count
+        self.batch_seq = (self.batch_seq + 1) & 0xFFFFFFFF
+        return frame
+
+    def __encode(self, samples, first_seq, state):
+        if self.send_mode == JSON:
+            return encode_json_batch(samples, self.batch_seq, first_seq, state)
+        return encode_batch(samples, self.batch_seq, first_seq, state, crc=self.crc)
+
+
+def encode_batch(samples, batch_seq, first_seq, state=0, crc=False):
+    """
+    Packs a (n, NUM_COLUMNS) block of samples into a binary frame
+    """
+    base_time = samples[0, TIME]
+    records = np.empty(len(samples), dtype=SAMPLE_DTYPE)
+    records["offset_us"] = np.rint((samples[:, TIME] - base_time) * 1e6)
+    records["accel"] = samples[:, ACCEL]
+    records["gyro"] = samples[:, GYRO]
+    records["mag"] = samples[:, MAG]
+    records["quat"] = samples[:, QUAT]
+    records["linear_accel"] = samples[:, LINEAR_ACCEL]
+
+    payload = BATCH_HEADER.pack(state, first_seq, len(samples)) + records.tobytes()
+    return encode_frame(STREAM_IMU, batch_seq, base_time, payload, crc=crc)
+
+
+def encode_json_batch(samples, batch_seq, first_seq, state=0):
+    """
+    Encodes a block of samples as one newline terminated JSON object
+    """
+    data = {
+        "version": PROTOCOL_VERSION,
+        "state": state,
+        "batch_seq": batch_seq,
+        "first_seq": first_seq,
+        "timestamps": samples[:, TIME].tolist(),
+        "accel": samples[:, ACCEL].tolist(),
+        "gyro": samples[:, GYRO].tolist(),
+        "mag": samples[:, MAG].tolist(),
+        "quat": samples[:, QUAT].tolist(),
+        "linear_accel": samples[:, LINEAR_ACCEL].tolist(),
+    }
+    return json.dumps(data).encode("utf-8") + b"\n"
+
+
+def decode_batch(frame):
+    """
+    Decodes one wire_protocol Frame into an IMUBatch, copying the samples out of the frame's payload
+    Raises ValueError if the frame is not an IMU batch
+    """
+    payload = frame.payload
+    if frame.stream_type != STREAM_IMU:
+        raise ValueError(f"Frame of stream type {frame.stream_type} is not an IMU batch")
+    if len(payload) < BATCH_HEADER.size:
+        raise ValueError("IMU frame shorter than its header")
+
+    state, first_seq, count = BATCH_HEADER.unpack_from(payload)
+    if len(payload) != BATCH_HEADER.size + count * SAMPLE_DTYPE.itemsize:
+        raise ValueError(f"IMU frame length does not match its {count} samples")
+
+    records = np.frombuffer(payload, dtype=SAMPLE_DTYPE, count=count, offset=BATCH_HEADER.size)
+    return IMUBatch(
+        PROTOCOL_VERSION,
+        state,
+        frame.sequence,
+        first_seq,
+        frame.timestamp + records["offset_us"] * 1e-6,
+        records["accel"].astype(np.float64),
+        records["gyro"].astype(np.float64),
+        records["mag"].astype(np.float64),
+        records["quat"].astype(np.float64),
+        records["linear_accel"].astype(np.float64),
+    )
+
+
+class IMUStreamDecoder:
+    """
+    Splits a TCP byte stream back into IMUBatches, for the base station side and tests
+    """
+
+    def __init__(self):
+        self.parser = FrameParser(buffer_size=1 << 16)
+        self.next_seq = None  # Expected sequence number of the next sample
+        self.missing = 0  # Samples skipped by the sender (ring overflow or disconnects)
+
+    def feed(self, data):
+        """
+        Adds received bytes and returns the list of batches completed by them
+        """
+        batches = []
+        for frame in self.parser.feed(data):
+            batch = decode_batch(frame)
+            if self.next_seq is not None and batch.first_seq > self.next_seq:
+                self.missing += batch.first_seq - self.next_seq
+            self.next_seq = batch.first_seq + len(batch.timestamps)
+            batches.append(batch)
+        return batches
@@ -1,24 +1,79 @@
-import time
 import logging
-import board
-import busio
-import adafruit_icm20x
+import multiprocessing as mp
+import signal
 import socket
-import struct
-import json
+import time
 from multiprocessing import Process
 
+from ..clock import REAL_CLOCK
+from ..scheduling import JitterMeter, scheduled
+from ..shutdown import connect_until_stopped, graceful, stop_processes
+from ..hal.registry import IMU_BACKENDS, create_backend
+from .icm20948 import ICM20948
+from .ahrs import MadgwickAHRS
+from .imu_calibration import load_calibration
+from .imu_rate import IMUUsageMeter, resolve_state_rates
+from .imu_ring_buffer import ACCEL, GYRO, LINEAR_ACCEL, MAG, QUAT, IMURingBuffer
+from .imu_uplink import BINARY, IMUUplink
+from .motion_detector import MotionDetector
+
 
 class IMUWorker:
     """
     IMU data processing for local sensing and to help change states
     """
     SOCKET_RETRY_WINDOW = 10
-
-    def __init__(self, host, port, stop_event, shared_data, send_mode="json"):
+    SOCKET_TIMEOUT = 10.0  # Seconds a connect or send may block
+
+    def __init__(
+        self,
+        host,
+        port,
+        stop_event,
+        shared_data,
+        send_mode=BINARY,
+        crc=False,
+        bandwidth=None,
+        bandwidth_stream=None,
+        sample_ring=None,
+        batch_size=25,
+        max_batch_age=0.2,
+        sensor_config=None,
+        motion_config=None,
+        ahrs_config=None,
+        calibration_path=None,
+        state_rates=None,
+        usage_report_interval=60.0,
+        hal_config=None,
+        clock=REAL_CLOCK,
+        scheduling=None,
+        state_machine=None,
+        shutdown_config=None,
+    ):
         """
-        shared_data: multiprocessing Array of doubles that can hold 9 values (eg. mp.Array('d',9))
+        shared_data: IMUSharedData holding the latest accel, gyro, mag values
         stop_event: multiprocessing event
+        sample_ring: IMURingBuffer every timestamped reading is appended to and sent from
+        send_mode: "binary" batch frames or "json" lines (see imu_uplink)
+        crc: send a CRC of every binary frame (see wire_protocol)
+        batch_size, max_batch_age: samples per uplink frame, and seconds before a partial batch is
+        sent
+        sensor_config: ICM20948 settings (i2c_bus, address, sample_rate, accel_range, gyro_range,
+        mag_rate) and poll_interval, the seconds between FIFO reads
+        motion_config: MotionDetector window, threshold and dwell settings
+        ahrs_config: enabled flag and MadgwickAHRS beta and use_mag settings
+        calibration_path: IMUCalibration file written by test/calibrate_imu.py, applied to every
+        sample
+        state_rates: {DeviceState name: {sample_rate, poll_interval}} used while the motion detector
+        reports that state, other states use the sensor_config rate
+        usage_report_interval: seconds between logs of the CPU and I2C utilization of each rate
+        hal_config: hal.imu config selecting the I2C bus backend, None for the ICM20948 on the Pi
+        bus
+        clock: Clock for polling, retries and sample timestamps
+        scheduling: {role: SchedulingPolicy} applied by the imu_sensor and imu_socket processes
+        state_machine: DeviceStateMachine the motion transitions are reported to
+        shutdown_config: timeout and kill_timeout for stopping the sensor and socket processes
+        bandwidth: shared BandwidthAllocator consulted before sending, and its IMU stream slot index
         """
         self.__logger = logging.getLogger(__name__)
 
@@ -27,167 +82,242 @@ class IMUWorker:
         self.port = port
         self.socket = None  
         self.last_reconnect_attempt = 0
-        self.send_mode = send_mode # "json" or "binary" (binary packed struct)
+        self.send_mode = send_mode # "binary" or "json"
+        self.crc = crc
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.sensor_config = sensor_config or {}
+        self.motion_config = motion_config or {}
+        self.ahrs_config = ahrs_config or {}
+        self.calibration_path = calibration_path
+        self.state_rates = state_rates or {}
+        self.usage_report_interval = usage_report_interval
+        self.hal_config = hal_config or {"backend": "icm20948"}
+        self.clock = clock
+        self.scheduling = scheduling or {}
+        # Created here, before the processes are forked, so the manager process can read them
+        self.jitter = JitterMeter()  # How late the sensor process wakes up for each FIFO read
+        self.process_ids = mp.RawArray("i", 2)  # Sensor and socket process ids, 0 until started
+        self.state_machine = state_machine
+        self.shutdown_config = shutdown_config or {"timeout": 2.0, "kill_timeout": 1.0}
+        self.bandwidth = bandwidth
+        self.bandwidth_stream = bandwidth_stream
 
         # IMU reading done in its own process to continuously poll sensor data without blocking camera workers
         self.stop_event = stop_event
 
         # Shared message queue so latest sensor readings and states are tracked and updated to trigger events
         self.shared_data = shared_data
+        # History of every reading, for consumers that need all samples rather than the latest one
+        self.sample_ring = sample_ring if sample_ring is not None else IMURingBuffer()
         
         self.socket_process = None # Background socket process for reconnecting
         self.sensor_process = None # Process for sensor data reading
 
     def setup_process(self):
         self.__logger.info("setting up processes")
-        self.sensor_process = Process(target=self.__read_imu_data)
+        sensor_target = scheduled(self.scheduling.get("imu_sensor"), graceful(self.__read_imu_data))
+        self.sensor_process = Process(target=self.clock.participant(sensor_target), name="IMU-Sensor")
         self.sensor_process.start()
+        self.process_ids[0] = self.sensor_process.pid
         
         self.__logger.info("setting up socket process")        
-        self.socket_process = Process(target=self.__handle_socket_comm)
+        socket_target = scheduled(self.scheduling.get("imu_socket"), graceful(self.__handle_socket_comm))
+        self.socket_process = Process(target=self.clock.participant(socket_target), name="IMU-Socket")
         self.socket_process.start()
+        self.process_ids[1] = self.socket_process.pid
         
     def __read_imu_data(self):
         self.__logger.info("[IMU] Running IMU")
 
+        # Sample rate and poll interval follow the motion state, starting in the MOVING (default)
+        # mode
+        default_mode, state_rates = resolve_state_rates(self.sensor_config, self.state_rates)
+        mode = default_mode
+
         # Intiailizie ICM 20948 IMU
+        sensor_config = dict(self.sensor_config)
+        sensor_config.pop("poll_interval", None)
+        sensor_config["sample_rate"] = mode.sample_rate
         try:
-            i2c = board.I2C()  # uses board.SCL and board.SDA                
-            sensor = adafruit_icm20x.ICM20948(i2c, address=0x69)
+            bus = create_backend(IMU_BACKENDS, self.hal_config, sensor_config.pop("i2c_bus", 1), clock=self.clock)
+            sensor = ICM20948(bus, **sensor_config)
+            sensor.configure()
             self.__logger.debug("[IMU] IMU sensor initialized")
-        except ValueError as e:
+        except (OSError, RuntimeError) as e:
             self.__logger.error(f"[IMU] No I2C device found at the given address: {e}")
             return # Return error if no sensor successfully setup
+        self.shared_data.set_sample_rate(sensor.sample_rate)
+
+        # Loaded once, every sample is corrected here so readers of the ring and shared data get
+        # calibrated values
+        calibration = load_calibration(self.calibration_path)
+
+        # Orientation fused at the sensor rate, filled into the quaternion and linear accel columns
+        ahrs_config = dict(self.ahrs_config)
+        ahrs = None
+        if ahrs_config.pop("enabled", True):
+            ahrs = MadgwickAHRS(sensor.sample_rate, **ahrs_config)
+
+        # Stationary/moving classification over every sample, published to the shared data. The
+        # state machine gets the first state once a full window has been evaluated, then every
+        # change
+        motion_detector = MotionDetector(sensor.sample_rate, **self.motion_config)
+        self.shared_data.set_state(motion_detector.state)
+
+        usage = IMUUsageMeter(bus, clock=self.clock.monotonic)
+        usage.switch(f"{sensor.sample_rate:.1f} Hz")
+        next_report = self.clock.monotonic() + self.usage_report_interval
+
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    # Drain every accel and gyro sample the sensor buffered since the last poll
+                    block = sensor.read_samples(now=self.clock.time())
+                    usage.add_samples(len(block))
+                    self.__process_samples(block, calibration, ahrs, motion_detector)
+
+                    next_mode = state_rates.get(motion_detector.state, default_mode)
+                    if next_mode != mode:
+                        mode = next_mode
+                        # Samples still in the FIFO were taken at the old rate and are processed
+                        # with it
+                        block = sensor.set_sample_rate(mode.sample_rate, now=self.clock.time())
+                        usage.add_samples(len(block))
+                        self.__process_samples(block, calibration, ahrs, motion_detector)
+
+                        for consumer in (ahrs, motion_detector, self.shared_data):
+                            if consumer is not None:
+                                consumer.set_sample_rate(sensor.sample_rate)
+                        usage.switch(f"{sensor.sample_rate:.1f} Hz")
+
+                    # Print calibrated values for debugging
+                    # self.shared_data.print()
+                except OSError as e:
+                    self.__logger.error(f"[IMU] I2C error: {e}")
+
+                if self.clock.monotonic() >= next_report:
+                    usage.log_report()
+                    self.__logger.info(f"[IMU] Wake-up lateness {self.jitter.summary()}")
+                    next_report += self.usage_report_interval
+
+                wake_time = self.clock.monotonic() + mode.poll_interval
+                if not self.clock.wait(self.stop_event, mode.poll_interval):
+                    # Grows when encoding or other processes hold the CPU the sampler needs
+                    self.jitter.add(self.clock.monotonic() - wake_time)
+        finally:
+            bus.close()  # Also on terminate, see shutdown.graceful
+
+    def __process_samples(self, block, calibration, ahrs, motion_detector):
+        """
+        Calibrates and fuses a block of samples, then publishes it to the shared data and ring and
+        reports motion state changes
+        """
+        if len(block) == 0:
+            return
+
+        calibration.apply(block)
+        if ahrs is not None:
+            ahrs.update(block)
+
+        # Atomically update shared memory with the newest sample
+        latest = block[-1]
+        self.shared_data.set(latest[ACCEL], latest[GYRO], latest[MAG], latest[QUAT], latest[LINEAR_ACCEL])
+        self.sample_ring.extend(block)
+
+        evaluated = motion_detector.evaluated
+        if motion_detector.update(block) or (motion_detector.evaluated and not evaluated):
+            # The first evaluated window reports the state even if it is still the initial MOVING,
+            # so a device armed while being carried leaves ARMED without waiting to be set down
+            # first
+            self.shared_data.set_state(motion_detector.state)
+            if self.state_machine is not None:
+                self.state_machine.transition(motion_detector.state, source="imu")
 
-        while not self.stop_event.is_set():
-            try:
-                # Reads accelereation, gyronometer, and magnetometer sensor data (tuple)
-                accel = sensor.acceleration
-                gyro = sensor.gyro
-                mag = sensor.magnetic
-
-                # Atomically update shared memory
-                self.shared_data.set(accel, gyro, mag)
-
-                # Print calibrated values for debugging
-                # self.shared_data.print()
-                # self.shared_data.print_raw()
-                # payload = self.__pack_binary_imu_data()
-                # self.__logger.debug(f"binary struct payload: {payload}") # print payload for debuggin
-
-                # json_data = self.__json_imu_data()
-                # self.__logger.debug(f"json payload: {json_data}") # print payload for debugging
-                time.sleep(0.02)
-                # time.sleep(1)
-            except Exception as e:
-                self.__logger.error(f"Error: {e}")
-    
     def __handle_socket_comm(self):
-        
+        """
+        Sends every sample in the ring to the base station in batches
+        """
+        uplink = IMUUplink(
+            self.sample_ring.reader(),
+            batch_size=self.batch_size,
+            max_age=self.max_batch_age,
+            send_mode=self.send_mode,
+            crc=self.crc,
+        )
+        # Check for new samples a few times per batch age so partial batches leave close to on time
+        poll_interval = self.max_batch_age / 4
+        # batch_size is set for the configured rate, frames keep the same length in time at other
+        # rates
+        nominal_rate = self.sensor_config.get("sample_rate", 1125.0)
+        sample_rate = None
+
         while not self.stop_event.is_set():
+            if self.shared_data.get_sample_rate() not in (0.0, sample_rate):
+                sample_rate = self.shared_data.get_sample_rate()
+                uplink.set_batch_size(round(self.batch_size * sample_rate / nominal_rate))
+
             if self.socket is None:
+                # Check if socket is connected. If not, attempt to reconnect every interval (SOCKET_RETRY_WINDOW)
                 self.__retry_socket_conn()
-                # self.__logger.debug(f"Attempting to reconnect")
-                
-            # Check if socket is connected. If not, attempt to reconnect every interval (SOCKET_RETRY_WINDOW)
-            # Send data if socket exists
+
             if self.socket:
-                try:
-                    self.send_imu_data()
-                except (BrokenPipeError, ConnectionResetError) as e:
-                    self.__logger.error(f"[IMU] Unable to connect to server: {e}")
-                    self.socket = None
+                self.send_imu_data(uplink)
             else:
-                # Retry socket connection every 5 seconds
-                self.__retry_socket_conn()
-    
+                # Readings taken while disconnected are not queued for later
+                dropped = uplink.discard()
+                if dropped:
+                    self.__logger.debug(f"[IMU] Not connected, dropped {dropped} samples")
+
+            self.clock.wait(self.stop_event, poll_interval)
+
+        # Samples read before the stop still go out, within the send timeout
+        if self.socket:
+            self.send_imu_data(uplink, flush=True)
+        if self.socket:
+            self.socket.close()
+
     def run(self):
         """
-        Starts IMU sensor reading and socket communication processes
+        Starts IMU sensor reading and socket communication processes, and stops them once the stop
+        event is set
         """
         self.setup_process()
         self.__logger.info("Finished setting up processes")
-        
-        try: 
+
+        try:
             while not self.stop_event.is_set():
-                time.sleep(1)
+                self.clock.wait(self.stop_event, 1)
         except KeyboardInterrupt:
             self.stop_event.set()
             self.__logger.info("[IMUWorker] Process interrupted by user")
-        
-        self.__logger.info("[IMUWorker] Exiting")
-        
-        # Wait for processes to finish
-        # self.sensor_process.join()
-        # self.socket_process.join()
-        
-        # self.__logger.info("Exiting IMU")
-                
-    def run_old(self):
-        self.__logger.info("[IMU] Running IMU")
-
-        # Intiailizie ICM 20948 IMU
-        try:
-            i2c = board.I2C()  # uses board.SCL and board.SDA
-            # self.__logger.debug("Setup i2c board clock and data")
-                
-            sensor = adafruit_icm20x.ICM20948(i2c, address=0x69)
-            self.__logger.debug("[IMU] IMU sensor initialized")
-        except ValueError as e:
-            self.__logger.error(f"[IMU] No I2C device found at the given address: {e}")
-            return # Return error if no sensor successfully setup
-
-        # Run until stop event triggered
-        while not self.stop_event.is_set():
-            try:
-                # Reads accelereation, gyronometer, and magnetometer sensor data (tuple)
-                accel = sensor.acceleration
-                gyro = sensor.gyro
-                mag = sensor.magnetic
-
-                # Atomically update shared memory
-                self.shared_data.set(accel, gyro, mag)
-
-                # Print calibrated values for debugging
-                # self.shared_data.print()
-                self.shared_data.print_raw()
-                # payload = self.__pack_binary_imu_data()
-                # self.__logger.debug(f"binary struct payload: {payload}") # print payload for debuggin
-
-                # json_data = self.__json_imu_data()
-                # self.__logger.debug(f"json payload: {json_data}") # print payload for debugging
+        finally:
+            self.stop_event.set()
+            # Half the timeout, so the escalation here ends before the manager escalates on this
+            # process.
+            # A terminate from the manager must not interrupt it and leave the two processes running
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            deadline = time.monotonic() + self.shutdown_config["timeout"] / 2
+            stop_processes(
+                [self.sensor_process, self.socket_process], deadline, self.shutdown_config["kill_timeout"] / 2
+            )
 
-                # Check if socket is connected. If not, attempt to reconnect every interval (SOCKET_RETRY_WINDOW)
-                # Send data if socket exists
-                # if self.socket:
-                #     try:
-                #         self.send_imu_data()
-                #     except (BrokenPipeError, ConnectionResetError) as e:
-                #         self.__logger.error(f"[IMU] Unable to connect to server: {e}")
-                #         self.socket = None
-                # else:
-                #     # Retry socket connection every 5 seconds
-                #     self.__retry_socket_conn()
-
-            except Exception as e:
-                self.__logger.error(f"[IMUWorker] Error: {e}")
-
-            time.sleep(0.02)  # 50 Hz delay
-            # time.sleep(1)
         self.__logger.info("[IMUWorker] Exiting")
 
     def __setup_socket(self):
         """
         Initializes the TCP socket transmitting IMU data to base terminal
+        Returns False if the stop event was set before the connection was made
         """
 
         # Initialize network connection
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.settimeout(10.0)
+        self.socket.settimeout(self.SOCKET_TIMEOUT)
 
         try:
             self.__logger.info(f"Connecting to {self.host}:{self.port}")
-            self.socket.connect((self.host, self.port))
+            if not connect_until_stopped(self.socket, (self.host, self.port), self.stop_event, self.SOCKET_TIMEOUT):
+                return False
         except socket.timeout:
             self.__logger.error("[IMU] Connection timed out")
             raise RuntimeError("[IMU] Connection timed out")
@@ -196,96 +326,49 @@ class IMUWorker:
             raise RuntimeError(f"[IMU] Connection failed: {e}")
 
         self.__logger.info(f"[IMU] Socket successfully initialized")
-    
+        return True
+
     def __retry_socket_conn(self):
-        current_time = time.time()
+        current_time = self.clock.time()
         if (current_time - self.last_reconnect_attempt) >= self.SOCKET_RETRY_WINDOW:
             self.last_reconnect_attempt = current_time
             try:
                 self.__logger.debug(f"[IMU] Attempting to reconnect to {self.host}:{self.port}")
-                
+
                 # Setup TCP socket
-                self.__setup_socket()
+                if not self.__setup_socket():
+                    self.socket.close()
+                    self.socket = None
             except Exception:
                 self.__logger.warning("[IMU] Unable to connect to socket, retrying...")
+                self.socket.close()
                 self.socket = None
 
 
-    def send_imu_data(self):
-        self.__logger.info(f"Sending data: {self.socket}")
-        if not self.socket:
-            self.__retry_socket_conn()
+    def send_imu_data(self, uplink, flush=False):
+        """
+        Sends the batches of new samples that are ready, or every pending sample if flush is set
+        """
+        # Leave the samples in the ring while the IMU stream is over its share of the uplink, they
+        # go out in larger batches once it has budget again
+        if not flush and self.bandwidth is not None and self.bandwidth.is_throttled(self.bandwidth_stream):
             return
 
-        # delay_seconds = 2
+        state = self.shared_data.get_state().value
         try:
-            if self.mode == "json":
-                # JSON serializable format
-                payload = self.__json_imu_data()
-            else:
-                # Packed data in binary struct
-                payload = self.__pack_binary_imu_data()
-
-            # Packed struct
-            self.socket.sendall(payload)
-
-            self.__logger.debug("[IMU] Packed data sent successfully")
-        except (BrokenPipeError, ConnectionResetError):
+            payloads = uplink.flush(state=state) if flush else uplink.poll(state=state, now=self.clock.time())
+            for payload in payloads:
+                self.socket.sendall(payload)
+                if self.bandwidth is not None:
+                    self.bandwidth.consume(self.bandwidth_stream, len(payload))
+
+                self.__logger.debug("[IMU] Sent batch of %d bytes", len(payload))
+        except (BrokenPipeError, ConnectionResetError, socket.timeout) as e:
+            self.__logger.error(f"[IMU] Unable to connect to server: {e}")
+            self.socket.close()
             self.socket = None
         except Exception as e:
-            self.__logger.error(f"[IMUWorker] Error sending IMU data: {json_err}")
-
-        # time.sleep(delay_seconds)
-
-    def __pack_binary_imu_data(self):
-        """
-        Pack imu data in struct:
-
-        Payload format:
-        - 4 bytes: length of payload (unsigned int, big-endian)
-        - 8 bytes: timestamp (float)
-        - 1 bytes: state flag (binary, 0 = moving, 1 = stationary)
-        - 9 * 4 bytes:  accel, gyro, mag (float, 4 bytes each)
-        """
-        try:
-            # Send raw imu data
-            imu_reading = self.shared_data.get_calibrated()
-            state_flag = self.shared_data.get_state().value  # State value (moving: 0, stationary: 1)
-            timestamp = time.time()
-
-            # Convert to dict with accel, gyro, mag, and time values
-            packed_data = struct.pack(
-                '>dB9f',
-                timestamp,  # current timestamp
-                state_flag,  # state
-                *(imu_reading.accel),  # x, y, z acceleration values
-                *(imu_reading.gyro),
-                *(imu_reading.mag)
-            )
-
-            # Prefix with 4-byte length header
-            return struct.pack('>I', len(packed_data)) + packed_data
-        except Exception as e:
-            self.__logger.error(f"[IMU] Error packing data: {e}")
-            return b''
-
-    def __json_imu_data(self):
-        # Send raw imu data
-        imu_reading = self.shared_data.get_calibrated()
-
-        # Convert to dict with accel, gyro, mag, and time values
-        data = {
-            "timestamp": time.time(),
-            "state": self.shared_data.get_state().name,
-            "accel": imu_reading.accel,
-            "gyro": imu_reading.gyro,
-            "mag": imu_reading.mag,
-        }
-
-        # Convert dict to JSON string
-        json_data = json.dumps(data)  
-        
-        return json_data.encode('utf-8') + b'\n' # Add newline as delimiter
+            self.__logger.error(f"[IMUWorker] Error sending IMU data: {e}")
 
     def stop_imu(self):
         self.stop_event.set()
@@ -0,0 +1,153 @@
+import logging
+
+import numpy as np
+
+from ..device_state import DeviceState
+from .icm20948 import STANDARD_GRAVITY
+from .imu_ring_buffer import ACCEL, GYRO, TIME
+
+
+class MotionDetector:
+    """
+    Classifies the device as MOVING or STATIONARY from a sliding window of IMU samples
+    For every sample, the rolling mean and variance of the gravity-compensated acceleration
+    magnitude
+    (|a| - g, independent of orientation) and of the gyro magnitude are computed over the window.
+    The device becomes STATIONARY once the strict enter thresholds have held for enter_dwell
+    seconds, and MOVING once the looser exit thresholds have been exceeded for exit_dwell seconds,
+    so noise around a single threshold does not make the state flicker
+    """
+
+    def __init__(
+        self,
+        sample_rate,
+        window=0.5,
+        enter_accel_std=0.05,
+        exit_accel_std=0.15,
+        enter_gyro=0.05,
+        exit_gyro=0.1,
+        max_accel_mean=1.5,
+        enter_dwell=1.0,
+        exit_dwell=0.1,
+    ):
+        """
+        sample_rate: IMU sample rate (Hz), sets the window length in samples
+        window: seconds of samples the statistics are computed over
+        enter_accel_std, exit_accel_std: acceleration magnitude standard deviation (m/s^2) below
+        which the device may become stationary, and above which it is moving again
+        enter_gyro, exit_gyro: mean gyro magnitude (rad/s) thresholds, the same way
+        max_accel_mean: largest mean |a| - g (m/s^2) still counted as stationary, allows for accel
+        bias
+        enter_dwell, exit_dwell: seconds a condition must hold before the state changes
+        """
+        self.window = window
+        self.window_size = max(int(round(window * sample_rate)), 2)
+        self.enter_accel_var = enter_accel_std**2
+        self.exit_accel_var = exit_accel_std**2
+        self.enter_gyro = enter_gyro
+        self.exit_gyro = exit_gyro
+        self.max_accel_mean = max_accel_mean
+        self.enter_dwell = enter_dwell
+        self.exit_dwell = exit_dwell
+
+        self.state = DeviceState.MOVING
+        self.evaluated = False  # Whether a full window has been seen, before that state is only the default
+        self.candidate_since = None  # Start time of the current run of samples meeting the switch condition
+        # Last window_size - 1 samples of the previous blocks: timestamp, |a| - g, |w|
+        self.history = np.empty((0, 3))
+        self.__logger = logging.getLogger(__name__)
+
+    def set_sample_rate(self, sample_rate):
+        """
+        Keeps the window length in seconds when the IMU rate changes. Until the window has been
+        refilled at the new rate it spans a mix of old and new samples
+        """
+        self.window_size = max(int(round(self.window * sample_rate)), 2)
+
+    def window_stats(self, block):
+        """
+        Returns the timestamps of the block and, for each sample, the rolling (accel mean, accel
+        variance, gyro mean, gyro variance) over the window ending at it. Samples before the first
+        full window are dropped
+        """
+        values = np.empty((len(block), 3))
+        values[:, 0] = block[:, TIME]
+        values[:, 1] = np.linalg.norm(block[:, ACCEL], axis=1) - STANDARD_GRAVITY
+        values[:, 2] = np.linalg.norm(block[:, GYRO], axis=1)
+        values = np.concatenate((self.history, values))
+        self.history = values[-(self.window_size - 1):]
+
+        if len(values) < self.window_size:
+            return values[:0, 0], np.empty((0, 4))
+        self.evaluated = True
+
+        # Rolling sums from cumulative sums, one window per sample once the first window is full
+        signals = values[:, 1:3]
+        zero = np.zeros((1, 2))
+        sums = np.concatenate((zero, np.cumsum(signals, axis=0)))
+        squares = np.concatenate((zero, np.cumsum(signals**2, axis=0)))
+        n = self.window_size
+        means = (sums[n:] - sums[:-n]) / n
+        variances = np.maximum((squares[n:] - squares[:-n]) / n - means**2, 0.0)
+
+        stats = np.column_stack((means[:, 0], variances[:, 0], means[:, 1], variances[:, 1]))
+        return values[n - 1:, 0], stats
+
+    def update(self, block):
+        """
+        Feeds a (n, NUM_COLUMNS) block of samples and returns the list of (timestamp, DeviceState)
+        transitions it caused, oldest first
+        """
+        times, stats = self.window_stats(block)
+        accel_mean, accel_var, gyro_mean = stats[:, 0], stats[:, 1], stats[:, 2]
+        still = (
+            (accel_var < self.enter_accel_var)
+            & (np.abs(accel_mean) < self.max_accel_mean)
+            & (gyro_mean < self.enter_gyro)
+        )
+        moving = (
+            (accel_var > self.exit_accel_var)
+            | (np.abs(accel_mean) >= self.max_accel_mean)
+            | (gyro_mean > self.exit_gyro)
+        )
+
+        transitions = []
+        start = 0
+        while start < len(times):
+            if self.state == DeviceState.STATIONARY:
+                condition, dwell, next_state = moving[start:], self.exit_dwell, DeviceState.MOVING
+            else:
+                condition, dwell, next_state = still[start:], self.enter_dwell, DeviceState.STATIONARY
+
+            switch = self.__first_dwell_met(times[start:], condition, dwell)
+            if switch is None:
+                break
+
+            start += switch
+            self.state = next_state
+            self.candidate_since = None
+            transitions.append((times[start], next_state))
+            self.__logger.info(f"Motion state {next_state.name} at {times[start]:.3f}")
+            start += 1
+        return transitions
+
+    def __first_dwell_met(self, times, condition, dwell):
+        """
+        Returns the index of the first sample at which the condition has held for dwell seconds, or
+        None. Keeps track of a run that continues into the next block
+        """
+        if len(times) == 0:
+            return None
+
+        # Index of the most recent sample, at or before each sample, where the condition was false
+        indices = np.arange(len(times))
+        last_false = np.maximum.accumulate(np.where(condition, -1, indices))
+        carried = self.candidate_since if self.candidate_since is not None else times[0]
+        run_start = np.where(last_false >= 0, times[np.minimum(last_false + 1, len(times) - 1)], carried)
+
+        met = np.flatnonzero(condition & (times - run_start >= dwell))
+        if len(met):
+            return int(met[0])
+
+        self.candidate_since = run_start[-1] if condition[-1] else None
+        return None
@@ -0,0 +1,132 @@
+import copy
+import logging
+import logging.handlers
+import multiprocessing as mp
+import os
+import sys
+import threading
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most burst records per interval seconds from each logging call site, so a message
+    logged for every frame or IMU batch is not queued, formatted and written every time
+    The next record passed from a site reports how many of its records were dropped. Records at
+    exempt_level and above always pass
+    """
+
+    def __init__(self, burst=20, interval=10.0, exempt_level=logging.ERROR):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.exempt_level = exempt_level
+        self.sites = {}  # (logger name, line number): [tokens, last refill time, dropped records]
+        self.lock = threading.Lock()
+        # A child forked while another thread held the lock would never be able to take it
+        os.register_at_fork(after_in_child=self.__reset_lock)
+
+    def __reset_lock(self):
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level or self.burst <= 0:
+            return True
+
+        key = (record.name, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [float(self.burst), record.created, 0]
+            tokens = min(self.burst, site[0] + (record.created - site[1]) * self.burst / self.interval)
+            site[1] = record.created
+            if tokens < 1.0:
+                site[0] = tokens
+                site[2] += 1
+                return False
+            site[0] = tokens - 1.0
+            dropped, site[2] = site[2], 0
+
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar messages dropped)"
+            record.args = None
+        return True
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them, the listener's handlers format them
+    The standard QueueHandler runs the whole formatter in the logging process. This one only merges
+    the arguments into the message and renders a traceback to text, as the arguments and the
+    traceback may not be picklable. Filters run before prepare(), so dropped records cost neither
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)  # Other handlers of the logging process see the original
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogService:
+    """
+    Sends the log records of every process to one listener thread in the controller process, which
+    formats and writes them. Worker processes forked after start() inherit the queue handler, so
+    logging in a worker only checks the level and rate limit, merges the message arguments and puts
+    the record on a queue
+    Levels are set per subsystem (logger name prefix) from the logging config section
+    """
+
+    def __init__(self, log_config, handlers=None):
+        """
+        log_config: logging section of the system config
+        handlers: handlers the listener writes to, a console handler if not given
+        """
+        self.config = log_config
+        if handlers is None:
+            console = logging.StreamHandler(sys.stdout)
+            console.setFormatter(logging.Formatter(log_config["format"]))
+            handlers = [console]
+        self.handlers = handlers
+        self.queue = mp.Queue()
+        self.listener = None
+        self.previous = None  # Root level and handlers restored by stop()
+
+        rate_limit = log_config["rate_limit"]
+        self.queue_handler = RecordQueueHandler(self.queue)
+        self.queue_handler.addFilter(RateLimitFilter(burst=rate_limit["burst"], interval=rate_limit["interval"]))
+
+    def start(self):
+        """
+        Routes the root logger through the queue and applies the configured levels
+        """
+        root = logging.getLogger()
+        self.previous = (root.level, list(root.handlers))
+        for handler in self.previous[1]:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.config["level"])
+        for name, level in (self.config.get("levels") or {}).items():
+            logging.getLogger(name).setLevel(level)
+
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """
+        Writes the records still queued and restores the previous root handlers
+        Call after the worker processes have exited, records they log later are lost
+        """
+        if self.listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        level, handlers = self.previous
+        root.setLevel(level)
+        for handler in handlers:
+            root.addHandler(handler)
+        self.listener.stop()
+        self.listener = None
@@ -0,0 +1,48 @@
+import os
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_process_usage(pid):
+    """
+    Reads the resident memory and CPU time of a process from /proc
+    Returns (rss bytes, user + system cpu seconds), or None if the process has exited
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            stat = file.read()
+        with open(f"/proc/{pid}/statm", "r") as file:
+            statm = file.read().split()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # Fields after the executable name, which is in brackets and may contain spaces
+    fields = stat[stat.rindex(")") + 2:].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    rss_bytes = int(statm[1]) * PAGE_SIZE
+    return rss_bytes, cpu_seconds
+
+
+def read_process_placement(pid):
+    """
+    Reads where and how a process is scheduled
+    Returns {cpus, last_cpu, nice, policy, priority}, or None if the process has exited
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            stat = file.read()
+        cpus = sorted(os.sched_getaffinity(pid))
+        policy = os.sched_getscheduler(pid)
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    fields = stat[stat.rindex(")") + 2:].split()
+    policy_names = {os.SCHED_OTHER: "other", os.SCHED_FIFO: "fifo", os.SCHED_RR: "rr"}
+    return {
+        "cpus": cpus,
+        "last_cpu": int(fields[36]),  # processor
+        "nice": int(fields[16]),
+        "policy": policy_names.get(policy, str(policy)),
+        "priority": int(fields[37]),  # rt_priority
+    }
@@ -0,0 +1,160 @@
+import bisect
+import functools
+import logging
+import multiprocessing as mp
+import os
+from dataclasses import dataclass
+
+# Worker roles with their own scheduling settings, see scheduling in config.yaml
+ROLES = ("main", "camera", "imu_manager", "imu_sensor", "imu_socket")
+POLICIES = {"other": os.SCHED_OTHER, "fifo": os.SCHED_FIFO}
+
+# Upper edges (seconds) of the wake-up lateness histogram bins, the last bin has no upper edge
+JITTER_EDGES = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+# Fields before the histogram in the JitterMeter array
+COUNT = 0
+TOTAL = 1
+MAX = 2
+NUM_FIELDS = 3
+
+
+@dataclass(frozen=True)
+class SchedulingPolicy:
+    """
+    CPU placement and priority of one worker process (or thread)
+    """
+
+    cpus: tuple = ()  # CPUs the worker may run on, empty to leave the affinity unchanged
+    nice: int = None  # Nice value (-20 to 19), None to leave it unchanged
+    policy: str = "other"  # other (time sharing) or fifo (real time, preempts every other process)
+    priority: int = 0  # SCHED_FIFO priority 1-99, ignored for other
+
+    def __post_init__(self):
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy '{self.policy}', expected one of {sorted(POLICIES)}")
+        if self.policy == "fifo" and not 1 <= self.priority <= 99:
+            raise ValueError(f"SCHED_FIFO priority must be 1-99, got {self.priority}")
+        object.__setattr__(self, "cpus", tuple(self.cpus or ()))
+
+    def is_default(self):
+        return self == SchedulingPolicy()
+
+
+def resolve_scheduling(scheduling_config):
+    """
+    Returns {role: SchedulingPolicy} for every role in ROLES from the scheduling config
+    Roles without settings, and every role when scheduling.enabled is false, keep the defaults
+    """
+    policies = {role: SchedulingPolicy() for role in ROLES}
+    if not scheduling_config.get("enabled", False):
+        return policies
+
+    for role, values in scheduling_config.items():
+        if role == "enabled":
+            continue
+        if role not in ROLES:
+            raise ValueError(f"Unknown scheduling role '{role}', expected one of {ROLES}")
+        policies[role] = SchedulingPolicy(**(values or {}))
+    return policies
+
+
+def apply_scheduling(policy, pid=0):
+    """
+    Applies a SchedulingPolicy to a process (pid 0 is the calling thread)
+    Settings the system refuses (e.g. SCHED_FIFO without CAP_SYS_NICE) are logged and skipped, the
+    worker keeps running with the remaining settings. Returns True if everything was applied
+    """
+    logger = logging.getLogger(__name__)
+    applied = True
+
+    if policy.cpus:
+        try:
+            os.sched_setaffinity(pid, set(policy.cpus))
+        except OSError as e:
+            logger.warning(f"Unable to pin {pid or os.getpid()} to CPUs {sorted(policy.cpus)}: {e}")
+            applied = False
+
+    if policy.nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, policy.nice)
+        except OSError as e:
+            logger.warning(f"Unable to set nice {policy.nice} for {pid or os.getpid()}: {e}")
+            applied = False
+
+    if policy.policy != "other":
+        try:
+            os.sched_setscheduler(pid, POLICIES[policy.policy], os.sched_param(policy.priority))
+        except OSError as e:
+            logger.warning(f"Unable to set SCHED_{policy.policy.upper()} for {pid or os.getpid()}: {e}")
+            applied = False
+
+    return applied
+
+
+def _run_scheduled(policy, target, *args, **kwargs):
+    apply_scheduling(policy)
+    return target(*args, **kwargs)
+
+
+def scheduled(policy, target):
+    """
+    Wraps the target of a new process or thread so it applies policy to itself before running
+    """
+    if policy is None or policy.is_default():
+        return target
+    return functools.partial(_run_scheduled, policy, target)
+
+
+class JitterMeter:
+    """
+    Shared histogram of how late a periodic loop wakes up compared with when it asked to
+    Written by the one process running the loop, read by any process for reports
+    """
+
+    def __init__(self):
+        self.shared_array = mp.RawArray("d", NUM_FIELDS + len(JITTER_EDGES) + 1)
+
+    def add(self, lateness):
+        """
+        Records one wake-up lateness in seconds
+        """
+        values = self.shared_array
+        lateness = max(lateness, 0.0)
+        values[NUM_FIELDS + bisect.bisect_left(JITTER_EDGES, lateness)] += 1
+        values[COUNT] += 1
+        values[TOTAL] += lateness
+        values[MAX] = max(values[MAX], lateness)
+
+    def reset(self):
+        for i in range(len(self.shared_array)):
+            self.shared_array[i] = 0.0
+
+    def percentile(self, fraction, values=None):
+        """
+        Upper edge of the bin holding the given fraction of wake-ups, capped at the max so a report
+        never shows a percentile above it. The max for the last bin
+        """
+        values = values if values is not None else self.shared_array[:]
+        target = fraction * values[COUNT]
+        seen = 0
+        for i, edge in enumerate(JITTER_EDGES):
+            seen += values[NUM_FIELDS + i]
+            if seen >= target:
+                return min(edge, values[MAX])
+        return values[MAX]
+
+    def summary(self):
+        """
+        Returns {count, mean_ms, p50_ms, p99_ms, max_ms} of the recorded wake-ups
+        """
+        values = self.shared_array[:]
+        count = int(values[COUNT])
+        if count == 0:
+            return {"count": 0}
+        return {
+            "count": count,
+            "mean_ms": 1e3 * values[TOTAL] / count,
+            "p50_ms": 1e3 * self.percentile(0.5, values),
+            "p99_ms": 1e3 * self.percentile(0.99, values),
+            "max_ms": 1e3 * values[MAX],
+        }
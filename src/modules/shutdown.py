@@ -0,0 +1,94 @@
+import errno
+import functools
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+# Connect errors that mean the connection is still being set up
+CONNECT_PENDING = (errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK)
+
+
+def stop_processes(processes, deadline, kill_timeout=1.0):
+    """
+    Waits for processes that were already told to stop until deadline (a time.monotonic() time),
+    then terminates every one still alive at once, and kills those still alive kill_timeout later
+    The waits overlap, so stopping N processes takes at most deadline + 2 * kill_timeout, not N
+    times it
+    Returns the names of the processes that had to be terminated
+    """
+    logger = logging.getLogger(__name__)
+    # Cameras in thread mode share one process, and processes that never started have no pid
+    processes = list({id(process): process for process in processes if process is not None and process.pid}.values())
+
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0.0))
+
+    stuck = [process for process in processes if process.is_alive()]
+    escalated = [process.name for process in stuck]
+    for action in ("terminate", "kill"):
+        if not stuck:
+            break
+        logger.warning(f"{[process.name for process in stuck]} still running after the shutdown deadline, {action}")
+        for process in stuck:
+            getattr(process, action)()
+        end = time.monotonic() + kill_timeout
+        for process in stuck:
+            process.join(max(end - time.monotonic(), 0.0))
+        stuck = [process for process in stuck if process.is_alive()]
+
+    for process in stuck:
+        logger.error(f"{process.name} ({process.pid}) did not exit after being killed")
+    return escalated
+
+
+def _exit_on_sigterm(signum, frame):
+    sys.exit(128 + signum)
+
+
+def _run_graceful(target, *args, **kwargs):
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    return target(*args, **kwargs)
+
+
+def graceful(target):
+    """
+    Wraps the target of a new process so terminate() raises SystemExit in it instead of ending it
+    on the spot, so its finally blocks still release the camera, I2C bus and sockets
+    A process blocked in a system call only handles the signal once the call returns, stop_processes
+    kills it if that takes longer than kill_timeout
+    """
+    return functools.partial(_run_graceful, target)
+
+
+def connect_until_stopped(sock, address, stop_event, timeout, poll_interval=0.1):
+    """
+    sock.connect(address) that gives up as soon as stop_event is set, instead of blocking shutdown
+    for up to timeout seconds
+    Returns True once connected, False if stopped first. Raises socket.timeout after timeout
+    seconds, or the OSError of a refused or failed connection (the socket must then be replaced to
+    retry)
+    """
+    previous_timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        error = sock.connect_ex(address)
+        end = time.monotonic() + timeout
+        while error in CONNECT_PENDING:
+            if stop_event.is_set():
+                return False
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout(f"Connection to {address} timed out")
+            _, writable, _ = select.select([], [sock], [], min(poll_interval, remaining))
+            if writable:
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+        if error:
+            raise OSError(error, os.strerror(error))  # Raised as the matching subclass, e.g. ConnectionRefusedError
+        return True
+    finally:
+        sock.settimeout(previous_timeout)
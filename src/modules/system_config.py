@@ -0,0 +1,139 @@
+import copy
+import logging
+import os
+
+import yaml
+
+CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "config.yaml"))
+
+# Fallback values used for any section or key missing from the config file
+DEFAULT_CONFIG = {
+    "hal": {
+        "camera": {
+            "backend": "v4l2",
+            "count": 2,
+            "synthetic": {"pattern": "bars"},
+            "file": {"path": "", "loop": True},
+        },
+        "imu": {"backend": "icm20948", "synthetic": {"still_seconds": 5.0, "moving_seconds": 3.0}},
+        "gpio": {"backend": "rpi", "memory": {"auto_press": {17: 2.0}}},
+        "clock": "real",
+    },
+    "button": {"debounce": 0.02},
+    "logging": {
+        "level": "INFO",
+        "format": "%(asctime)s %(levelname)s [%(processName)s %(filename)s:%(lineno)d] %(message)s",
+        "levels": {},
+        "rate_limit": {"burst": 20, "interval": 10.0},
+    },
+    "network": {
+        "server_host": "192.168.194.241",
+        "camera_base_port": 5000,
+        "imu_host": "192.168.194.44",
+        "imu_port": 6000,
+        "crc": True,
+    },
+    "control": {"enabled": False, "host": "127.0.0.1", "port": 7000},
+    "camera": {
+        "max_cameras": 4,
+        "capture_mode": "process",
+        "start_paused": False,
+        "default_profile": "default",
+        "encoders": {
+            "jpeg": {"backend": "jpeg"},
+        },
+        "profiles": {
+            "default": {"fps": 2.0, "width": 320, "height": 240, "quality": 90},
+        },
+        "devices": {},
+        "state_profiles": {},
+    },
+    "imu": {
+        "ring_capacity": 16384,
+        "calibration_file": "imu_calibration.yaml",
+        "sensor": {
+            "i2c_bus": 1,
+            "address": 0x69,
+            "sample_rate": 1125.0,
+            "accel_range": 4,
+            "gyro_range": 500,
+            "mag_rate": 100,
+            "poll_interval": 0.01,
+        },
+        "state_rates": {"STATIONARY": {"sample_rate": 56.25, "poll_interval": 0.25}},
+        "usage_report_interval": 60.0,
+        "motion": {
+            "window": 0.5,
+            "enter_accel_std": 0.05,
+            "exit_accel_std": 0.15,
+            "enter_gyro": 0.05,
+            "exit_gyro": 0.1,
+            "max_accel_mean": 1.5,
+            "enter_dwell": 1.0,
+            "exit_dwell": 0.1,
+        },
+        "ahrs": {"enabled": True, "beta": 0.1, "use_mag": True},
+        "uplink": {"send_mode": "binary", "batch_size": 25, "max_batch_age": 0.2},
+    },
+    "scheduling": {"enabled": False},
+    "shutdown": {"timeout": 2.0, "kill_timeout": 1.0},
+    "governor": {
+        "enabled": False,
+        "interval": 2.0,
+        "sysfs_root": "/",
+        "soft_temp": 70.0,
+        "hard_temp": 78.0,
+        "restore_margin": 5.0,
+        "max_cpu_usage": 0.9,
+        "restore_cpu_usage": 0.7,
+        "hold": 10.0,
+        "steps": [{"max_quality": 70}, {"fps_scale": 0.5}, {"resolution_scale": 0.5}],
+    },
+    "bandwidth": {
+        "enabled": False,
+        "total_mbps": 40.0,
+        "burst_seconds": 1.0,
+        "imu": {"priority": 2, "weight": 1.0},
+        "camera": {"priority": 1, "weight": 1.0},
+        "devices": {},
+    },
+}
+
+
+def _merge(defaults, overrides):
+    """
+    Recursively merges the overrides dict on top of a copy of the defaults dict
+    """
+    merged = copy.deepcopy(defaults)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path=CONFIG_PATH):
+    """
+    Reads the yaml config file and fills in missing values from DEFAULT_CONFIG
+    If the file does not exist, logs a warning and returns the defaults
+    """
+    logger = logging.getLogger(__name__)
+
+    try:
+        with open(path, "r") as file:
+            config = yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        logger.warning(f"Config file {path} not found, using default settings")
+        config = {}
+
+    logger.info(f"Loaded config from {path}")
+    return _merge(DEFAULT_CONFIG, config)
+
+
+def resolve_path(path, config_path=CONFIG_PATH):
+    """
+    Returns a path from the config as an absolute path, relative paths are relative to the config
+    file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), os.path.expanduser(path))
@@ -0,0 +1,88 @@
+import logging
+import multiprocessing as mp
+import time
+
+from ..device_state import DeviceState
+
+
+class DeviceStateMachine:
+    """
+    Device state shared by all processes
+    Transitions are checked against ALLOWED_TRANSITIONS and wake every subscriber through a shared
+    condition, so subscribers block until something changes instead of polling
+    """
+
+    ALLOWED_TRANSITIONS = {
+        DeviceState.DISARMED: {DeviceState.ARMED},
+        DeviceState.ARMED: {DeviceState.DISARMED, DeviceState.MOVING, DeviceState.STATIONARY},
+        DeviceState.MOVING: {DeviceState.DISARMED, DeviceState.STATIONARY},
+        DeviceState.STATIONARY: {DeviceState.DISARMED, DeviceState.MOVING},
+    }
+
+    def __init__(self, initial_state=DeviceState.DISARMED):
+        # Guards the fields below, which are only written with the condition held
+        self.condition = mp.Condition()
+        self.state_value = mp.RawValue("B", initial_state.value)
+        self.version = mp.RawValue("Q", 0)  # Number of transitions so far
+        self.changed_at = mp.RawValue("d", time.time())  # time.time() of the last transition
+        self.__logger = logging.getLogger(__name__)
+
+    @property
+    def state(self):
+        return DeviceState(self.state_value.value)
+
+    def transition(self, new_state, source=""):
+        """
+        Moves to new_state if it is allowed from the current state and wakes the subscribers
+        Returns True if the state changed. Can be called from any process
+        """
+        with self.condition:
+            current = DeviceState(self.state_value.value)
+            if new_state == current:
+                return False
+            if new_state not in self.ALLOWED_TRANSITIONS[current]:
+                self.__logger.debug(f"Ignoring {current.name} -> {new_state.name} from {source or 'unknown'}")
+                return False
+
+            self.state_value.value = new_state.value
+            self.changed_at.value = time.time()
+            self.version.value += 1
+            self.condition.notify_all()
+
+        self.__logger.info(f"Device state {current.name} -> {new_state.name} ({source or 'unknown'})")
+        return True
+
+    def subscribe(self):
+        """
+        Returns a StateSubscription that reports transitions made after this call
+        """
+        return StateSubscription(self)
+
+
+class StateSubscription:
+    """
+    One subscriber's view of a DeviceStateMachine
+    If several transitions happen before the subscriber wakes up, it only sees the latest state
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.version = machine.version.value
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the state changes or timeout seconds pass
+        Returns the new DeviceState, or None on timeout
+        """
+        machine = self.machine
+        with machine.condition:
+            if not machine.condition.wait_for(lambda: machine.version.value != self.version, timeout):
+                return None
+            self.version = machine.version.value
+            return DeviceState(machine.state_value.value)
+
+    def latency(self):
+        """
+        Seconds since the last transition, right after wait() returns this is the wake-up latency
+        """
+        return time.time() - self.machine.changed_at.value
@@ -1,10 +1,27 @@
 import multiprocessing as mp
+import os
+import threading
 import time
+
+import yaml
+
 from ..camera_transmitter.camera_device_manager import CameraDeviceManager
 from ..imu.imu_manager import IMUManager
 from ..imu.imu_shared_data import IMUSharedData
+from ..imu.imu_ring_buffer import IMURingBuffer
+from ..imu.imu_pose import IMUPoseSampler
+from ..bandwidth_allocator import BandwidthAllocator
+from ..clock import create_clock
+from ..control import control_protocol as control
+from ..control.control_server import ControlServer
+from ..governor.performance_governor import PerformanceGovernor
+from ..governor.system_sensors import SystemSensors
+from ..process_stats import read_process_placement
+from ..scheduling import apply_scheduling, resolve_scheduling
+from ..shutdown import stop_processes
+from ..system_config import CONFIG_PATH, load_config, resolve_path
+from .device_state_machine import DeviceStateMachine
 import logging
-from collections import deque
 
 from ..device_state import DeviceState
 
@@ -12,33 +29,143 @@ class SystemController:
     """
     Controls all subsystems including stop events and initialization
     """
+    STATE_WAIT_TIMEOUT = 5.0  # Seconds state subscribers sleep before rechecking the stop event
 
-    def __init__(self):
+    def __init__(self, config_path=CONFIG_PATH, config=None, clock=None):
+        """
+        config: system config dict (see system_config.load_config), loaded from config_path if not
+        given
+        clock: Clock shared by every worker, created from hal.clock if not given
+        """
         self.__logger = logging.getLogger(__name__)
         self.stop_event = mp.Event()
 
+        self.config_path = config_path
+        self.config = config if config is not None else load_config(config_path)
+        # Created before any worker process so a VirtualClock is shared by all of them
+        self.clock = clock if clock is not None else create_clock(self.config["hal"]["clock"])
+        # CPU placement and priority per worker role, applied by each process as it starts
+        self.scheduling = resolve_scheduling(self.config["scheduling"])
+
+        # Device state shared with the IMU process, which reports motion transitions to it
+        self.state_machine = DeviceStateMachine()
+
         # Initialize imu data and setup shared memory
-        self.imu_shared_array = mp.Array("d", 9)
-        self.imu_data = IMUSharedData(self.imu_shared_array)
+        self.imu_data = IMUSharedData()
+        # Timestamped history of every IMU sample, read with per-consumer cursors
+        self.imu_ring = IMURingBuffer(capacity=self.config["imu"]["ring_capacity"])
+
+        # Shared uplink budget, one stream slot for the IMU and one per camera
+        self.bandwidth = None
+        imu_stream = None
+        bandwidth_config = self.config["bandwidth"]
+        if bandwidth_config["enabled"]:
+            self.bandwidth = BandwidthAllocator(
+                total_rate=bandwidth_config["total_mbps"] * 1e6 / 8,
+                max_streams=1 + self.config["camera"]["max_cameras"],
+                burst_seconds=bandwidth_config["burst_seconds"],
+                clock=self.clock.monotonic,
+            )
+            imu_stream = self.bandwidth.add_stream("imu", **bandwidth_config["imu"])
 
         # Create controller for subsystems
-        self.camera_controller = CameraDeviceManager(stop_event=self.stop_event)
-        self.imu_controller = IMUManager(stop_event=self.stop_event, imu_data=self.imu_data)
-        
-        self.stationary_window = deque(maxlen=5) # Buffer to make sure IMU state is stationary
-        # self.device_state = "MOVING"
-        self.device_state = DeviceState.MOVING
+        # Camera frames are tagged with the IMU orientation and rate interpolated at their capture
+        # time
+        imu_pose = IMUPoseSampler(
+            self.imu_ring, self.imu_data, sample_rate=self.config["imu"]["sensor"]["sample_rate"]
+        )
+        self.camera_controller = CameraDeviceManager(
+            stop_event=self.stop_event, config=self.config, bandwidth=self.bandwidth, imu_pose=imu_pose,
+            clock=self.clock,
+            scheduling=self.scheduling["camera"],
+        )
+        self.imu_controller = IMUManager(
+            stop_event=self.stop_event,
+            imu_data=self.imu_data,
+            host=self.config["network"]["imu_host"],
+            port=self.config["network"]["imu_port"],
+            bandwidth=self.bandwidth,
+            bandwidth_stream=imu_stream,
+            sample_ring=self.imu_ring,
+            uplink_config=self.config["imu"]["uplink"],
+            crc=self.config["network"]["crc"],
+            sensor_config=self.config["imu"]["sensor"],
+            motion_config=self.config["imu"]["motion"],
+            ahrs_config=self.config["imu"]["ahrs"],
+            calibration_path=resolve_path(self.config["imu"]["calibration_file"], config_path),
+            state_rates=self.config["imu"]["state_rates"],
+            usage_report_interval=self.config["imu"]["usage_report_interval"],
+            hal_config=self.config["hal"]["imu"],
+            clock=self.clock,
+            scheduling=self.scheduling,
+            state_machine=self.state_machine,
+            shutdown_config=self.config["shutdown"],
+        )
+
+        # Lowers the camera streams when the SoC runs hot or the CPUs are saturated
+        self.governor = None
+        governor_config = self.config["governor"]
+        if governor_config["enabled"]:
+            self.governor = PerformanceGovernor.from_config(
+                SystemSensors(governor_config["sysfs_root"]), self.camera_controller.set_limit, governor_config,
+                clock=self.clock,
+            )
 
         self.imu_process = None
+        self.governor_thread = None
+        self.state_thread = None  # Forwards state changes to the camera workers
+        self.control_server = None  # Base station control channel, see start_control_server
 
     def start(self):
         """
-        Start all subsystems (IMU, camera)
+        Start all subsystems (IMU, camera), also after stop() to re-arm
         """
         self.__logger.info("\nStarting IMU and camera workers")
+        self.stop_event.clear()
+        apply_scheduling(self.scheduling["main"])
         self.imu_controller.start_imu_worker(self.imu_data)
         self.camera_controller.start_camera_workers()
 
+        self.state_thread = threading.Thread(
+            target=self.__forward_state_changes, args=(self.subscribe(),), name="State-Dispatch", daemon=True
+        )
+        self.state_thread.start()
+
+        if self.governor is not None:
+            self.governor_thread = threading.Thread(
+                target=self.clock.participant(self.governor.run),
+                args=(self.stop_event, self.config["governor"]["interval"]),
+                name="Governor",
+                daemon=True,
+            )
+            self.governor_thread.start()
+
+    @property
+    def device_state(self):
+        return self.state_machine.state
+
+    def subscribe(self):
+        """
+        Returns a StateSubscription whose wait() blocks until the device state changes
+        """
+        return self.state_machine.subscribe()
+
+    def arm(self):
+        return self.state_machine.transition(DeviceState.ARMED, source="arming button")
+
+    def disarm(self):
+        return self.state_machine.transition(DeviceState.DISARMED, source="disarm")
+
+    def __forward_state_changes(self, subscription):
+        """
+        Pushes the stream profile for each new device state to the camera workers
+        """
+        self.camera_controller.set_device_state(self.device_state)
+        while not self.stop_event.is_set():
+            state = subscription.wait(timeout=self.STATE_WAIT_TIMEOUT)
+            if state is not None and not self.stop_event.is_set():
+                self.camera_controller.set_device_state(state)
+
     # TODO: IMU should also create socket and transmit IMU readings to terminal
     def get_imu_reading(self):
         """
@@ -47,6 +174,34 @@ class SystemController:
         # see when imu starts and stops moving --> change state to stream lidar data
         return self.imu_data.get()
 
+    def reload_config(self):
+        """
+        Re-reads the config file and pushes updated camera profiles to the running workers
+        """
+        self.__logger.info(f"Reloading config from {self.config_path}")
+        try:
+            config = load_config(self.config_path)
+            self.camera_controller.apply_config(config)
+        except (OSError, ValueError, TypeError, yaml.YAMLError) as e:
+            self.__logger.error(f"Unable to reload config, keeping current settings: {e}")
+            return
+        self.config = config
+
+    def get_metrics(self):
+        """
+        Returns a dict of runtime metrics from all subsystems
+        """
+        metrics = {
+            "camera": self.camera_controller.get_metrics(),
+            "imu": self.imu_controller.get_metrics(),
+            "main": read_process_placement(os.getpid()),
+        }
+        if self.bandwidth is not None:
+            metrics["bandwidth"] = self.bandwidth.get_metrics()
+        if self.governor is not None:
+            metrics["governor"] = self.governor.get_metrics()
+        return metrics
+
     def is_running(self):
         """
         Checks and returns if all systems are still running
@@ -57,50 +212,85 @@ class SystemController:
 
     def stop(self):
         """
-        Stops all subsystem processes if event triggered
+        Stops all subsystem processes within shutdown.timeout seconds, plus up to two kill_timeouts
+        for processes that have to be terminated and killed
         """
-        self.stop_event.set()
+        shutdown = self.config["shutdown"]
+        deadline = time.monotonic() + shutdown["timeout"]
 
-        # Stop all camera workers
-        self.__logger.debug("Stopping camera workers")
-        self.camera_controller.stop_workers()
+        # Every worker is told to stop before waiting for any of them, so they flush and exit in
+        # parallel
+        self.stop_event.set()
+        processes = self.camera_controller.signal_stop() + self.imu_controller.signal_stop()
+        self.disarm()  # Also wakes the state subscribers so they see the stop event
 
-        self.__logger.debug("Stopping IMU process")
-        self.imu_controller.stop_workers()
+        self.__logger.debug("Stopping camera and IMU workers")
+        stop_processes(processes, deadline, shutdown["kill_timeout"])
+        # Every process has exited, these only release the manager resources
+        self.camera_controller.stop_workers(deadline)
+        self.imu_controller.stop_workers(deadline)
 
+        for thread in (self.state_thread, self.governor_thread):
+            if thread is not None:
+                thread.join(timeout=1.0)
+        self.state_thread = self.governor_thread = None
         self.__logger.debug("All processes terminated")
 
+    def start_control_server(self, port=None):
+        """
+        Serves base station requests (see control_protocol.py) on control.port, or port if given
+        Runs until stop_control_server, across arming and disarming. Returns the port
+        """
+        control_config = self.config["control"]
+        handlers = {
+            control.STATUS: lambda camera, params: {
+                "version": control.PROTOCOL_VERSION,
+                "state": self.device_state.name,
+                "running": self.is_running(),
+                "cameras": self.camera_controller.get_cameras(),
+            },
+            control.METRICS: lambda camera, params: self.get_metrics(),
+            control.ARM: lambda camera, params: {"changed": self.arm()},
+            control.DISARM: lambda camera, params: {"changed": self.disarm()},
+            control.SET_STREAM: lambda camera, params: self.camera_controller.set_stream_params(camera, **params),
+            control.SNAPSHOT: lambda camera, params: self.camera_controller.snapshot(camera, **params),
+            control.PAUSE: lambda camera, params: self.camera_controller.pause(camera),
+            control.RESUME: lambda camera, params: self.camera_controller.resume(camera),
+        }
+        self.control_server = ControlServer(
+            handlers, host=control_config["host"], port=control_config["port"] if port is None else port
+        )
+        self.control_server.start()
+        return self.control_server.port
+
+    def stop_control_server(self):
+        if self.control_server is not None:
+            self.control_server.stop()
+            self.control_server = None
+
     def monitor_system_status(self):
         """
-        Loop to detect if device is stationary
+        Blocks until the system stops, logging device state changes as the IMU reports them
         """
         self.__logger.info("Monitoring system")
+        subscription = self.subscribe()
 
         try:
             while not self.stop_event.is_set():
-                is_stationary = self.imu_data.is_stationary()
-                self.stationary_window.append(is_stationary)
-
-                # Checks that all entries in the specified window is stationary to confirm state change
-                if all(self.stationary_window) and self.device_state != DeviceState.STATIONARY:
-                    self.device_state = DeviceState.STATIONARY
+                state = subscription.wait(timeout=self.STATE_WAIT_TIMEOUT)
+                if state == DeviceState.STATIONARY:
                     self.__logger.info("Device STATIONARY --> triggering state change, starting mapping")
-
-                # Checks that all entries in the specified window is moving to confirm state change
-                elif not all(self.stationary_window) and self.device_state != DeviceState.MOVING:
-                    self.device_state = DeviceState.MOVING
+                elif state == DeviceState.MOVING:
                     self.__logger.info("Motion detected --> resetting state")
 
-                time.sleep(0.5)
-
         except KeyboardInterrupt:
             self.__logger.warning("System loop interrupted by user")
         finally:
             self.stop()
 
     def update_state_from_imu(self, is_stationary):
-        if self.device_state in [DeviceState.ARMED, DeviceState.MOVING, DeviceState.STATIONARY]:
-            if is_stationary and self.device_state != DeviceState.STATIONARY:
-                self.set_state(DeviceState.STATIONARY)
-            elif not is_stationary and self.device_state != DeviceState.MOVING:
-                self.set_state(DeviceState.MOVING)
+        """
+        Applies a motion reading, ignored unless the device is armed
+        """
+        new_state = DeviceState.STATIONARY if is_stationary else DeviceState.MOVING
+        return self.state_machine.transition(new_state, source="imu")
@@ -0,0 +1,208 @@
+import logging
+import struct
+import zlib
+from collections import namedtuple
+
+# Framing shared by the camera and IMU streams to the base station. Every frame is a fixed header
+# followed by the payload. Big endian (network endianess): magic, uint8 protocol version, uint8
+# stream type, uint8 flags, uint32 sequence number (per stream, +1 for every frame sent, wraps at
+# 2**32), float64 capture timestamp (epoch seconds), uint32 payload length, uint32 CRC-32
+# With FLAG_CRC the CRC covers the header fields before it and the payload, otherwise it is zero.
+# The payload starts with the header of its stream (camera_worker.CAMERA_HEADER,
+# imu_uplink.BATCH_HEADER)
+MAGIC = b"AR"
+PROTOCOL_VERSION = 3  # 1 and 2 were the IMU batch schemas before the camera and IMU framing were shared
+FRAME_HEADER = struct.Struct(">2sBBBIdII")
+CRC = struct.Struct(">I")
+CRC_OFFSET = FRAME_HEADER.size - CRC.size
+MAX_PAYLOAD_SIZE = 64 << 20  # Longer lengths are treated as corruption
+
+# Stream types
+STREAM_CAMERA = 1
+STREAM_IMU = 2
+
+# Flags
+FLAG_CRC = 0x01
+
+Frame = namedtuple("Frame", ["stream_type", "sequence", "timestamp", "flags", "payload"])
+
+
+def pack_header_into(buffer, stream_type, sequence, timestamp, length, crc_parts=None):
+    """
+    Packs a frame header into the start of buffer, for a payload of length bytes
+    crc_parts: the payload as a sequence of buffers to compute the CRC over, None to send without
+    CRC
+    """
+    flags = 0 if crc_parts is None else FLAG_CRC
+    FRAME_HEADER.pack_into(
+        buffer, 0, MAGIC, PROTOCOL_VERSION, stream_type, flags, sequence & 0xFFFFFFFF, timestamp, length, 0
+    )
+    if crc_parts is not None:
+        crc = zlib.crc32(memoryview(buffer)[:CRC_OFFSET])
+        for part in crc_parts:
+            crc = zlib.crc32(part, crc)
+        CRC.pack_into(buffer, CRC_OFFSET, crc)
+
+
+def encode_frame(stream_type, sequence, timestamp, payload, crc=False):
+    """
+    Returns one frame (bytes) holding payload
+    """
+    header = bytearray(FRAME_HEADER.size)
+    pack_header_into(header, stream_type, sequence, timestamp, len(payload), (payload,) if crc else None)
+    return bytes(header) + payload
+
+
+def sendmsg_all(sock, buffers):
+    """
+    Sends the buffers in order with scatter-gather sendmsg, without joining them into a new bytes
+    object first. Like sendall, the rest is sent again after a partial send
+    Returns the number of bytes sent
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    total = sum(len(view) for view in views)
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if views:
+            views[0] = views[0][sent:]
+    return total
+
+
+class FrameWriter:
+    """
+    Frames the payloads of one stream, numbering them in the order they are packed
+    The frame header and the stream's own payload header are packed into one reused buffer, which is
+    sent before the data with sendmsg_all, so framing allocates nothing and never copies the data
+    """
+
+    def __init__(self, stream_type, payload_header=None, crc=False):
+        """
+        payload_header: struct.Struct of the header that starts each payload, None if there is none
+        crc: send a CRC of each frame
+        """
+        self.stream_type = stream_type
+        self.payload_header = payload_header
+        self.crc = crc
+        self.sequence = 0  # Sequence number of the next frame
+        self.buffer = bytearray(FRAME_HEADER.size + (payload_header.size if payload_header else 0))
+        self.fields = memoryview(self.buffer)[FRAME_HEADER.size:]
+
+    def pack(self, timestamp, data, *fields):
+        """
+        Packs the headers of the frame holding the payload header fields followed by data
+        Returns the buffer to send before data, it is overwritten by the next call
+        """
+        if self.payload_header is not None:
+            self.payload_header.pack_into(self.buffer, FRAME_HEADER.size, *fields)
+        length = len(self.fields) + len(data)
+        pack_header_into(
+            self.buffer, self.stream_type, self.sequence, timestamp, length, (self.fields, data) if self.crc else None
+        )
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return self.buffer
+
+
+class FrameParser:
+    """
+    Splits a received byte stream into frames, for the base station side and tests
+    Data is received into one reused buffer and each frame's payload is a memoryview into it, valid
+    until the next recv_into() or until feed() copies in more data, so use each frame before taking
+    the next one. Corrupt frames (bad magic, version, length or CRC) are skipped up to the next
+    magic, and missing sequence numbers are counted as dropped frames
+    """
+
+    def __init__(self, buffer_size=1 << 20, verify_crc=True, max_payload_size=MAX_PAYLOAD_SIZE):
+        self.buffer = bytearray(buffer_size)  # Grown if a frame does not fit
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not parsed yet
+        self.end = 0  # End of the received data
+        self.verify_crc = verify_crc
+        self.max_payload_size = max_payload_size
+        self.next_sequence = {}  # Stream type: sequence number expected next
+        self.frames = 0
+        self.dropped = 0  # Frames missing from the sequence numbers
+        self.errors = 0  # Corrupt or unsupported frames skipped
+        self.skipped_bytes = 0
+        self.__logger = logging.getLogger(__name__)
+
+    def recv_into(self, sock):
+        """
+        Receives from the socket into the free end of the buffer
+        Returns the number of bytes received, 0 once the peer has closed the connection
+        """
+        self.__make_room()
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        """
+        Copies in data that was received as bytes, and yields the frames completed by it
+        """
+        data = memoryview(data).cast("B")
+        while len(data):
+            self.__make_room()
+            count = min(len(data), len(self.buffer) - self.end)
+            self.view[self.end:self.end + count] = data[:count]
+            self.end += count
+            data = data[count:]
+            yield from self.parse()
+
+    def parse(self):
+        """
+        Yields the complete frames in the buffer as Frames
+        """
+        while self.end - self.start >= FRAME_HEADER.size:
+            magic, version, stream_type, flags, sequence, timestamp, length, crc = FRAME_HEADER.unpack_from(
+                self.buffer, self.start
+            )
+            if magic != MAGIC or version != PROTOCOL_VERSION or length > self.max_payload_size:
+                self.__skip(f"bad header (magic {magic!r}, version {version}, length {length})")
+                continue
+
+            payload_start = self.start + FRAME_HEADER.size
+            payload_end = payload_start + length
+            if payload_end > self.end:
+                return
+            payload = self.view[payload_start:payload_end]
+            if flags & FLAG_CRC and self.verify_crc:
+                if zlib.crc32(payload, zlib.crc32(self.view[self.start:self.start + CRC_OFFSET])) != crc:
+                    self.__skip(f"CRC mismatch in frame {sequence} of stream {stream_type}")
+                    continue
+            self.start = payload_end
+
+            expected = self.next_sequence.get(stream_type)
+            if expected is not None:
+                gap = (sequence - expected) & 0xFFFFFFFF
+                if gap < 0x80000000:  # Otherwise the sender restarted its count
+                    self.dropped += gap
+            self.next_sequence[stream_type] = (sequence + 1) & 0xFFFFFFFF
+            self.frames += 1
+            yield Frame(stream_type, sequence, timestamp, flags, payload)
+
+    def __skip(self, reason):
+        """
+        Skips a corrupt frame by searching for the next magic after its start
+        """
+        self.errors += 1
+        position = self.buffer.find(MAGIC, self.start + 1, self.end)
+        if position < 0:
+            position = max(self.start + 1, self.end - len(MAGIC) + 1)  # The tail may be the start of a magic
+        self.__logger.warning("Skipped %d bytes of the stream: %s", position - self.start, reason)
+        self.skipped_bytes += position - self.start
+        self.start = position
+
+    def __make_room(self):
+        """
+        Moves the unparsed bytes to the start of the buffer, and grows it if they fill it
+        """
+        remaining = self.end - self.start
+        if self.start:
+            self.view[:remaining] = self.view[self.start:self.end]
+            self.start, self.end = 0, remaining
+        if self.end == len(self.buffer):
+            buffer = bytearray(2 * len(self.buffer))
+            buffer[:remaining] = self.view[:remaining]
+            self.buffer, self.view = buffer, memoryview(buffer)
@@ -1,6 +1,5 @@
 """
-Instantiates SystemController to read IMU data, capture mutliple camera device data
-Transmits over TCP socket connections
+Runs the arming button service on the Pi: each press arms or disarms, the LED shows the state
 """
 
 import logging
@@ -12,7 +11,9 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from modules.arming_button.button import ArmingButton
+from modules.arming_button.button_service import ButtonService
 from modules.device_state import DeviceState
+from modules.system_controller.device_state_machine import DeviceStateMachine
 
 
 if __name__ == "__main__":
@@ -22,33 +23,25 @@ if __name__ == "__main__":
     logging.info("Main starting")
 
     arming_btn = ArmingButton()
+    state_machine = DeviceStateMachine()
+    button_service = ButtonService(arming_btn, state_machine)
+    state_changes = state_machine.subscribe()
+    button_service.start()
 
-    arming_btn.update_state(DeviceState.DISARMED)
     try:
         while True:
-            arming_btn.wait_for_press_2()  # Wait for button press before starting sensors
-            
-            # # time.sleep(2)
-            # logging.info("Setting led to blue") 
-            
-            # # Once the button is pressed, update the state and start subsystems
-            # logging.info("Arming button pressed, system armed")
-            # arming_btn.update_state(DeviceState.ARMED)
-            
-            input("Press Enter when ready to test again...")
-            logging.info("Setting led to blue...")
-            arming_btn.update_state(DeviceState.STATIONARY)
-            
-            # Poll IMU to check if it reports stationary state
-            # if arming_btn.state != DeviceState.STATIONARY and controller.imu_data.is_stationary():
-            #     # Set colour to blue when IMU is stationary, trigger mapping
-            #     arming_btn.update_state(DeviceState.STATIONARY)
-            #     logging.info("Device is stationary")
-            # time.sleep(1)
+            # Each press arms or disarms, the LED follows
+            state = state_changes.wait()
+            logging.info(f"Device is {state.name} ({1e3 * state_changes.latency():.1f} ms after the transition)")
+
+            if state == DeviceState.ARMED:
+                input("Press Enter to set the LED to blue...")
+                state_machine.transition(DeviceState.STATIONARY, source="button test")
 
     except KeyboardInterrupt:
         logging.info("Process interrupted by user")
     finally:
-        logging.debug("Stopping all subsystem workers")
+        logging.debug("Stopping button service")
+        button_service.stop()
         arming_btn.cleanup()
         logging.debug("All processes stopped")
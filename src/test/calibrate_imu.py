@@ -1,143 +1,133 @@
 """
-Tests I2C connection and help calibrate IMU values for setup
+Calibrates the IMU and writes the calibration file the IMU worker loads at startup
+Averages many samples in each of the six accelerometer poses (bias, scale and axis misalignment),
+takes the gyro bias from the same still samples, and fits the magnetometer hard and soft iron
+ellipsoid while the device is rotated by hand
 """
 import os
 import sys
 
+import argparse
 import logging
-import multiprocessing as mp
 import time
 
-# IMU library imports
-import adafruit_icm20x
-import board
-import busio
+import numpy as np
 
 # Add parent directory of "modules" to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from modules.imu.imu_shared_data import IMUSharedData
-from modules.imu.imu_manager import IMUManager
-
-# Setup I2C connection
-i2c = board.I2C()  # uses board.SCL and board.SDA
-logging.info("Setup i2c board clock and data")
-try:
-    imu = adafruit_icm20x.ICM20948(i2c, address=0x69)
-    logging.debug("IMU initialized")
-except ValueError as e:
-    logging.error(f"No I2C device found at the given address: {e}")
-    
-def test_imu_connection(accel_offsets):
-    while True:
-        accel_x, accel_y, accel_z = imu.acceleration
-        corrected_accel = apply_accel_calibration(accel_x, accel_y, accel_z, accel_offsets)
+from modules.imu.icm20948 import ICM20948, SMBusI2C
+from modules.imu.imu_calibration import ACCEL_POSES, IMUCalibration, fit_calibration
+from modules.imu.imu_ring_buffer import ACCEL, GYRO, MAG
+from modules.system_config import CONFIG_PATH, load_config, resolve_path
 
-        # print the calibrarted acceleration values
-        logging.info("Acceleration: X:{:.2f}, Y: {:.2f}, Z: {:.2f} m/s^2".format(*corrected_accel))
-        logging.info("Gyro X:{:.2f}, Y: {:.2f}, Z: {:.2f} rads/s".format(*imu.gyro))
-        logging.info("Magnetometer X:{:.2f}, Y: {:.2f}, Z: {:.2f} uT\n".format(*imu.magnetic))
-        time.sleep(0.5)
+SETTLE_TIME = 1.0  # Seconds ignored after each pose is confirmed, while the device stops moving
+STILL_ACCEL_STD = 0.2  # m/s^2, pose samples noisier than this are retaken
 
 
-def get_accel_reading_for_orientation(orientation, accel_data):
-    """
-    Gets accelerometer readings for different orientations and store data for offset calculations
-    Prompts user to place IMU in specified orientations
-    """
-    logging.info(f"Place IMU in {orientation} orientation.")
-    time.sleep(2)  # Wait for the device to be placed in orientation
-    
-    # Read accelerometer values for the current orientation
-    accel_x, accel_y, accel_z = imu.acceleration
-    
-    # Store the accelerometer data for the current orientation
-    accel_data[orientation] = (accel_x, accel_y, accel_z)
-    
-    # Print the accelerometer readings
-    logging.info(f"Acc. readings ({orientation}): X:{accel_x}, Y:{accel_y}, Z:{accel_z}\n")
-
-
-def calibrate_accelerometer():
+def collect(sensor, seconds, poll_interval):
     """
-    Calibrate accelerometer by placing IMU in different orientations
-    Returns calibration offsets for X, Y, Z axes
+    Returns every sample read over the given number of seconds as one (n, NUM_COLUMNS) block
     """
-    logging.info("Calibrate accelerometer by placing IMU in the following orientations")
-    time.sleep(1)  # Time for user to move IMU
-
-    # Dictionary to store accelerometer data for each orientation
-    accel_data = {
-        "Z+": [],
-        "Z-": [],
-        "X+": [],
-        "X-": [],
-        "Y+": [],
-        "Y-": []
-    }
-
-    # Collect accelerometer readings for each orientation using the new function
-    for orientation in accel_data:
-        get_accel_reading_for_orientation(orientation, accel_data)
-    
-    # Calculate offsets for each axis
-    accel_x_offset = (accel_data["X+"][0] + accel_data["X-"][0]) / 2
-    accel_y_offset = (accel_data["Y+"][1] + accel_data["Y-"][1]) / 2
-    accel_z_offset = (accel_data["Z+"][2] + accel_data["Z-"][2]) / 2
-    
-    # Print calibration offsets
-    logging.info("\nFinal Accelerometer Calibration Axis Offsets:")
-    logging.info(f"(X, Y, Z): {accel_x_offset}, {accel_y_offset}, {accel_z_offset}")
-    
-    # Return the calculated offsets
-    return accel_x_offset, accel_y_offset, accel_z_offset
-
-
-# Function to apply accelerometer calibration offsets
-def apply_accel_calibration(accel_x, accel_y, accel_z, offsets):
+    blocks = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        blocks.append(sensor.read_samples())
+        time.sleep(poll_interval)
+    return np.concatenate(blocks)
+
+
+def collect_poses(sensor, seconds, poll_interval):
     """
-    Apply accelerometer calibration offsets to the raw sensor data.
+    Prompts for each pose in ACCEL_POSES and returns the accel samples per pose and all gyro samples
     """
-    accel_x_offset, accel_y_offset, accel_z_offset = offsets
-    corrected_x = accel_x - accel_x_offset
-    corrected_y = accel_y - accel_y_offset
-    corrected_z = accel_z - accel_z_offset
-    return corrected_x, corrected_y, corrected_z
-
-# Calibrate gyroscope by checking zero-rate drift
-def calibrate_gyroscope():
-    time.sleep(1)  # Time for user to keep device still
-    
-    # Read gyroscope values when stationary
-    gyro_x, gyro_y, gyro_z = imu.gyro
-    
-    logging.debug(f"Gyroscope readings (X, Y, Z): {gyro_x}, {gyro_y}, {gyro_z}")
-    # Calibration may not be necessary for gyro since all readings are <0.1 when stationary
+    accel_poses = {}
+    still_gyro = []
+    for pose in ACCEL_POSES:
+        while True:
+            direction = "up" if pose[1] == "+" else "down"
+            input(f"Place the IMU still with its {pose[0]} axis pointing {direction}, then press Enter")
+            time.sleep(SETTLE_TIME)
+            sensor.reset_fifo()
+            samples = collect(sensor, seconds, poll_interval)
 
-if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.DEBUG, handlers=[logging.StreamHandler()]  # output to console
-    )
-    logging.info("Starting imu test")
+            spread = samples[:, ACCEL].std(axis=0).max()
+            if spread < STILL_ACCEL_STD:
+                break
+            logging.warning(f"IMU moved during {pose} (accel std {spread:.3f} m/s^2), retaking")
+
+        accel_poses[pose] = samples[:, ACCEL]
+        still_gyro.append(samples[:, GYRO])
+        logging.info(f"{pose}: {len(samples)} samples, mean accel {np.round(samples[:, ACCEL].mean(axis=0), 3)} m/s^2")
 
-    # Call calibration functions
-    accel_offsets = calibrate_accelerometer() # Calibrate accelerometer
+    return accel_poses, np.concatenate(still_gyro)
 
-    # Sample of applied calibration readings while using IMU
-    accel_x, accel_y, accel_z = imu.acceleration
-    corrected_x, corrected_y, corrected_z = apply_accel_calibration(accel_x, accel_y, accel_z, accel_offsets)
-    logging.debug(f"Corrected Accel Data: X:{corrected_x}, Y:{corrected_y}, Z:{corrected_z}")
 
-    # calibrate_accelerometer(icm)
-    calibrate_gyroscope()
+def collect_mag(sensor, seconds, poll_interval):
+    """
+    Mag readings while the device is rotated through as many orientations as possible
+    """
+    input(f"Slowly rotate the IMU in all directions (figure eights) for {seconds:.0f} s, press Enter to start")
+    sensor.reset_fifo()
+    samples = collect(sensor, seconds, poll_interval)
+    # Every accel/gyro sample carries the latest mag reading, keep each reading once
+    return np.unique(samples[:, MAG], axis=0)
 
-    # try: 
-    #     test_imu_connection(accel_offsets)  # Only tests IMU connection and prints data
-    # except KeyboardInterrupt:
-    #     logging.info("Process interrupted by user")
-    # finally:
-    #     logging.debug("IMU workers stopped")
 
-        
+def show_calibrated(sensor, calibration, poll_interval):
+    """
+    Logs calibrated readings twice a second until interrupted
+    """
+    while True:
+        block = calibration.apply(collect(sensor, 0.5, poll_interval))
+        logging.info(
+            "Accel: X:{:.2f}, Y: {:.2f}, Z: {:.2f} m/s^2 ".format(*block[:, ACCEL].mean(axis=0))
+            + "Gyro X:{:.3f}, Y: {:.3f}, Z: {:.3f} rads/s ".format(*block[:, GYRO].mean(axis=0))
+            + "Mag X:{:.1f}, Y: {:.1f}, Z: {:.1f} uT |{:.1f}|".format(*block[-1, MAG], np.linalg.norm(block[-1, MAG]))
+        )
 
 
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default=resolve_path(config["imu"]["calibration_file"], CONFIG_PATH))
+    parser.add_argument("--pose-seconds", type=float, default=3.0, help="samples averaged per accel pose")
+    parser.add_argument("--mag-seconds", type=float, default=30.0)
+    parser.add_argument("--skip-mag", action="store_true", help="leave the magnetometer uncorrected")
+    parser.add_argument("--show", action="store_true", help="only log readings with the existing calibration")
+    args = parser.parse_args()
+
+    sensor_config = dict(config["imu"]["sensor"])
+    poll_interval = sensor_config.pop("poll_interval")
+    bus = SMBusI2C(sensor_config.pop("i2c_bus"))
+    sensor = ICM20948(bus, **sensor_config)
+    sensor.configure()
+    logging.info(f"IMU configured at {sensor.sample_rate:.1f} Hz")
+
+    try:
+        if args.show:
+            show_calibrated(sensor, IMUCalibration.load(args.output), poll_interval)
+
+        accel_poses, still_gyro = collect_poses(sensor, args.pose_seconds, poll_interval)
+        mag_samples = None if args.skip_mag else collect_mag(sensor, args.mag_seconds, poll_interval)
+        calibration = fit_calibration(accel_poses, still_gyro, mag_samples)
+
+        logging.info(
+            f"Accel bias {np.round(calibration.accel_bias, 4)} m/s^2, matrix\n{np.round(calibration.accel_matrix, 4)}"
+        )
+        logging.info(f"Gyro bias {np.round(calibration.gyro_bias, 5)} rads/s")
+        logging.info(
+            f"Mag hard iron {np.round(calibration.mag_bias, 2)} uT, soft iron\n{np.round(calibration.mag_matrix, 4)}"
+        )
+        calibration.save(args.output)
+        logging.info(f"Wrote {args.output}")
+
+        show_calibrated(sensor, calibration, poll_interval)
+    except KeyboardInterrupt:
+        logging.info("Process interrupted by user")
+    finally:
+        bus.close()
@@ -0,0 +1,65 @@
+"""
+Runs the connected cameras in process-per-camera mode and then in single-process thread mode,
+and reports the total resident memory and CPU usage of the capture processes for each mode
+Run on the Pi from the src directory with the base station receivers running
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from modules.camera_transmitter.camera_device_manager import (
+    CameraDeviceManager,
+    PROCESS_PER_CAMERA,
+    THREAD_PER_CAMERA,
+)
+from modules.process_stats import read_process_usage
+from modules.system_config import load_config
+
+WARMUP_SECONDS = 10  # Camera warm-up and encoder selection
+MEASURE_SECONDS = 30
+
+
+def measure_mode(capture_mode):
+    """
+    Streams all cameras in the given capture mode and returns (cameras, rss MB, cpu %)
+    """
+    config = load_config()
+    config["camera"]["capture_mode"] = capture_mode
+
+    camera_controller = CameraDeviceManager(stop_event=mp.Event(), config=config)
+    camera_controller.start_camera_workers()
+
+    try:
+        time.sleep(WARMUP_SECONDS)
+        cameras = len(camera_controller.worker_queue)
+        pids = {worker.process.pid for worker in camera_controller.worker_queue}
+        start = {pid: read_process_usage(pid) for pid in pids}
+
+        time.sleep(MEASURE_SECONDS)
+        end = {pid: read_process_usage(pid) for pid in pids}
+    finally:
+        camera_controller.stop_workers()
+
+    alive = [pid for pid in pids if start[pid] and end[pid]]
+    rss_mb = sum(end[pid][0] for pid in alive) / 2**20
+    cpu_percent = 100 * sum(end[pid][1] - start[pid][1] for pid in alive) / MEASURE_SECONDS
+    return cameras, rss_mb, cpu_percent
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    results = {mode: measure_mode(mode) for mode in (PROCESS_PER_CAMERA, THREAD_PER_CAMERA)}
+
+    logging.info(f"{'Mode':<10}{'Cameras':>10}{'RSS (MB)':>12}{'CPU (%)':>10}")
+    for mode, (cameras, rss_mb, cpu_percent) in results.items():
+        logging.info(f"{mode:<10}{cameras:>10}{rss_mb:>12.1f}{cpu_percent:>10.1f}")
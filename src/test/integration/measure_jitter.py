@@ -0,0 +1,78 @@
+"""
+Streams with the scheduling settings off and then on, and reports for each run the IMU sampler
+wake-up lateness and where every worker process ran
+Run on the Pi from the src directory with the base station receivers running, or with --simulated to
+use the synthetic backends and local sinks: python test/integration/measure_jitter.py [--simulated]
+"""
+
+import os
+import sys
+
+import argparse
+import copy
+import logging
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from modules.clock import REAL_CLOCK
+from modules.system_config import load_config
+from modules.system_controller.system_controller import SystemController
+from run_simulated import TCPSink, consecutive_sinks, simulated_config
+
+WARMUP_SECONDS = 10  # Camera warm-up and encoder selection
+
+
+def measure(config, seconds):
+    """
+    Streams for WARMUP_SECONDS + seconds and returns the controller metrics
+    """
+    controller = SystemController(config=config)
+    controller.arm()
+    controller.start()
+    try:
+        time.sleep(WARMUP_SECONDS)
+        controller.imu_controller.imu_worker.jitter.reset()
+        time.sleep(seconds)
+        return controller.get_metrics()
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=30.0, help="measured time per run")
+    parser.add_argument("--simulated", action="store_true", help="synthetic camera and IMU with local sinks")
+    parser.add_argument("--cameras", type=int, default=2, help="synthetic cameras with --simulated")
+    parser.add_argument("--pattern", default="noise", choices=("bars", "static", "noise"))
+    args = parser.parse_args()
+
+    config = load_config()
+    sinks = []
+    if args.simulated:
+        args.arm_after = 0.0
+        camera_sinks = consecutive_sinks(args.cameras, REAL_CLOCK)
+        imu_sink = TCPSink("imu")
+        config = simulated_config(args, camera_sinks, imu_sink)
+        sinks = camera_sinks + [imu_sink]
+
+    results = {}
+    for enabled in (False, True):
+        run_config = copy.deepcopy(config)
+        run_config["scheduling"]["enabled"] = enabled
+        results["scheduled" if enabled else "default"] = measure(run_config, args.seconds)
+    for sink in sinks:
+        sink.close()
+
+    for name, metrics in results.items():
+        logging.info(f"{name}: IMU wake-up lateness {metrics['imu']['jitter']}")
+        logging.info(f"  main: {metrics['main']}")
+        for role, placement in metrics["imu"]["placement"].items():
+            logging.info(f"  {role}: {placement}")
+        for pid, process in metrics["camera"]["processes"].items():
+            logging.info(f"  {process['name']} ({pid}): {process['placement']}")
@@ -0,0 +1,232 @@
+"""
+Runs the full arming to streaming flow on plain Linux with the synthetic camera, synthetic IMU and
+in-memory GPIO backends, streaming to TCP sinks on localhost in place of the base station
+Reports the time to the first byte and the bytes received per stream, and the controller metrics
+With --virtual the run uses a VirtualClock, so an hour of streaming, link drops and motion
+transitions takes as long as the encoding and sending work in it
+Run from the src directory:
+python test/integration/run_simulated.py [--seconds 30] [--pattern bars] [--virtual]
+"""
+
+import os
+import sys
+
+import argparse
+import logging
+import socket
+import threading
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from modules.arming_button.button import ArmingButton
+from modules.arming_button.button_service import ButtonService
+from modules.clock import REAL_CLOCK, create_clock
+from modules.device_state import DeviceState
+from modules.governor.fake_sysfs import FakeSysfs
+from modules.hal.registry import GPIO_BACKENDS, create_backend
+from modules.system_config import load_config
+from modules.system_controller.system_controller import SystemController
+
+HOST = "127.0.0.1"
+
+
+class TCPSink:
+    """
+    Accepts connections on a local port and counts the bytes received
+    """
+
+    def __init__(self, name, port=0, clock=REAL_CLOCK):
+        """
+        port: 0 for any free port
+        """
+        self.name = name
+        self.clock = clock
+        self.server = socket.create_server((HOST, port))
+        self.port = self.server.getsockname()[1]
+        self.bytes_received = 0
+        self.first_byte_time = None
+        self.connections = []  # Open connections, closed by drop() to simulate a link drop
+        self.accepted = 0
+        thread = threading.Thread(target=self.__serve, name=f"Sink-{name}", daemon=True)
+        thread.start()
+
+    def __serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            self.connections.append(connection)
+            threading.Thread(target=self.__receive, args=(connection,), daemon=True).start()
+
+    def __receive(self, connection):
+        buffer = bytearray(1 << 16)
+        with connection:
+            while True:
+                try:
+                    received = connection.recv_into(buffer)
+                except OSError:
+                    return
+                if not received:
+                    return
+                if self.first_byte_time is None:
+                    self.first_byte_time = self.clock.monotonic()
+                self.bytes_received += received
+
+    def drop(self):
+        """
+        Resets every open connection, like the base station link going down
+        """
+        connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.drop()
+        self.server.close()
+
+
+def simulated_config(args, camera_sinks, imu_sink):
+    """
+    config.yaml with every backend simulated and the streams sent to the local sinks
+    """
+    config = load_config()
+    config["hal"]["camera"]["backend"] = "synthetic"
+    config["hal"]["camera"]["count"] = args.cameras
+    config["hal"]["camera"]["synthetic"]["pattern"] = args.pattern
+    config["hal"]["imu"]["backend"] = "synthetic"
+    config["hal"]["gpio"]["backend"] = "memory"
+    config["hal"]["gpio"]["memory"]["auto_press"] = {ArmingButton.BUTTON_PIN: args.arm_after}
+    config["camera"]["max_cameras"] = args.cameras
+
+    # Camera i sends to camera_base_port + i, so the sinks need consecutive ports
+    config["network"]["server_host"] = HOST
+    config["network"]["camera_base_port"] = camera_sinks[0].port
+    config["network"]["imu_host"] = HOST
+    config["network"]["imu_port"] = imu_sink.port
+
+    # The governor reads a cool, idle fake SoC: a sped up run keeps the host CPUs busy
+    config["governor"]["sysfs_root"] = FakeSysfs().root
+    return config
+
+
+def consecutive_sinks(count, clock, attempts=20):
+    """
+    count camera sinks on consecutive ports, retrying from a new base port if one is taken
+    """
+    for _ in range(attempts):
+        sinks = [TCPSink("camera-0", clock=clock)]
+        try:
+            for i in range(1, count):
+                sinks.append(TCPSink(f"camera-{i}", sinks[0].port + i, clock))
+            return sinks
+        except OSError:
+            for sink in sinks:
+                sink.close()
+    raise RuntimeError(f"Unable to find {count} consecutive free ports")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=30.0, help="streaming time after arming")
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--pattern", default="bars", choices=("bars", "static", "noise"))
+    parser.add_argument("--arm-after", type=float, default=1.0, help="seconds before the simulated button press")
+    parser.add_argument(
+        "--virtual",
+        action="store_true",
+        help=(
+            "run on a VirtualClock, faster than real time. Time stands still while any clock thread is "
+            "blocked outside the clock (e.g. in a socket call), so such a block stalls the simulation"
+        ),
+    )
+    parser.add_argument(
+        "--drop-interval", type=float, default=0.0, help="seconds between simulated link drops, 0 for none"
+    )
+    parser.add_argument(
+        "--temperature", type=float, default=None, help="simulated SoC temperature (C) for the governor"
+    )
+    args = parser.parse_args()
+
+    # Created before the workers and sinks so they all share it
+    clock = create_clock("virtual" if args.virtual else "real")
+    camera_sinks = consecutive_sinks(args.cameras, clock)
+    imu_sink = TCPSink("imu", clock=clock)
+    config = simulated_config(args, camera_sinks, imu_sink)
+    if args.temperature is not None:
+        FakeSysfs(config["governor"]["sysfs_root"]).set_temperature(args.temperature)
+
+    controller = SystemController(config=config, clock=clock)
+    gpio = create_backend(GPIO_BACKENDS, config["hal"]["gpio"], clock=clock)
+    arming_btn = ArmingButton(gpio=gpio, clock=clock)
+    button_service = ButtonService(
+        arming_btn, controller.state_machine, debounce=config["button"]["debounce"], clock=clock
+    )
+
+    real_start = time.monotonic()
+    start = clock.monotonic()
+    state_changes = controller.subscribe()
+    button_service.start()
+    clock.unregister()  # Waits for the simulated press below, not on the clock
+    while state_changes.wait() != DeviceState.ARMED:
+        pass
+    armed = clock.monotonic()
+    logging.info(f"Armed {armed - start:.2f} s after startup")
+
+    controller.start()
+    if args.drop_interval:
+        # Camera workers exit when their link drops, the manager restarts them
+        monitor = clock.participant(controller.camera_controller.monitor_workers)
+        threading.Thread(target=monitor, daemon=True).start()
+
+    transitions = 0
+    try:
+        end = armed + args.seconds
+        next_drop = armed + args.drop_interval if args.drop_interval else float("inf")
+        while clock.monotonic() < end:
+            clock.sleep(min(1.0, end - clock.monotonic(), max(next_drop - clock.monotonic(), 0.0)))
+            state = state_changes.wait(timeout=0)
+            if state is not None:
+                transitions += 1
+                logging.info(f"Device is {state.name} at {clock.monotonic() - armed:.1f} s")
+            if clock.monotonic() >= next_drop:
+                logging.info(f"Dropping the links at {clock.monotonic() - armed:.1f} s")
+                for sink in camera_sinks + [imu_sink]:
+                    sink.drop()
+                next_drop += args.drop_interval
+        metrics = controller.get_metrics()
+    except KeyboardInterrupt:
+        logging.info("Process interrupted by user")
+        metrics = None
+    finally:
+        clock.unregister()
+        controller.stop()
+        button_service.stop()
+        arming_btn.cleanup()
+
+    elapsed = clock.monotonic() - armed
+    real_elapsed = time.monotonic() - real_start
+    logging.info(
+        f"{elapsed:.1f} s simulated in {real_elapsed:.1f} s ({elapsed / real_elapsed:.1f}x), "
+        f"{transitions} state changes"
+    )
+    logging.info(f"{'Stream':<10}{'First byte (s)':>16}{'Connects':>10}{'MB':>10}{'Mbit/s':>10}")
+    for sink in camera_sinks + [imu_sink]:
+        first = f"{sink.first_byte_time - armed:.2f}" if sink.first_byte_time else "-"
+        logging.info(
+            f"{sink.name:<10}{first:>16}{sink.accepted:>10}{sink.bytes_received / 1e6:>10.2f}"
+            f"{8 * sink.bytes_received / elapsed / 1e6:>10.2f}"
+        )
+        sink.close()
+    if metrics is not None:
+        logging.info(f"Metrics: {metrics}")
@@ -0,0 +1,103 @@
+"""
+Runs MadgwickAHRS over synthetic IMU traces: static orientations, a constant rate turn and block
+size independence, checking the quaternion and the gravity-free linear acceleration.
+Run directly to measure the filter cost at the sensor rate
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.imu.ahrs import MadgwickAHRS, rotation_matrices
+from modules.imu.icm20948 import STANDARD_GRAVITY
+from modules.imu.imu_ring_buffer import ACCEL, GYRO, LINEAR_ACCEL, MAG, NUM_COLUMNS, QUAT, TIME
+
+SAMPLE_RATE = 1125.0
+EARTH_FIELD = np.array([20.0, 0.0, -40.0])  # uT, earth frame (x north, z up)
+GRAVITY = np.array([0.0, 0.0, STANDARD_GRAVITY])  # Accelerometer reading at rest, earth frame
+
+
+def quaternion(axis, angle):
+    axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+    return np.concatenate(([np.cos(angle / 2)], np.sin(angle / 2) * axis))
+
+
+def make_trace(quats, gyro=(0.0, 0.0, 0.0), seed=0):
+    """
+    Builds the readings of a sensor at rest (apart from gyro) at each orientation in quats
+    """
+    rng = np.random.default_rng(seed)
+    rotations = rotation_matrices(quats)
+    trace = np.zeros((len(quats), NUM_COLUMNS))
+    trace[:, TIME] = np.arange(len(quats)) / SAMPLE_RATE
+    # Sensor frame readings are the earth frame vectors rotated by R^T
+    trace[:, ACCEL] = np.einsum("nji,j->ni", rotations, GRAVITY) + rng.normal(0, 0.02, (len(quats), 3))
+    trace[:, GYRO] = gyro
+    trace[:, MAG] = np.einsum("nji,j->ni", rotations, EARTH_FIELD) + rng.normal(0, 0.3, (len(quats), 3))
+    return trace
+
+
+def angle_between(q, expected):
+    return 2 * np.arccos(np.clip(np.abs(np.sum(q * expected, axis=-1)), 0, 1))
+
+
+def run(trace, block_size, **kwargs):
+    ahrs = MadgwickAHRS(SAMPLE_RATE, **kwargs)
+    trace = trace.copy()
+    for start in range(0, len(trace), block_size):
+        ahrs.update(trace[start:start + block_size])
+    return trace
+
+
+def test_static_orientations():
+    for axis, angle in (((1, 0, 0), 0.0), ((1, 0, 0), 0.6), ((0, 1, 1), -1.2), ((1, -2, 0.5), 2.5)):
+        truth = quaternion(axis, angle)
+        trace = run(make_trace(np.tile(truth, (int(SAMPLE_RATE), 1))), block_size=11)
+        assert angle_between(trace[-1, QUAT], truth) < np.radians(2)
+        assert np.abs(trace[:, LINEAR_ACCEL]).mean() < 0.2
+
+
+def test_tracks_constant_rate_turn():
+    # 90 deg/s about z, the gyro alone must carry the filter through a quarter turn per second
+    rate = np.pi / 2
+    times = np.arange(int(2 * SAMPLE_RATE)) / SAMPLE_RATE
+    truth = np.stack([quaternion((0, 0, 1), rate * t) for t in times])
+    trace = run(make_trace(truth, gyro=(0.0, 0.0, rate)), block_size=11)
+    assert angle_between(trace[:, QUAT], truth).max() < np.radians(3)
+    assert np.abs(trace[:, LINEAR_ACCEL]).mean() < 0.2
+
+
+def test_block_size_independent():
+    truth = np.tile(quaternion((0, 1, 0), 0.3), (500, 1))
+    trace = make_trace(truth)
+    expected = run(trace, block_size=len(trace))
+    for block_size in (1, 7, 100):
+        np.testing.assert_allclose(run(trace, block_size=block_size)[:, QUAT], expected[:, QUAT], atol=1e-12)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    truth = np.tile(quaternion((1, 1, 0), 0.4), (int(10 * SAMPLE_RATE), 1))
+    trace = make_trace(truth, gyro=(0.01, -0.02, 0.005))
+    for use_mag in (True, False):
+        for block_size in (1, 11, 45):
+            ahrs = MadgwickAHRS(SAMPLE_RATE, use_mag=use_mag)
+            samples = trace.copy()
+            start = time.perf_counter()
+            for i in range(0, len(samples), block_size):
+                ahrs.update(samples[i:i + block_size])
+            elapsed = time.perf_counter() - start
+            logging.info(
+                f"use_mag={use_mag!s:<5} block {block_size:>3}: {1e6 * elapsed / len(samples):.2f} us/sample, "
+                f"{100 * elapsed / (len(samples) / SAMPLE_RATE):.2f}% of one core at {SAMPLE_RATE:.0f} Hz"
+            )
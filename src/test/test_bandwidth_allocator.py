@@ -0,0 +1,171 @@
+"""
+Checks the uplink bandwidth allocator: the weighted max-min split of the budget by priority, weight,
+demand and minimum rate, and the shared token bucket refilling, overdrawing and throttling on an
+injected clock. Run directly to simulate a camera and the IMU sharing the uplink and log their rates
+"""
+
+import os
+import sys
+
+import logging
+
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.bandwidth_allocator import BandwidthAllocator, allocate
+
+INF = float("inf")
+
+
+class FakeTime:
+    """
+    Clock for the allocator that only moves when advanced
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def test_priority_first():
+    assert allocate(1000.0, [(0, 1, 1.0, INF), (1, 0, 1.0, INF)]) == {0: 1000.0, 1: 0.0}
+    # The lower priority stream only gets what the higher one does not need
+    assert allocate(1000.0, [(0, 1, 1.0, 300.0), (1, 0, 1.0, INF)]) == {0: 300.0, 1: 700.0}
+
+
+def test_weighted_split():
+    assert allocate(1000.0, [(0, 0, 1.0, INF), (1, 0, 3.0, INF)]) == {0: 250.0, 1: 750.0}
+
+
+def test_demand_capped_and_redistributed():
+    # The first stream needs less than its half, the rest goes to the second
+    assert allocate(1000.0, [(0, 0, 1.0, 100.0), (1, 0, 1.0, INF)]) == {0: 100.0, 1: 900.0}
+    # Budget left once every demand is met is split by weight, so streams can grow
+    assert allocate(1000.0, [(0, 0, 1.0, 100.0), (1, 0, 1.0, 200.0)]) == {0: 450.0, 1: 550.0}
+
+
+def test_min_rate():
+    rates = allocate(1000.0, [(0, 1, 1.0, INF), (1, 0, 1.0, INF), (2, 0, 1.0, INF)], min_rate=100.0)
+    assert rates == {0: 800.0, 1: 100.0, 2: 100.0}
+    # Below the total of the minimum rates every stream still keeps its minimum
+    assert allocate(100.0, [(0, 0, 1.0, INF), (1, 0, 1.0, INF)], min_rate=100.0) == {0: 100.0, 1: 100.0}
+
+
+@pytest.mark.parametrize(
+    "streams, expected",
+    [
+        ([(0, 0, 0.0, INF), (1, 0, 1.0, INF)], {0: 500.0, 1: 500.0}),
+        ([(0, 0, 0.0, INF), (1, 0, 1.0, INF), (2, 0, 2.0, INF)], {0: 250.0, 1: 250.0, 2: 500.0}),
+        ([(0, 0, 0.0, INF), (1, 0, 0.0, INF)], {0: 500.0, 1: 500.0}),
+        ([(0, 0, 0.0, 100.0), (1, 0, 2.0, 200.0)], {0: 333.3333333333333, 1: 666.6666666666666}),
+    ],
+)
+def test_zero_and_mixed_weights(streams, expected):
+    rates = allocate(1000.0, streams)
+    assert rates == pytest.approx(expected)
+    assert sum(rates.values()) == pytest.approx(1000.0)  # Never more than the budget
+
+
+def make_allocator(clock, **kwargs):
+    kwargs.setdefault("rebalance_interval", 1000.0)  # Rates stay fixed unless a test advances past it
+    return BandwidthAllocator(total_rate=100000.0, max_streams=2, burst_seconds=1.0, clock=clock, **kwargs)
+
+
+def test_refill_and_overdraw():
+    clock = FakeTime()
+    allocator = make_allocator(clock)
+    stream = allocator.add_stream("camera")  # The only stream is allocated the whole budget
+
+    assert not allocator.is_throttled(stream)
+    allocator.consume(stream, 50000)  # A frame larger than the bucket holds may overdraw it
+    assert allocator.is_throttled(stream)
+    clock.advance(0.4)
+    assert allocator.is_throttled(stream)  # 40000 of the 50000 bytes paid back
+    clock.advance(0.11)
+    assert not allocator.is_throttled(stream)
+
+    # The bucket holds at most burst_seconds of the rate
+    clock.advance(10.0)
+    allocator.consume(stream, 150000)
+    assert allocator.is_throttled(stream)
+    clock.advance(0.49)
+    assert allocator.is_throttled(stream)
+    clock.advance(0.02)
+    assert not allocator.is_throttled(stream)
+
+
+def test_metrics_and_demand():
+    clock = FakeTime()
+    allocator = make_allocator(clock, rebalance_interval=1.0)
+    camera = allocator.add_stream("camera", priority=1)
+    imu = allocator.add_stream("imu", priority=2, weight=2.0)
+
+    metrics = allocator.get_metrics()
+    assert set(metrics) == {"camera", "imu"}
+    assert set(metrics["camera"]) == {
+        "priority", "weight", "allocated_bytes_per_sec", "used_bytes_per_sec", "demand_bytes_per_sec",
+        "total_bytes_sent", "throttled_count",
+    }
+    assert metrics["imu"]["priority"] == 2 and metrics["imu"]["weight"] == 2.0
+    assert metrics["camera"]["demand_bytes_per_sec"] is None  # Not measured yet
+
+    # The IMU has the higher priority, so the camera starts with the minimum rate and its frame
+    # overdraws the bucket
+    clock.advance(0.5)
+    allocator.consume(camera, 5000)
+    allocator.consume(imu, 1000)
+    clock.advance(0.5)
+    assert allocator.is_throttled(camera)  # Rebalances from the bytes sent in the last second
+
+    metrics = allocator.get_metrics()
+    assert metrics["camera"]["demand_bytes_per_sec"] == 5000.0
+    assert metrics["camera"]["used_bytes_per_sec"] == 2500.0  # Smoothed from zero
+    assert metrics["camera"]["total_bytes_sent"] == 5000 and metrics["imu"]["total_bytes_sent"] == 1000
+    assert metrics["camera"]["throttled_count"] == 1 and metrics["imu"]["throttled_count"] == 0
+    allocated = [stream["allocated_bytes_per_sec"] for stream in metrics.values()]
+    assert sum(allocated) == pytest.approx(100000.0)
+    # Both demands are met, the camera now gets its demand and a third of what is left
+    assert metrics["camera"]["allocated_bytes_per_sec"] > 5000.0 * BandwidthAllocator.DEMAND_HEADROOM
+
+    clock.advance(0.2)
+    assert not allocator.is_throttled(camera)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    # A camera sending 20 KB frames at 10 fps and the IMU sending 2 KB batches at 20 Hz over 150
+    # KB/s
+    clock = FakeTime()
+    allocator = BandwidthAllocator(total_rate=150000.0, max_streams=2, clock=clock)
+    camera = allocator.add_stream("camera", priority=1)
+    imu = allocator.add_stream("imu", priority=2)
+    skipped = 0
+    for tick in range(20 * 30):  # 30 seconds in 50 ms ticks
+        if tick % 2 == 0:
+            if allocator.is_throttled(camera):
+                skipped += 1
+            else:
+                allocator.consume(camera, 20000)
+        if not allocator.is_throttled(imu):
+            allocator.consume(imu, 2000)
+        clock.advance(0.05)
+        if tick % 100 == 99:
+            metrics = allocator.get_metrics()
+            logging.info(
+                f"{clock.now:5.1f} s: " + ", ".join(
+                    f"{name} {values['allocated_bytes_per_sec'] / 1000:.1f} KB/s allocated, "
+                    f"{values['used_bytes_per_sec'] / 1000:.1f} KB/s used"
+                    for name, values in metrics.items()
+                )
+            )
+    logging.info(f"Camera frames skipped: {skipped} of {20 * 30 // 2}")
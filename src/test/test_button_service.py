@@ -0,0 +1,148 @@
+"""
+Checks the event-driven arming button: presses toggle between armed and disarmed within the debounce
+time, contact bounce counts as one press, and the LED follows state changes from any source.
+Run directly to measure press-to-armed latency and idle CPU use
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.arming_button.button import ArmingButton
+from modules.arming_button.button_service import ButtonService
+from modules.device_state import DeviceState
+from modules.hal.gpio import InMemoryGPIO
+from modules.system_controller.device_state_machine import DeviceStateMachine
+
+DEBOUNCE = 0.02
+
+
+class CountingGPIO(InMemoryGPIO):
+    """
+    Counts the reads of each pin
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reads = {}
+
+    def input(self, pin):
+        self.reads[pin] = self.reads.get(pin, 0) + 1
+        return super().input(pin)
+
+
+def start_service(gpio=None):
+    gpio = gpio or InMemoryGPIO()
+    button = ArmingButton(gpio=gpio)
+    state_machine = DeviceStateMachine()
+    service = ButtonService(button, state_machine, debounce=DEBOUNCE)
+    service.start()
+    return gpio, button, state_machine, service
+
+
+def led_colour(gpio, button):
+    return [colour for colour in "RGB" if gpio.input(button.led_pins[colour]) == gpio.LOW]
+
+
+def wait_for_led(gpio, button, colour, timeout=2.0):
+    end = time.monotonic() + timeout
+    while led_colour(gpio, button) != [colour] and time.monotonic() < end:
+        time.sleep(0.005)
+    return led_colour(gpio, button) == [colour]
+
+
+def test_press_toggles_arming_and_led():
+    gpio, button, state_machine, service = start_service()
+    state_changes = state_machine.subscribe()
+    assert led_colour(gpio, button) == ["R"]
+
+    gpio.press(button.button_pin)
+    pressed_at = time.time()
+    assert state_changes.wait(timeout=1.0) == DeviceState.ARMED
+    assert state_machine.changed_at.value - pressed_at < DEBOUNCE + 0.05
+    assert wait_for_led(gpio, button, "G")
+    gpio.release(button.button_pin)
+    time.sleep(2 * DEBOUNCE)
+
+    # Motion states reported by the IMU process drive the LED too
+    state_machine.transition(DeviceState.STATIONARY, source="imu")
+    assert wait_for_led(gpio, button, "B")
+
+    gpio.press(button.button_pin, hold=0.05)
+    assert state_changes.wait(timeout=1.0) == DeviceState.STATIONARY
+    assert state_changes.wait(timeout=1.0) == DeviceState.DISARMED
+    assert wait_for_led(gpio, button, "R")
+    assert service.presses == 2
+    service.stop()
+    assert not any(thread.is_alive() for thread in service.threads)
+
+
+def test_bounce_counts_as_one_press():
+    gpio, button, state_machine, service = start_service()
+    for _ in range(5):
+        gpio.press(button.button_pin)
+        time.sleep(0.002)
+        gpio.release(button.button_pin)
+        time.sleep(0.002)
+    gpio.press(button.button_pin)
+    time.sleep(0.2)
+    for _ in range(5):  # Release bounce
+        gpio.release(button.button_pin)
+        time.sleep(0.002)
+        gpio.press(button.button_pin)
+        time.sleep(0.002)
+    gpio.release(button.button_pin)
+    time.sleep(0.2)
+
+    assert service.presses == 1
+    assert state_machine.state == DeviceState.ARMED
+
+    # A glitch shorter than the debounce time is ignored
+    gpio.press(button.button_pin)
+    gpio.release(button.button_pin)
+    time.sleep(0.2)
+    assert service.presses == 1
+    service.stop()
+
+
+def test_idle_does_not_poll():
+    gpio, button, state_machine, service = start_service(CountingGPIO())
+    assert button.button_pin in gpio.callbacks  # Edges arrive as callbacks
+    time.sleep(0.2)
+    reads = gpio.reads.get(button.button_pin, 0)
+    time.sleep(0.5)
+    # Nothing reads the pin or changes while the button is not touched
+    assert gpio.reads.get(button.button_pin, 0) == reads
+    assert service.presses == 0
+    assert state_machine.state == DeviceState.DISARMED and led_colour(gpio, button) == ["R"]
+    service.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    gpio, button, state_machine, service = start_service()
+    state_changes = state_machine.subscribe()
+    latencies = []
+    for _ in range(20):
+        pressed_at = time.time()
+        gpio.press(button.button_pin, hold=0.05)
+        state_changes.wait(timeout=1.0)
+        latencies.append(state_machine.changed_at.value - pressed_at)
+        time.sleep(0.1)
+    logging.info(
+        f"Press to state change: mean {1e3 * sum(latencies) / len(latencies):.1f} ms, "
+        f"max {1e3 * max(latencies):.1f} ms ({1e3 * DEBOUNCE:.0f} ms debounce)"
+    )
+
+    start_cpu, start = time.process_time(), time.monotonic()
+    time.sleep(5.0)
+    logging.info(f"Idle CPU {100 * (time.process_time() - start_cpu) / (time.monotonic() - start):.3f}%")
+    service.stop()
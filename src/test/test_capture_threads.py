@@ -0,0 +1,102 @@
+"""
+Checks thread capture mode: a camera thread that exits while the cameras should be running, here
+because the base station dropped its connection, is started again and reconnects, and every thread
+stops with the stop event
+"""
+
+import os
+import sys
+
+import logging
+import socket
+import threading
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter.camera_device_manager import run_camera_threads
+from modules.camera_transmitter.camera_worker import CameraWorker
+from modules.camera_transmitter.frame_encoder import EncoderPreset
+from modules.camera_transmitter.stream_profile import StreamProfile
+
+HOST = "127.0.0.1"
+
+
+class DroppingServer:
+    """
+    Accepts connections, closing each one after it received some data
+    """
+
+    def __init__(self, keep_bytes=10000):
+        self.server = socket.create_server((HOST, 0))
+        self.port = self.server.getsockname()[1]
+        self.keep_bytes = keep_bytes
+        self.connections = 0
+        threading.Thread(target=self.__serve, daemon=True).start()
+
+    def __serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            received = 0
+            with connection:
+                while received < self.keep_bytes:
+                    data = connection.recv(1 << 16)
+                    if not data:
+                        break
+                    received += len(data)
+                connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b"\x01\x00\x00\x00\x00\x00\x00\x00")
+
+    def close(self):
+        self.server.close()
+
+
+def test_exited_camera_thread_restarts():
+    server = DroppingServer()
+    stop_event = threading.Event()
+    profile = StreamProfile(fps=50.0, width=160, height=120, encoders=(EncoderPreset(name="jpeg", backend="jpeg"),))
+    worker = CameraWorker(
+        device_id=0, port=server.port, host=HOST, profile=profile, stop_event=stop_event,
+        camera_config={"backend": "synthetic", "synthetic": {"pattern": "noise"}},
+    )
+    capture = threading.Thread(
+        target=run_camera_threads, args=([worker], stop_event), kwargs={"restart_interval": 0.05}
+    )
+    capture.start()
+    try:
+        end = time.monotonic() + 20.0
+        while server.connections < 3 and time.monotonic() < end:
+            time.sleep(0.05)
+        assert server.connections >= 3  # Reconnected after each dropped connection
+    finally:
+        stop_event.set()
+        capture.join(timeout=10.0)
+        server.close()
+    assert not capture.is_alive()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    # Connections per second while the base station drops each one, with the default restart
+    # interval
+    server = DroppingServer()
+    stop_event = threading.Event()
+    profile = StreamProfile(fps=30.0, width=320, height=240, encoders=(EncoderPreset(name="jpeg", backend="jpeg"),))
+    worker = CameraWorker(
+        device_id=0, port=server.port, host=HOST, profile=profile, stop_event=stop_event,
+        camera_config={"backend": "synthetic", "synthetic": {"pattern": "noise"}},
+    )
+    capture = threading.Thread(target=run_camera_threads, args=([worker], stop_event))
+    capture.start()
+    time.sleep(10.0)
+    stop_event.set()
+    capture.join()
+    server.close()
+    logging.info(f"{server.connections} connections in 10 s")
@@ -0,0 +1,157 @@
+"""
+Checks VirtualClock: sleeps finish without waiting in real time, participants in other threads and
+processes wake in simulated time order, waits and polls end early when their event is set or their
+pipe has data, and exited processes and threads do not stop time. Run directly to measure how fast
+an hour of IMU and camera polling is simulated
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import threading
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.arming_button.button import ArmingButton
+from modules.arming_button.button_service import ButtonService
+from modules.clock import Clock, VirtualClock, create_clock
+from modules.device_state import DeviceState
+from modules.hal.gpio import InMemoryGPIO
+from modules.system_controller.device_state_machine import DeviceStateMachine
+
+
+def poller(clock, interval, count, log):
+    """
+    Sleeps count times, logging (interval, monotonic time) to the log queue after each sleep if
+    given
+    """
+    for _ in range(count):
+        clock.sleep(interval)
+        if log is not None:
+            log.put((interval, round(clock.monotonic(), 6)))
+
+
+def test_sleep_is_instant():
+    clock = VirtualClock()
+    start = time.monotonic()
+    for _ in range(3600):
+        clock.sleep(1.0)
+    assert clock.monotonic() == 3600.0
+    assert clock.time() - clock.monotonic() > 1e9  # Looks like a wall clock time
+    assert time.monotonic() - start < 5.0
+    clock.unregister()
+
+
+def test_participants_wake_in_order():
+    clock = VirtualClock()
+    log = mp.Queue()
+    processes = [
+        mp.Process(target=clock.participant(poller), args=(clock, interval, count, log))
+        for interval, count in ((0.02, 50), (0.25, 4))
+    ]
+    thread = threading.Thread(target=clock.participant(poller), args=(clock, 0.1, 10, log))
+    for process in processes:
+        process.start()
+    thread.start()
+    clock.unregister()  # Only the pollers hold time back
+
+    for process in processes:
+        process.join(timeout=10.0)
+    thread.join(timeout=10.0)
+    events = [log.get(timeout=1.0) for _ in range(64)]
+
+    # Every poller woke at each multiple of its interval, and no wake-up was seen before an earlier
+    # one
+    for interval, count in ((0.02, 50), (0.25, 4), (0.1, 10)):
+        times = [t for i, t in events if i == interval]
+        assert times == [round(interval * (k + 1), 6) for k in range(count)]
+    assert round(clock.monotonic(), 6) == 1.0
+
+
+def test_wait_and_exited_processes():
+    clock = VirtualClock()
+    event = mp.Event()
+
+    # A process that exits without unregistering is reaped instead of stopping time
+    process = mp.Process(target=os._exit, args=(0,))
+    process.start()
+    process.join()
+    clock.sleep(5.0)
+    assert clock.monotonic() == 5.0
+
+    threading.Timer(0.1, event.set).start()
+    assert clock.wait(event, timeout=None)
+    assert not clock.wait(mp.Event(), timeout=10.0)
+    assert clock.monotonic() == 15.0
+    clock.unregister()
+
+    # Nor is a thread that exits without unregistering, in a process that keeps running
+    thread = threading.Thread(target=clock.sleep, args=(1.0,))
+    thread.start()
+    thread.join(timeout=10.0)
+    clock.sleep(5.0)
+    assert clock.monotonic() == 21.0
+    clock.unregister()
+
+    assert isinstance(create_clock("real"), Clock) and isinstance(create_clock("virtual"), VirtualClock)
+
+
+def sender(clock, conn):
+    clock.sleep(3.0)
+    conn.send("profile")
+    clock.sleep(10.0)
+
+
+def test_poll_wakes_on_data():
+    clock = VirtualClock()
+    receiver, sender_conn = mp.Pipe(duplex=False)
+    process = mp.Process(target=clock.participant(sender), args=(clock, sender_conn))
+    process.start()
+    assert clock.poll(receiver, timeout=100.0)
+    assert clock.monotonic() == 3.0  # When it was sent, not at the end of the timeout
+    assert receiver.recv() == "profile"
+    assert not clock.poll(receiver, timeout=20.0)
+    assert clock.monotonic() == 23.0
+    clock.unregister()
+    process.join(timeout=10.0)
+
+
+def test_button_arms_in_simulated_time():
+    clock = VirtualClock()
+    gpio = InMemoryGPIO(auto_press={ArmingButton.BUTTON_PIN: 600.0}, clock=clock)
+    button = ArmingButton(gpio=gpio, clock=clock)
+    state_machine = DeviceStateMachine()
+    service = ButtonService(button, state_machine, clock=clock)
+    state_changes = state_machine.subscribe()
+
+    start = time.monotonic()
+    service.start()
+    clock.unregister()  # Waits for the state change, not on the clock
+    assert state_changes.wait(timeout=30.0) == DeviceState.ARMED
+    assert 600.0 <= clock.monotonic() < 601.0
+    assert time.monotonic() - start < 30.0
+    service.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    # Stationary IMU sensor and socket loops and two cameras at 2 fps for ten simulated minutes
+    clock = VirtualClock()
+    seconds = 600
+    pollers = ((0.25, 4 * seconds), (0.05, 20 * seconds), (0.5, 2 * seconds), (0.5, 2 * seconds))
+    processes = [mp.Process(target=clock.participant(poller), args=(clock, i, n, None)) for i, n in pollers]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    clock.unregister()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    logging.info(f"{clock.monotonic():.0f} s simulated in {elapsed:.1f} s ({clock.monotonic() / elapsed:.0f}x)")
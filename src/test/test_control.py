@@ -0,0 +1,222 @@
+"""
+Checks the base station control channel: message framing, request dispatch and errors, rejection of
+mistyped or out of range stream and snapshot values, and the camera commands (stream parameters,
+pause/resume and snapshots) against a synthetic camera streaming to a local socket. Run directly to
+measure control request round trip times
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import socket
+import threading
+import time
+
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter.camera_device_manager import CameraDeviceManager
+from modules.camera_transmitter.camera_worker import CAMERA_HEADER
+from modules.camera_transmitter.tile_delta import FRAME_SNAPSHOT, TileDeltaDecoder
+from modules.control import control_protocol as control
+from modules.control.control_client import ControlClient
+from modules.control.control_protocol import (
+    MAX_MESSAGE_SIZE,
+    MESSAGE_LENGTH,
+    ControlError,
+    MessageReader,
+    encode_message,
+)
+from modules.control.control_server import ControlServer
+from modules.device_state import DeviceState
+from modules.system_config import load_config
+from modules.system_controller.system_controller import SystemController
+from modules.wire_protocol import FrameParser
+
+HOST = "127.0.0.1"
+
+
+class FrameSink:
+    """
+    Accepts one camera stream and keeps (receive time, frame type, payload) of each frame
+    """
+
+    def __init__(self):
+        self.server = socket.create_server((HOST, 0))
+        self.port = self.server.getsockname()[1]
+        self.frames = []
+        threading.Thread(target=self.__receive, daemon=True).start()
+
+    def __receive(self):
+        connection, _ = self.server.accept()
+        parser = FrameParser()
+        with connection:
+            while parser.recv_into(connection):
+                for frame in parser.parse():
+                    frame_type = CAMERA_HEADER.unpack_from(frame.payload)[2]
+                    self.frames.append((time.monotonic(), frame_type, bytes(frame.payload[CAMERA_HEADER.size:])))
+
+    def count_since(self, start):
+        return sum(1 for received, _, _ in self.frames if received >= start)
+
+    def close(self):
+        self.server.close()
+
+
+def test_message_reader():
+    messages = [{"id": 1, "type": control.STATUS}, {"id": 2, "type": control.PAUSE, "camera": 0}]
+    data = b"".join(encode_message(message) for message in messages)
+    reader = MessageReader()
+    received = []
+    for i in range(0, len(data), 7):  # Split across messages and length prefixes
+        received += reader.feed(data[i:i + 7])
+    assert received == messages
+
+    with pytest.raises(ControlError):
+        MessageReader().feed(MESSAGE_LENGTH.pack(MAX_MESSAGE_SIZE + 1))
+    with pytest.raises(ControlError):
+        MessageReader().feed(MESSAGE_LENGTH.pack(3) + b"[1]")
+
+
+def test_server_dispatch_and_errors():
+    def fail(camera, params):
+        raise ValueError("bad value")
+
+    def broken_pipe(camera, params):
+        raise BrokenPipeError("worker pipe closed")
+
+    handlers = {
+        control.STATUS: lambda camera, params: {"camera": camera, **params},
+        control.PAUSE: fail,
+        control.RESUME: broken_pipe,
+    }
+    server = ControlServer(handlers, host=HOST, port=0)
+    server.start()
+    with ControlClient(HOST, server.port) as client:
+        assert client.request(control.STATUS, camera=1, fps=5) == {"camera": 1, "fps": 5}
+        with pytest.raises(ControlError, match="bad value"):
+            client.request(control.PAUSE)
+        with pytest.raises(ControlError, match="worker pipe closed"):
+            client.request(control.RESUME)  # Answered, the connection stays open
+        with pytest.raises(ControlError, match="Unknown request type"):
+            client.request("reboot")
+        assert client.request(control.STATUS) == {"camera": None}  # Still usable after errors
+    server.stop()
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"width": "abc"},
+        {"width": -640},
+        {"height": 480.5},
+        {"fps": 0},
+        {"fps": float("nan")},
+        {"quality": 101},
+        {"quality": True},
+        {"frame_size_budget": None},
+        {"max_gyro_rate": -1.0},
+    ],
+)
+def test_bad_stream_values_rejected(changes):
+    manager = CameraDeviceManager(mp.Event(), config=load_config())
+    with pytest.raises(ValueError):
+        manager.set_stream_params(None, **changes)
+    assert manager.overrides == {}  # Nothing is kept for the worker to apply again after a restart
+
+
+@pytest.mark.parametrize(
+    "request_fields", [{"count": 0}, {"count": 10 ** 6}, {"width": "abc"}, {"height": -1}, {"quality": 500}]
+)
+def test_bad_snapshot_values_rejected(request_fields):
+    manager = CameraDeviceManager(mp.Event(), config=load_config())
+    with pytest.raises(ValueError):
+        manager.snapshot(None, **request_fields)
+
+
+def test_camera_commands():
+    sink = FrameSink()
+    config = load_config()
+    config["hal"]["camera"].update(backend="synthetic", count=1)
+    config["hal"]["imu"]["backend"] = "synthetic"
+    config["hal"]["clock"] = "real"
+    config["camera"]["state_profiles"] = {}
+    config["bandwidth"]["enabled"] = False
+    config["governor"]["enabled"] = False
+    config["scheduling"]["enabled"] = False
+    with socket.create_server((HOST, 0)) as closed:
+        imu_port = closed.getsockname()[1]  # Refused, the IMU is not under test
+    config["network"].update(server_host=HOST, camera_base_port=sink.port, imu_host=HOST, imu_port=imu_port)
+
+    controller = SystemController(config=config)
+    port = controller.start_control_server(port=0)
+    client = ControlClient(HOST, port)
+    try:
+        client.request(control.ARM)
+        controller.start()
+        assert client.request(control.STATUS)["state"] == DeviceState.ARMED.name
+
+        # Default profile is 2 fps, raise it to 20
+        result = client.request(control.SET_STREAM, camera=0, fps=20.0)
+        assert result["0"]["fps"] == 20.0
+        time.sleep(0.5)
+        start = time.monotonic()
+        time.sleep(1.0)
+        assert sink.count_since(start) >= 10
+        with pytest.raises(ControlError):
+            client.request(control.SET_STREAM, camera=0, encoders=["png"])
+        with pytest.raises(ControlError):
+            client.request(control.SET_STREAM, camera=5, fps=1.0)
+        with pytest.raises(ControlError, match="width must be an integer"):
+            client.request(control.SET_STREAM, camera=0, width="abc")
+        assert client.request(control.SET_STREAM, camera=0, quality=70)["0"]["width"] == result["0"]["width"]
+
+        # Paused cameras send nothing
+        assert client.request(control.PAUSE, camera=0) == [0]
+        assert client.request(control.STATUS)["cameras"][0]["paused"]
+        time.sleep(0.3)
+        start = time.monotonic()
+        time.sleep(0.5)
+        assert sink.count_since(start) == 0
+
+        # Snapshots are taken while paused, at their own resolution
+        client.request(control.SNAPSHOT, camera=0, count=2, width=640, height=480)
+        time.sleep(0.5)
+        snapshots = [payload for _, frame_type, payload in sink.frames if frame_type == FRAME_SNAPSHOT]
+        assert len(snapshots) == 2
+        assert TileDeltaDecoder().decode(FRAME_SNAPSHOT, snapshots[0]).shape[:2] == (480, 640)
+
+        client.request(control.RESUME)
+        start = time.monotonic()
+        time.sleep(0.5)
+        assert sink.count_since(start) >= 5
+
+        assert "camera" in client.request(control.METRICS)
+        assert client.request(control.DISARM) == {"changed": True}
+        assert controller.device_state == DeviceState.DISARMED
+    finally:
+        client.close()
+        controller.stop_control_server()
+        controller.stop()
+        sink.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    server = ControlServer({control.STATUS: lambda camera, params: {"state": "ARMED"}}, host=HOST, port=0)
+    server.start()
+    with ControlClient(HOST, server.port) as client:
+        count = 1000
+        start = time.perf_counter()
+        for _ in range(count):
+            client.request(control.STATUS)
+        elapsed = time.perf_counter() - start
+    server.stop()
+    logging.info(f"Control request round trip {1e6 * elapsed / count:.0f} us")
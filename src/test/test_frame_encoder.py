@@ -0,0 +1,177 @@
+"""
+Checks encoder selection and the encoder backends: the fastest preset whose output fits the frame
+size budget is picked, the smallest output when none fits, and the stream quality and preset options
+reach each backend's cv2 parameters. Run directly to benchmark every backend on a synthetic frame
+"""
+
+import os
+import sys
+
+import logging
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter import frame_encoder
+from modules.camera_transmitter.frame_encoder import (
+    ENCODER_BACKENDS,
+    EncoderPreset,
+    FrameEncoder,
+    GrayJpegEncoder,
+    JpegEncoder,
+    PngEncoder,
+    WebpEncoder,
+    create_encoder,
+    select_encoder,
+)
+from modules.camera_transmitter.stream_profile import resolve_camera_profiles
+
+
+def make_frame(width=320, height=240, seed=0):
+    """
+    Smooth gradient with some noise, compresses roughly like a camera image
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width)[None, :, None]
+    y = np.linspace(0, 255, height)[:, None, None]
+    frame = (x + y) / 2 + rng.normal(0, 8, (height, width, 3))
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+class FakeEncoder(FrameEncoder):
+    """
+    Takes a fixed time on the fake clock and returns a fixed size
+    """
+
+    def __init__(self, name, seconds, size, clock):
+        super().__init__(EncoderPreset(name=name, backend="fake"), quality=80)
+        self.seconds = seconds
+        self.size = size
+        self.clock = clock
+
+    def encode(self, frame):
+        self.clock.now += self.seconds
+        return self.size > 0, np.zeros(self.size, dtype=np.uint8)
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(frame_encoder, "time", types.SimpleNamespace(perf_counter=lambda: clock.now))
+    return clock
+
+
+def test_fastest_within_budget(fake_clock):
+    encoders = [
+        FakeEncoder("fast_large", 0.001, 50000, fake_clock),
+        FakeEncoder("slow_small", 0.010, 10000, fake_clock),
+        FakeEncoder("medium", 0.005, 20000, fake_clock),
+    ]
+    encoder, results = select_encoder(encoders, make_frame(), size_budget=30000)
+    assert encoder.preset.name == "medium"
+    assert [result.preset for result in results] == ["fast_large", "slow_small", "medium"]
+    assert results[2].encode_seconds == pytest.approx(0.005) and results[2].size == 20000
+
+    encoder, _ = select_encoder(encoders, make_frame(), size_budget=50000)
+    assert encoder.preset.name == "fast_large"
+
+
+def test_smallest_when_none_fits(fake_clock):
+    encoders = [
+        FakeEncoder("failed", 0.001, 0, fake_clock),  # A failed encode never counts as the smallest
+        FakeEncoder("large", 0.001, 50000, fake_clock),
+        FakeEncoder("small", 0.010, 20000, fake_clock),
+    ]
+    encoder, _ = select_encoder(encoders, make_frame(), size_budget=1000)
+    assert encoder.preset.name == "small"
+
+    with pytest.raises(ValueError):
+        select_encoder([], make_frame(), size_budget=1000)
+
+
+def test_real_encoders_select_by_size():
+    frame = make_frame()
+    png = create_encoder(EncoderPreset(name="lossless", backend="png"), quality=80)
+    jpeg = create_encoder(EncoderPreset(name="jpeg", backend="jpeg"), quality=80)
+    _, results = select_encoder([png, jpeg], frame, size_budget=1 << 30, repeats=1)
+    png_size, jpeg_size = results[0].size, results[1].size
+    assert jpeg_size < png_size
+
+    # Only the JPEG fits between the two sizes, whichever is faster here
+    encoder, _ = select_encoder([png, jpeg], frame, size_budget=(png_size + jpeg_size) // 2, repeats=1)
+    assert encoder is jpeg
+
+
+def test_create_encoder_backends():
+    for backend, encoder_class in ENCODER_BACKENDS.items():
+        encoder = create_encoder(EncoderPreset(name=backend, backend=backend), quality=55)
+        assert type(encoder) is encoder_class and encoder.quality == 55
+    assert len({encoder_class.ENCODER_ID for encoder_class in ENCODER_BACKENDS.values()}) == len(ENCODER_BACKENDS)
+
+    with pytest.raises(ValueError, match="Unknown encoder backend 'h264' in preset 'video'"):
+        create_encoder(EncoderPreset(name="video", backend="h264"), quality=55)
+
+
+def test_chroma_subsampling_checked_on_load():
+    # Unquoted in YAML the value is an int
+    assert EncoderPreset(name="p", backend="jpeg", chroma_subsampling=444).chroma_subsampling == "444"
+    with pytest.raises(ValueError, match="chroma_subsampling 421"):
+        EncoderPreset(name="p", backend="jpeg", chroma_subsampling=421)
+    with pytest.raises(ValueError, match="chroma_subsampling .4:2:0."):
+        resolve_camera_profiles({
+            "default_profile": "low",
+            "encoders": {"jpeg": {"backend": "jpeg", "chroma_subsampling": "4:2:0"}},
+            "profiles": {"low": {}},
+        })
+
+
+def test_quality_maps_to_backend_params():
+    preset = EncoderPreset(name="p", backend="jpeg", chroma_subsampling="444", optimize=True, compression=7)
+    assert JpegEncoder(preset, 42).params() == [
+        cv2.IMWRITE_JPEG_QUALITY, 42,
+        cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+        cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    ]
+    assert GrayJpegEncoder(preset, 42).params() == [cv2.IMWRITE_JPEG_QUALITY, 42, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    assert WebpEncoder(preset, 42).params() == [cv2.IMWRITE_WEBP_QUALITY, 42]
+    assert PngEncoder(preset, 42).params() == [cv2.IMWRITE_PNG_COMPRESSION, 7]  # Lossless, quality ignored
+
+
+@pytest.mark.parametrize("backend", ["jpeg", "gray_jpeg", "webp"])
+def test_quality_changes_output(backend):
+    frame = make_frame()
+    sizes = []
+    for quality in (20, 90):
+        success, encoded = create_encoder(EncoderPreset(name=backend, backend=backend), quality).encode(frame)
+        assert success
+        sizes.append(len(encoded))
+    assert sizes[0] < sizes[1]
+
+
+def test_gray_jpeg_decodes_single_channel():
+    success, encoded = create_encoder(EncoderPreset(name="gray", backend="gray_jpeg"), 80).encode(make_frame())
+    assert success
+    assert cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED).shape == (240, 320)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    frame = make_frame(1280, 720)
+    presets = [
+        EncoderPreset(name="jpeg_420", backend="jpeg"),
+        EncoderPreset(name="jpeg_444_optimized", backend="jpeg", chroma_subsampling="444", optimize=True),
+        EncoderPreset(name="gray_jpeg", backend="gray_jpeg"),
+        EncoderPreset(name="webp", backend="webp"),
+        EncoderPreset(name="png_1", backend="png"),
+    ]
+    encoders = [create_encoder(preset, quality=80) for preset in presets]
+    encoder, _ = select_encoder(encoders, frame, size_budget=200000, repeats=10)
+    logging.info(f"Selected {encoder} for a 200000 byte budget at 1280x720")
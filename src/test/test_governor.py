@@ -0,0 +1,191 @@
+"""
+Checks the performance governor against a fake sysfs tree: sensor readings, stepping the camera
+limits down under thermal, CPU and firmware throttle pressure and back up with headroom, and the
+limits reaching the camera workers of a running system. Run directly to simulate a heat soak with a
+simple thermal model and log the governor's decisions
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter.stream_profile import NO_LIMIT, StreamLimit, StreamProfile
+from modules.clock import VirtualClock
+from modules.governor.fake_sysfs import FakeSysfs
+from modules.governor.performance_governor import PerformanceGovernor
+from modules.governor.system_sensors import THROTTLED, UNDER_VOLTAGE, SystemSensors
+from modules.system_config import load_config
+from modules.system_controller.system_controller import SystemController
+
+HOST = "127.0.0.1"
+STEPS = [StreamLimit(max_quality=70), StreamLimit(fps_scale=0.5), StreamLimit(resolution_scale=0.5)]
+
+
+def make_governor(fake, clock, hold=0.0):
+    limits = []
+    governor = PerformanceGovernor(
+        SystemSensors(fake.root), limits.append, STEPS, soft_temp=70.0, hard_temp=78.0, hold=hold, clock=clock
+    )
+    return governor, limits
+
+
+def test_sensors_read_fake_sysfs():
+    fake = FakeSysfs(cpus=4, zones=2, max_freq=1800.0)
+    fake.set_temperature(61.5, zone=1)
+    fake.set_cpu_freq(600.0)
+    fake.set_load_average(3.0)
+    fake.set_throttled(UNDER_VOLTAGE)
+
+    sensors = SystemSensors(fake.root)
+    sensors.read()  # Usage is measured from the previous reading
+    fake.set_cpu_usage(0.25)
+    reading = sensors.read()
+    assert reading.temperature == 61.5
+    assert reading.cpu_freq == 600.0 and reading.max_cpu_freq == 1800.0
+    assert reading.cpu_usage == 0.25
+    assert reading.load_average == 0.75
+    assert not reading.firmware_throttled()  # Under-voltage alone does not slow the CPU
+    fake.set_throttled(UNDER_VOLTAGE | THROTTLED)
+    assert sensors.read().firmware_throttled()
+
+    empty = SystemSensors(os.path.join(fake.root, "missing")).read()
+    assert empty.temperature is None and empty.cpu_usage is None and not empty.firmware_throttled()
+
+
+def test_limit_applies_to_profiles():
+    profile = StreamProfile(fps=10.0, width=1920, height=1080, quality=90)
+    limit = NO_LIMIT
+    for step in STEPS:
+        limit = limit.combine(step)
+    limited = limit.apply(profile)
+    assert (limited.fps, limited.width, limited.height, limited.quality) == (5.0, 960, 540, 70)
+    assert NO_LIMIT.apply(profile) is profile
+    assert StreamLimit(max_quality=95).apply(profile).quality == 90  # Never raises quality
+
+
+def test_steps_down_and_restores():
+    fake = FakeSysfs()
+    clock = VirtualClock()
+    governor, limits = make_governor(fake, clock)
+
+    assert governor.update() == 0 and limits == []
+    fake.set_temperature(72.0)
+    assert [governor.update() for _ in range(4)] == [1, 2, 3, 3]  # One step per update
+    assert limits[-1] == governor.limit_for(3)
+
+    fake.set_temperature(67.0)  # Below soft_temp but within restore_margin of it
+    assert governor.update() == 3
+    fake.set_temperature(60.0)
+    assert [governor.update() for _ in range(3)] == [2, 1, 0]
+    assert limits[-1] == NO_LIMIT
+
+    fake.set_temperature(80.0)  # Past the hard limit every step is applied at once
+    assert governor.update() == 3
+    fake.set_temperature(50.0)
+    governor.update()
+
+    # CPU saturation and the firmware throttle flags are pressure too
+    fake.set_cpu_usage(0.95)
+    assert governor.update() == 3
+    fake.set_cpu_usage(0.2)
+    assert governor.update() == 2
+    fake.set_throttled(THROTTLED)
+    assert governor.update() == 3
+
+    metrics = governor.get_metrics()
+    assert metrics["level"] == 3 and metrics["pressure"] == ["firmware throttle"]
+    assert metrics["decisions"][-1]["reason"] == "firmware throttle"
+    assert metrics["changes"] == len(limits)
+
+
+def test_hold_between_changes():
+    fake = FakeSysfs()
+    clock = VirtualClock()
+    governor, limits = make_governor(fake, clock, hold=10.0)
+    fake.set_temperature(75.0)
+    assert [governor.update() for _ in range(3)] == [1, 1, 1]
+    clock.sleep(10.0)
+    assert governor.update() == 2
+
+
+def test_system_controller_limits_cameras():
+    fake = FakeSysfs()
+    config = load_config()
+    config["hal"]["camera"].update(backend="synthetic", count=1)
+    config["hal"]["imu"]["backend"] = "synthetic"
+    config["hal"]["clock"] = "real"
+    config["camera"]["state_profiles"] = {}
+    config["scheduling"]["enabled"] = False
+    config["network"].update(server_host=HOST, imu_host=HOST)
+    config["governor"].update(
+        enabled=True, sysfs_root=fake.root, interval=0.05, hold=0.0,
+        steps=[{"max_quality": 50}, {"fps_scale": 0.5, "resolution_scale": 0.5}],
+    )
+
+    controller = SystemController(config=config)
+    controller.arm()
+    controller.start()
+    try:
+        worker = controller.camera_controller.worker_queue[0]
+        controller.camera_controller.set_stream_params(None, fps=20.0)
+        base = worker.profile
+
+        fake.set_temperature(75.0)
+        time.sleep(0.5)
+        assert controller.get_metrics()["governor"]["level"] == 2
+        assert worker.profile == base.with_changes(fps=10.0, width=160, height=120, quality=50)
+        # Base station changes are limited too
+        assert controller.camera_controller.set_stream_params(None, fps=8.0)[0]["fps"] == 4.0
+
+        fake.set_temperature(50.0)
+        time.sleep(0.5)
+        assert controller.get_metrics()["governor"]["level"] == 0
+        assert worker.profile == base.with_changes(fps=8.0)
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    # First order thermal model: the SoC heads for ambient plus a rise proportional to the camera
+    # pixel rate, with a time constant of a few minutes. At full rate it would pass the hard limit
+    ambient, full_rise, time_constant = 35.0, 55.0, 120.0
+    fake = FakeSysfs()
+    clock = VirtualClock()
+    config = load_config()["governor"]
+    profile = StreamProfile(fps=15.0, width=1280, height=720, quality=85)
+    state = {"limit": NO_LIMIT}
+    governor = PerformanceGovernor.from_config(
+        SystemSensors(fake.root), lambda limit: state.update(limit=limit), config, clock=clock
+    )
+
+    temperature, peak = ambient, ambient
+    step = config["interval"]
+    for _ in range(int(1800 / step)):  # 30 simulated minutes
+        limited = state["limit"].apply(profile)
+        load = (limited.fps * limited.width * limited.height) / (profile.fps * profile.width * profile.height)
+        target = ambient + full_rise * load
+        temperature += (target - temperature) * step / time_constant
+        peak = max(peak, temperature)
+        fake.set_temperature(temperature)
+        fake.set_cpu_usage(0.3 + 0.5 * load)
+        governor.update()
+        clock.sleep(step)
+
+    for decision in governor.decisions:
+        logging.info(
+            f"{decision['time']:7.0f} s: level {decision['from']} -> {decision['to']} "
+            f"({decision['reason']}, {decision['temperature']:.1f} C)"
+        )
+    logging.info(
+        f"Peak {peak:.1f} C, hard limit {config['hard_temp']} C, "
+        f"final level {governor.level}, {governor.changes} changes"
+    )
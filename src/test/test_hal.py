@@ -0,0 +1,167 @@
+"""
+Checks the hardware abstraction layer backends: registry lookups, synthetic camera frames, pacing
+and buffer timestamps, the in-memory GPIO driving the arming button, and the synthetic IMU bus
+taking the motion detector through its transitions. Run directly to measure synthetic frame
+generation cost per pattern
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.arming_button.button import ArmingButton
+from modules.arming_button.button_service import ButtonService
+from modules.clock import VirtualClock
+from modules.device_state import DeviceState
+from modules.hal.camera import PacedCapture
+from modules.hal.gpio import InMemoryGPIO
+from modules.hal.imu import SyntheticIMUBus
+from modules.hal.registry import CAMERA_BACKENDS, GPIO_BACKENDS, IMU_BACKENDS, BackendRegistry, create_backend
+from modules.imu.icm20948 import ICM20948
+from modules.imu.motion_detector import MotionDetector
+from modules.system_config import DEFAULT_CONFIG
+from modules.system_controller.device_state_machine import DeviceStateMachine
+
+
+def make_camera(pattern, width=320, height=240, fps=50):
+    camera = create_backend(CAMERA_BACKENDS, {"backend": "synthetic", "synthetic": {"pattern": pattern}}, 0)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    camera.set(cv2.CAP_PROP_FPS, fps)
+    return camera
+
+
+def test_registry():
+    registry = BackendRegistry("test")
+    registry.register("direct", dict)
+    registry.register("lazy", "..imu.fake_i2c:FakeICM20948Bus")
+    assert registry.create("direct", a=1) == {"a": 1}
+    assert registry.load("lazy").__name__ == "FakeICM20948Bus"
+    with pytest.raises(ValueError):
+        registry.load("missing")
+
+    # Every default backend and each option section names a registered backend
+    for registry, section in ((CAMERA_BACKENDS, "camera"), (IMU_BACKENDS, "imu"), (GPIO_BACKENDS, "gpio")):
+        config = DEFAULT_CONFIG["hal"][section]
+        assert config["backend"] in registry.backends
+        assert all(name in registry.backends for name in config if isinstance(config[name], dict))
+    assert isinstance(create_backend(GPIO_BACKENDS, {"backend": "memory"}), InMemoryGPIO)
+
+
+def test_synthetic_camera_frames_and_pacing():
+    for pattern in ("bars", "static", "noise"):
+        camera = make_camera(pattern)
+        assert camera.isOpened()
+        result, frame = camera.read()
+        assert result and frame.shape == (240, 320, 3) and frame.dtype == np.uint8
+
+    camera = make_camera("static", fps=50)
+    camera.read()
+    start = time.monotonic()
+    for _ in range(10):
+        camera.read()
+    assert time.monotonic() - start >= 10 / 50 - 0.01
+
+    # Static frames only differ in one tile
+    _, first = camera.read()
+    _, second = camera.read()
+    assert 0 < np.count_nonzero(np.any(first != second, axis=2)) <= 2 * 32 * 32
+
+    camera.release()
+    assert camera.read() == (False, None) and not camera.grab()
+    with pytest.raises(ValueError):
+        CAMERA_BACKENDS.create("synthetic", 0, pattern="missing")
+
+
+def test_grab_paces_and_timestamps():
+    clock = VirtualClock()
+    camera = CAMERA_BACKENDS.create("synthetic", 0, clock=clock)
+    camera.set(cv2.CAP_PROP_FPS, 10)
+    assert camera.get(cv2.CAP_PROP_POS_MSEC) == 0.0  # Nothing captured yet
+    camera.read()
+    # Skipped frames are taken at the camera's rate too, so the next read is a fresh frame
+    for _ in range(5):
+        assert camera.grab()
+    assert clock.monotonic() == pytest.approx(0.5)
+    clock.sleep(0.05)
+    camera.read()
+    # The buffer time is when the frame was due, in monotonic() milliseconds
+    assert camera.get(cv2.CAP_PROP_POS_MSEC) == pytest.approx(600.0)
+    assert clock.monotonic() == pytest.approx(0.6) and camera.frames == 2
+    clock.unregister()
+
+
+def test_paced_capture_needs_next_frame():
+    class NoFrames(PacedCapture):
+        pass
+
+    with pytest.raises(TypeError, match="next_frame"):
+        NoFrames(0)
+
+
+def test_in_memory_gpio_arms_button():
+    gpio = InMemoryGPIO()
+    button = ArmingButton(gpio=gpio)
+    assert button.state == DeviceState.DISARMED
+    assert gpio.input(button.led_pins["R"]) == gpio.LOW  # Red on
+
+    state_machine = DeviceStateMachine()
+    service = ButtonService(button, state_machine)
+    state_changes = state_machine.subscribe()
+    service.start()
+    gpio.press(button.button_pin, hold=0.1)
+    assert state_changes.wait(timeout=2.0) == DeviceState.ARMED
+    time.sleep(0.1)  # LED thread
+    assert button.state == DeviceState.ARMED
+    assert [gpio.input(button.led_pins[colour]) for colour in "RGB"] == [gpio.HIGH, gpio.LOW, gpio.HIGH]
+    service.stop()
+
+    # Edge callbacks
+    edges = []
+    gpio.add_event_detect(button.button_pin, gpio.FALLING, callback=edges.append)
+    gpio.press(button.button_pin)
+    gpio.release(button.button_pin)
+    assert edges == [button.button_pin]
+
+
+def test_synthetic_imu_motion_transitions():
+    clock = VirtualClock()
+    bus = SyntheticIMUBus(still_seconds=4.0, moving_seconds=2.0, clock=clock)
+    sensor = ICM20948(bus, sample_rate=225)
+    sensor.configure()
+    detector = MotionDetector(sensor.sample_rate)
+
+    transitions = []
+    while clock.monotonic() < 12.0:
+        clock.sleep(0.05)
+        transitions += detector.update(sensor.read_samples(now=clock.time()))
+    clock.unregister()
+
+    states = [state for _, state in transitions]
+    assert DeviceState.STATIONARY in states and DeviceState.MOVING in states
+    # Moving starts 4 s into each 6 s period
+    moving_times = [timestamp - bus.start for timestamp, state in transitions if state == DeviceState.MOVING]
+    assert any(4.0 <= offset % 6.0 < 4.5 for offset in moving_times)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    for pattern in ("bars", "static", "noise"):
+        camera = make_camera(pattern, width=1280, height=720, fps=1e6)
+        start = time.perf_counter()
+        for _ in range(100):
+            camera.read()
+        elapsed = time.perf_counter() - start
+        logging.info(f"{pattern}: {1e3 * elapsed / 100:.2f} ms per 1280x720 frame")
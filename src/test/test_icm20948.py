@@ -0,0 +1,154 @@
+"""
+Runs the ICM20948 driver against the fake I2C register map: checks the configuration, FIFO decoding
+and overflow recovery, and compares burst FIFO reads with the previous per-register polling over a
+simulated 400 kHz bus
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.imu import icm20948 as icm
+from modules.imu.fake_i2c import FakeICM20948Bus
+from modules.imu.icm20948 import ICM20948
+
+BUS_HZ = 400000
+DURATION = 3  # seconds
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_sensor(**kwargs):
+    clock = VirtualClock()
+    bus = FakeICM20948Bus(clock=clock)
+    sensor = ICM20948(bus, **kwargs)
+    sensor.configure()
+    return sensor, bus, clock
+
+
+def test_configure():
+    sensor, bus, _ = make_sensor(sample_rate=225, accel_range=8, gyro_range=1000, mag_rate=50)
+    assert sensor.divider == 4
+    assert sensor.sample_rate == 225.0
+    assert bus.sample_rate() == 225.0
+    assert bus.banks[0][icm.FIFO_EN_2] == icm.ACCEL_GYRO_FIFO
+    assert bus.banks[0][icm.INT_PIN_CFG] & icm.BYPASS_EN
+    assert bus.mag_registers[icm.AK09916_CNTL2] == icm.MAG_MODES[50]
+
+
+def test_fifo_decode():
+    sensor, bus, clock = make_sensor(sample_rate=1125, accel_range=4, gyro_range=500)
+    clock.now = 0.02
+    block = sensor.read_samples(now=clock.now)
+    assert len(block) == int(0.02 * 1125)
+
+    times = np.arange(1, len(block) + 1) / 1125
+    expected = bus.signal(times)
+    np.testing.assert_allclose(block[:, 1:7], expected[:, 0:6], atol=2 * sensor.scale.max())
+    np.testing.assert_allclose(block[-1, 7:10], expected[0, 6:9], atol=icm.MAG_SCALE)
+    np.testing.assert_allclose(np.diff(block[:, 0]), 1 / 1125)
+
+    # Only new samples are returned by the next read
+    clock.now = 0.03
+    assert len(sensor.read_samples(now=clock.now)) == int(0.03 * 1125) - int(0.02 * 1125)
+
+
+def test_fifo_overflow():
+    sensor, _, clock = make_sensor(sample_rate=1125)
+    clock.now = 1.0  # Far more samples than the FIFO holds
+    assert len(sensor.read_samples(now=clock.now)) == 0
+    assert sensor.overflows == 1
+
+    clock.now = 1.01
+    assert len(sensor.read_samples(now=clock.now)) > 0
+
+
+def test_set_sample_rate():
+    sensor, bus, clock = make_sensor(sample_rate=1125)
+    clock.now = 0.02
+    # Samples taken before the change come back at the old spacing
+    tail = sensor.set_sample_rate(56.25, now=clock.now)
+    assert len(tail) == int(0.02 * 1125)
+    np.testing.assert_allclose(np.diff(tail[:, 0]), 1 / 1125)
+    assert sensor.sample_rate == bus.sample_rate() == 56.25
+    assert bus.banks[2][icm.ACCEL_SMPLRT_DIV_2] == 19
+
+    clock.now = 0.52
+    block = sensor.read_samples(now=clock.now)
+    assert len(block) == int(0.5 * 56.25)
+    np.testing.assert_allclose(np.diff(block[:, 0]), 1 / 56.25)
+
+
+def run_fifo_polling(poll_interval):
+    """
+    Returns (samples/s, I2C transactions/s, bus utilization) draining the FIFO every poll_interval
+    """
+    bus = FakeICM20948Bus(bus_hz=BUS_HZ)
+    sensor = ICM20948(bus, sample_rate=1125)
+    sensor.configure()
+    start_transactions, start_busy = bus.transactions, bus.busy_seconds
+
+    samples = 0
+    start = time.monotonic()
+    while time.monotonic() - start < DURATION:
+        samples += len(sensor.read_samples())
+        time.sleep(poll_interval)
+    elapsed = time.monotonic() - start
+    return (
+        samples / elapsed,
+        (bus.transactions - start_transactions) / elapsed,
+        (bus.busy_seconds - start_busy) / elapsed,
+        sensor.overflows,
+    )
+
+
+def run_register_polling():
+    """
+    Previous approach: accel, gyro and mag read as separate transactions followed by a 20 ms sleep
+    """
+    bus = FakeICM20948Bus(bus_hz=BUS_HZ)
+    ICM20948(bus).configure()
+    start_transactions, start_busy = bus.transactions, bus.busy_seconds
+
+    samples = 0
+    start = time.monotonic()
+    while time.monotonic() - start < DURATION:
+        bus.read_block(bus.address, icm.ACCEL_XOUT_H, 6)
+        bus.read_block(bus.address, icm.ACCEL_XOUT_H + 6, 6)
+        bus.read_block(icm.AK09916_ADDRESS, icm.AK09916_ST1, 9)
+        samples += 1
+        time.sleep(0.02)
+    elapsed = time.monotonic() - start
+    return (
+        samples / elapsed,
+        (bus.transactions - start_transactions) / elapsed,
+        (bus.busy_seconds - start_busy) / elapsed,
+        0,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+    logging.info(f"{'Mode':<22}{'Samples/s':>11}{'I2C txn/s':>11}{'Bus busy (%)':>14}{'Overflows':>11}")
+
+    results = [("registers, 20 ms sleep", run_register_polling())]
+    for poll_interval in (0.005, 0.01, 0.03):
+        results.append((f"FIFO, {1e3 * poll_interval:.0f} ms poll", run_fifo_polling(poll_interval)))
+
+    for name, (rate, transactions, busy, overflows) in results:
+        logging.info(f"{name:<22}{rate:>11.1f}{transactions:>11.1f}{100 * busy:>14.1f}{overflows:>11}")
@@ -29,8 +29,7 @@ if __name__ == "__main__":
     try:
         stop_event = mp.Event()
 
-        imu_shared_array = mp.Array("d", 9)
-        imu_data = IMUSharedData(imu_shared_array)
+        imu_data = IMUSharedData()
 
         imu_manager = IMUManager(stop_event=stop_event, imu_data=imu_data)
         imu_manager.start_imu_worker(imu_data)
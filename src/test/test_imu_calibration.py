@@ -0,0 +1,141 @@
+"""
+Checks the IMU calibration fits against synthetic readings with known accel bias, scale and
+misalignment, gyro bias and mag hard/soft iron distortion, and the calibration file round trip.
+Run directly to compare applying the calibration per batch with the old per-read offsets
+"""
+
+import os
+import sys
+
+import logging
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.imu.icm20948 import STANDARD_GRAVITY
+from modules.imu.imu_calibration import (
+    ACCEL_POSES,
+    CALIBRATION_VERSION,
+    IMUCalibration,
+    fit_calibration,
+    fit_ellipsoid,
+    load_calibration,
+)
+from modules.imu.imu_ring_buffer import ACCEL, GYRO, MAG, NUM_COLUMNS
+
+ACCEL_BIAS = np.array([0.3, -0.15, 0.4])
+# Per-axis scale error with a small cross-axis term
+ACCEL_DISTORTION = np.array([[1.02, 0.01, 0.0], [0.0, 0.97, -0.02], [0.015, 0.0, 1.01]])
+GYRO_BIAS = np.array([0.0045, -0.0107, 0.0136])
+MAG_BIAS = np.array([12.0, -30.0, 5.0])
+MAG_DISTORTION = np.array([[1.1, 0.05, 0.0], [0.05, 0.9, 0.02], [0.0, 0.02, 1.0]])
+FIELD = 50.0  # uT
+
+
+def pose_samples(seed=0, count=300):
+    rng = np.random.default_rng(seed)
+    poses = {}
+    for pose, up in ACCEL_POSES.items():
+        true = STANDARD_GRAVITY * np.array(up)
+        poses[pose] = ACCEL_DISTORTION @ true + ACCEL_BIAS + rng.normal(0, 0.05, (count, 3))
+    gyro = GYRO_BIAS + rng.normal(0, 0.01, (count * len(ACCEL_POSES), 3))
+    return poses, gyro
+
+
+def mag_samples(seed=0, count=2000):
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return (FIELD * directions) @ MAG_DISTORTION.T + MAG_BIAS + rng.normal(0, 0.3, (count, 3))
+
+
+def test_fit_recovers_distortion():
+    poses, gyro = pose_samples()
+    calibration = fit_calibration(poses, gyro, mag_samples())
+
+    np.testing.assert_allclose(calibration.accel_bias, ACCEL_BIAS, atol=0.01)
+    np.testing.assert_allclose(calibration.accel_matrix @ ACCEL_DISTORTION, np.eye(3), atol=0.005)
+    np.testing.assert_allclose(calibration.gyro_bias, GYRO_BIAS, atol=0.001)
+    np.testing.assert_allclose(calibration.mag_bias, MAG_BIAS, atol=0.5)
+
+    # Corrected readings lie on a sphere
+    block = np.zeros((2000, NUM_COLUMNS))
+    block[:, MAG] = mag_samples(seed=1)
+    block[:, ACCEL] = poses["X-"][0]
+    calibration.apply(block)
+    radii = np.linalg.norm(block[:, MAG], axis=1)
+    assert radii.std() / radii.mean() < 0.01
+    assert abs(radii.mean() - FIELD) < 2.0
+    np.testing.assert_allclose(block[0, ACCEL], (-STANDARD_GRAVITY, 0, 0), atol=0.2)
+
+
+def test_apply_matches_per_sensor_correction():
+    rng = np.random.default_rng(2)
+    _, matrix, _ = fit_ellipsoid(mag_samples())
+    calibration = IMUCalibration(ACCEL_BIAS, np.linalg.inv(ACCEL_DISTORTION), GYRO_BIAS, MAG_BIAS, matrix)
+    raw = rng.normal(0, 10, (50, NUM_COLUMNS))
+    block = calibration.apply(raw.copy())
+
+    np.testing.assert_allclose(block[:, ACCEL], (raw[:, ACCEL] - ACCEL_BIAS) @ np.linalg.inv(ACCEL_DISTORTION).T)
+    np.testing.assert_allclose(block[:, GYRO], raw[:, GYRO] - GYRO_BIAS)
+    np.testing.assert_allclose(block[:, MAG], (raw[:, MAG] - MAG_BIAS) @ matrix.T)
+    # Other columns are untouched
+    np.testing.assert_array_equal(block[:, 0], raw[:, 0])
+    np.testing.assert_array_equal(block[:, 10:], raw[:, 10:])
+
+
+def test_file_round_trip_and_version():
+    poses, gyro = pose_samples()
+    calibration = fit_calibration(poses, gyro, mag_samples())
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "imu_calibration.yaml")
+        calibration.save(path)
+        loaded = load_calibration(path)
+        np.testing.assert_allclose(loaded.offset, calibration.offset)
+        np.testing.assert_allclose(loaded.matrix_t, calibration.matrix_t)
+        assert loaded.created == calibration.created
+
+        with open(path) as file:
+            data = yaml.safe_load(file)
+        assert data["version"] == CALIBRATION_VERSION
+        data["version"] = CALIBRATION_VERSION + 1
+        with open(path, "w") as file:
+            yaml.safe_dump(data, file)
+        # Unknown versions and missing files fall back to the raw readings
+        for bad_path in (path, os.path.join(directory, "missing.yaml")):
+            fallback = load_calibration(bad_path)
+            np.testing.assert_array_equal(fallback.offset, np.zeros(9))
+            np.testing.assert_array_equal(fallback.matrix_t, np.eye(9))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    poses, gyro = pose_samples()
+    start = time.perf_counter()
+    calibration = fit_calibration(poses, gyro, mag_samples())
+    logging.info(f"Fit: {1e3 * (time.perf_counter() - start):.1f} ms")
+
+    samples = np.random.default_rng(3).normal(0, 10, (11250, NUM_COLUMNS))
+    for batch in (11, 45):
+        start = time.perf_counter()
+        for i in range(0, len(samples), batch):
+            calibration.apply(samples[i:i + batch])
+        elapsed = time.perf_counter() - start
+        logging.info(f"Batch of {batch:>2}: {1e6 * elapsed / len(samples):.3f} us/sample")
+
+    # Previous approach: every reader subtracted the offsets in Python on every read
+    offsets = calibration.offset[:6].tolist()
+    start = time.perf_counter()
+    for row in samples[:, 1:10].tolist():
+        accel = (row[0] - offsets[0], row[1] - offsets[1], row[2] - offsets[2])
+        gyro = (row[3] - offsets[3], row[4] - offsets[4], row[5] - offsets[5])
+    elapsed = time.perf_counter() - start
+    logging.info(f"Per-read offsets (bias only, per reader): {1e6 * elapsed / len(samples):.3f} us/sample")
@@ -0,0 +1,138 @@
+"""
+Benchmarks IMUSharedData writer latency and reader throughput with several reader processes polling
+Compares the seqlock layout against the previous lock-protected mp.Array layout, and checks that no
+reader sees a torn (partially written) reading and that a writer stopped mid-update does not leave
+readers spinning
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.imu.imu_shared_data import IMUSharedData
+
+WRITES = 5000
+WRITE_PERIOD = 0.001  # 1 kHz writer
+READER_COUNTS = [0, 1, 3, 6]
+
+
+class LockedIMUData:
+    """
+    Previous layout: mp.Array with its lock taken by every read and write
+    """
+
+    def __init__(self):
+        self.shared_array = mp.Array("d", 9)
+
+    def set(self, accel, gyro, mag):
+        with self.shared_array.get_lock():
+            self.shared_array[0:3] = accel
+            self.shared_array[3:6] = gyro
+            self.shared_array[6:9] = mag
+
+    def get(self):
+        with self.shared_array.get_lock():
+            return tuple(self.shared_array[0:3]), tuple(self.shared_array[3:6]), tuple(self.shared_array[6:9])
+
+
+def writer(imu_data, results):
+    latencies = []
+    next_write = time.perf_counter()
+    for i in range(1, WRITES + 1):
+        value = (float(i),) * 3
+        start = time.perf_counter()
+        imu_data.set(value, value, value)
+        latencies.append(time.perf_counter() - start)
+
+        next_write += WRITE_PERIOD
+        time.sleep(max(next_write - time.perf_counter(), 0))
+    results.put(("writer", latencies))
+
+
+def reader(imu_data, stop_event, results):
+    reads = 0
+    torn = 0
+    while not stop_event.is_set():
+        accel, gyro, mag = imu_data.get()
+        # The writer always writes the same value to all 9 fields
+        if len(set(accel + gyro + mag)) != 1:
+            torn += 1
+        reads += 1
+    results.put(("reader", (reads, torn)))
+
+
+def run_benchmark(imu_data, num_readers):
+    """
+    Returns (writer latencies in seconds, total reads, torn reads, elapsed seconds)
+    """
+    stop_event = mp.Event()
+    results = mp.Queue()
+    readers = [mp.Process(target=reader, args=(imu_data, stop_event, results)) for _ in range(num_readers)]
+    for process in readers:
+        process.start()
+
+    start = time.perf_counter()
+    write_process = mp.Process(target=writer, args=(imu_data, results))
+    write_process.start()
+
+    latencies, reads, torn = [], 0, 0
+    for _ in range(num_readers + 1):
+        kind, value = results.get()
+        if kind == "writer":
+            latencies = value
+            elapsed = time.perf_counter() - start
+            stop_event.set()
+        else:
+            reads += value[0]
+            torn += value[1]
+
+    for process in readers + [write_process]:
+        process.join()
+    return latencies, reads, torn, elapsed
+
+
+def test_writer_stopped_mid_update():
+    imu_data = IMUSharedData()
+    imu_data.set((1.0,) * 3, (2.0,) * 3, (3.0,) * 3)
+    imu_data.seq.value += 1  # As if the writer was killed between its two stores
+
+    start = time.monotonic()
+    assert imu_data.get().accel == (1.0,) * 3  # Returned after the timeout instead of spinning
+    assert time.monotonic() - start < 10 * IMUSharedData.STALE_WRITE_TIMEOUT
+
+    # The writer of the next arming starts from an even number again
+    imu_data.set((4.0,) * 3, (5.0,) * 3, (6.0,) * 3)
+    assert imu_data.seq.value % 2 == 0
+    assert imu_data.get().mag == (6.0,) * 3
+
+
+def test_no_torn_reads():
+    _, reads, torn, _ = run_benchmark(IMUSharedData(), num_readers=2)
+    assert reads > 0
+    assert torn == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+    logging.info(
+        f"{'Layout':<10}{'Readers':>8}{'Write mean (us)':>17}{'Write p99 (us)':>16}"
+        f"{'Write max (us)':>16}{'Reads/s':>12}{'Torn':>6}"
+    )
+
+    for name, make_data in (("lock", LockedIMUData), ("seqlock", IMUSharedData)):
+        for num_readers in READER_COUNTS:
+            latencies, reads, torn, elapsed = run_benchmark(make_data(), num_readers)
+            latencies.sort()
+            logging.info(
+                f"{name:<10}{num_readers:>8}{1e6 * sum(latencies) / len(latencies):>17.1f}"
+                f"{1e6 * latencies[int(0.99 * len(latencies))]:>16.1f}{1e6 * latencies[-1]:>16.1f}"
+                f"{reads / elapsed:>12.0f}{torn:>6}"
+            )
@@ -0,0 +1,109 @@
+"""
+Checks IMUPoseSampler against a ring of samples rotating at a known rate: interpolated orientation
+and angular rate at frame timestamps, timestamps outside the history, and the extended frame header.
+Run directly to measure the lookup cost per frame
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter.camera_worker import CAMERA_HEADER
+from modules.device_state import DeviceState
+from modules.imu.imu_pose import IMUPoseSampler, angular_speed
+from modules.imu.imu_ring_buffer import GYRO, NUM_COLUMNS, QUAT, TIME, IMURingBuffer
+from modules.imu.imu_shared_data import IMUSharedData
+
+SAMPLE_RATE = 1125.0
+RATE = 2.0  # rads/s about z
+
+
+def rotation(t):
+    """
+    Quaternion of a rotation about z at RATE after t seconds
+    """
+    return np.stack((np.cos(RATE * t / 2), np.zeros_like(t), np.zeros_like(t), np.sin(RATE * t / 2)), axis=-1)
+
+
+def filled_ring(seconds=1.0, start=1000.0, capacity=4096):
+    ring = IMURingBuffer(capacity=capacity)
+    block = np.zeros((int(seconds * SAMPLE_RATE), NUM_COLUMNS))
+    block[:, TIME] = start + np.arange(len(block)) / SAMPLE_RATE
+    block[:, GYRO] = (0.0, 0.0, RATE)
+    block[:, QUAT] = rotation(block[:, TIME] - start)
+    # Ramp the x rate so interpolation between samples is visible
+    block[:, GYRO.start] = np.arange(len(block))
+    ring.extend(block)
+    return ring, block
+
+
+def test_interpolates_between_samples():
+    ring, block = filled_ring()
+    shared_data = IMUSharedData()
+    shared_data.set_state(DeviceState.MOVING)
+    sampler = IMUPoseSampler(ring, shared_data, sample_rate=SAMPLE_RATE)
+
+    # Halfway between two samples near the end of the history
+    index = len(block) - 20
+    timestamp = (block[index, TIME] + block[index + 1, TIME]) / 2
+    pose = sampler.pose_at(timestamp)
+    np.testing.assert_allclose(pose.quaternion, rotation(timestamp - block[0, TIME]), atol=1e-6)
+    np.testing.assert_allclose(pose.gyro, (index + 0.5, 0.0, RATE))
+    assert pose.state == DeviceState.MOVING
+    assert angular_speed(pose) > RATE
+
+
+def test_timestamps_outside_history():
+    ring, block = filled_ring()
+    sampler = IMUPoseSampler(ring, sample_rate=SAMPLE_RATE, history=0.25, max_gap=0.05)
+
+    # Slightly newer than the last FIFO read uses the last sample
+    pose = sampler.pose_at(block[-1, TIME] + 0.02)
+    np.testing.assert_allclose(pose.quaternion, block[-1, QUAT])
+    assert pose.state is None
+
+    assert sampler.pose_at(block[-1, TIME] + 0.1) is None
+    assert sampler.pose_at(block[-1, TIME] - 0.5) is None  # Older than the history
+    assert IMUPoseSampler(IMURingBuffer(capacity=16)).pose_at(time.time()) is None
+
+
+def test_recent_wraps_around():
+    ring, block = filled_ring(seconds=2.0, capacity=1000)
+    recent = ring.recent(300)
+    np.testing.assert_array_equal(recent, block[-300:])
+    assert len(ring.recent(5000)) == 1000  # No row is being written, so the whole ring is valid
+
+
+def test_frame_header_round_trip():
+    ring, block = filled_ring()
+    pose = IMUPoseSampler(ring, sample_rate=SAMPLE_RATE).pose_at(block[-5, TIME])
+    header = CAMERA_HEADER.pack(2, 1, 0, DeviceState.MOVING.value, *pose.quaternion, *pose.gyro)
+    assert len(header) == CAMERA_HEADER.size == 35
+
+    device_id, encoder_id, frame_type, state, *values = CAMERA_HEADER.unpack(header)
+    assert (device_id, encoder_id, frame_type) == (2, 1, 0)
+    assert DeviceState(state) == DeviceState.MOVING
+    np.testing.assert_allclose(values[:4], pose.quaternion, atol=1e-6)
+    np.testing.assert_allclose(values[4:], pose.gyro, rtol=1e-6)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    ring, block = filled_ring(seconds=3.0, capacity=16384)
+    sampler = IMUPoseSampler(ring, IMUSharedData(), sample_rate=SAMPLE_RATE)
+    timestamps = np.linspace(block[-250, TIME], block[-1, TIME], 1000)
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        sampler.pose_at(timestamp)
+    elapsed = time.perf_counter() - start
+    logging.info(f"pose_at: {1e6 * elapsed / len(timestamps):.1f} us per frame")
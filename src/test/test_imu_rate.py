@@ -0,0 +1,115 @@
+"""
+Checks the per-state IMU rate settings and the usage meter, and reports the sensor process CPU and
+I2C bus utilization at the moving and stationary rates, draining the fake ICM20948 over a simulated
+400 kHz bus with the same calibration, AHRS and motion detection the IMU worker runs
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.device_state import DeviceState
+from modules.imu.ahrs import MadgwickAHRS
+from modules.imu.fake_i2c import FakeICM20948Bus
+from modules.imu.icm20948 import ICM20948
+from modules.imu.imu_calibration import IMUCalibration
+from modules.imu.imu_rate import IMUUsageMeter, RateMode, resolve_state_rates
+from modules.imu.motion_detector import MotionDetector
+from modules.system_config import DEFAULT_CONFIG
+
+BUS_HZ = 400000
+DURATION = 3  # seconds per mode
+
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_resolve_state_rates():
+    imu_config = DEFAULT_CONFIG["imu"]
+    default, state_rates = resolve_state_rates(imu_config["sensor"], imu_config["state_rates"])
+    assert default == RateMode(1125.0, 0.01)
+    assert state_rates == {DeviceState.STATIONARY: RateMode(56.25, 0.25)}
+
+    # Unset fields fall back to the sensor settings
+    _, state_rates = resolve_state_rates(
+        {"sample_rate": 500.0, "poll_interval": 0.02}, {"MOVING": {"sample_rate": 1125}}
+    )
+    assert state_rates[DeviceState.MOVING] == RateMode(1125, 0.02)
+    with pytest.raises(ValueError):
+        resolve_state_rates({}, {"SLEEPING": {"sample_rate": 10}})
+
+
+def test_usage_meter():
+    clock, cpu_clock = ManualClock(), ManualClock()
+    bus = FakeICM20948Bus()
+    meter = IMUUsageMeter(bus, clock=clock, cpu_clock=cpu_clock)
+    meter.switch("fast")
+    clock.now, cpu_clock.now, bus.busy_seconds = 2.0, 0.2, 0.1
+    meter.add_samples(2250)
+    meter.switch("slow")
+    clock.now, cpu_clock.now, bus.busy_seconds = 12.0, 0.3, 0.11
+    meter.add_samples(560)
+
+    report = meter.report()
+    assert report["fast"] == (2.0, 2250, 0.2, 0.1)
+    assert report["slow"].samples == 560
+    assert report["slow"].seconds == pytest.approx(10.0)
+    assert report["slow"].cpu_seconds == pytest.approx(0.1)
+    assert report["slow"].bus_seconds == pytest.approx(0.01)
+
+
+def run_mode(sensor, meter, mode, calibration, ahrs, detector):
+    """
+    Runs the IMU worker sensor loop at a rate mode for DURATION seconds
+    """
+    sensor.set_sample_rate(mode.sample_rate)
+    for consumer in (ahrs, detector):
+        consumer.set_sample_rate(sensor.sample_rate)
+    meter.switch(f"{sensor.sample_rate:.1f} Hz every {1e3 * mode.poll_interval:.0f} ms")
+
+    end = time.monotonic() + DURATION
+    while time.monotonic() < end:
+        block = sensor.read_samples()
+        meter.add_samples(len(block))
+        if len(block):
+            calibration.apply(block)
+            ahrs.update(block)
+            detector.update(block)
+        time.sleep(mode.poll_interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    imu_config = DEFAULT_CONFIG["imu"]
+    default, state_rates = resolve_state_rates(imu_config["sensor"], imu_config["state_rates"])
+    bus = FakeICM20948Bus(bus_hz=BUS_HZ)
+    sensor = ICM20948(bus, sample_rate=default.sample_rate)
+    sensor.configure()
+    calibration = IMUCalibration()
+    ahrs = MadgwickAHRS(sensor.sample_rate)
+    detector = MotionDetector(sensor.sample_rate)
+    meter = IMUUsageMeter(bus)
+
+    run_mode(sensor, meter, default, calibration, ahrs, detector)
+    run_mode(sensor, meter, state_rates[DeviceState.STATIONARY], calibration, ahrs, detector)
+    for label, usage in meter.report().items():
+        logging.info(
+            f"{label}: {usage.samples / usage.seconds:.1f} samples/s, "
+            f"CPU {100 * usage.cpu_seconds / usage.seconds:.2f}%, I2C bus "
+            f"{100 * usage.bus_seconds / usage.seconds:.2f}%"
+        )
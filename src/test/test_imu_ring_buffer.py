@@ -0,0 +1,194 @@
+"""
+Checks the IMU sample ring: readers get every sample once in order across the end of the ring, and a
+writer that laps a reader, before or while it copies, is reported as dropped samples that are
+skipped instead of returned as torn or out of order rows. Run directly to measure read throughput
+from a second process
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.imu.imu_ring_buffer import NUM_COLUMNS, TIME, IMURingBuffer
+
+CAPACITY = 100
+
+
+def make_block(first, count):
+    """
+    Samples numbered first to first + count - 1, every column holds the number
+    """
+    return np.repeat(np.arange(first, first + count, dtype=np.float64)[:, None], NUM_COLUMNS, axis=1)
+
+
+class LappingRing(IMURingBuffer):
+    """
+    Ring whose writer appends laps samples as a reader starts copying rows, as if the writer process
+    ran in between
+    """
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.laps = 0
+
+    @property
+    def samples(self):
+        samples = super().samples
+        if self.laps:
+            laps, self.laps = self.laps, 0
+            seq = self.write_seq.value
+            self.extend(make_block(seq, laps))
+        return samples
+
+
+def test_reads_in_order_across_the_end():
+    ring = IMURingBuffer(capacity=CAPACITY)
+    reader = ring.reader()
+    written = 0
+    for count in (75, 75, 99, 1, 50):  # Crosses the end of the ring several times
+        ring.extend(make_block(written, count))
+        block = reader.read()
+        np.testing.assert_array_equal(block.samples, make_block(written, count))
+        assert block.first_seq == written and block.dropped == 0
+        written += count
+    assert reader.pending() == 0 and reader.dropped == 0
+    assert len(reader.read().samples) == 0
+
+
+def test_overflow_skips_overwritten_rows():
+    ring = IMURingBuffer(capacity=CAPACITY)
+    reader = ring.reader()
+    ring.extend(make_block(0, 30))
+    reader.read()
+
+    # The writer laps the reader: samples 30 to 179 were written, the ring only holds the last 100
+    for i in range(30, 180):
+        ring.append(float(i), (i,) * 3, (i,) * 3, (i,) * 3)
+    assert reader.pending() == 150
+    block = reader.read()
+    assert block.first_seq == 80 and block.dropped == 50
+    np.testing.assert_array_equal(block.samples[:, TIME], np.arange(80, 180))
+    assert reader.dropped == 50
+
+    # Later reads carry on from where the writer is, without reporting the same loss again
+    ring.extend(make_block(180, 10))
+    block = reader.read()
+    assert block.first_seq == 180 and block.dropped == 0 and len(block.samples) == 10
+    assert reader.dropped == 50
+
+
+def test_block_larger_than_ring():
+    ring = IMURingBuffer(capacity=CAPACITY)
+    reader = ring.reader()
+    ring.extend(make_block(0, 250))
+    assert ring.write_seq.value == 250
+    block = reader.read()
+    np.testing.assert_array_equal(block.samples, make_block(150, 100))
+    assert block.first_seq == 150 and block.dropped == 150
+
+
+def test_writer_laps_during_copy():
+    ring = LappingRing(CAPACITY)
+    reader = ring.reader()
+    ring.extend(make_block(0, 90))
+    ring.laps = 40  # Written while the reader copies its 90 rows
+
+    block = reader.read()
+    # Rows 0 to 29 were overwritten by 100 to 129, only 30 to 89 are returned
+    assert block.first_seq == 30 and block.dropped == 30
+    np.testing.assert_array_equal(block.samples, make_block(30, 60))
+
+    block = reader.read()
+    assert block.first_seq == 90 and block.dropped == 0
+    np.testing.assert_array_equal(block.samples, make_block(90, 40))
+
+    # Lapped by more than the whole ring while copying: nothing valid is left in the copy
+    ring.laps = 2 * CAPACITY
+    block = reader.read()
+    assert len(block.samples) == 0 and block.first_seq == 130 and block.dropped == 0
+    block = reader.read()
+    assert block.dropped == CAPACITY and block.first_seq == 130 + CAPACITY
+
+
+def test_large_sequence_numbers():
+    # Sequence numbers keep counting past any multiple of the capacity, rows are placed modulo it
+    ring = IMURingBuffer(capacity=CAPACITY)
+    start = 2 ** 40 + 37
+    ring.write_seq.value = ring.reserved_seq.value = start
+    reader = ring.reader()
+    ring.extend(make_block(0, 80))
+    ring.extend(make_block(80, 80))  # Laps the reader
+    block = reader.read()
+    assert block.first_seq == start + 60 and block.dropped == 60
+    np.testing.assert_array_equal(block.samples, make_block(60, 100))
+    np.testing.assert_array_equal(ring.latest(), make_block(159, 1)[0])
+    np.testing.assert_array_equal(ring.recent(5), make_block(155, 5))
+
+    late = ring.reader(from_start=True)
+    assert late.cursor == start + 160 - CAPACITY
+
+
+def read_continuously(ring, stop_event, results):
+    reader = ring.reader()
+    samples = 0
+    disorder = 0
+    while not stop_event.is_set() or reader.pending():
+        block = reader.read()
+        if len(block.samples):
+            # Each sample holds its sequence number, so a torn or stale row shows up as a mismatch
+            expected = block.first_seq + np.arange(len(block.samples))
+            disorder += int(np.count_nonzero(block.samples != expected[:, None]))
+            samples += len(block.samples)
+        time.sleep(0.001)
+    results.put((samples, reader.dropped, disorder))
+
+
+def stream_to_reader(seconds, capacity=16384, block_size=40):
+    """
+    Writes blocks of FIFO reads as fast as possible while another process reads them
+    Returns (samples written, samples/s, samples read, samples dropped, wrong values read)
+    """
+    ring = IMURingBuffer(capacity=capacity)
+    stop_event = mp.Event()
+    results = mp.Queue()
+    reader_process = mp.Process(target=read_continuously, args=(ring, stop_event, results))
+    reader_process.start()
+    time.sleep(0.2)
+
+    written = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        ring.extend(make_block(written, block_size))
+        written += block_size
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    samples, dropped, disorder = results.get()
+    reader_process.join()
+    return written, written / elapsed, samples, dropped, disorder
+
+
+def test_concurrent_reader_gets_no_torn_rows():
+    # A small ring so the writer laps the reader, often while it copies
+    written, _, samples, dropped, disorder = stream_to_reader(0.5, capacity=1024)
+    assert disorder == 0
+    assert samples + dropped == written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    written, rate, samples, dropped, disorder = stream_to_reader(3.0)
+    logging.info(
+        f"{rate / 1e6:.2f} M samples/s written, {samples} read, {dropped} dropped, "
+        f"{disorder} wrong values (must be 0), {samples + dropped} of {written} accounted for"
+    )
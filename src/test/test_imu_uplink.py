@@ -0,0 +1,182 @@
+"""
+Checks that IMU uplink batches round-trip through the decoder with every sample sent once, and
+measures throughput to a local receiver with a writer process filling the sample ring at 1 kHz
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import socket
+import threading
+import time
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.imu.imu_ring_buffer import IMURingBuffer, NUM_COLUMNS
+from modules.imu.imu_uplink import JSON, IMUStreamDecoder, IMUUplink, encode_json_batch
+
+SAMPLE_RATE = 1000  # Hz, well above the sensor rate
+DURATION = 5  # seconds
+
+
+def make_samples(count, start_time=1000.0, rate=SAMPLE_RATE):
+    samples = np.random.default_rng(0).normal(size=(count, NUM_COLUMNS))
+    samples[:, 0] = start_time + np.arange(count) / rate
+    return samples
+
+
+def test_round_trip():
+    ring = IMURingBuffer(capacity=256)
+    uplink = IMUUplink(ring.reader(), batch_size=10, max_age=1.0)
+    samples = make_samples(35)
+    ring.extend(samples)
+
+    frames = uplink.poll(state=3, now=samples[-1, 0])
+    assert len(frames) == 3  # The last 5 samples wait for their batch to fill
+
+    frames += uplink.flush(state=3)
+    decoder = IMUStreamDecoder()
+    batches = decoder.feed(b"".join(frames))
+    assert [batch.batch_seq for batch in batches] == [0, 1, 2, 3]
+    assert [batch.first_seq for batch in batches] == [0, 10, 20, 30]
+    assert all(batch.state == 3 for batch in batches)
+
+    timestamps = np.concatenate([batch.timestamps for batch in batches])
+    accel = np.concatenate([batch.accel for batch in batches])
+    mag = np.concatenate([batch.mag for batch in batches])
+    np.testing.assert_allclose(timestamps, samples[:, 0], atol=1e-6)
+    np.testing.assert_allclose(accel, samples[:, 1:4], rtol=1e-6)
+    np.testing.assert_allclose(mag, samples[:, 7:10], rtol=1e-6)
+    assert decoder.missing == 0
+
+
+def test_flush_on_age():
+    ring = IMURingBuffer(capacity=256)
+    uplink = IMUUplink(ring.reader(), batch_size=50, max_age=0.1)
+    samples = make_samples(3)
+    ring.extend(samples)
+
+    assert uplink.poll(now=samples[0, 0] + 0.05) == []
+    frames = uplink.poll(now=samples[0, 0] + 0.1)
+    assert len(frames) == 1
+    assert len(IMUStreamDecoder().feed(frames[0])[0].timestamps) == 3
+
+
+def test_split_frames_and_overflow():
+    ring = IMURingBuffer(capacity=16)
+    reader = ring.reader()
+    uplink = IMUUplink(reader, batch_size=8, max_age=1.0)
+    ring.extend(make_samples(8))
+    first = uplink.poll(now=0)
+    ring.extend(make_samples(40))  # Overflows the ring, the reader drops the oldest samples
+    second = uplink.poll(now=0) + uplink.flush()
+
+    # Frames may arrive split at any byte boundary
+    data = b"".join(first + second)
+    decoder = IMUStreamDecoder()
+    batches = []
+    for i in range(0, len(data), 7):
+        batches += decoder.feed(data[i:i + 7])
+
+    # Samples lost to the overflow show up as a gap in the sample sequence numbers
+    assert reader.dropped > 0
+    assert decoder.missing == reader.dropped
+    assert sum(len(batch.timestamps) for batch in batches) + decoder.missing == 48
+
+
+def write_samples(ring, stop_event):
+    samples = make_samples(SAMPLE_RATE * DURATION, start_time=time.time())
+    next_write = time.perf_counter()
+    for row in samples:
+        row[0] = time.time()
+        ring.append(row[0], row[1:4], row[4:7], row[7:10])
+        next_write += 1 / SAMPLE_RATE
+        time.sleep(max(next_write - time.perf_counter(), 0))
+    stop_event.set()
+
+
+def receive(server, result):
+    connection, _ = server.accept()
+    decoder = IMUStreamDecoder()
+    samples = 0
+    received = 0
+    latencies = []
+    while True:
+        data = connection.recv(65536)
+        if not data:
+            break
+        received += len(data)
+        for batch in decoder.feed(data):
+            samples += len(batch.timestamps)
+            latencies.append(time.time() - batch.timestamps[0])
+    connection.close()
+    result.update(samples=samples, bytes=received, missing=decoder.missing, latencies=latencies)
+
+
+def run_uplink(batch_size, max_age):
+    """
+    Streams DURATION seconds of samples to a receiver thread and returns its results
+    """
+    server = socket.create_server(("127.0.0.1", 0))
+    result = {}
+    receiver = threading.Thread(target=receive, args=(server, result))
+    receiver.start()
+
+    ring = IMURingBuffer()
+    stop_event = mp.Event()
+    uplink = IMUUplink(ring.reader(), batch_size=batch_size, max_age=max_age)
+    writer = mp.Process(target=write_samples, args=(ring, stop_event))
+    writer.start()
+
+    sender = socket.create_connection(server.getsockname())
+    start = time.perf_counter()
+    sent = 0
+    while not stop_event.is_set():
+        for frame in uplink.poll():
+            sender.sendall(frame)
+            sent += 1
+        stop_event.wait(max_age / 4)
+    writer.join()
+    for frame in uplink.flush():
+        sender.sendall(frame)
+        sent += 1
+    elapsed = time.perf_counter() - start
+
+    sender.close()
+    receiver.join()
+    server.close()
+    result.update(frames=sent, elapsed=elapsed)
+    return result
+
+
+def test_local_receiver():
+    result = run_uplink(batch_size=25, max_age=0.2)
+    assert result["samples"] == SAMPLE_RATE * DURATION
+    assert result["missing"] == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    json_size = len(encode_json_batch(make_samples(25), 0, 0)) / 25
+    logging.info(f"JSON ({JSON}) size: {json_size:.1f} bytes/sample")
+    logging.info(
+        f"{'Batch':>6}{'Max age (s)':>13}{'Samples':>9}{'Missing':>9}{'Frames/s':>10}"
+        f"{'Bytes/sample':>14}{'Samples/s':>11}{'Latency p99 (ms)':>18}"
+    )
+
+    for batch_size, max_age in ((1, 0.01), (10, 0.05), (25, 0.2), (100, 0.5)):
+        result = run_uplink(batch_size, max_age)
+        latencies = sorted(result["latencies"])
+        logging.info(
+            f"{batch_size:>6}{max_age:>13}{result['samples']:>9}{result['missing']:>9}"
+            f"{result['frames'] / result['elapsed']:>10.1f}{result['bytes'] / result['samples']:>14.1f}"
+            f"{result['samples'] / result['elapsed']:>11.0f}{1e3 * latencies[int(0.99 * len(latencies))]:>18.1f}"
+        )
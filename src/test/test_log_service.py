@@ -0,0 +1,161 @@
+"""
+Checks the logging setup: records from worker processes reach the single listener through the queue,
+subsystem levels apply in the workers, records are queued without being formatted, and hot-path
+messages are rate limited per call site with a count of what was dropped. Run directly to compare
+the cost of a log call in a worker with and without the queue
+"""
+
+import os
+import sys
+
+import copy
+import logging
+import multiprocessing as mp
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.log_service import LogService, RateLimitFilter, RecordQueueHandler
+from modules.system_config import DEFAULT_CONFIG
+
+
+class RecordList(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def log_config(**changes):
+    config = copy.deepcopy(DEFAULT_CONFIG["logging"])
+    config.update(changes)
+    return config
+
+
+def make_record(line, level=logging.INFO, created=0.0, message="frame %d", args=(1,)):
+    record = logging.LogRecord("modules.test", level, __file__, line, message, args, None)
+    record.created = created
+    return record
+
+
+def log_from_worker(count):
+    logger = logging.getLogger("modules.camera_transmitter.test")
+    logger.debug("not shown, below the subsystem level")
+    logger.info("worker started")
+    for i in range(count):
+        logger.info("payload %d sent", i)
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("worker failed")
+
+
+def test_rate_limit_per_call_site():
+    rate_limit = RateLimitFilter(burst=3, interval=1.0)
+    passed = [rate_limit.filter(make_record(10, created=0.001 * i)) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert rate_limit.filter(make_record(11))  # Another call site has its own budget
+    assert rate_limit.filter(make_record(10, level=logging.ERROR, created=0.02))  # Errors always pass
+
+    # One token back after a third of the interval, the record reports the dropped ones
+    record = make_record(10, created=0.4)
+    assert rate_limit.filter(record)
+    assert record.getMessage() == "frame 1 (7 similar messages dropped)"
+    assert not rate_limit.filter(make_record(10, created=0.4))
+
+
+class FailingFormatter(logging.Formatter):
+    def format(self, record):
+        raise AssertionError("formatted in the logging process")
+
+
+def test_queue_handler_does_not_format():
+    queue = mp.Queue()
+    handler = RecordQueueHandler(queue)
+    handler.setFormatter(FailingFormatter())
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        record = logging.LogRecord(
+            "modules.test", logging.ERROR, __file__, 1, "frame %d of %s", (3, object()), sys.exc_info()
+        )
+    handler.handle(record)
+
+    queued = queue.get(timeout=5.0)  # Pickled through the queue, as from a worker process
+    assert queued.msg.startswith("frame 3 of <object object at") and queued.args is None
+    assert queued.exc_info is None and "ZeroDivisionError" in queued.exc_text
+    assert record.args[0] == 3 and record.exc_info is not None  # The original is left as it was
+
+
+def test_worker_records_reach_listener():
+    records = RecordList()
+    service = LogService(
+        log_config(
+            level="WARNING", levels={"modules.camera_transmitter": "INFO"}, rate_limit={"burst": 5, "interval": 60.0}
+        ),
+        handlers=[records],
+    )
+    root_handlers = list(logging.getLogger().handlers)
+    service.start()
+    try:
+        worker = mp.Process(target=log_from_worker, args=(100,), name="Worker-7")
+        worker.start()
+        worker.join(timeout=10.0)
+        assert worker.exitcode == 0
+    finally:
+        service.stop()
+        logging.getLogger("modules.camera_transmitter").setLevel(logging.NOTSET)
+    assert logging.getLogger().handlers == root_handlers
+
+    messages = [record.getMessage() for record in records.records]
+    assert messages[0] == "worker started"
+    assert messages[1:6] == [f"payload {i} sent" for i in range(5)]  # The rest are dropped
+    assert messages[-1] == "worker failed"
+    assert len(messages) == 7
+    assert {record.processName for record in records.records} == {"Worker-7"}
+    assert "ZeroDivisionError" in records.records[-1].exc_text
+    assert "Traceback" not in records.records[-1].msg  # The listener formats it
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    def time_worker(count, results):
+        start = time.process_time()
+        log_from_worker(count)
+        results.put(time.process_time() - start)
+
+    count = 20000
+    with open(os.devnull, "w") as devnull:
+        formatter = logging.Formatter(DEFAULT_CONFIG["logging"]["format"])
+        for name in ("direct", "queue"):
+            console = logging.StreamHandler(devnull)
+            console.setFormatter(formatter)
+            root = logging.getLogger()
+            previous = list(root.handlers)
+            if name == "queue":
+                service = LogService(log_config(levels={"modules.camera_transmitter": "INFO"}), handlers=[console])
+                service.start()
+            else:
+                for handler in previous:
+                    root.removeHandler(handler)
+                root.addHandler(console)
+
+            results = mp.Queue()
+            worker = mp.Process(target=time_worker, args=(count, results), name="Worker-0")
+            worker.start()
+            cpu_seconds = results.get()
+            worker.join()
+
+            if name == "queue":
+                service.stop()
+            else:
+                root.removeHandler(console)
+                for handler in previous:
+                    root.addHandler(handler)
+            logging.info(f"{name}: {1e6 * cpu_seconds / count:.2f} us of worker CPU per hot-path log call")
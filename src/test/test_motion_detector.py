@@ -0,0 +1,99 @@
+"""
+Feeds synthetic IMU traces through MotionDetector: checks transitions, hysteresis against noise near
+the thresholds, minimum dwell and that results do not depend on how samples are split into blocks.
+Run directly to measure the detector cost at the sensor rate
+"""
+
+import os
+import sys
+
+import logging
+import time
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.device_state import DeviceState
+from modules.imu.imu_ring_buffer import NUM_COLUMNS
+from modules.imu.motion_detector import STANDARD_GRAVITY, MotionDetector
+
+SAMPLE_RATE = 1125.0
+
+
+def make_trace(segments, rate=SAMPLE_RATE, seed=0):
+    """
+    Builds a (n, NUM_COLUMNS) trace from (seconds, accel noise std, gyro magnitude) segments
+    """
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for seconds, accel_std, gyro in segments:
+        count = int(seconds * rate)
+        block = np.zeros((count, NUM_COLUMNS))
+        block[:, 3] = STANDARD_GRAVITY + rng.normal(0, accel_std, count)
+        block[:, 4] = gyro
+        block[:, 7:10] = (20.0, -5.0, 40.0)
+        blocks.append(block)
+
+    trace = np.concatenate(blocks)
+    trace[:, 0] = np.arange(len(trace)) / rate
+    return trace
+
+
+def run(trace, block_size, **kwargs):
+    detector = MotionDetector(SAMPLE_RATE, **kwargs)
+    transitions = []
+    for start in range(0, len(trace), block_size):
+        transitions += detector.update(trace[start:start + block_size])
+    return transitions
+
+
+def test_transitions_and_dwell():
+    # Moving, still for 3 s, then moving again
+    trace = make_trace([(2.0, 0.5, 0.5), (3.0, 0.01, 0.01), (1.0, 0.5, 0.5)])
+    transitions = run(trace, block_size=11)
+
+    assert [state for _, state in transitions] == [DeviceState.STATIONARY, DeviceState.MOVING]
+    # Stationary once a (nearly) full window of still samples has held for enter_dwell
+    assert 2.0 + 0.45 + 1.0 <= transitions[0][0] < 2.0 + 0.5 + 1.1
+    # Moving again within exit_dwell plus the time the noise takes to raise the window std
+    assert 5.0 <= transitions[1][0] < 5.0 + 0.2
+
+
+def test_short_pause_is_not_stationary():
+    trace = make_trace([(1.0, 0.5, 0.5), (1.2, 0.01, 0.01), (1.0, 0.5, 0.5)])
+    assert run(trace, block_size=11) == []
+
+
+def test_hysteresis():
+    # Noise between the enter and exit thresholds keeps whatever state the device is in
+    trace = make_trace([(2.0, 0.01, 0.01), (5.0, 0.1, 0.07)], seed=1)
+    transitions = run(trace, block_size=11)
+    assert [state for _, state in transitions] == [DeviceState.STATIONARY]
+
+
+def test_block_size_independent():
+    trace = make_trace([(1.0, 0.5, 0.5), (2.0, 0.01, 0.01), (0.5, 0.5, 0.5), (2.0, 0.01, 0.01)])
+    expected = run(trace, block_size=len(trace))
+    assert len(expected) == 3
+    for block_size in (1, 7, 100):
+        assert run(trace, block_size=block_size) == expected
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    trace = make_trace([(10.0, 0.5, 0.5), (10.0, 0.01, 0.01)] * 3)
+    for block_size in (1, 11, 45):
+        detector = MotionDetector(SAMPLE_RATE)
+        start = time.perf_counter()
+        for i in range(0, len(trace), block_size):
+            detector.update(trace[i:i + block_size])
+        elapsed = time.perf_counter() - start
+        logging.info(
+            f"block {block_size:>3}: {1e6 * elapsed / len(trace):.2f} us/sample, "
+            f"{100 * elapsed / (len(trace) / SAMPLE_RATE):.2f}% of one core at {SAMPLE_RATE:.0f} Hz"
+        )
@@ -0,0 +1,131 @@
+"""
+Checks the per-worker scheduling settings: config resolution and validation, applying affinity and
+nice in a child process and reading the placement back, and the wake-up lateness histogram.
+Run directly to measure sampler wake-up lateness with and without a competing encoding load
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.process_stats import read_process_placement
+from modules.scheduling import ROLES, JitterMeter, SchedulingPolicy, resolve_scheduling, scheduled
+
+
+def report_placement(queue):
+    queue.put(read_process_placement(os.getpid()))
+
+
+def test_resolve_scheduling():
+    config = {"enabled": False, "camera": {"cpus": [0, 1], "nice": 5}}
+    assert all(policy.is_default() for policy in resolve_scheduling(config).values())
+
+    config["enabled"] = True
+    policies = resolve_scheduling(config)
+    assert set(policies) == set(ROLES)
+    assert policies["camera"] == SchedulingPolicy(cpus=(0, 1), nice=5)
+    assert policies["imu_sensor"].is_default()
+
+    with pytest.raises(ValueError):
+        resolve_scheduling({"enabled": True, "lidar": {"nice": 1}})
+    with pytest.raises(ValueError):
+        SchedulingPolicy(policy="batch")
+    with pytest.raises(ValueError):
+        SchedulingPolicy(policy="fifo", priority=0)
+
+
+def test_scheduled_process_placement():
+    cpu = min(os.sched_getaffinity(0))
+    policy = SchedulingPolicy(cpus=(cpu,), nice=7)
+    queue = mp.Queue()
+    process = mp.Process(target=scheduled(policy, report_placement), args=(queue,))
+    process.start()
+    placement = queue.get(timeout=5.0)
+    process.join()
+
+    assert placement["cpus"] == [cpu]
+    assert placement["last_cpu"] == cpu
+    assert placement["nice"] == 7
+    assert placement["policy"] == "other"
+    assert scheduled(SchedulingPolicy(), report_placement) is report_placement
+
+
+def test_refused_settings_are_skipped():
+    # CPUs that do not exist are refused by the kernel, the process keeps running
+    queue = mp.Queue()
+    policy = SchedulingPolicy(cpus=(4096,))
+    process = mp.Process(target=scheduled(policy, report_placement), args=(queue,))
+    process.start()
+    assert queue.get(timeout=5.0)["cpus"] == sorted(os.sched_getaffinity(0))
+    process.join()
+    assert process.exitcode == 0
+
+
+def test_jitter_meter():
+    meter = JitterMeter()
+    assert meter.summary() == {"count": 0}
+    for lateness in [0.00005] * 98 + [0.003, 0.2]:
+        meter.add(lateness)
+
+    summary = meter.summary()
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == pytest.approx(0.1)
+    assert summary["p99_ms"] == pytest.approx(5.0)
+    assert summary["max_ms"] == pytest.approx(200.0)
+    meter.add(-0.001)  # Early wake-ups count as on time
+    assert meter.summary()["count"] == 101
+    meter.reset()
+    assert meter.summary() == {"count": 0}
+
+    # Wake-ups that are all on time report no lateness, not the upper edge of the first bin
+    for _ in range(10):
+        meter.add(0.0)
+    assert meter.summary()["p50_ms"] == meter.summary()["p99_ms"] == meter.summary()["max_ms"] == 0.0
+
+
+def sample_loop(meter, seconds, interval=0.005):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        wake_time = time.monotonic() + interval
+        time.sleep(interval)
+        meter.add(time.monotonic() - wake_time)
+
+
+def encode_loop(stop_event):
+    frame = np.random.default_rng(0).integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+    while not stop_event.is_set():
+        cv2.imencode(".jpg", frame)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    cpus = sorted(os.sched_getaffinity(0))
+    sampler_policy = SchedulingPolicy(cpus=(cpus[-1],), policy="fifo", priority=50)
+    encoder_policy = SchedulingPolicy(cpus=tuple(cpus[:-1]) or (cpus[0],), nice=5)
+    for name, sampler, encoder in (("unpinned", None, None), ("pinned", sampler_policy, encoder_policy)):
+        stop_event = mp.Event()
+        encoders = [mp.Process(target=scheduled(encoder, encode_loop), args=(stop_event,)) for _ in cpus]
+        for process in encoders:
+            process.start()
+
+        meter = JitterMeter()
+        process = mp.Process(target=scheduled(sampler, sample_loop), args=(meter, 5.0))
+        process.start()
+        process.join()
+        stop_event.set()
+        for encoder_process in encoders:
+            encoder_process.join()
+        logging.info(f"{name}: {meter.summary()}")
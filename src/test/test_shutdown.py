@@ -0,0 +1,178 @@
+"""
+Checks shutdown: stuck processes are terminated and killed in parallel within the deadline,
+terminated workers still run their cleanup, connects give up when stopped, and the system stops and
+re-arms with synthetic backends without any worker waiting for the shutdown deadline. Run directly
+to time disarm-to-rearm cycles
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.shutdown import connect_until_stopped, graceful, stop_processes
+from modules.system_config import load_config
+from modules.system_controller.system_controller import SystemController
+
+HOST = "127.0.0.1"
+
+
+def stalled_server():
+    """
+    Listening socket whose backlog is full, further connects to it hang until they time out
+    Returns (server, connected client)
+    """
+    server = socket.create_server((HOST, 0), backlog=0)
+    client = socket.create_connection(server.getsockname())
+    return server, client
+
+
+def closed_port():
+    """
+    A port nothing listens on, connects to it are refused
+    """
+    with socket.create_server((HOST, 0)) as server:
+        return server.getsockname()[1]
+
+
+def exits_on_stop(stop_event):
+    stop_event.wait()
+
+
+def ignores_terminate():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60.0)
+
+
+def cleans_up(released):
+    try:
+        time.sleep(60.0)
+    finally:
+        released.set()
+
+
+def simulated_controller(imu_port, camera_port):
+    config = load_config()
+    config["hal"]["camera"]["backend"] = "synthetic"
+    config["hal"]["imu"]["backend"] = "synthetic"
+    config["hal"]["clock"] = "real"
+    config["network"].update(server_host=HOST, camera_base_port=camera_port, imu_host=HOST, imu_port=imu_port)
+    config["scheduling"]["enabled"] = False
+    return SystemController(config=config)
+
+
+def test_stop_processes_escalates_in_parallel():
+    stop_event = mp.Event()
+    released = mp.Event()
+    processes = [
+        mp.Process(target=exits_on_stop, args=(stop_event,), name="exits"),
+        mp.Process(target=graceful(cleans_up), args=(released,), name="cleans-up"),
+        mp.Process(target=ignores_terminate, name="ignores-terminate"),
+        mp.Process(target=ignores_terminate, name="ignores-terminate-2"),
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(0.2)
+
+    start = time.monotonic()
+    stop_event.set()
+    escalated = stop_processes(processes + [processes[0], None], start + 0.5, kill_timeout=0.3)
+    elapsed = time.monotonic() - start
+
+    assert escalated == ["cleans-up", "ignores-terminate", "ignores-terminate-2"]
+    assert elapsed < 0.5 + 2 * 0.3 + 0.3  # Not one kill_timeout per stuck process
+    assert not any(process.is_alive() for process in processes)
+    assert processes[0].exitcode == 0
+    assert released.is_set() and processes[1].exitcode == 128 + signal.SIGTERM
+    assert processes[2].exitcode == -signal.SIGKILL
+
+
+def test_connect_until_stopped():
+    server = socket.create_server((HOST, 0))
+    address = server.getsockname()
+    stop_event = threading.Event()
+
+    client = socket.socket()
+    client.settimeout(5.0)
+    assert connect_until_stopped(client, address, stop_event, timeout=5.0)
+    assert client.gettimeout() == 5.0
+    client.close()
+    server.close()
+
+    with pytest.raises(ConnectionRefusedError):
+        connect_until_stopped(socket.socket(), address, stop_event, timeout=5.0)
+
+    server, _ = stalled_server()
+    start = time.monotonic()
+    with pytest.raises(socket.timeout):
+        connect_until_stopped(socket.socket(), server.getsockname(), stop_event, timeout=0.2)
+    threading.Timer(0.2, stop_event.set).start()
+    assert not connect_until_stopped(socket.socket(), server.getsockname(), stop_event, timeout=60.0)
+    assert time.monotonic() - start < 10.0  # Long before the connect timeout
+    server.close()
+
+
+def test_stop_and_rearm_before_the_deadline():
+    # The IMU socket is stuck connecting, the cameras are waiting to retry
+    server, _ = stalled_server()
+    controller = simulated_controller(server.getsockname()[1], closed_port())
+    controller.config["shutdown"]["timeout"] = 30.0
+    controller.arm()
+    controller.start()
+    time.sleep(1.0)
+
+    imu_pids = [pid for pid in controller.imu_controller.imu_worker.process_ids if pid]
+    assert len(imu_pids) == 2
+
+    start = time.monotonic()
+    controller.stop()
+    stopped = time.monotonic() - start
+    controller.arm()
+    controller.start()
+    rearmed = time.monotonic() - start
+
+    try:
+        # Far below the deadline, so every worker exited by itself instead of being terminated.
+        # Typically tens of milliseconds, the bound only allows for a loaded machine
+        assert stopped < 10.0 and rearmed < 15.0
+        # The sensor and socket processes were joined by the IMU worker, not orphaned
+        for pid in imu_pids:
+            with pytest.raises(ProcessLookupError):
+                os.kill(pid, 0)
+        time.sleep(0.5)
+        assert controller.camera_controller.is_running() and controller.imu_controller.is_running()
+    finally:
+        controller.stop()
+        server.close()
+    assert not controller.is_running()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    server, _ = stalled_server()
+    controller = simulated_controller(server.getsockname()[1], closed_port())
+    controller.arm()
+    controller.start()
+    for cycle in range(5):
+        time.sleep(1.0)
+        start = time.monotonic()
+        controller.stop()
+        stopped = time.monotonic() - start
+        controller.arm()
+        controller.start()
+        rearmed = time.monotonic() - start
+        logging.info(f"Cycle {cycle}: stopped in {1e3 * stopped:.0f} ms, re-armed in {1e3 * rearmed:.0f} ms")
+    controller.stop()
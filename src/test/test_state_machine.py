@@ -0,0 +1,146 @@
+"""
+Checks DeviceStateMachine transition rules, that subscribers in other processes are woken by
+transitions, in order and up to the last one, and that a device armed while moving reports MOVING
+from the IMU without first becoming still. Run directly to measure how long they take to wake up,
+compared with polling the state once a second
+"""
+
+import os
+import sys
+
+import logging
+import multiprocessing as mp
+import socket
+import time
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.device_state import DeviceState
+from modules.imu.imu_shared_data import IMUSharedData
+from modules.imu.imu_worker import IMUWorker
+from modules.system_controller.device_state_machine import DeviceStateMachine
+
+TRANSITIONS = 50
+POLL_INTERVAL = 1.0  # Previous main loop polling interval
+
+
+def test_transition_rules():
+    machine = DeviceStateMachine()
+    assert machine.transition(DeviceState.STATIONARY, source="imu") is False  # Not armed yet
+    assert machine.transition(DeviceState.ARMED)
+    assert machine.transition(DeviceState.ARMED) is False
+    assert machine.transition(DeviceState.STATIONARY, source="imu")
+    assert machine.transition(DeviceState.ARMED) is False
+    assert machine.transition(DeviceState.DISARMED)
+    assert machine.state == DeviceState.DISARMED
+
+
+def subscriber(machine, ready, results):
+    subscription = machine.subscribe()
+    first_version = subscription.version
+    ready.set()
+    seen = []  # (transitions so far, state) per wakeup
+    latencies = []
+    while subscription.version - first_version < TRANSITIONS:
+        state = subscription.wait(timeout=5.0)
+        if state is None:
+            break
+        latencies.append(subscription.latency())
+        seen.append((subscription.version - first_version, state))
+    results.put((seen, latencies))
+
+
+def motion_source(machine, interval):
+    """
+    Stands in for the IMU process, alternating MOVING and STATIONARY
+    """
+    for i in range(TRANSITIONS):
+        time.sleep(interval)
+        machine.transition(DeviceState.STATIONARY if i % 2 == 0 else DeviceState.MOVING, source="imu")
+
+
+def run(num_subscribers=3, interval=0.02):
+    """
+    Returns ([(transitions so far, state) per wakeup] per subscriber, sorted latencies in seconds)
+    """
+    machine = DeviceStateMachine()
+    machine.transition(DeviceState.ARMED)
+    results = mp.Queue()
+    ready = [mp.Event() for _ in range(num_subscribers)]
+    processes = [mp.Process(target=subscriber, args=(machine, event, results)) for event in ready]
+    for process in processes:
+        process.start()
+    for event in ready:
+        event.wait()
+
+    source = mp.Process(target=motion_source, args=(machine, interval))
+    source.start()
+
+    seen, latencies = [], []
+    for _ in processes:
+        subscriber_seen, values = results.get()
+        seen.append(subscriber_seen)
+        latencies += values
+    for process in processes + [source]:
+        process.join()
+    return seen, sorted(latencies)
+
+
+def test_subscribers_woken():
+    seen, _ = run()
+    assert len(seen) == 3
+    for subscriber_seen in seen:
+        # Only transitions wake a subscriber, in order. A slow one may see several as one wakeup,
+        # but it always gets the last state
+        versions = [version for version, _ in subscriber_seen]
+        assert versions == sorted(set(versions)) and 1 <= len(versions) <= TRANSITIONS
+        assert subscriber_seen[-1] == (TRANSITIONS, DeviceState.MOVING)
+        # Transition i sets STATIONARY for odd i (counting from 1), MOVING for even ones
+        for version, state in subscriber_seen:
+            assert state == (DeviceState.STATIONARY if version % 2 else DeviceState.MOVING)
+
+
+def test_armed_while_moving():
+    with socket.create_server(("127.0.0.1", 0)) as closed:
+        port = closed.getsockname()[1]  # Refused, the uplink is not under test
+    machine = DeviceStateMachine()
+    machine.transition(DeviceState.ARMED)
+    shared_data = IMUSharedData()
+    stop_event = mp.Event()
+    worker = IMUWorker(
+        "127.0.0.1", port, stop_event, shared_data, state_machine=machine,
+        sensor_config={"sample_rate": 225, "poll_interval": 0.02},
+        # Carried around from the start and never set down
+        hal_config={"backend": "synthetic", "synthetic": {"still_seconds": 0.0, "moving_seconds": 3600.0}},
+    )
+    subscription = machine.subscribe()
+    worker.setup_process()
+    try:
+        # Reported once the first window is evaluated, without waiting for the device to become
+        # still
+        assert subscription.wait(timeout=10.0) == DeviceState.MOVING
+        assert shared_data.get_state() == DeviceState.MOVING
+    finally:
+        stop_event.set()
+        worker.sensor_process.join(timeout=5.0)
+        worker.socket_process.join(timeout=5.0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    seen, latencies = run(interval=0.1)
+    wakeups = sum(len(subscriber_seen) for subscriber_seen in seen)
+    logging.info(
+        f"Condition: median {1e3 * latencies[len(latencies) // 2]:.2f} ms, "
+        f"max {1e3 * latencies[-1]:.2f} ms, {wakeups} wakeups for {TRANSITIONS} transitions x {len(seen)} subscribers"
+    )
+    elapsed = TRANSITIONS * 0.1
+    logging.info(
+        f"Polling every {POLL_INTERVAL:.0f} s: median {1e3 * POLL_INTERVAL / 2:.0f} ms, "
+        f"max {1e3 * POLL_INTERVAL:.0f} ms, "
+        f"{int(elapsed / POLL_INTERVAL) * len(seen)} wakeups over the same {elapsed:.0f} s"
+    )
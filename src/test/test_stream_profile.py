@@ -0,0 +1,196 @@
+"""
+Checks the stream profile configuration: missing config values fall back to the defaults, profiles
+resolve per USB port with undefined names and encoder presets rejected, a running camera worker
+switches profile when the manager sends one through its pipe, and a malformed config file sent with
+SIGHUP keeps the current settings. Run directly to time profile switches on a synthetic camera
+"""
+
+import os
+import sys
+
+import copy
+import logging
+import multiprocessing as mp
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter.camera_worker import CONTROL_SET_PROFILE, CameraWorker
+from modules.camera_transmitter.frame_encoder import EncoderPreset
+from modules.camera_transmitter.stream_profile import StreamProfile, resolve_camera_profiles
+from modules.system_config import DEFAULT_CONFIG, _merge, load_config
+from modules.system_controller.system_controller import SystemController
+
+HOST = "127.0.0.1"
+
+
+def camera_config(**changes):
+    config = copy.deepcopy(DEFAULT_CONFIG["camera"])
+    config.update(changes)
+    return config
+
+
+def test_merge_fills_defaults():
+    defaults = {"network": {"host": "a", "port": 1}, "camera": {"profiles": {"low": {"fps": 2.0}}}, "debug": False}
+    merged = _merge(defaults, {"network": {"port": 2}, "camera": {"profiles": {"high": {"fps": 30.0}}}, "extra": 1})
+    assert merged == {
+        "network": {"host": "a", "port": 2},
+        "camera": {"profiles": {"low": {"fps": 2.0}, "high": {"fps": 30.0}}},
+        "debug": False,
+        "extra": 1,
+    }
+    assert defaults["network"]["port"] == 1  # The defaults are copied, not changed
+    assert _merge(defaults, None) == defaults
+    assert _merge(defaults, {"network": None})["network"] is None  # Non-dict values replace whole sections
+
+
+def test_load_config_defaults():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "config.yaml")
+        with open(path, "w") as file:
+            file.write("network:\n  server_host: 10.0.0.2\n")
+        config = load_config(path)
+        assert config["network"]["server_host"] == "10.0.0.2"
+        assert config["network"]["imu_port"] == DEFAULT_CONFIG["network"]["imu_port"]
+        assert config["camera"] == DEFAULT_CONFIG["camera"]
+        assert load_config(os.path.join(directory, "missing.yaml")) == DEFAULT_CONFIG
+
+
+def test_resolve_per_port_profiles():
+    config = camera_config(
+        default_profile="low",
+        encoders={"jpeg": {"backend": "jpeg"}, "webp": {"backend": "webp"}},
+        profiles={
+            "low": {"fps": 2.0, "width": 320, "height": 240},
+            "high": {"fps": 30.0, "width": 1280, "height": 720, "encoders": ["webp", "jpeg"]},
+        },
+        devices={"1-1.2": "high"},
+    )
+    default, devices = resolve_camera_profiles(config)
+    assert (default.fps, default.width, default.height) == (2.0, 320, 240)
+    assert default.encoders == (EncoderPreset(name="jpeg", backend="jpeg"),)  # The default preset
+    assert set(devices) == {"1-1.2"}
+    assert devices["1-1.2"].fps == 30.0
+    assert [preset.name for preset in devices["1-1.2"].encoders] == ["webp", "jpeg"]
+
+
+@pytest.mark.parametrize(
+    "changes, message",
+    [
+        ({"profiles": {"low": {"encoders": ["h264"]}}}, "undefined encoder preset 'h264'"),
+        ({"devices": {"1-1.2": "missing"}}, "undefined stream profile 'missing'"),
+        ({"default_profile": "missing"}, "Default stream profile 'missing'"),
+    ],
+)
+def test_resolve_rejects_undefined_names(changes, message):
+    config = camera_config(default_profile="low", encoders={"jpeg": {"backend": "jpeg"}}, profiles={"low": {}})
+    config.update(changes)
+    with pytest.raises(ValueError, match=message):
+        resolve_camera_profiles(config)
+
+
+class DrainingServer:
+    """
+    Accepts one connection and discards what it receives
+    """
+
+    def __init__(self):
+        self.server = socket.create_server((HOST, 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.__drain, daemon=True).start()
+
+    def __drain(self):
+        connection, _ = self.server.accept()
+        with connection:
+            while connection.recv(1 << 16):
+                pass
+
+    def close(self):
+        self.server.close()
+
+
+def wait_until(condition, timeout=10.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def run_worker(profile):
+    """
+    Starts a CameraWorker thread streaming a synthetic camera to a local server
+    Returns (worker, manager end of its pipe, stop function)
+    """
+    server = DrainingServer()
+    manager_conn, worker_conn = mp.Pipe()
+    stop_event = threading.Event()
+    worker = CameraWorker(
+        device_id=0, port=server.port, host=HOST, profile=profile, stop_event=stop_event, control_conn=worker_conn,
+        camera_config={"backend": "synthetic", "synthetic": {"pattern": "bars"}},
+    )
+    thread = threading.Thread(target=worker.run_camera, daemon=True)
+    thread.start()
+
+    def stop():
+        stop_event.set()
+        thread.join(timeout=5.0)
+        server.close()
+
+    assert wait_until(lambda: worker.camera is not None and worker.camera.frames > 0)
+    return worker, manager_conn, stop
+
+
+def test_worker_applies_profile_from_pipe():
+    encoders = (EncoderPreset(name="jpeg", backend="jpeg"),)
+    profile = StreamProfile(fps=20.0, width=160, height=120, encoders=encoders)
+    worker, manager_conn, stop = run_worker(profile)
+    try:
+        # Quality only changes the encoding, a new resolution reconfigures the camera
+        manager_conn.send((CONTROL_SET_PROFILE, profile.with_changes(quality=60)))
+        assert wait_until(lambda: worker.profile.quality == 60)
+
+        new_profile = profile.with_changes(width=320, height=240, fps=10.0)
+        manager_conn.send((CONTROL_SET_PROFILE, new_profile))
+        assert wait_until(lambda: worker.frame is not None and worker.frame.shape == (240, 320, 3))
+        assert worker.profile == new_profile
+    finally:
+        stop()
+
+
+def test_malformed_config_keeps_settings():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "config.yaml")
+        with open(path, "w") as file:
+            file.write("hal:\n  clock: real\ngovernor:\n  enabled: false\n")
+        controller = SystemController(config_path=path)
+        config = controller.config
+
+        with open(path, "w") as file:
+            file.write("camera:\n  default_profile: [low_rate\n")  # Unterminated list
+        controller.reload_config()
+        assert controller.config is config
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, handlers=[logging.StreamHandler()]  # output to console
+    )
+
+    # Time from sending a profile to the first frame captured with it
+    encoders = (EncoderPreset(name="jpeg", backend="jpeg"),)
+    profile = StreamProfile(fps=30.0, width=320, height=240, encoders=encoders)
+    worker, manager_conn, stop = run_worker(profile)
+    try:
+        for width, height in ((640, 480), (1280, 720), (320, 240)):
+            start = time.perf_counter()
+            manager_conn.send((CONTROL_SET_PROFILE, profile.with_changes(width=width, height=height)))
+            wait_until(lambda: worker.frame is not None and worker.frame.shape[:2] == (height, width))
+            logging.info(f"{width}x{height}: first frame after {1000 * (time.perf_counter() - start):.1f} ms")
+    finally:
+        stop()
@@ -0,0 +1,99 @@
+"""
+Runs TileDeltaEncoder on a synthetic mostly static scene and checks TileDeltaDecoder reconstructs it
+"""
+
+import os
+import sys
+
+import logging
+
+import numpy as np
+
+# Add parent directory of "modules" to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from modules.camera_transmitter.frame_encoder import EncoderPreset, create_encoder
+from modules.camera_transmitter.tile_delta import (
+    FRAME_DELTA,
+    FRAME_KEY,
+    TileDeltaDecoder,
+    TileDeltaEncoder,
+)
+
+WIDTH, HEIGHT = 330, 250  # Not a multiple of the tile size to exercise edge padding
+TILE_SIZE = 32
+
+
+def make_scene(step):
+    """
+    Static gradient background with a small square moving across it
+    """
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    frame = np.stack([x % 256, y % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+    left = 10 + 12 * step
+    frame[100:140, left:left + 40] = (0, 0, 255)
+    return frame
+
+
+def run_sequence(backend, frames=12, keyframe_interval=5, threshold=6.0):
+    encoder = create_encoder(EncoderPreset(name=backend, backend=backend), quality=95)
+    delta_encoder = TileDeltaEncoder(
+        encoder, tile_size=TILE_SIZE, threshold=threshold, keyframe_interval=keyframe_interval
+    )
+    decoder = TileDeltaDecoder()
+
+    results = []
+    for step in range(frames):
+        frame = make_scene(step)
+        frame_type, payload = delta_encoder.encode(frame)
+        reconstructed = decoder.decode(frame_type, payload)
+        results.append((frame, frame_type, payload, reconstructed))
+    return results
+
+
+def test_keyframe_schedule():
+    frame_types = [frame_type for _, frame_type, _, _ in run_sequence("png")]
+    assert frame_types[0] == FRAME_KEY
+    assert frame_types[1:6] == [FRAME_DELTA] * 5
+    assert frame_types[6] == FRAME_KEY
+
+
+def test_lossless_reconstruction():
+    # PNG is lossless and a zero threshold resends any changed tile, so frames match exactly
+    for frame, _, _, reconstructed in run_sequence("png", threshold=0):
+        assert reconstructed.shape == frame.shape
+        assert np.array_equal(reconstructed, frame)
+
+
+def test_delta_frames_are_smaller():
+    results = run_sequence("jpeg")
+    key_sizes = [len(payload) for _, frame_type, payload, _ in results if frame_type == FRAME_KEY]
+    delta_sizes = [len(payload) for _, frame_type, payload, _ in results if frame_type == FRAME_DELTA]
+    assert max(delta_sizes) < min(key_sizes)
+
+    for frame, _, _, reconstructed in results:
+        assert np.abs(reconstructed.astype(int) - frame).mean() < 3
+
+
+def test_missing_keyframe():
+    results = run_sequence("jpeg", frames=3)
+    decoder = TileDeltaDecoder()
+    try:
+        decoder.decode(FRAME_DELTA, results[1][2])
+    except ValueError:
+        return
+    raise AssertionError("Delta frame decoded without its keyframe")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG, handlers=[logging.StreamHandler()]  # output to console
+    )
+    test_keyframe_schedule()
+    test_lossless_reconstruction()
+    test_delta_frames_are_smaller()
+    test_missing_keyframe()
+
+    for frame, frame_type, payload, _ in run_sequence("jpeg"):
+        logging.info(f"Frame type {frame_type}: {len(payload)} bytes")
+    logging.info("Tile delta tests passed")